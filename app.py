@@ -4,14 +4,22 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime, timedelta
 import os
+import time
 from dotenv import load_dotenv
-from sqlalchemy import inspect, text
+from sqlalchemy import text
 from urllib.parse import quote_plus
 
 # 导入扩展和模型
 from extensions import db, init_extensions
 from models import User, EmotionDiary, EmotionAnalysis, GameState, GameProgress, Postcard, AdventureSession, UserItem, AccessLog
 from routes import auth_bp, diary_bp, upload_bp, analysis_bp, game_bp, postcard_bp, adventure_bp, admin_bp
+from commands import register_commands
+from services.user_counters import register_counter_events
+from services.diary_search import register_search_events
+from services.emotion_tags import register_tag_events
+from services.diary_images import register_image_events
+from services.diary_stats import register_stats_events
+from services.db_pool import InstrumentedQueuePool, register_pool_events
 
 # 加载环境变量（override=True 确保.env文件优先于系统环境变量）
 load_dotenv(override=True)
@@ -68,6 +76,7 @@ app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 
 # 数据库配置优化 - 简化版本避免云端兼容性问题
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'poolclass': InstrumentedQueuePool,  # 记录取连接等待时间（services/db_pool.py）
     'pool_size': 5,
     'pool_recycle': 3600,
     'pool_pre_ping': True  # 添加连接检查
@@ -76,125 +85,51 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
 # 初始化扩展
 init_extensions(app)
 
+# 用户计数缓存（未读明信片、日记数、明信片数）随写入维护
+register_counter_events()
+# 日记全文索引（SQLite FTS5）随写入同步
+register_search_events()
+# 情绪标签关联表随日记写入同步
+register_tag_events()
+# 日记上传图片关联表随日记写入同步（文件垃圾回收按key查引用）
+register_image_events()
+# 用户日记统计汇总随日记写入累加
+register_stats_events()
+# 连接占用时长统计
+with app.app_context():
+    register_pool_events(db.engine)
+
+
+def check_schema_version():
+    """
+    启动时检查数据库结构版本
 
-def ensure_schema_updates():
-    """Ensure critical schema patches are applied when migrations haven't run."""
-    schema_updates = {
-        'users': {
-            'reset_token': 'VARCHAR(255)',
-            'reset_token_expires': 'DATETIME',
-            # 管理员字段
-            'is_admin': 'BOOLEAN DEFAULT 0',
-            'last_login_at': 'DATETIME',
-            'login_count': 'INTEGER DEFAULT 0'
-        },
-        'emotion_diaries': {
-            'trigger_event': 'TEXT',
-            'images': 'JSON',
-            'score_applied': 'BOOLEAN DEFAULT 0'
-        },
-        'emotion_analysis': {
-            'analysis_payload': 'JSON'
-        },
-        'game_states': {
-            'mental_health_score': 'INTEGER DEFAULT 50',
-            'stress_level': 'INTEGER DEFAULT 50',
-            'growth_potential': 'INTEGER DEFAULT 50',
-            # 新增游戏资源字段
-            'coins': 'INTEGER DEFAULT 0',
-            'level': 'INTEGER DEFAULT 1',
-            'total_diaries': 'INTEGER DEFAULT 0',
-            'created_at': 'DATETIME'
-        },
-        'postcards': {
-            # 明信片表的所有字段（通过db.create_all创建，这里仅做兼容性检查）
-            'image_url': 'VARCHAR(500)',
-            'image_prompt': 'TEXT',
-            'location_name': 'VARCHAR(100)',
-            'message': 'TEXT',
-            'status': 'VARCHAR(20) DEFAULT "pending"',
-            'emotion_tags': 'JSON',
-            'emotion_intensity': 'INTEGER',
-            'mental_health_score': 'INTEGER',
-            'generated_at': 'DATETIME',
-            'is_read': 'BOOLEAN DEFAULT 0',
-            'read_at': 'DATETIME',
-            # 探险收获
-            'stat_changes': 'JSON',
-            'coins_earned': 'INTEGER DEFAULT 0'
-        },
-        'adventure_sessions': {
-            # 探险会话表字段
-            'scene_name': 'VARCHAR(100)',
-            'monsters': 'JSON',
-            'challenges': 'JSON',
-            'current_challenge': 'INTEGER DEFAULT 0',
-            'coins_earned': 'INTEGER DEFAULT 0',
-            'items_earned': 'JSON',
-            'stat_changes': 'JSON',
-            'started_at': 'DATETIME',
-            'completed_at': 'DATETIME'
-        },
-        'user_items': {
-            # 用户道具表字段
-            'item_name_zh': 'VARCHAR(50)',
-            'item_type': 'VARCHAR(20) DEFAULT "healing"',
-            'quantity': 'INTEGER DEFAULT 1',
-            'effect_type': 'VARCHAR(30)',
-            'effect_value': 'INTEGER DEFAULT 0'
-        },
-        'access_logs': {
-            # 访问日志表字段
-            'ip_address': 'VARCHAR(50)',
-            'user_agent': 'VARCHAR(500)',
-            'path': 'VARCHAR(200)',
-            'method': 'VARCHAR(10)',
-            'user_id': 'INTEGER',
-            'status_code': 'INTEGER'
-        }
-    }
+    表结构变更由部署步骤执行一次 flask db upgrade（migrations/versions/），
+    这里只读 alembic_version 的一行与迁移脚本的最新版本比较，不做表结构反射、不改表，
+    版本落后时打印警告。
+    """
+    from alembic.config import Config as AlembicConfig
+    from alembic.script import ScriptDirectory
 
     try:
+        alembic_config = AlembicConfig()
+        alembic_config.set_main_option('script_location', os.path.join(app.root_path, 'migrations'))
+        heads = set(ScriptDirectory.from_config(alembic_config).get_heads())
+
         with app.app_context():
-            inspector = inspect(db.engine)
-            existing_tables = set(inspector.get_table_names())
-
-            engine_name = db.engine.url.get_backend_name()
-
-            for table_name, columns in schema_updates.items():
-                if table_name not in existing_tables:
-                    continue
-
-                existing_columns = {col['name'] for col in inspector.get_columns(table_name)}
-                missing = {
-                    column_name: column_type
-                    for column_name, column_type in columns.items()
-                    if column_name not in existing_columns
-                }
-
-                if not missing:
-                    continue
-
-                with db.engine.begin() as connection:
-                    for column_name, column_type in missing.items():
-                        column_type_sql = column_type
-                        col_type_upper = column_type.upper()
-                        if col_type_upper.startswith('BOOLEAN') and engine_name == 'sqlite':
-                            column_type_sql = 'INTEGER DEFAULT 0'
-                        elif col_type_upper == 'JSON' and engine_name == 'sqlite':
-                            column_type_sql = 'TEXT'
-
-                        connection.execute(
-                            text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type_sql}')
-                        )
-                        if table_name == 'emotion_diaries' and column_name == 'score_applied':
-                            # 旧日记默认视为已计分，避免重复影响GameState
-                            connection.execute(text('UPDATE emotion_diaries SET score_applied = 1 WHERE score_applied IS NULL OR score_applied = 0'))
+            with db.engine.connect() as connection:
+                current = {row[0] for row in connection.execute(text('SELECT version_num FROM alembic_version'))}
     except Exception as schema_error:
-        app.logger.warning(f"Schema check failed: {schema_error}")
+        app.logger.warning(f"Schema version unknown, run `flask db upgrade`: {str(schema_error).splitlines()[0]}")
+        return
+
+    if current != heads:
+        app.logger.warning(
+            f"Schema version {sorted(current)} is behind {sorted(heads)}, run `flask db upgrade`"
+        )
 
 
-ensure_schema_updates()
+check_schema_version()
 
 # 注册蓝图
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -206,46 +141,88 @@ app.register_blueprint(postcard_bp, url_prefix='/api/postcard')
 app.register_blueprint(adventure_bp, url_prefix='/api/adventure')
 app.register_blueprint(admin_bp, url_prefix='/api/admin')
 
+# 注册命令行维护任务
+register_commands(app)
+
 
 # ==================== 访问日志中间件 ====================
 
+# 跳过静态文件、健康检查和管理员访问日志API
+ACCESS_LOG_SKIP_PATHS = ('/static', '/api/health', '/api/admin/logs', '/image/', '/game/')
+
+
 @app.before_request
-def log_request():
-    """记录访问日志"""
-    # 跳过静态文件、健康检查和管理员访问日志API
-    skip_paths = ['/static', '/api/health', '/api/admin/logs', '/image/', '/game/']
-    for skip in skip_paths:
-        if request.path.startswith(skip):
-            return
-
-    # 跳过favicon
-    if request.path == '/favicon.ico':
-        return
+def start_request_timer():
+    """记录请求开始时间（用于访问日志耗时）"""
+    from flask import g
+    g._request_started = time.perf_counter()
+
 
+@app.after_request
+def capture_response_info(response):
+    """记录响应状态码、大小和身份，真正入队放在 teardown（异常请求也会经过）"""
+    from flask import g
     try:
-        # 尝试获取当前登录用户ID
-        from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+        from flask_jwt_extended import get_jwt_identity
+
+        # 复用 @jwt_required 已解码的身份，不再为记日志重复校验JWT
         user_id = None
-        try:
-            verify_jwt_in_request(optional=True)
+        if g.get('_jwt_extended_jwt'):
             identity = get_jwt_identity()
             if identity:
                 user_id = int(identity) if isinstance(identity, str) else identity
-        except:
-            pass
-
-        log = AccessLog(
-            ip_address=request.remote_addr or 'unknown',
-            user_agent=(request.user_agent.string[:500] if request.user_agent else 'unknown'),
-            path=request.path[:200],
-            method=request.method,
-            user_id=user_id
-        )
-        db.session.add(log)
-        db.session.commit()
-    except Exception as e:
+
+        g._access_log_response = {
+            'status_code': response.status_code,
+            # 流式响应没有固定长度
+            'response_bytes': response.calculate_content_length(),
+            'user_id': user_id
+        }
+    except Exception:
+        pass
+    return response
+
+
+@app.teardown_request
+def log_request(exc=None):
+    """记录访问日志（只放入内存队列，由后台线程批量写入数据库）"""
+    from flask import g
+
+    path = request.path
+    if path.startswith(ACCESS_LOG_SKIP_PATHS) or path == '/favicon.ico':
+        return
+
+    try:
+        from services.access_log import record
+        from services.latency_histogram import bucket_for
+        from services.stats_rollup import ensure_scheduler
+        from services.postcard_service import ensure_image_sweeper
+
+        # 后台定时任务（每个进程一个线程，第一个请求时启动）
+        ensure_scheduler()
+        ensure_image_sweeper()
+
+        started = g.get('_request_started')
+        duration_us = int((time.perf_counter() - started) * 1_000_000) if started else None
+        # 没有经过 after_request（响应阶段出错）按500记录
+        response_info = g.get('_access_log_response') or {'status_code': 500, 'response_bytes': None, 'user_id': None}
+
+        record({
+            'ip_address': request.remote_addr or 'unknown',
+            'user_agent': (request.user_agent.string[:500] if request.user_agent else 'unknown'),
+            'path': path[:200],
+            'method': request.method,
+            'endpoint': (request.endpoint or '')[:100] or None,
+            'user_id': response_info['user_id'],
+            'status_code': response_info['status_code'],
+            'duration_us': duration_us,
+            'latency_bucket': bucket_for(duration_us) if duration_us is not None else None,
+            'response_bytes': response_info['response_bytes'],
+            'created_at': datetime.utcnow()
+        })
+    except Exception:
         # 日志记录失败不影响正常请求
-        db.session.rollback()
+        pass
 
 
 # ==================== 创建默认管理员 ====================
@@ -405,22 +382,49 @@ def serve_game_assets(filename):
     return send_from_directory(game_folder, filename)
 
 
-# 静态文件服务：/image/ 目录（Zeabur持久化存储）
+# 静态文件服务：/image/ 目录（明信片、上传图片等存储对象）
 @app.route('/image/<path:filename>')
 def serve_image_assets(filename):
     """
-    服务/image/目录中的静态资源
-    Zeabur部署时，/image/ 是持久化存储目录
-    本地开发时，可以通过环境变量 IMAGE_FOLDER 指定目录
+    服务/image/下的图片资源
+    postcards/ 和 uploads/（S3后端早先写入的上传图片URL）交给存储后端处理：
+    本地存储直接返回文件，S3兼容存储重定向到预签名URL，由对象存储直接返回字节
+    其他路径仍从 IMAGE_FOLDER 目录读取（Zeabur持久化存储，默认 /image）
     """
-    from flask import send_from_directory
+    from flask import send_from_directory, abort
+    from services.storage import get_storage, STORAGE_AREAS
+
+    area, _, key = filename.partition('/')
+    if area in STORAGE_AREAS and key:
+        try:
+            return get_storage(area).serve(key)
+        except ValueError:
+            abort(404)
+
     image_folder = os.environ.get('IMAGE_FOLDER', '/image')
     return send_from_directory(image_folder, filename)
 
 
+# 上传图片：/static/uploads/ 是上传图片在数据库里的URL（与存储后端无关），比 Flask 的 /static/ 规则更具体，优先匹配
+@app.route('/static/uploads/<path:filename>')
+def serve_upload(filename):
+    """
+    服务用户上传的图片
+    本地存储从上传目录（UPLOAD_IMAGE_FOLDER）返回文件，S3兼容存储重定向到预签名URL
+    """
+    from flask import abort
+    from services.storage import get_storage
+
+    try:
+        return get_storage('uploads').serve(filename)
+    except ValueError:
+        abort(404)
+
+
 if __name__ == '__main__':
+    # 本地开发：python app.py 启动调试服务器，直接按模型建表（不存在时）并创建默认管理员。
+    # 生产环境不走这里：表结构由 flask db upgrade 维护，用 gunicorn 启动（见 zeabur_config.yaml）
     with app.app_context():
-        # 创建表（如果不存在）
         db.create_all()
         print(f"数据库连接: {app.config['SQLALCHEMY_DATABASE_URI'][:50]}...")
         # 创建默认管理员
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+命令行维护任务（flask <命令>）
+
+用法示例：
+    flask --app app create-default-admin
+    flask --app app gc-files --dry-run
+    flask --app app build-fallback-library --variants 2
+    flask --app app rollup-stats --rebuild
+    flask --app app archive-logs --retention-days 30
+    flask --app app recount-user-counters
+    flask --app app benchmark-diary-search --rows 1000000
+    flask --app app backfill-emotion-tags
+    flask --app app backfill-diary-images
+    flask --app app rebuild-diary-stats
+    flask --app app verify-game-ledger
+    flask --app app checkpoint-adventures
+    flask --app app resume-image-downloads
+"""
+
+import json
+
+import click
+
+
+def register_commands(app):
+    """注册所有维护命令"""
+
+    @app.cli.command('create-default-admin')
+    def create_admin():
+        """创建默认管理员账户（已存在时确保是管理员），部署时在 db upgrade 之后执行"""
+        from app import create_default_admin
+
+        create_default_admin()
+
+    @app.cli.command('gc-files')
+    @click.option('--grace-hours', type=int, default=None, help='未被引用的文件保留多少小时后删除')
+    @click.option('--batch-size', type=int, default=None, help='每批对账的文件数')
+    @click.option('--dry-run', is_flag=True, help='只统计不删除')
+    def gc_files(grace_hours, batch_size, dry_run):
+        """清理未被引用的图片文件，并更新用户存储占用统计"""
+        from services.storage_gc import collect_garbage
+
+        summary = collect_garbage(grace_hours=grace_hours, batch_size=batch_size, dry_run=dry_run)
+        click.echo(json.dumps(summary, ensure_ascii=False, indent=2))
+
+    @app.cli.command('build-fallback-library')
+    @click.option('--variants', type=int, default=1, help='每个场景+心情生成几张图片')
+    @click.option('--tier', type=click.Choice(['preview', 'full']), default='full', help='图片尺寸档位')
+    @click.option('--force', is_flag=True, help='重新生成已存在的图片')
+    @click.option('--delay', type=float, default=1.0, help='每次调用图片API后的间隔（秒）')
+    def build_fallback_library(variants, tier, force, delay):
+        """离线生成备用明信片图库（图片生成失败或限流时使用）"""
+        from services.fallback_library import build_library
+
+        stats = build_library(variants=variants, tier=tier, force=force, delay=delay)
+        click.echo(json.dumps(stats, ensure_ascii=False, indent=2))
+
+    @app.cli.command('rollup-stats')
+    @click.option('--rebuild', is_flag=True, help='从最早的数据开始重算（保留已归档日子的访问量）')
+    def rollup_stats(rebuild):
+        """刷新每小时/每日统计汇总表"""
+        from services.stats_rollup import run_locked
+
+        result = run_locked(rebuild=rebuild, force=True)
+        if result is None:
+            raise click.ClickException('另一个进程正在刷新统计汇总，请稍后再试')
+        click.echo(json.dumps(result, ensure_ascii=False, indent=2))
+
+    @app.cli.command('backfill-visitor-sketches')
+    @click.option('--days', type=int, default=90, help='用最近多少天的访问日志重建')
+    def backfill_visitor_sketches(days):
+        """用原始访问日志重建每日独立访客草图"""
+        from services.visitor_sketch import backfill
+
+        click.echo(f"已处理 {backfill(days)} 条访问日志")
+
+    @app.cli.command('archive-logs')
+    @click.option('--retention-days', type=int, default=None, help='数据库中保留最近多少天的访问日志')
+    def archive_logs(retention_days):
+        """把超过保留期的访问日志归档到压缩文件并从数据库删除"""
+        from services.log_archive import archive_old_logs, ArchiveBusyError
+
+        try:
+            archived = archive_old_logs(retention_days=retention_days)
+        except ArchiveBusyError as e:
+            raise click.ClickException(str(e))
+        click.echo(json.dumps(archived, ensure_ascii=False, indent=2))
+
+    @app.cli.command('recount-user-counters')
+    @click.option('--user-id', 'user_ids', type=int, multiple=True, help='只修复指定用户（可重复）')
+    def recount_counters(user_ids):
+        """按实际数据重新计算用户的日记数、明信片数、未读明信片数"""
+        from services.user_counters import recount_user_counters
+
+        updated = recount_user_counters(user_ids=list(user_ids) or None)
+        click.echo(json.dumps({'updated_users': updated}, ensure_ascii=False))
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index():
+        """重建日记全文索引（SQLite FTS5；MySQL 的 FULLTEXT 索引由数据库维护，无需重建）"""
+        from extensions import db
+        from services.diary_search import ensure_sqlite_index, rebuild_sqlite_index
+
+        with db.engine.begin() as connection:
+            if not ensure_sqlite_index(connection):
+                click.echo('当前数据库不使用 FTS5 表，无需重建')
+                return
+            count = rebuild_sqlite_index(connection)
+        click.echo(json.dumps({'indexed_diaries': count}, ensure_ascii=False))
+
+    @app.cli.command('benchmark-diary-search')
+    @click.option('--rows', type=int, default=1000000, help='合成日记数量')
+    @click.option('--keyword', 'keywords', multiple=True, help='搜索词（可重复）')
+    def benchmark_diary_search(rows, keywords):
+        """在临时SQLite库中对比 LIKE 与全文索引的搜索耗时"""
+        from services.diary_search import benchmark_search
+
+        result = benchmark_search(rows=rows, keywords=list(keywords) or None)
+        click.echo(json.dumps(result, ensure_ascii=False, indent=2))
+
+    @app.cli.command('backfill-emotion-tags')
+    @click.option('--batch-size', type=int, default=500, help='每批处理的日记数')
+    def backfill_tags(batch_size):
+        """按日记的 emotion_tags 重建情绪标签关联表"""
+        from extensions import db
+        from services.emotion_tags import backfill_emotion_tags
+        from services.diary_stats import rebuild_diary_stats
+
+        with db.engine.begin() as connection:
+            count = backfill_emotion_tags(connection, batch_size=batch_size)
+            rebuild_diary_stats(connection)
+        click.echo(json.dumps({'diaries': count}, ensure_ascii=False))
+
+    @app.cli.command('backfill-diary-images')
+    @click.option('--batch-size', type=int, default=500, help='每批处理的日记数')
+    def backfill_images(batch_size):
+        """按日记的 images 重建上传图片关联表"""
+        from extensions import db
+        from services.diary_images import backfill_diary_images
+
+        with db.engine.begin() as connection:
+            count = backfill_diary_images(connection, batch_size=batch_size)
+        click.echo(json.dumps({'diaries': count}, ensure_ascii=False))
+
+    @app.cli.command('rebuild-diary-stats')
+    @click.option('--user-id', 'user_ids', type=int, multiple=True, help='只重算指定用户（可重复）')
+    def rebuild_stats(user_ids):
+        """按日记和标签关联重算用户日记统计汇总表"""
+        from extensions import db
+        from services.diary_stats import rebuild_diary_stats
+
+        with db.engine.begin() as connection:
+            result = rebuild_diary_stats(connection, list(user_ids) or None)
+        click.echo(json.dumps(result, ensure_ascii=False))
+
+    @app.cli.command('verify-game-ledger')
+    @click.option('--user-id', 'user_ids', type=int, multiple=True, help='只检查指定用户（可重复）')
+    def verify_game_ledger(user_ids):
+        """用快照+流水重放每个用户的游戏状态，与 game_states 比对"""
+        from services.game_ledger import verify_ledger
+
+        result = verify_ledger(user_ids=list(user_ids) or None)
+        click.echo(json.dumps(result, ensure_ascii=False, indent=2))
+        if result['mismatched']:
+            raise click.ClickException(f"{len(result['mismatched'])} 个用户的流水与当前状态不一致")
+
+    @app.cli.command('checkpoint-adventures')
+    def checkpoint_adventures():
+        """把状态存储中进行中探险的新答案写回数据库（停机前或定时执行）"""
+        from services.adventure_state import checkpoint, enabled
+
+        if not enabled():
+            raise click.ClickException('未启用探险状态存储（ADVENTURE_STATE_STORE）')
+        click.echo(json.dumps({'written': checkpoint()}, ensure_ascii=False))
+
+    @app.cli.command('resume-image-downloads')
+    @click.option('--limit', type=int, default=100, help='本次最多重新提交多少张明信片')
+    def resume_image_downloads(limit):
+        """重新提交还没转存完的明信片临时图片（进程重启丢失的下载任务，Web进程也会定时扫描）"""
+        from services.postcard_service import sweep_pending_images
+
+        click.echo(json.dumps({'resubmitted': sweep_pending_images(limit=limit)}, ensure_ascii=False))
@@ -0,0 +1,127 @@
+"""legacy column patches
+
+原来 app.py 的 ensure_schema_updates() 在每个 worker 导入时检查并补加的列，
+改为在部署时由 flask db upgrade 执行一次。接在索引迁移 3f2a9c1d7b45 之后，
+已经升级到 3f2a9c1d7b45 的库也会执行到这里。
+只包含原始版本就有的列；之后各需求新增的列在各自的迁移里
+（2b5c8e1f9a43 明信片图片档位、2c9f4a7d1e56 明信片图片来源、2d3e6b8c5f71 访问日志耗时）。
+
+新库由 3f2a9c1d7b45 按模型建表，建表时已经带上这些列，
+因此这里只给已存在的表补加缺少的列，重复执行不会出错。
+
+Revision ID: 1a7d5e3c2b90
+Revises: 3f2a9c1d7b45
+Create Date: 2026-10-19 10:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a7d5e3c2b90'
+down_revision = '3f2a9c1d7b45'
+branch_labels = None
+depends_on = None
+
+
+def _columns():
+    """{表名: [Column, ...]}（每次调用新建Column对象，同一个Column不能加到两张表）"""
+    return {
+        'users': [
+            sa.Column('reset_token', sa.String(255)),
+            sa.Column('reset_token_expires', sa.DateTime()),
+            # 管理员字段
+            sa.Column('is_admin', sa.Boolean(), server_default=sa.text('0')),
+            sa.Column('last_login_at', sa.DateTime()),
+            sa.Column('login_count', sa.Integer(), server_default=sa.text('0')),
+        ],
+        'emotion_diaries': [
+            sa.Column('trigger_event', sa.Text()),
+            sa.Column('images', sa.JSON()),
+            sa.Column('score_applied', sa.Boolean(), server_default=sa.text('0')),
+        ],
+        'emotion_analysis': [
+            sa.Column('analysis_payload', sa.JSON()),
+        ],
+        'game_states': [
+            sa.Column('mental_health_score', sa.Integer(), server_default=sa.text('50')),
+            sa.Column('stress_level', sa.Integer(), server_default=sa.text('50')),
+            sa.Column('growth_potential', sa.Integer(), server_default=sa.text('50')),
+            # 游戏资源字段
+            sa.Column('coins', sa.Integer(), server_default=sa.text('0')),
+            sa.Column('level', sa.Integer(), server_default=sa.text('1')),
+            sa.Column('total_diaries', sa.Integer(), server_default=sa.text('0')),
+            sa.Column('created_at', sa.DateTime()),
+        ],
+        'postcards': [
+            sa.Column('image_url', sa.String(500)),
+            sa.Column('image_prompt', sa.Text()),
+            sa.Column('location_name', sa.String(100)),
+            sa.Column('message', sa.Text()),
+            sa.Column('status', sa.String(20), server_default='pending'),
+            sa.Column('emotion_tags', sa.JSON()),
+            sa.Column('emotion_intensity', sa.Integer()),
+            sa.Column('mental_health_score', sa.Integer()),
+            sa.Column('generated_at', sa.DateTime()),
+            sa.Column('is_read', sa.Boolean(), server_default=sa.text('0')),
+            sa.Column('read_at', sa.DateTime()),
+            # 探险收获
+            sa.Column('stat_changes', sa.JSON()),
+            sa.Column('coins_earned', sa.Integer(), server_default=sa.text('0')),
+        ],
+        'adventure_sessions': [
+            sa.Column('scene_name', sa.String(100)),
+            sa.Column('monsters', sa.JSON()),
+            sa.Column('challenges', sa.JSON()),
+            sa.Column('current_challenge', sa.Integer(), server_default=sa.text('0')),
+            sa.Column('coins_earned', sa.Integer(), server_default=sa.text('0')),
+            sa.Column('items_earned', sa.JSON()),
+            sa.Column('stat_changes', sa.JSON()),
+            sa.Column('started_at', sa.DateTime()),
+            sa.Column('completed_at', sa.DateTime()),
+        ],
+        'user_items': [
+            sa.Column('item_name_zh', sa.String(50)),
+            sa.Column('item_type', sa.String(20), server_default='healing'),
+            sa.Column('quantity', sa.Integer(), server_default=sa.text('1')),
+            sa.Column('effect_type', sa.String(30)),
+            sa.Column('effect_value', sa.Integer(), server_default=sa.text('0')),
+        ],
+        'access_logs': [
+            sa.Column('ip_address', sa.String(50)),
+            sa.Column('user_agent', sa.String(500)),
+            sa.Column('path', sa.String(200)),
+            sa.Column('method', sa.String(10)),
+            sa.Column('user_id', sa.Integer()),
+            sa.Column('status_code', sa.Integer()),
+        ],
+    }
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    for table, columns in _columns().items():
+        if table not in tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        for column in columns:
+            if column.name in existing:
+                continue
+            op.add_column(table, column)
+            if table == 'emotion_diaries' and column.name == 'score_applied':
+                # 旧日记默认视为已计分，避免重复影响GameState
+                op.execute('UPDATE emotion_diaries SET score_applied = 1 WHERE score_applied IS NULL OR score_applied = 0')
+
+    # 3f2a9c1d7b45 因缺列跳过的索引
+    if 'postcards' in tables:
+        existing = {index['name'] for index in inspector.get_indexes('postcards')}
+        if 'ix_postcards_user_read' not in existing:
+            op.create_index('ix_postcards_user_read', 'postcards', ['user_id', 'is_read'])
+
+
+def downgrade():
+    # 这些列是模型的一部分，降级时保留
+    pass
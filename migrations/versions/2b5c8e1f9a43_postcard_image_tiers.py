@@ -0,0 +1,50 @@
+"""postcard image tiers
+
+postcards 增加图片尺寸档位：先出快速预览图再渲染2K图（services/postcard_service.py），
+preview_url 保留预览图、image_tier 记录 image_url 当前的档位、time_to_first_image_ms 记录首图耗时。
+
+新库由 3f2a9c1d7b45 按模型建表时已经带上这些列，这里只给已存在的表补加缺少的列，重复执行不会出错。
+
+Revision ID: 2b5c8e1f9a43
+Revises: 1a7d5e3c2b90
+Create Date: 2026-10-19 10:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b5c8e1f9a43'
+down_revision = '1a7d5e3c2b90'
+branch_labels = None
+depends_on = None
+
+
+def _columns():
+    return [
+        sa.Column('preview_url', sa.String(500)),
+        sa.Column('image_tier', sa.String(20)),
+        sa.Column('time_to_first_image_ms', sa.Integer()),
+    ]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'postcards' not in inspector.get_table_names():
+        return
+    existing = {column['name'] for column in inspector.get_columns('postcards')}
+    for column in _columns():
+        if column.name not in existing:
+            op.add_column('postcards', column)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'postcards' not in inspector.get_table_names():
+        return
+    existing = {column['name'] for column in inspector.get_columns('postcards')}
+    with op.batch_alter_table('postcards') as batch_op:
+        for column in reversed(_columns()):
+            if column.name in existing:
+                batch_op.drop_column(column.name)
@@ -0,0 +1,47 @@
+"""postcard image source
+
+postcards 增加 image_source：图片来自AI生成（generated）还是备用图库（library，services/fallback_library.py）。
+
+新库由 3f2a9c1d7b45 按模型建表时已经带上这些列，这里只给已存在的表补加缺少的列，重复执行不会出错。
+
+Revision ID: 2c9f4a7d1e56
+Revises: 2b5c8e1f9a43
+Create Date: 2026-10-19 10:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c9f4a7d1e56'
+down_revision = '2b5c8e1f9a43'
+branch_labels = None
+depends_on = None
+
+
+def _columns():
+    return [
+        sa.Column('image_source', sa.String(20)),
+    ]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'postcards' not in inspector.get_table_names():
+        return
+    existing = {column['name'] for column in inspector.get_columns('postcards')}
+    for column in _columns():
+        if column.name not in existing:
+            op.add_column('postcards', column)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'postcards' not in inspector.get_table_names():
+        return
+    existing = {column['name'] for column in inspector.get_columns('postcards')}
+    with op.batch_alter_table('postcards') as batch_op:
+        for column in reversed(_columns()):
+            if column.name in existing:
+                batch_op.drop_column(column.name)
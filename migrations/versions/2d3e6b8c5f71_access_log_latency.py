@@ -0,0 +1,50 @@
+"""access log latency
+
+access_logs 增加每个请求的路由端点、耗时、耗时直方图桶号和响应大小（services/access_log.py、services/latency_histogram.py）。
+
+新库由 3f2a9c1d7b45 按模型建表时已经带上这些列，这里只给已存在的表补加缺少的列，重复执行不会出错。
+
+Revision ID: 2d3e6b8c5f71
+Revises: 2c9f4a7d1e56
+Create Date: 2026-10-19 10:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2d3e6b8c5f71'
+down_revision = '2c9f4a7d1e56'
+branch_labels = None
+depends_on = None
+
+
+def _columns():
+    return [
+        sa.Column('endpoint', sa.String(100)),
+        sa.Column('duration_us', sa.BigInteger()),
+        sa.Column('latency_bucket', sa.Integer()),
+        sa.Column('response_bytes', sa.BigInteger()),
+    ]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'access_logs' not in inspector.get_table_names():
+        return
+    existing = {column['name'] for column in inspector.get_columns('access_logs')}
+    for column in _columns():
+        if column.name not in existing:
+            op.add_column('access_logs', column)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'access_logs' not in inspector.get_table_names():
+        return
+    existing = {column['name'] for column in inspector.get_columns('access_logs')}
+    with op.batch_alter_table('access_logs') as batch_op:
+        for column in reversed(_columns()):
+            if column.name in existing:
+                batch_op.drop_column(column.name)
@@ -0,0 +1,63 @@
+"""add hot query indexes
+
+为高频查询补充索引：用户日记列表、明信片未读数/按日记查找、探险会话、
+道具背包、游戏状态，以及访问日志的时间范围统计。
+
+空库（还没有 users 表）在这里按模型一次建出全部表，已经带上所有迁移的列和索引，
+之后的迁移检查到表、列、索引已存在即跳过；部署只需执行 flask db upgrade，应用启动时不再建表。
+已有的库先检查表和索引是否存在，重复执行不会出错。
+
+Revision ID: 3f2a9c1d7b45
+Revises:
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b45'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('emotion_diaries', 'ix_emotion_diaries_user_created', ['user_id', 'created_at']),
+    ('game_states', 'ix_game_states_user', ['user_id']),
+    ('postcards', 'ix_postcards_user_read', ['user_id', 'is_read']),
+    ('postcards', 'ix_postcards_diary', ['diary_id']),
+    ('adventure_sessions', 'ix_adventure_sessions_diary_user', ['diary_id', 'user_id']),
+    ('user_items', 'ix_user_items_user_item', ['user_id', 'item_name']),
+    ('access_logs', 'ix_access_logs_created', ['created_at']),
+]
+
+
+def _existing_indexes(inspector, table):
+    return {index['name'] for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+    if 'users' not in tables:
+        from models import db
+        db.metadata.create_all(bind)
+        return
+
+    for table, name, columns in INDEXES:
+        if table not in tables or name in _existing_indexes(inspector, table):
+            continue
+        # 很旧的库可能还缺 postcards.is_read 等列，这类索引由 1a7d5e3c2b90 补完列后再建
+        if set(columns) <= {column['name'] for column in inspector.get_columns(table)}:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    for table, name, columns in reversed(INDEXES):
+        if table in tables and name in _existing_indexes(inspector, table):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,44 @@
+"""diary images
+
+日记-上传图片关联 diary_images（见 services/diary_images.py），文件垃圾回收按 image_key 查引用，
+建表后按现有日记回填。
+
+Revision ID: 4e6a2c8f1d37
+Revises: 7b3e9d1f5a20
+Create Date: 2026-10-20 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e6a2c8f1d37'
+down_revision = '7b3e9d1f5a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    tables = set(sa.inspect(bind).get_table_names())
+    if 'emotion_diaries' not in tables:
+        # 新库由 3f2a9c1d7b45 按模型建表
+        return
+
+    if 'diary_images' not in tables:
+        op.create_table(
+            'diary_images',
+            sa.Column('diary_id', sa.Integer(), sa.ForeignKey('emotion_diaries.id'), primary_key=True),
+            sa.Column('image_key', sa.String(255), primary_key=True),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+        )
+        op.create_index('ix_diary_images_key', 'diary_images', ['image_key'])
+
+    from services.diary_images import backfill_diary_images
+    backfill_diary_images(bind)
+
+
+def downgrade():
+    if 'diary_images' in sa.inspect(op.get_bind()).get_table_names():
+        op.drop_table('diary_images')
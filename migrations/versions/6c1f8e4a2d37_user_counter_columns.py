@@ -0,0 +1,58 @@
+"""user counter columns
+
+users 表增加计数缓存列 diary_count / postcard_count / unread_postcards，
+并按现有数据回填（之后由 services/user_counters.py 在写入时维护）。
+
+Revision ID: 6c1f8e4a2d37
+Revises: 2d3e6b8c5f71
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c1f8e4a2d37'
+down_revision = '2d3e6b8c5f71'
+branch_labels = None
+depends_on = None
+
+
+COUNTER_COLUMNS = ('diary_count', 'postcard_count', 'unread_postcards')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'users' not in inspector.get_table_names():
+        return
+
+    existing = {column['name'] for column in inspector.get_columns('users')}
+    for name in COUNTER_COLUMNS:
+        if name not in existing:
+            op.add_column('users', sa.Column(name, sa.Integer(), server_default=sa.text('0')))
+
+    tables = set(inspector.get_table_names())
+    if 'emotion_diaries' in tables:
+        op.execute(
+            'UPDATE users SET diary_count = '
+            '(SELECT COUNT(*) FROM emotion_diaries WHERE emotion_diaries.user_id = users.id)'
+        )
+    if 'postcards' in tables:
+        op.execute(
+            'UPDATE users SET postcard_count = '
+            '(SELECT COUNT(*) FROM postcards WHERE postcards.user_id = users.id), '
+            'unread_postcards = '
+            '(SELECT COUNT(*) FROM postcards WHERE postcards.user_id = users.id AND postcards.is_read = 0)'
+        )
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'users' not in inspector.get_table_names():
+        return
+    existing = {column['name'] for column in inspector.get_columns('users')}
+    with op.batch_alter_table('users') as batch_op:
+        for name in COUNTER_COLUMNS:
+            if name in existing:
+                batch_op.drop_column(name)
@@ -0,0 +1,47 @@
+"""postcard image pending
+
+postcards 增加 image_pending_at：image_url / preview_url 还是豆包临时URL、等待转存时记录最近一次提交下载的时间，
+转存完成后清空。进程重启丢失的下载任务由 sweep_pending_images 按这一列重新提交（services/postcard_service.py）。
+
+已有的仍指向临时URL的明信片按生成时间回填，超过临时URL有效期的会在第一次扫描时放弃。
+
+Revision ID: 7b3e9d1f5a20
+Revises: f2c8a4d6b913
+Create Date: 2026-10-20 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e9d1f5a20'
+down_revision = 'f2c8a4d6b913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'postcards' not in inspector.get_table_names():
+        return
+
+    if 'image_pending_at' not in {column['name'] for column in inspector.get_columns('postcards')}:
+        op.add_column('postcards', sa.Column('image_pending_at', sa.DateTime()))
+        op.execute(
+            "UPDATE postcards SET image_pending_at = COALESCE(generated_at, created_at) "
+            "WHERE image_url LIKE 'http%' OR preview_url LIKE 'http%'"
+        )
+    if 'ix_postcards_image_pending' not in {index['name'] for index in inspector.get_indexes('postcards')}:
+        op.create_index('ix_postcards_image_pending', 'postcards', ['image_pending_at'])
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'postcards' not in inspector.get_table_names():
+        return
+    if 'ix_postcards_image_pending' in {index['name'] for index in inspector.get_indexes('postcards')}:
+        op.drop_index('ix_postcards_image_pending', table_name='postcards')
+    if 'image_pending_at' in {column['name'] for column in inspector.get_columns('postcards')}:
+        with op.batch_alter_table('postcards') as batch_op:
+            batch_op.drop_column('image_pending_at')
@@ -0,0 +1,49 @@
+"""diary fulltext index
+
+日记内容全文索引（见 services/diary_search.py）：
+- MySQL: emotion_diaries.content 上的 FULLTEXT 索引，使用 ngram 解析器支持中文
+- SQLite: FTS5 虚拟表 emotion_diaries_fts，并按现有日记回填
+
+Revision ID: 8d2b6f0c4e19
+Revises: 6c1f8e4a2d37
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2b6f0c4e19'
+down_revision = '6c1f8e4a2d37'
+branch_labels = None
+depends_on = None
+
+
+INDEX_NAME = 'ft_emotion_diaries_content'
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if 'emotion_diaries' not in inspector.get_table_names():
+        return
+
+    if bind.dialect.name == 'mysql':
+        existing = {index['name'] for index in inspector.get_indexes('emotion_diaries')}
+        if INDEX_NAME not in existing:
+            op.execute(f'ALTER TABLE emotion_diaries ADD FULLTEXT INDEX {INDEX_NAME} (content) WITH PARSER ngram')
+    elif bind.dialect.name == 'sqlite':
+        from services.diary_search import ensure_sqlite_index
+        ensure_sqlite_index(bind)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'mysql':
+        existing = {index['name'] for index in sa.inspect(bind).get_indexes('emotion_diaries')}
+        if INDEX_NAME in existing:
+            op.drop_index(INDEX_NAME, table_name='emotion_diaries')
+    elif bind.dialect.name == 'sqlite':
+        from services.diary_search import FTS_TABLE
+        op.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
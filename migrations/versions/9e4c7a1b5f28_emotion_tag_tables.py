@@ -0,0 +1,55 @@
+"""emotion tag tables
+
+情绪标签字典 emotion_tags 和日记-标签关联 diary_emotion_tags（见 services/emotion_tags.py），
+建表后按现有日记回填。
+
+Revision ID: 9e4c7a1b5f28
+Revises: 8d2b6f0c4e19
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4c7a1b5f28'
+down_revision = '8d2b6f0c4e19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    tables = set(sa.inspect(bind).get_table_names())
+    if 'emotion_diaries' not in tables:
+        # 新库由 3f2a9c1d7b45 按模型建表
+        return
+
+    if 'emotion_tags' not in tables:
+        op.create_table(
+            'emotion_tags',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('name', sa.String(50), nullable=False, unique=True),
+            sa.Column('created_at', sa.DateTime()),
+        )
+    if 'diary_emotion_tags' not in tables:
+        op.create_table(
+            'diary_emotion_tags',
+            sa.Column('diary_id', sa.Integer(), sa.ForeignKey('emotion_diaries.id'), primary_key=True),
+            sa.Column('tag_id', sa.Integer(), sa.ForeignKey('emotion_tags.id'), primary_key=True),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime()),
+        )
+        op.create_index('ix_diary_emotion_tags_user_tag', 'diary_emotion_tags', ['user_id', 'tag_id', 'created_at'])
+
+    from services.emotion_tags import backfill_emotion_tags
+    backfill_emotion_tags(bind)
+
+
+def downgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'diary_emotion_tags' in tables:
+        op.drop_table('diary_emotion_tags')
+    if 'emotion_tags' in tables:
+        op.drop_table('emotion_tags')
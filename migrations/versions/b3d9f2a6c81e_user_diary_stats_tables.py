@@ -0,0 +1,52 @@
+"""user diary stats tables
+
+用户日记统计汇总表 user_diary_daily / user_tag_counts（见 services/diary_stats.py），
+建表后按现有日记和标签关联重算。
+
+Revision ID: b3d9f2a6c81e
+Revises: 9e4c7a1b5f28
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d9f2a6c81e'
+down_revision = '9e4c7a1b5f28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    tables = set(sa.inspect(bind).get_table_names())
+    if 'emotion_diaries' not in tables:
+        # 新库由 3f2a9c1d7b45 按模型建表
+        return
+
+    if 'user_diary_daily' not in tables:
+        op.create_table(
+            'user_diary_daily',
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+            sa.Column('day', sa.Date(), primary_key=True),
+            sa.Column('diary_count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        )
+    if 'user_tag_counts' not in tables:
+        op.create_table(
+            'user_tag_counts',
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+            sa.Column('tag_id', sa.Integer(), sa.ForeignKey('emotion_tags.id'), primary_key=True),
+            sa.Column('diary_count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        )
+
+    from services.diary_stats import rebuild_diary_stats
+    rebuild_diary_stats(bind)
+
+
+def downgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    for name in ('user_tag_counts', 'user_diary_daily'):
+        if name in tables:
+            op.drop_table(name)
@@ -0,0 +1,83 @@
+"""game ledger
+
+游戏状态流水 game_ledger、快照 game_snapshots 和 game_states.ledger_seq（见 services/game_ledger.py）。
+已有用户以当前状态保存 seq=0 的基线快照，之后的变化从流水重放。
+
+Revision ID: c7e2a5d9f314
+Revises: b3d9f2a6c81e
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e2a5d9f314'
+down_revision = 'b3d9f2a6c81e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    if 'game_states' not in tables:
+        # 新库由 3f2a9c1d7b45 按模型建表
+        return
+
+    if 'ledger_seq' not in {column['name'] for column in inspector.get_columns('game_states')}:
+        op.add_column('game_states', sa.Column('ledger_seq', sa.Integer(), server_default=sa.text('0')))
+
+    if 'game_ledger' not in tables:
+        op.create_table(
+            'game_ledger',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('seq', sa.Integer(), nullable=False),
+            sa.Column('source', sa.String(30), nullable=False),
+            sa.Column('diary_id', sa.Integer()),
+            sa.Column('coins', sa.Integer()),
+            sa.Column('mental_health', sa.Integer()),
+            sa.Column('stress', sa.Integer()),
+            sa.Column('growth', sa.Integer()),
+            sa.Column('diaries', sa.Integer()),
+            sa.Column('level_up', sa.Boolean()),
+            sa.Column('created_at', sa.DateTime()),
+            sa.UniqueConstraint('user_id', 'seq', name='uq_game_ledger_user_seq'),
+        )
+        op.create_index('ix_game_ledger_user_created', 'game_ledger', ['user_id', 'created_at'])
+
+    if 'game_snapshots' not in tables:
+        op.create_table(
+            'game_snapshots',
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+            sa.Column('seq', sa.Integer(), primary_key=True),
+            sa.Column('mental_health_score', sa.Integer(), nullable=False),
+            sa.Column('stress_level', sa.Integer(), nullable=False),
+            sa.Column('growth_potential', sa.Integer(), nullable=False),
+            sa.Column('coins', sa.Integer(), nullable=False),
+            sa.Column('level', sa.Integer(), nullable=False),
+            sa.Column('total_diaries', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime()),
+        )
+        # 基线快照：流水上线时的状态
+        op.execute(
+            'INSERT INTO game_snapshots '
+            '(user_id, seq, mental_health_score, stress_level, growth_potential, coins, level, total_diaries, created_at) '
+            'SELECT user_id, 0, COALESCE(mental_health_score, 50), COALESCE(stress_level, 50), '
+            'COALESCE(growth_potential, 50), COALESCE(coins, 0), COALESCE(level, 1), COALESCE(total_diaries, 0), '
+            'CURRENT_TIMESTAMP FROM game_states '
+            'WHERE id IN (SELECT MIN(id) FROM game_states GROUP BY user_id)'
+        )
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    for name in ('game_snapshots', 'game_ledger'):
+        if name in tables:
+            op.drop_table(name)
+    if 'game_states' in tables and 'ledger_seq' in {column['name'] for column in inspector.get_columns('game_states')}:
+        with op.batch_alter_table('game_states') as batch_op:
+            batch_op.drop_column('ledger_seq')
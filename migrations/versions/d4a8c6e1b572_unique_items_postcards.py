@@ -0,0 +1,166 @@
+"""unique items and postcards
+
+user_items (user_id, item_name) 与 postcards.diary_id 改为唯一索引，探险结算据此做 upsert。
+建索引前合并已有重复：同名道具数量累加到最早的一行；同一日记的多张明信片保留已完成的（否则最早的）一张，
+并按剩下的明信片重算 users 的 postcard_count / unread_postcards。
+
+多出的明信片不直接丢弃：先整行复制到 postcards_duplicate_backup（kept_id 为保留下来的那张），
+保留的那张没有图片时用重复行的图片补上，合并的id会打印出来；降级时从备份表恢复这些明信片。
+
+Revision ID: d4a8c6e1b572
+Revises: c7e2a5d9f314
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+import sys
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a8c6e1b572'
+down_revision = 'c7e2a5d9f314'
+branch_labels = None
+depends_on = None
+
+
+# (表, 旧的普通索引, 新的唯一索引, 列)
+INDEXES = (
+    ('user_items', 'ix_user_items_user_item', 'uq_user_items_user_item', ['user_id', 'item_name']),
+    ('postcards', 'ix_postcards_diary', 'uq_postcards_diary', ['diary_id']),
+)
+
+
+def _delete_ids(bind, table: str, ids: list):
+    for start in range(0, len(ids), 500):
+        bind.execute(
+            sa.text(f'DELETE FROM {table} WHERE id IN :ids').bindparams(sa.bindparam('ids', expanding=True)),
+            {'ids': ids[start:start + 500]}
+        )
+
+
+def _merge_duplicate_items(bind):
+    groups = bind.execute(sa.text(
+        'SELECT user_id, item_name, MIN(id), SUM(quantity) FROM user_items '
+        'GROUP BY user_id, item_name HAVING COUNT(*) > 1'
+    )).fetchall()
+    for user_id, item_name, keep_id, quantity in groups:
+        bind.execute(sa.text('UPDATE user_items SET quantity = :quantity WHERE id = :id'),
+                     {'quantity': quantity, 'id': keep_id})
+        duplicate_ids = [row[0] for row in bind.execute(sa.text(
+            'SELECT id FROM user_items WHERE user_id = :user_id AND item_name = :item_name AND id <> :id'
+        ), {'user_id': user_id, 'item_name': item_name, 'id': keep_id})]
+        _delete_ids(bind, 'user_items', duplicate_ids)
+    return len(groups)
+
+
+BACKUP_TABLE = 'postcards_duplicate_backup'
+# 保留的明信片缺图时从重复行补上的列（旧库可能还没有后面几列）
+IMAGE_COLUMNS = ('image_url', 'preview_url', 'image_tier', 'image_source', 'image_prompt', 'generated_at')
+
+
+def _postcard_columns(bind) -> list:
+    return [column['name'] for column in sa.inspect(bind).get_columns('postcards')]
+
+
+def _recount_user_postcards(bind):
+    if 'postcard_count' in {c['name'] for c in sa.inspect(bind).get_columns('users')}:
+        op.execute(
+            'UPDATE users SET postcard_count = '
+            '(SELECT COUNT(*) FROM postcards WHERE postcards.user_id = users.id), '
+            'unread_postcards = '
+            '(SELECT COUNT(*) FROM postcards WHERE postcards.user_id = users.id AND postcards.is_read = 0)'
+        )
+
+
+def _merge_duplicate_postcards(bind):
+    diary_ids = [row[0] for row in bind.execute(sa.text(
+        'SELECT diary_id FROM postcards WHERE diary_id IS NOT NULL GROUP BY diary_id HAVING COUNT(*) > 1'
+    ))]
+    if not diary_ids:
+        return 0
+
+    columns = _postcard_columns(bind)
+    image_columns = [name for name in IMAGE_COLUMNS if name in columns]
+    if BACKUP_TABLE not in sa.inspect(bind).get_table_names():
+        # 与 postcards 同列，外加 kept_id
+        op.execute(f'CREATE TABLE {BACKUP_TABLE} AS SELECT p.*, p.id AS kept_id FROM postcards p WHERE 1 = 0')
+
+    merged = []
+    for diary_id in diary_ids:
+        rows = bind.execute(sa.text(
+            f"SELECT id, {', '.join(image_columns)} FROM postcards WHERE diary_id = :diary_id "
+            "ORDER BY CASE WHEN status = 'completed' THEN 0 ELSE 1 END, id"
+        ), {'diary_id': diary_id}).mappings().all()
+        kept, duplicates = rows[0], rows[1:]
+        duplicate_ids = [row['id'] for row in duplicates]
+        bind.execute(
+            sa.text(f'INSERT INTO {BACKUP_TABLE} SELECT p.*, :kept_id FROM postcards p WHERE p.id IN :ids')
+            .bindparams(sa.bindparam('ids', expanding=True)),
+            {'kept_id': kept['id'], 'ids': duplicate_ids}
+        )
+        if not kept['image_url']:
+            source = next((row for row in duplicates if row['image_url']), None)
+            if source:
+                bind.execute(
+                    sa.text(f"UPDATE postcards SET {', '.join(f'{name} = :{name}' for name in image_columns)} "
+                            "WHERE id = :id"),
+                    {**{name: source[name] for name in image_columns}, 'id': kept['id']}
+                )
+        _delete_ids(bind, 'postcards', duplicate_ids)
+        merged.append((kept['id'], duplicate_ids))
+
+    _recount_user_postcards(bind)
+    print(f"[迁移] 合并了 {len(merged)} 篇日记的重复明信片，原行已备份到 {BACKUP_TABLE}:", file=sys.stderr)
+    for kept_id, duplicate_ids in merged:
+        print(f"  保留 #{kept_id}，合并 {duplicate_ids}", file=sys.stderr)
+    return len(merged)
+
+
+def _restore_duplicate_postcards(bind):
+    """把备份的重复明信片放回 postcards（需在删除唯一索引之后）"""
+    if BACKUP_TABLE not in sa.inspect(bind).get_table_names():
+        return
+    columns = ', '.join(_postcard_columns(bind))
+    op.execute(f'INSERT INTO postcards ({columns}) SELECT {columns} FROM {BACKUP_TABLE}')
+    op.drop_table(BACKUP_TABLE)
+    _recount_user_postcards(bind)
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+
+    if 'user_items' in tables:
+        _merge_duplicate_items(bind)
+    if 'postcards' in tables:
+        _merge_duplicate_postcards(bind)
+
+    for table, old_name, new_name, columns in INDEXES:
+        if table not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table)}
+        # 先建新索引再删旧索引：MySQL 外键列上必须一直有索引
+        if new_name not in existing:
+            op.create_index(new_name, table, columns, unique=True)
+        if old_name in existing:
+            op.drop_index(old_name, table_name=table)
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+    for table, old_name, new_name, columns in INDEXES:
+        if table not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table)}
+        if old_name not in existing:
+            op.create_index(old_name, table, columns)
+        if new_name in existing:
+            op.drop_index(new_name, table_name=table)
+
+    if 'postcards' in tables:
+        _restore_duplicate_postcards(bind)
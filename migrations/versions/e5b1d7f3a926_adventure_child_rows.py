@@ -0,0 +1,150 @@
+"""adventure child rows
+
+探险的怪物、挑战从 adventure_sessions 的 monsters / challenges JSON 列拆到
+adventure_monsters / adventure_challenges（按 (session_id, position) 一项一行），并按现有JSON回填。
+旧JSON列保留不删；降级时把子表内容写回JSON列再删除子表。
+
+Revision ID: e5b1d7f3a926
+Revises: d4a8c6e1b572
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b1d7f3a926'
+down_revision = 'd4a8c6e1b572'
+branch_labels = None
+depends_on = None
+
+
+# 单独成列的字段（其余字段放在 data 里），与 models.AdventureMonster / AdventureChallenge 一致
+MONSTER_FIELDS = ('type', 'defeated')
+CHALLENGE_FIELDS = ('type', 'completed', 'user_answers', 'is_correct')
+FIELD_TYPES = {
+    'type': sa.String(50),
+    'defeated': sa.Boolean(),
+    'completed': sa.Boolean(),
+    'user_answers': sa.JSON(),
+    'is_correct': sa.Boolean(),
+}
+BATCH_SIZE = 500
+
+
+def _json(value):
+    if isinstance(value, (bytes, str)):
+        value = json.loads(value) if value else None
+    return value if isinstance(value, list) else []
+
+
+def _split(session_id, position, item, fields):
+    data = dict(item) if isinstance(item, dict) else {}
+    row = {'session_id': session_id, 'position': position}
+    for name in fields:
+        row[name] = data.pop(name, None)
+    row['data'] = data
+    return row
+
+
+def _join(row, fields):
+    item = dict(row['data'] or {})
+    for name in fields:
+        if row[name] is not None:
+            item[name] = row[name]
+    return item
+
+
+def _columns(name):
+    columns = [
+        sa.Column('session_id', sa.Integer(), sa.ForeignKey('adventure_sessions.id'), primary_key=True),
+        sa.Column('position', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('type', sa.String(50)),
+    ]
+    if name == 'adventure_monsters':
+        columns.append(sa.Column('defeated', sa.Boolean()))
+    else:
+        columns += [
+            sa.Column('completed', sa.Boolean()),
+            sa.Column('user_answers', sa.JSON()),
+            sa.Column('is_correct', sa.Boolean()),
+        ]
+    columns.append(sa.Column('data', sa.JSON()))
+    return columns
+
+
+def _tables():
+    """回填/写回用的轻量表对象"""
+    def table(name, fields):
+        return sa.table(name, sa.column('session_id'), sa.column('position'), sa.column('data', sa.JSON()),
+                        *[sa.column(field, FIELD_TYPES[field]) for field in fields])
+    return table('adventure_monsters', MONSTER_FIELDS), table('adventure_challenges', CHALLENGE_FIELDS)
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+    if 'adventure_sessions' not in tables:
+        # 新库由 3f2a9c1d7b45 按模型建表
+        return
+
+    for name in ('adventure_monsters', 'adventure_challenges'):
+        if name not in tables:
+            op.create_table(name, *_columns(name))
+    monsters, challenges = _tables()
+
+    columns = {column['name'] for column in inspector.get_columns('adventure_sessions')}
+    if not {'monsters', 'challenges'} <= columns:
+        return
+
+    # 按id分批回填（已有子表行的会话跳过，可重复执行）
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.text(
+            'SELECT id, monsters, challenges FROM adventure_sessions WHERE id > :last_id ORDER BY id LIMIT :limit'
+        ), {'last_id': last_id, 'limit': BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        session_ids = [row[0] for row in rows]
+        for table, index, fields in ((monsters, 1, MONSTER_FIELDS), (challenges, 2, CHALLENGE_FIELDS)):
+            existing = {row[0] for row in bind.execute(
+                sa.select(table.c.session_id).where(table.c.session_id.in_(session_ids)).distinct()
+            )}
+            values = [
+                _split(row[0], position, item, fields)
+                for row in rows if row[0] not in existing
+                for position, item in enumerate(_json(row[index]))
+            ]
+            if values:
+                bind.execute(table.insert(), values)
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+    if 'adventure_sessions' not in tables:
+        return
+
+    columns = {column['name'] for column in inspector.get_columns('adventure_sessions')}
+    for name in ('monsters', 'challenges'):
+        if name not in columns:
+            op.add_column('adventure_sessions', sa.Column(name, sa.JSON()))
+
+    monsters, challenges = _tables()
+    sessions = sa.table('adventure_sessions', sa.column('id'), sa.column('monsters', sa.JSON()),
+                        sa.column('challenges', sa.JSON()))
+    for table, column, fields in ((monsters, 'monsters', MONSTER_FIELDS), (challenges, 'challenges', CHALLENGE_FIELDS)):
+        if table.name not in tables:
+            continue
+        items = {}
+        for row in bind.execute(sa.select(table).order_by(table.c.session_id, table.c.position)).mappings():
+            items.setdefault(row['session_id'], []).append(_join(row, fields))
+        for session_id, values in items.items():
+            bind.execute(sessions.update().where(sessions.c.id == session_id).values({column: values}))
+        op.drop_table(table.name)
@@ -0,0 +1,88 @@
+"""stats and library tables
+
+原来由各服务在运行时 __table__.create(checkfirst=True) 建的表改由迁移创建：
+- user_storage_usage：文件垃圾回收对账后的用户存储占用（services/storage_gc.py）
+- fallback_images：备用明信片图库（services/fallback_library.py）
+- stats_hourly / stats_daily：流量与业务汇总（services/stats_rollup.py）
+- visitor_sketches：每日独立访客 HyperLogLog 草图（services/visitor_sketch.py）
+
+这些表只依赖 users，已存在的表跳过，重复执行不会出错。
+
+Revision ID: f2c8a4d6b913
+Revises: e5b1d7f3a926
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8a4d6b913'
+down_revision = 'e5b1d7f3a926'
+branch_labels = None
+depends_on = None
+
+
+def _stats_columns(key):
+    return [
+        key,
+        sa.Column('visits', sa.Integer()),
+        sa.Column('unique_visitors', sa.Integer()),
+        sa.Column('server_errors', sa.Integer()),
+        sa.Column('new_users', sa.Integer()),
+        sa.Column('diaries', sa.Integer()),
+        sa.Column('postcards', sa.Integer()),
+        sa.Column('postcards_by_status', sa.JSON()),
+        sa.Column('updated_at', sa.DateTime()),
+    ]
+
+
+def _tables():
+    """{表名: 建表参数}（每次调用新建Column对象）"""
+    return {
+        'user_storage_usage': [
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+            sa.Column('postcard_files', sa.Integer()),
+            sa.Column('postcard_bytes', sa.BigInteger()),
+            sa.Column('upload_files', sa.Integer()),
+            sa.Column('upload_bytes', sa.BigInteger()),
+            sa.Column('updated_at', sa.DateTime()),
+        ],
+        'fallback_images': [
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('scene_name', sa.String(50), nullable=False),
+            sa.Column('mood', sa.String(20), nullable=False),
+            sa.Column('variant', sa.Integer()),
+            sa.Column('image_url', sa.String(500), nullable=False),
+            sa.Column('image_prompt', sa.Text()),
+            sa.Column('created_at', sa.DateTime()),
+            sa.UniqueConstraint('scene_name', 'mood', 'variant', name='uq_fallback_image_scene_mood_variant'),
+        ],
+        'stats_hourly': _stats_columns(sa.Column('bucket_start', sa.DateTime(), primary_key=True)),
+        'stats_daily': _stats_columns(sa.Column('day', sa.Date(), primary_key=True)),
+        'visitor_sketches': [
+            sa.Column('day', sa.Date(), primary_key=True),
+            sa.Column('scope', sa.String(50), primary_key=True),
+            sa.Column('sketch', sa.LargeBinary(), nullable=False),
+            sa.Column('updated_at', sa.DateTime()),
+        ],
+    }
+
+
+def upgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    for name, columns in _tables().items():
+        if name in tables:
+            continue
+        if name == 'user_storage_usage' and 'users' not in tables:
+            # 新库由 3f2a9c1d7b45 按模型建表
+            continue
+        op.create_table(name, *columns)
+
+
+def downgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    for name in reversed(list(_tables())):
+        if name in tables:
+            op.drop_table(name)
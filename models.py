@@ -30,6 +30,11 @@ class User(db.Model):
     last_login_at = db.Column(db.DateTime, nullable=True)
     login_count = db.Column(db.Integer, default=0)
 
+    # 计数缓存（写入时由 services/user_counters.py 维护，flask recount-user-counters 可修复）
+    diary_count = db.Column(db.Integer, default=0)
+    postcard_count = db.Column(db.Integer, default=0)
+    unread_postcards = db.Column(db.Integer, default=0)
+
     # 关联
     diaries = db.relationship('EmotionDiary', backref='user', lazy=True, cascade='all, delete-orphan')
     game_state = db.relationship('GameState', backref='user', lazy=True, uselist=False, cascade='all, delete-orphan')
@@ -59,12 +64,21 @@ class User(db.Model):
             'last_login_at': format_datetime(self.last_login_at),
             'login_count': self.login_count,
             'profile_data': self.profile_data,
-            'diary_count': len(self.diaries) if self.diaries else 0
+            'diary_count': self.diary_count or 0,
+            'postcard_count': self.postcard_count or 0
         }
 
 class EmotionDiary(db.Model):
     """情绪日记模型"""
     __tablename__ = 'emotion_diaries'
+    __table_args__ = (
+        # 用户日记列表、统计（按时间倒序）
+        db.Index('ix_emotion_diaries_user_created', 'user_id', 'created_at'),
+        # 日记全文检索（services/diary_search.py）：MySQL ngram 全文索引，按模型建新库时一起建出；
+        # 其他数据库不建（SQLite 用 FTS5 表）
+        db.Index('ft_emotion_diaries_content', 'content',
+                 mysql_prefix='FULLTEXT', mysql_with_parser='ngram').ddl_if(dialect='mysql'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -134,6 +148,9 @@ class GameState(db.Model):
     用于店铺经营游戏的角色属性和资源管理
     """
     __tablename__ = 'game_states'
+    __table_args__ = (
+        db.Index('ix_game_states_user', 'user_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -148,6 +165,9 @@ class GameState(db.Model):
     level = db.Column(db.Integer, default=1)                 # 等级：每10篇日记升1级
     total_diaries = db.Column(db.Integer, default=0)         # 日记总数：记录写作数量
 
+    # ===== 流水序号（每次结算+1，与 game_ledger.seq 对应）=====
+    ledger_seq = db.Column(db.Integer, default=0)
+
     # ===== 时间戳 =====
     last_active = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -180,6 +200,14 @@ class Postcard(db.Model):
     去不同的地方旅行，并寄回明信片（图片+文字）
     """
     __tablename__ = 'postcards'
+    __table_args__ = (
+        # 未读数量、明信片列表
+        db.Index('ix_postcards_user_read', 'user_id', 'is_read'),
+        # 每篇日记最多一张明信片（探险结算按它upsert）
+        db.Index('uq_postcards_diary', 'diary_id', unique=True),
+        # 补转存临时图片URL（services/postcard_service.py sweep_pending_images）
+        db.Index('ix_postcards_image_pending', 'image_pending_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -187,6 +215,10 @@ class Postcard(db.Model):
 
     # 明信片内容
     image_url = db.Column(db.String(500))           # AI生成的图片URL
+    preview_url = db.Column(db.String(500))         # 预览图URL（2K图生成后保留，用于列表小图）
+    image_tier = db.Column(db.String(20))           # 当前image_url的尺寸档位: preview/full
+    image_source = db.Column(db.String(20))         # 图片来源: generated（AI生成）/library（备用图库）
+    image_pending_at = db.Column(db.DateTime)       # image_url/preview_url 还是临时URL：最近一次提交转存的时间，转存完后清空
     image_prompt = db.Column(db.Text)               # 生成图片使用的prompt
     location_name = db.Column(db.String(100))       # 地点名称，如"心灵森林·宁静小径"
     message = db.Column(db.Text)                    # 小狐狸写给用户的话
@@ -202,6 +234,7 @@ class Postcard(db.Model):
     # 时间戳
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     generated_at = db.Column(db.DateTime)           # 图片生成完成时间
+    time_to_first_image_ms = db.Column(db.Integer)  # 从创建到第一张图片可见的耗时（毫秒）
 
     # 用户是否已查看
     is_read = db.Column(db.Boolean, default=False)
@@ -217,6 +250,9 @@ class Postcard(db.Model):
             'user_id': self.user_id,
             'diary_id': self.diary_id,
             'image_url': self.image_url,
+            'preview_url': self.preview_url,
+            'image_tier': self.image_tier,
+            'image_source': self.image_source,
             'image_prompt': self.image_prompt,
             'location_name': self.location_name,
             'message': self.message,
@@ -226,6 +262,7 @@ class Postcard(db.Model):
             'mental_health_score': self.mental_health_score,
             'created_at': format_datetime(self.created_at),
             'generated_at': format_datetime(self.generated_at),
+            'time_to_first_image_ms': self.time_to_first_image_ms,
             'is_read': self.is_read,
             'read_at': format_datetime(self.read_at),
             'stat_changes': self.stat_changes or {},
@@ -274,6 +311,9 @@ class AdventureSession(db.Model):
     探险中需要帮助小橘击败"迷雾怪物"（认知扭曲的具象化）
     """
     __tablename__ = 'adventure_sessions'
+    __table_args__ = (
+        db.Index('ix_adventure_sessions_diary_user', 'diary_id', 'user_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -283,11 +323,16 @@ class AdventureSession(db.Model):
     status = db.Column(db.String(20), default='pending')  # pending/in_progress/completed/skipped
     scene_name = db.Column(db.String(100))                # 场景名称，如"迷雾森林"
 
-    # 怪物和挑战配置（JSON）
-    monsters = db.Column(db.JSON, default=list)           # [{type, name_zh, severity, defeated}]
-    challenges = db.Column(db.JSON, default=list)         # [{type, question, options, correct_ids, completed}]
+    # 怪物和挑战按序号存在 adventure_monsters / adventure_challenges，
+    # 通过 monsters / challenges 属性以原来的JSON列表形式读写
+    # （表上旧的同名JSON列保留给回滚用，不再读写）
     current_challenge = db.Column(db.Integer, default=0)  # 当前挑战索引
 
+    monster_rows = db.relationship('AdventureMonster', order_by='AdventureMonster.position',
+                                   lazy=True, cascade='all, delete-orphan')
+    challenge_rows = db.relationship('AdventureChallenge', order_by='AdventureChallenge.position',
+                                     lazy=True, cascade='all, delete-orphan')
+
     # 奖励
     coins_earned = db.Column(db.Integer, default=0)
     items_earned = db.Column(db.JSON, default=list)       # [{name, name_zh, effect_type, effect_value}]
@@ -298,6 +343,24 @@ class AdventureSession(db.Model):
     started_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
 
+    @property
+    def monsters(self):
+        """[{type, name_zh, severity, defeated}]"""
+        return [row.to_dict() for row in self.monster_rows]
+
+    @monsters.setter
+    def monsters(self, items):
+        _sync_rows(self.monster_rows, items or [], AdventureMonster)
+
+    @property
+    def challenges(self):
+        """[{type, question, options, correct_ids, completed, user_answers, is_correct}]"""
+        return [row.to_dict() for row in self.challenge_rows]
+
+    @challenges.setter
+    def challenges(self, items):
+        _sync_rows(self.challenge_rows, items or [], AdventureChallenge)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -317,6 +380,83 @@ class AdventureSession(db.Model):
         }
 
 
+
+def _sync_rows(rows: list, items: list, model):
+    """按序号把列表写进子表行：已有的行原地更新（没变的列不产生UPDATE），多出的追加，少了的删除"""
+    for position, item in enumerate(items):
+        if position < len(rows):
+            rows[position].load(item)
+        else:
+            row = model(position=position)
+            row.load(item)
+            rows.append(row)
+    del rows[len(items):]
+
+
+class AdventureMonster(db.Model):
+    """
+    探险中的一只怪物（adventure_sessions.monsters 的一项）
+
+    type 和 defeated 单独成列，便于按怪物类型统计；其余生成时的字段原样放在 data 里
+    """
+    __tablename__ = 'adventure_monsters'
+
+    session_id = db.Column(db.Integer, db.ForeignKey('adventure_sessions.id'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    type = db.Column(db.String(50))
+    defeated = db.Column(db.Boolean)   # 为空表示原数据里没有该字段
+    data = db.Column(db.JSON, default=dict)
+
+    def load(self, item: dict):
+        data = dict(item)
+        self.type = data.pop('type', None)
+        self.defeated = data.pop('defeated', None)
+        if self.data != data:
+            self.data = data
+
+    def to_dict(self):
+        result = dict(self.data or {})
+        if self.type is not None:
+            result['type'] = self.type
+        if self.defeated is not None:
+            result['defeated'] = self.defeated
+        return result
+
+
+class AdventureChallenge(db.Model):
+    """
+    探险中的一道挑战题（adventure_sessions.challenges 的一项）
+
+    答题只更新本行的 completed / user_answers / is_correct；题目内容原样放在 data 里
+    """
+    __tablename__ = 'adventure_challenges'
+
+    session_id = db.Column(db.Integer, db.ForeignKey('adventure_sessions.id'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    type = db.Column(db.String(50))
+    completed = db.Column(db.Boolean)
+    user_answers = db.Column(db.JSON)
+    is_correct = db.Column(db.Boolean)
+    data = db.Column(db.JSON, default=dict)
+
+    def load(self, item: dict):
+        data = dict(item)
+        self.type = data.pop('type', None)
+        self.completed = data.pop('completed', None)
+        self.user_answers = data.pop('user_answers', None)
+        self.is_correct = data.pop('is_correct', None)
+        if self.data != data:
+            self.data = data
+
+    def to_dict(self):
+        result = dict(self.data or {})
+        for name in ('type', 'completed', 'user_answers', 'is_correct'):
+            value = getattr(self, name)
+            if value is not None:
+                result[name] = value
+        return result
+
+
 class AccessLog(db.Model):
     """
     访问日志模型 - 用于统计网站流量
@@ -324,6 +464,10 @@ class AccessLog(db.Model):
     记录每次HTTP请求的基本信息，用于后台管理系统的流量分析
     """
     __tablename__ = 'access_logs'
+    __table_args__ = (
+        # 按时间范围统计、归档
+        db.Index('ix_access_logs_created', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     ip_address = db.Column(db.String(50))
@@ -332,6 +476,10 @@ class AccessLog(db.Model):
     method = db.Column(db.String(10))
     user_id = db.Column(db.Integer, nullable=True)  # 已登录用户的ID
     status_code = db.Column(db.Integer, nullable=True)  # HTTP响应状态码
+    endpoint = db.Column(db.String(100), nullable=True)  # 匹配到的路由端点，如 postcard.get_postcards
+    duration_us = db.Column(db.BigInteger, nullable=True)  # 请求耗时（微秒）
+    latency_bucket = db.Column(db.Integer, nullable=True)  # 耗时所在的直方图桶号（见 services/latency_histogram.py）
+    response_bytes = db.Column(db.BigInteger, nullable=True)  # 响应体大小（流式响应为空）
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def to_dict(self):
@@ -343,6 +491,9 @@ class AccessLog(db.Model):
             'method': self.method,
             'user_id': self.user_id,
             'status_code': self.status_code,
+            'endpoint': self.endpoint,
+            'duration_ms': round(self.duration_us / 1000.0, 2) if self.duration_us is not None else None,
+            'response_bytes': self.response_bytes,
             'created_at': format_datetime(self.created_at)
         }
 
@@ -357,6 +508,10 @@ class UserItem(db.Model):
     - cosmetic: 装饰道具，装扮小橘（MVP暂不实现）
     """
     __tablename__ = 'user_items'
+    __table_args__ = (
+        # 同名道具只占一行，获得时 quantity + 1（探险结算按它upsert）
+        db.Index('uq_user_items_user_item', 'user_id', 'item_name', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -386,3 +541,243 @@ class UserItem(db.Model):
             'effect_value': self.effect_value,
             'acquired_at': format_datetime(self.acquired_at)
         }
+
+
+class UserStorageUsage(db.Model):
+    """
+    用户存储占用统计 - 由文件垃圾回收任务（flask gc-files）全量对账后写入
+
+    只统计仍被数据库引用的文件：
+    - 明信片图片：Postcard.image_url / preview_url
+    - 上传图片：EmotionDiary.images（按 diary_images 查找）
+    """
+    __tablename__ = 'user_storage_usage'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    postcard_files = db.Column(db.Integer, default=0)
+    postcard_bytes = db.Column(db.BigInteger, default=0)
+    upload_files = db.Column(db.Integer, default=0)
+    upload_bytes = db.Column(db.BigInteger, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def total_bytes(self):
+        return (self.postcard_bytes or 0) + (self.upload_bytes or 0)
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'postcard_files': self.postcard_files or 0,
+            'postcard_bytes': self.postcard_bytes or 0,
+            'upload_files': self.upload_files or 0,
+            'upload_bytes': self.upload_bytes or 0,
+            'total_bytes': self.total_bytes,
+            'updated_at': format_datetime(self.updated_at)
+        }
+
+
+class FallbackImage(db.Model):
+    """
+    备用明信片图片库 - 由 flask build-fallback-library 预先生成
+
+    图片生成失败或被限流时，按场景和心情挑一张直接挂到明信片上
+    """
+    __tablename__ = 'fallback_images'
+    __table_args__ = (
+        db.UniqueConstraint('scene_name', 'mood', 'variant', name='uq_fallback_image_scene_mood_variant'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scene_name = db.Column(db.String(50), nullable=False)   # 场景名，如"雨天窗边"、"河边"
+    mood = db.Column(db.String(20), nullable=False)         # positive/neutral/healing
+    variant = db.Column(db.Integer, default=0)              # 同一场景心情下的第几张
+    image_url = db.Column(db.String(500), nullable=False)   # 存储中的图片路径
+    image_prompt = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'scene_name': self.scene_name,
+            'mood': self.mood,
+            'variant': self.variant,
+            'image_url': self.image_url,
+            'created_at': format_datetime(self.created_at)
+        }
+
+
+class StatsHourly(db.Model):
+    """
+    每小时流量/业务汇总 - 由 services/stats_rollup.py 增量维护
+
+    管理后台的趋势统计只读汇总表，不再扫描原始访问日志
+    """
+    __tablename__ = 'stats_hourly'
+
+    bucket_start = db.Column(db.DateTime, primary_key=True)  # 小时起点（UTC）
+    visits = db.Column(db.Integer, default=0)
+    unique_visitors = db.Column(db.Integer, default=0)       # 按IP去重
+    server_errors = db.Column(db.Integer, default=0)         # 5xx响应数
+    new_users = db.Column(db.Integer, default=0)
+    diaries = db.Column(db.Integer, default=0)
+    postcards = db.Column(db.Integer, default=0)
+    postcards_by_status = db.Column(db.JSON, default=dict)   # {"completed": 10, "failed": 1}
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'hour': format_datetime(self.bucket_start),
+            'visits': self.visits or 0,
+            'unique_visitors': self.unique_visitors or 0,
+            'server_errors': self.server_errors or 0,
+            'new_users': self.new_users or 0,
+            'diaries': self.diaries or 0,
+            'postcards': self.postcards or 0,
+            'postcards_by_status': self.postcards_by_status or {}
+        }
+
+
+class StatsDaily(db.Model):
+    """每日流量/业务汇总（字段同 StatsHourly，独立访客按天去重）"""
+    __tablename__ = 'stats_daily'
+
+    day = db.Column(db.Date, primary_key=True)
+    visits = db.Column(db.Integer, default=0)
+    unique_visitors = db.Column(db.Integer, default=0)
+    server_errors = db.Column(db.Integer, default=0)
+    new_users = db.Column(db.Integer, default=0)
+    diaries = db.Column(db.Integer, default=0)
+    postcards = db.Column(db.Integer, default=0)
+    postcards_by_status = db.Column(db.JSON, default=dict)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'date': self.day.isoformat() if self.day else None,
+            'visits': self.visits or 0,
+            'unique_visitors': self.unique_visitors or 0,
+            'server_errors': self.server_errors or 0,
+            'new_users': self.new_users or 0,
+            'diaries': self.diaries or 0,
+            'postcards': self.postcards or 0,
+            'postcards_by_status': self.postcards_by_status or {}
+        }
+
+
+class VisitorSketch(db.Model):
+    """
+    每日独立访客 HyperLogLog 草图（services/visitor_sketch.py 在写入访问日志时维护）
+
+    scope: '*' 表示全站，其余为路径前缀，如 /api/diary、/postcards
+    """
+    __tablename__ = 'visitor_sketches'
+
+    day = db.Column(db.Date, primary_key=True)
+    scope = db.Column(db.String(50), primary_key=True)
+    sketch = db.Column(db.LargeBinary, nullable=False)  # HyperLogLog.to_bytes()
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class EmotionTag(db.Model):
+    """情绪标签字典"""
+    __tablename__ = 'emotion_tags'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class DiaryEmotionTag(db.Model):
+    """
+    日记-情绪标签关联（services/emotion_tags.py 随日记写入维护）
+
+    EmotionDiary.emotion_tags JSON 列的规范化副本，用于按标签筛选和按用户统计标签
+    """
+    __tablename__ = 'diary_emotion_tags'
+    __table_args__ = (
+        db.Index('ix_diary_emotion_tags_user_tag', 'user_id', 'tag_id', 'created_at'),
+    )
+
+    diary_id = db.Column(db.Integer, db.ForeignKey('emotion_diaries.id'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('emotion_tags.id'), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime)  # 日记的创建时间
+
+
+class DiaryImage(db.Model):
+    """
+    日记-上传图片关联（services/diary_images.py 随日记写入维护）
+
+    EmotionDiary.images 中上传图片的存储key，文件垃圾回收按key逐批查引用（flask gc-files）
+    """
+    __tablename__ = 'diary_images'
+    __table_args__ = (
+        db.Index('ix_diary_images_key', 'image_key'),
+    )
+
+    diary_id = db.Column(db.Integer, db.ForeignKey('emotion_diaries.id'), primary_key=True)
+    image_key = db.Column(db.String(255), primary_key=True)  # uploads 区域的存储key
+    user_id = db.Column(db.Integer, nullable=False)
+
+
+class UserDiaryDaily(db.Model):
+    """
+    每个用户每天的日记数（services/diary_stats.py 随日记写入增量维护）
+
+    日记统计接口的"最近7天"直接对这里的7行求和
+    """
+    __tablename__ = 'user_diary_daily'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)  # 日记创建日期（UTC）
+    diary_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UserTagCount(db.Model):
+    """每个用户各情绪标签出现的日记数（services/diary_stats.py 随标签关联增量维护）"""
+    __tablename__ = 'user_tag_counts'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('emotion_tags.id'), primary_key=True)
+    diary_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class GameLedger(db.Model):
+    """
+    游戏状态变化流水（只追加，services/game_ledger.py 在每次奖励结算时写入）
+
+    记录的是变化量，任意时刻的状态 = 之前最近的快照 + 按 seq 重放之后的流水
+    """
+    __tablename__ = 'game_ledger'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'seq', name='uq_game_ledger_user_seq'),
+        db.Index('ix_game_ledger_user_created', 'user_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)              # 用户内递增序号（GameState.ledger_seq）
+    source = db.Column(db.String(30), nullable=False)        # analysis / adventure / legacy_analysis
+    diary_id = db.Column(db.Integer)
+    coins = db.Column(db.Integer, default=0)                 # 实际获得的金币（含升级奖励）
+    mental_health = db.Column(db.Integer, default=0)         # 属性变化量（重放时同样截断到0-100）
+    stress = db.Column(db.Integer, default=0)
+    growth = db.Column(db.Integer, default=0)
+    diaries = db.Column(db.Integer, default=0)
+    level_up = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class GameSnapshot(db.Model):
+    """游戏状态快照：第 seq 条流水之后的完整状态（每 GAME_SNAPSHOT_INTERVAL 条流水保存一次）"""
+    __tablename__ = 'game_snapshots'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    mental_health_score = db.Column(db.Integer, nullable=False)
+    stress_level = db.Column(db.Integer, nullable=False)
+    growth_potential = db.Column(db.Integer, nullable=False)
+    coins = db.Column(db.Integer, nullable=False)
+    level = db.Column(db.Integer, nullable=False)
+    total_diaries = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -180,6 +180,23 @@ FALLBACK_SCENES = {
     ]
 }
 
+# 故事里常见的森林地点（AI生成的场景多为这些地点，备用图库按地点预先生成图片）
+COMMON_LOCATIONS = [
+    {'name': '河边', 'desc': '清澈的小河边，河水闪着光，岸边有圆圆的石头'},
+    {'name': '树下', 'desc': '森林里一棵高大的老橡树下，树叶沙沙作响'},
+    {'name': '山坡', 'desc': '开满小野花的绿色山坡，远处是连绵的森林'},
+    {'name': '花丛', 'desc': '五颜六色的花丛中，蝴蝶在飞舞'},
+]
+
+# 不同心情下小狐狸的表情
+FOX_MOODS = {
+    'positive': "表情开心，眼睛弯弯的，正在桌前写信",
+    'neutral': "表情温和放松，正在写信",
+    'healing': "表情温柔关切，正在认真写信",
+}
+
+FOX_BASE = "一只可爱的橘色小狐狸，大眼睛，蓬松的尾巴"
+
 # 备用回信模板（使用小狐狸讲故事的模式）
 FALLBACK_MESSAGES = {
     'positive': [
@@ -197,6 +214,50 @@ FALLBACK_MESSAGES = {
 }
 
 
+def get_scene_type(mental_health_score: int) -> str:
+    """根据心理健康值确定场景类型（心情）: positive / neutral / healing"""
+    if mental_health_score is None:
+        return 'neutral'
+    if mental_health_score >= 60:
+        return 'positive'
+    if mental_health_score <= 40:
+        return 'healing'
+    return 'neutral'
+
+
+def build_scene_image_prompt(scene_desc: str, scene_type: str) -> str:
+    """生成小狐狸在某个场景写信的图片prompt"""
+    fox_mood = FOX_MOODS.get(scene_type, FOX_MOODS['neutral'])
+    return f"像素艺术风格，{FOX_BASE}，{fox_mood}，{scene_desc}，桌上有信纸和羽毛笔，16bit复古游戏画风，治愈系氛围，色彩温暖明亮"
+
+
+def get_library_image_specs() -> list:
+    """
+    备用图库需要预先生成的全部图片
+
+    每个备用场景按它所属的心情生成；常见森林地点在每种心情下各生成一张。
+
+    Returns:
+        [{'scene_name': ..., 'mood': ..., 'image_prompt': ...}, ...]
+    """
+    specs = []
+    for scene_type, scenes in FALLBACK_SCENES.items():
+        for scene in scenes:
+            specs.append({
+                'scene_name': scene['name'],
+                'mood': scene_type,
+                'image_prompt': build_scene_image_prompt(scene['desc'], scene_type)
+            })
+    for location in COMMON_LOCATIONS:
+        for scene_type in FOX_MOODS:
+            specs.append({
+                'scene_name': location['name'],
+                'mood': scene_type,
+                'image_prompt': build_scene_image_prompt(location['desc'], scene_type)
+            })
+    return specs
+
+
 def get_fallback_postcard_data(
     emotions: list,
     mental_health_score: int,
@@ -207,26 +268,13 @@ def get_fallback_postcard_data(
     备用方案：当AI调用失败时，使用简单规则生成明信片数据
     """
     # 确定场景类型
-    if mental_health_score >= 60:
-        scene_type = 'positive'
-    elif mental_health_score <= 40:
-        scene_type = 'healing'
-    else:
-        scene_type = 'neutral'
+    scene_type = get_scene_type(mental_health_score)
 
     # 随机选择场景
     scene = random.choice(FALLBACK_SCENES[scene_type])
 
     # 生成图片prompt
-    fox_base = "一只可爱的橘色小狐狸，大眼睛，蓬松的尾巴"
-    if mental_health_score >= 60:
-        fox_mood = "表情开心，眼睛弯弯的，正在桌前写信"
-    elif mental_health_score <= 40:
-        fox_mood = "表情温柔关切，正在认真写信"
-    else:
-        fox_mood = "表情温和放松，正在写信"
-
-    image_prompt = f"像素艺术风格，{fox_base}，{fox_mood}，{scene['desc']}，桌上有信纸和羽毛笔，16bit复古游戏画风，治愈系氛围，色彩温暖明亮"
+    image_prompt = build_scene_image_prompt(scene['desc'], scene_type)
 
     # 生成消息
     message_template = random.choice(FALLBACK_MESSAGES[scene_type])
@@ -253,12 +301,7 @@ def get_fallback_postcard_data(
 
 def get_scene_for_emotion(emotions: list, mental_health_score: int) -> tuple:
     """兼容旧接口"""
-    if mental_health_score >= 60:
-        scene_type = 'positive'
-    elif mental_health_score <= 40:
-        scene_type = 'healing'
-    else:
-        scene_type = 'neutral'
+    scene_type = get_scene_type(mental_health_score)
 
     scene = random.choice(FALLBACK_SCENES[scene_type])
     return scene['name'], scene_type
@@ -1,12 +1,16 @@
 # 管理员路由模块
+import os
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_token
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, case
 from extensions import db
-from models import User, EmotionDiary, EmotionAnalysis, Postcard, AdventureSession, AccessLog, GameState
+from services.pagination import keyset_page, approximate_count, InvalidCursorError
+from services.diary_search import apply_search
+from services import adventure_state
+from models import User, EmotionDiary, EmotionAnalysis, Postcard, AdventureSession, AdventureMonster, AdventureChallenge, AccessLog, GameState, UserStorageUsage, StatsHourly, StatsDaily, format_datetime
 
 bp = Blueprint('admin', __name__)
 
@@ -84,99 +88,187 @@ def check_admin():
 
 # ==================== 统计数据 ====================
 
-@bp.route('/stats/overview', methods=['GET'])
-@admin_required
-def get_overview_stats():
-    """获取网站概览统计"""
+# 概览快照：超过 ADMIN_OVERVIEW_TTL 秒后台刷新，超过 ADMIN_OVERVIEW_MAX_AGE 秒当场重算
+ADMIN_OVERVIEW_TTL = int(os.environ.get('ADMIN_OVERVIEW_TTL', 60))
+ADMIN_OVERVIEW_MAX_AGE = int(os.environ.get('ADMIN_OVERVIEW_MAX_AGE', 600))
+
+
+def _build_overview() -> dict:
+    """
+    一条SQL算出概览的全部计数
+
+    每张表一个带条件求和的聚合子查询（各扫描一次），四个单行子查询拼成一行返回
+    """
+    from sqlalchemy import select, case, true
+    from services.visitor_sketch import unique_visitors
+
     now = datetime.utcnow()
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     week_start = today_start - timedelta(days=7)
-    month_start = today_start - timedelta(days=30)
-
-    # 用户统计
-    total_users = User.query.count()
-    today_new_users = User.query.filter(User.created_at >= today_start).count()
-    week_new_users = User.query.filter(User.created_at >= week_start).count()
-    active_users = User.query.filter(User.is_active == True).count()
-
-    # 日记统计
-    total_diaries = EmotionDiary.query.count()
-    today_diaries = EmotionDiary.query.filter(EmotionDiary.created_at >= today_start).count()
-    week_diaries = EmotionDiary.query.filter(EmotionDiary.created_at >= week_start).count()
-    analyzed_diaries = EmotionDiary.query.filter(EmotionDiary.analysis_status == 'completed').count()
-
-    # 明信片统计
-    total_postcards = Postcard.query.count()
-    completed_postcards = Postcard.query.filter(Postcard.status == 'completed').count()
-
-    # 访问量统计
-    total_visits = AccessLog.query.count()
-    today_visits = AccessLog.query.filter(AccessLog.created_at >= today_start).count()
-    week_visits = AccessLog.query.filter(AccessLog.created_at >= week_start).count()
-
-    # 独立访客（按IP去重）
-    today_unique_visitors = db.session.query(func.count(func.distinct(AccessLog.ip_address))).filter(
-        AccessLog.created_at >= today_start
-    ).scalar() or 0
 
-    return jsonify({
+    def count_if(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    users = select(
+        func.count(User.id).label('users_total'),
+        count_if(User.created_at >= today_start).label('users_today'),
+        count_if(User.created_at >= week_start).label('users_week'),
+        count_if(User.is_active == True).label('users_active')
+    ).subquery()
+    diaries = select(
+        func.count(EmotionDiary.id).label('diaries_total'),
+        count_if(EmotionDiary.created_at >= today_start).label('diaries_today'),
+        count_if(EmotionDiary.created_at >= week_start).label('diaries_week'),
+        count_if(EmotionDiary.analysis_status == 'completed').label('diaries_analyzed')
+    ).subquery()
+    postcards = select(
+        func.count(Postcard.id).label('postcards_total'),
+        count_if(Postcard.status == 'completed').label('postcards_completed')
+    ).subquery()
+    # 访问量读每日汇总（采样、丢弃之前计数），access_logs 是采样后的明细
+    visits = select(
+        func.coalesce(func.sum(StatsDaily.visits), 0).label('visits_total'),
+        func.coalesce(func.sum(case((StatsDaily.day >= today_start.date(), StatsDaily.visits), else_=0)), 0)
+        .label('visits_today'),
+        func.coalesce(func.sum(case((StatsDaily.day >= week_start.date(), StatsDaily.visits), else_=0)), 0)
+        .label('visits_week')
+    ).subquery()
+
+    row = db.session.execute(
+        select(users, diaries, postcards, visits).select_from(
+            users.join(diaries, true()).join(postcards, true()).join(visits, true())
+        )
+    ).mappings().one()
+    row = {key: int(value or 0) for key, value in row.items()}
+
+    return {
         'users': {
-            'total': total_users,
-            'today_new': today_new_users,
-            'week_new': week_new_users,
-            'active': active_users
+            'total': row['users_total'],
+            'today_new': row['users_today'],
+            'week_new': row['users_week'],
+            'active': row['users_active']
         },
         'diaries': {
-            'total': total_diaries,
-            'today': today_diaries,
-            'week': week_diaries,
-            'analyzed': analyzed_diaries
+            'total': row['diaries_total'],
+            'today': row['diaries_today'],
+            'week': row['diaries_week'],
+            'analyzed': row['diaries_analyzed']
         },
         'postcards': {
-            'total': total_postcards,
-            'completed': completed_postcards
+            'total': row['postcards_total'],
+            'completed': row['postcards_completed']
         },
         'visits': {
-            'total': total_visits,
-            'today': today_visits,
-            'week': week_visits,
-            'today_unique': today_unique_visitors
-        }
-    })
+            'total': row['visits_total'],
+            'today': row['visits_today'],
+            'week': row['visits_week'],
+            # 独立访客（按IP去重，HyperLogLog草图估计值）
+            'today_unique': unique_visitors(today_start.date(), today_start.date())
+        },
+        'generated_at': format_datetime(now)
+    }
+
+
+@bp.route('/stats/overview', methods=['GET'])
+@admin_required
+def get_overview_stats():
+    """
+    获取网站概览统计
+
+    读缓存的快照（services/cache.py，有Redis时各worker共用），响应里的 snapshot_age 是快照生成了多少秒。
+    ?refresh=1 强制当场重算。
+    """
+    from services.cache import get_snapshot
+
+    force = request.args.get('refresh', '').lower() in ('1', 'true')
+    overview, age = get_snapshot(
+        'admin_overview', _build_overview,
+        ttl=ADMIN_OVERVIEW_TTL, max_age=ADMIN_OVERVIEW_MAX_AGE, force=force
+    )
+    return jsonify(dict(overview, snapshot_age=round(age, 1)))
+
+
+def _daily_rollups(days: int):
+    """读取最近days天的每日汇总（由 services/stats_rollup.py 维护）"""
+    start_day = (datetime.utcnow() - timedelta(days=days)).date()
+    return StatsDaily.query.filter(StatsDaily.day >= start_day).order_by(StatsDaily.day).all()
 
 
 @bp.route('/stats/traffic', methods=['GET'])
 @admin_required
 def get_traffic_stats():
-    """获取流量统计（按天）"""
+    """获取流量统计（按天，读取每日汇总表）"""
     days = request.args.get('days', 7, type=int)
     days = min(days, 90)  # 最多90天
 
-    now = datetime.utcnow()
-    start_date = now - timedelta(days=days)
+    from services.visitor_sketch import daily_unique_visitors, unique_visitors, range_for_days
 
-    # 按天分组统计访问量
-    daily_stats = db.session.query(
-        func.date(AccessLog.created_at).label('date'),
-        func.count(AccessLog.id).label('visits'),
-        func.count(func.distinct(AccessLog.ip_address)).label('unique_visitors')
-    ).filter(
-        AccessLog.created_at >= start_date
-    ).group_by(
-        func.date(AccessLog.created_at)
-    ).order_by(
-        func.date(AccessLog.created_at)
-    ).all()
+    start_day, end_day = range_for_days(days + 1)
+    sketch_counts = daily_unique_visitors(start_day, end_day)
 
     result = []
-    for stat in daily_stats:
+    for stat in _daily_rollups(days):
+        if not stat.visits:
+            continue
         result.append({
-            'date': str(stat.date),
+            'date': stat.day.isoformat(),
             'visits': stat.visits,
-            'unique_visitors': stat.unique_visitors
+            # 优先用访客草图（包含最近一次汇总之后的访问）
+            'unique_visitors': sketch_counts.get(stat.day, stat.unique_visitors)
         })
 
-    return jsonify({'traffic': result, 'days': days})
+    return jsonify({
+        'traffic': result,
+        'days': days,
+        'unique_visitors': unique_visitors(start_day, end_day)
+    })
+
+
+@bp.route('/stats/visitors', methods=['GET'])
+@admin_required
+def get_unique_visitors():
+    """
+    获取一段时间内的独立访客数（HyperLogLog草图合并，误差约1%）
+
+    参数：
+    - days: 最近多少天（默认7，最多365）
+    - start / end: 日期 YYYY-MM-DD，优先于days
+    """
+    from datetime import date
+    from services.visitor_sketch import unique_visitors, unique_visitors_by_scope, range_for_days
+
+    try:
+        if request.args.get('start'):
+            start_day = date.fromisoformat(request.args['start'])
+            end_day = date.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow().date()
+        else:
+            start_day, end_day = range_for_days(min(request.args.get('days', 7, type=int), 365))
+    except ValueError:
+        return jsonify({'error': '日期格式错误，请使用YYYY-MM-DD'}), 400
+
+    by_scope = unique_visitors_by_scope(start_day, end_day)
+    total = by_scope.pop('*', 0)
+
+    return jsonify({
+        'start': start_day.isoformat(),
+        'end': end_day.isoformat(),
+        'unique_visitors': total,
+        'by_scope': sorted(
+            [{'scope': scope, 'unique_visitors': count} for scope, count in by_scope.items()],
+            key=lambda item: item['unique_visitors'], reverse=True
+        )
+    })
+
+
+@bp.route('/stats/traffic/hourly', methods=['GET'])
+@admin_required
+def get_hourly_traffic_stats():
+    """获取按小时的流量和业务汇总（最近hours小时，最多168）"""
+    hours = min(request.args.get('hours', 24, type=int), 168)
+    start = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours)
+
+    rows = StatsHourly.query.filter(StatsHourly.bucket_start >= start).order_by(StatsHourly.bucket_start).all()
+    return jsonify({'hourly': [row.to_dict() for row in rows], 'hours': hours})
 
 
 @bp.route('/stats/users-trend', methods=['GET'])
@@ -186,25 +278,12 @@ def get_users_trend():
     days = request.args.get('days', 30, type=int)
     days = min(days, 90)
 
-    now = datetime.utcnow()
-    start_date = now - timedelta(days=days)
-
-    # 按天分组统计新用户
-    daily_users = db.session.query(
-        func.date(User.created_at).label('date'),
-        func.count(User.id).label('new_users')
-    ).filter(
-        User.created_at >= start_date
-    ).group_by(
-        func.date(User.created_at)
-    ).order_by(
-        func.date(User.created_at)
-    ).all()
-
     result = []
-    for stat in daily_users:
+    for stat in _daily_rollups(days):
+        if not stat.new_users:
+            continue
         result.append({
-            'date': str(stat.date),
+            'date': stat.day.isoformat(),
             'new_users': stat.new_users
         })
 
@@ -218,32 +297,229 @@ def get_diaries_trend():
     days = request.args.get('days', 30, type=int)
     days = min(days, 90)
 
-    now = datetime.utcnow()
-    start_date = now - timedelta(days=days)
+    result = []
+    for stat in _daily_rollups(days):
+        if not stat.diaries:
+            continue
+        result.append({
+            'date': stat.day.isoformat(),
+            'diaries': stat.diaries,
+            'postcards': stat.postcards,
+            'postcards_by_status': stat.postcards_by_status or {}
+        })
+
+    return jsonify({'trend': result, 'days': days})
+
 
-    daily_diaries = db.session.query(
-        func.date(EmotionDiary.created_at).label('date'),
-        func.count(EmotionDiary.id).label('diaries')
+@bp.route('/stats/latency', methods=['GET'])
+@admin_required
+def get_latency_stats():
+    """
+    获取各接口的延迟分位数和错误率
+
+    参数：
+    - hours: 最近多少小时（默认24，最多720）
+    - start / end: ISO时间（UTC），优先于hours
+
+    统计方式：按 (endpoint, 桶号) 计数得到每个接口的直方图，
+    再把同一蓝图下的直方图合并，不对原始耗时排序。
+    访问日志开启采样时（状态码>=400始终记录），<400的请求数按采样比例还原，响应里带 sample_rate
+    """
+    from sqlalchemy import case
+    from services.latency_histogram import LatencyHistogram
+    from services.access_log import ACCESS_LOG_SAMPLE_RATE
+
+    sample_rate = ACCESS_LOG_SAMPLE_RATE if 0 < ACCESS_LOG_SAMPLE_RATE < 1 else 1.0
+
+    try:
+        end = datetime.fromisoformat(request.args['end'].rstrip('Z')) if request.args.get('end') else datetime.utcnow()
+        if request.args.get('start'):
+            start = datetime.fromisoformat(request.args['start'].rstrip('Z'))
+        else:
+            hours = min(request.args.get('hours', 24, type=int), 720)
+            start = end - timedelta(hours=hours)
+    except ValueError:
+        return jsonify({'error': '时间格式错误，请使用ISO格式'}), 400
+
+    rows = db.session.query(
+        AccessLog.endpoint,
+        AccessLog.latency_bucket,
+        func.count(AccessLog.id).label('requests'),
+        func.sum(case((AccessLog.status_code >= 500, 1), else_=0)).label('server_errors'),
+        func.sum(case((AccessLog.status_code.between(400, 499), 1), else_=0)).label('client_errors'),
+        func.sum(case((AccessLog.status_code < 400, 1), else_=0)).label('sampled')
     ).filter(
-        EmotionDiary.created_at >= start_date
+        AccessLog.created_at >= start,
+        AccessLog.created_at < end,
+        AccessLog.latency_bucket.isnot(None)
     ).group_by(
-        func.date(EmotionDiary.created_at)
-    ).order_by(
-        func.date(EmotionDiary.created_at)
+        AccessLog.endpoint, AccessLog.latency_bucket
     ).all()
 
-    result = []
-    for stat in daily_diaries:
-        result.append({
-            'date': str(stat.date),
-            'diaries': stat.diaries
+    def new_group():
+        return {'histogram': LatencyHistogram(), 'server_errors': 0, 'client_errors': 0}
+
+    endpoints = {}
+    blueprints = {}
+    for row in rows:
+        endpoint = row.endpoint or '(unmatched)'
+        if '.' in endpoint:
+            blueprint = endpoint.split('.', 1)[0]
+        else:
+            blueprint = '(app)' if row.endpoint else endpoint
+        sampled = int(row.sampled or 0)
+        requests = row.requests - sampled + round(sampled / sample_rate)
+        for key, groups in ((endpoint, endpoints), (blueprint, blueprints)):
+            group = groups.setdefault(key, new_group())
+            group['histogram'].add_bucket(row.latency_bucket, requests)
+            group['server_errors'] += int(row.server_errors or 0)
+            group['client_errors'] += int(row.client_errors or 0)
+
+    def to_result(name, group):
+        result = group['histogram'].summary()
+        total = result['count'] or 1
+        result.update({
+            'name': name,
+            'error_rate': round(group['server_errors'] / total, 4),
+            'client_error_rate': round(group['client_errors'] / total, 4)
         })
+        return result
 
-    return jsonify({'trend': result, 'days': days})
+    endpoint_stats = [to_result(name, group) for name, group in endpoints.items()]
+    endpoint_stats.sort(key=lambda item: item['count'], reverse=True)
+    blueprint_stats = [to_result(name, group) for name, group in blueprints.items()]
+    blueprint_stats.sort(key=lambda item: item['count'], reverse=True)
+
+    return jsonify({
+        'start': format_datetime(start),
+        'end': format_datetime(end),
+        'sample_rate': sample_rate,
+        'blueprints': blueprint_stats,
+        'endpoints': endpoint_stats
+    })
+
+
+@bp.route('/stats/storage', methods=['GET'])
+@admin_required
+def get_storage_stats():
+    """获取存储占用统计（数据由 flask gc-files 对账任务生成）"""
+    limit = min(request.args.get('limit', 20, type=int), 100)
+
+    total_bytes_expr = UserStorageUsage.postcard_bytes + UserStorageUsage.upload_bytes
+    totals = db.session.query(
+        func.count(UserStorageUsage.user_id),
+        func.coalesce(func.sum(UserStorageUsage.postcard_files), 0),
+        func.coalesce(func.sum(UserStorageUsage.postcard_bytes), 0),
+        func.coalesce(func.sum(UserStorageUsage.upload_files), 0),
+        func.coalesce(func.sum(UserStorageUsage.upload_bytes), 0),
+        func.max(UserStorageUsage.updated_at)
+    ).one()
+
+    rows = db.session.query(UserStorageUsage, User.username).join(
+        User, User.id == UserStorageUsage.user_id
+    ).order_by(desc(total_bytes_expr)).limit(limit).all()
+
+    top_users = []
+    for usage, username in rows:
+        item = usage.to_dict()
+        item['username'] = username
+        top_users.append(item)
+
+    return jsonify({
+        'users': totals[0],
+        'postcard_files': int(totals[1]),
+        'postcard_bytes': int(totals[2]),
+        'upload_files': int(totals[3]),
+        'upload_bytes': int(totals[4]),
+        'total_bytes': int(totals[2]) + int(totals[4]),
+        'updated_at': format_datetime(totals[5]),
+        'top_users': top_users
+    })
+
+
+@bp.route('/stats/adventure-answers', methods=['GET'])
+@admin_required
+def get_adventure_answer_stats():
+    """按怪物类型统计探险答题正确率（挑战与怪物按序号一一对应）"""
+    days = min(request.args.get('days', 30, type=int), 365)
+    since = datetime.utcnow() - timedelta(days=days)
+
+    rows = db.session.query(
+        AdventureMonster.type,
+        func.count(),
+        func.sum(case((AdventureChallenge.is_correct == True, 1), else_=0))
+    ).join(
+        AdventureChallenge, (AdventureChallenge.session_id == AdventureMonster.session_id)
+        & (AdventureChallenge.position == AdventureMonster.position)
+    ).join(
+        AdventureSession, AdventureSession.id == AdventureMonster.session_id
+    ).filter(
+        AdventureChallenge.completed == True,
+        AdventureSession.created_at >= since
+    ).group_by(AdventureMonster.type).all()
+
+    monsters = []
+    for monster_type, answered, correct in rows:
+        correct = int(correct or 0)
+        monsters.append({
+            'type': monster_type,
+            'answered': answered,
+            'correct': correct,
+            'accuracy': round(correct / answered * 100, 1) if answered else 0
+        })
+    monsters.sort(key=lambda item: item['answered'], reverse=True)
+
+    return jsonify({'days': days, 'monsters': monsters})
+
+
+@bp.route('/stats/db-pool', methods=['GET'])
+@admin_required
+def get_db_pool_stats():
+    """
+    数据库连接池统计（取连接等待、长时间占用，只是处理本次请求的worker进程的数据）
+
+    ?reset=1 读取后清零
+    """
+    from services.db_pool import pool_metrics
+
+    reset = request.args.get('reset', '').lower() in ('1', 'true')
+    return jsonify(pool_metrics(db.engine, reset=reset))
 
 
 # ==================== 用户管理 ====================
 
+
+def _paginate_list(query, model, page: int, per_page: int, filtered: bool, key=None):
+    """
+    管理后台列表分页
+
+    带 cursor 参数时按 (created_at, id) 游标分页：不做OFFSET，总数取整表估计值（有筛选条件时为空）；
+    否则保持原来的页码分页。
+
+    Returns:
+        (当前页的行, 分页信息dict)
+    """
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        result = keyset_page(query, model.created_at, model.id, cursor, per_page, key=key)
+        return result['items'], {
+            'total': None if filtered else approximate_count(model),
+            'next_cursor': result['next_cursor'],
+            'has_more': result['has_more']
+        }
+
+    pagination = query.order_by(desc(model.created_at)).paginate(page=page, per_page=per_page, error_out=False)
+    return pagination.items, {
+        'total': pagination.total,
+        'pages': pagination.pages,
+        'current_page': page
+    }
+
+
+@bp.errorhandler(InvalidCursorError)
+def handle_invalid_cursor(error):
+    return jsonify({'error': str(error)}), 400
+
 @bp.route('/users', methods=['GET'])
 @admin_required
 def list_users():
@@ -260,22 +536,12 @@ def list_users():
             (User.email.contains(search))
         )
 
-    query = query.order_by(desc(User.created_at))
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    rows, page_info = _paginate_list(query, User, page, per_page, filtered=bool(search))
 
-    users = []
-    for user in pagination.items:
-        user_dict = user.to_admin_dict()
-        # 添加明信片数量
-        user_dict['postcard_count'] = Postcard.query.filter_by(user_id=user.id).count()
-        users.append(user_dict)
+    # 日记数、明信片数直接读用户行上的计数缓存
+    users = [user.to_admin_dict() for user in rows]
 
-    return jsonify({
-        'users': users,
-        'total': pagination.total,
-        'pages': pagination.pages,
-        'current_page': page
-    })
+    return jsonify({'users': users, **page_info})
 
 
 @bp.route('/users/<int:user_id>', methods=['GET'])
@@ -292,9 +558,6 @@ def get_user_detail(user_id):
     game_state = GameState.query.filter_by(user_id=user_id).first()
     user_dict['game_state'] = game_state.to_dict() if game_state else None
 
-    # 获取明信片数量
-    user_dict['postcard_count'] = Postcard.query.filter_by(user_id=user_id).count()
-
     # 获取最近日记
     recent_diaries = EmotionDiary.query.filter_by(user_id=user_id).order_by(
         desc(EmotionDiary.created_at)
@@ -388,8 +651,8 @@ def delete_user(user_id):
     from services.postcard_service import delete_postcard_image
     postcards = Postcard.query.filter_by(user_id=user_id).all()
     for postcard in postcards:
-        if postcard.image_url:
-            delete_postcard_image(postcard.image_url)
+        if postcard.image_url or postcard.preview_url:
+            delete_postcard_image(postcard.image_url, postcard.preview_url)
 
     # 删除用户（级联删除日记、分析、游戏数据等）
     db.session.delete(user)
@@ -409,36 +672,42 @@ def list_diaries():
     user_id = request.args.get('user_id', type=int)
     search = request.args.get('search', '')
 
-    query = EmotionDiary.query
+    # 用户名随日记一起JOIN查出，不再逐条查用户
+    query = db.session.query(EmotionDiary, User.username).outerjoin(User, User.id == EmotionDiary.user_id)
 
     if user_id:
         query = query.filter(EmotionDiary.user_id == user_id)
 
     if search:
-        query = query.filter(EmotionDiary.content.contains(search))
-
-    query = query.order_by(desc(EmotionDiary.created_at))
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        query = apply_search(query, search)
+
+    rows, page_info = _paginate_list(
+        query, EmotionDiary, page, per_page, filtered=bool(user_id or search),
+        key=lambda row: (row[0].created_at, row[0].id)
+    )
+
+    # 当前页哪些日记有明信片：一条查询
+    diary_ids = [diary.id for diary, _ in rows]
+    with_postcard = set()
+    if diary_ids:
+        with_postcard = {
+            diary_id for (diary_id,) in db.session.query(Postcard.diary_id).filter(
+                Postcard.diary_id.in_(diary_ids)
+            ).distinct()
+        }
 
     diaries = []
-    for diary in pagination.items:
+    for diary, username in rows:
         diary_dict = diary.to_dict()
         # 添加用户信息
-        user = User.query.get(diary.user_id)
-        diary_dict['username'] = user.username if user else 'Unknown'
+        diary_dict['username'] = username or 'Unknown'
         # 添加内容摘要
         diary_dict['content_preview'] = diary.content[:100] + '...' if len(diary.content) > 100 else diary.content
         # 添加明信片信息
-        postcard = Postcard.query.filter_by(diary_id=diary.id).first()
-        diary_dict['has_postcard'] = postcard is not None
+        diary_dict['has_postcard'] = diary.id in with_postcard
         diaries.append(diary_dict)
 
-    return jsonify({
-        'diaries': diaries,
-        'total': pagination.total,
-        'pages': pagination.pages,
-        'current_page': page
-    })
+    return jsonify({'diaries': diaries, **page_info})
 
 
 @bp.route('/diaries/<int:diary_id>', methods=['GET'])
@@ -481,8 +750,8 @@ def admin_delete_diary(diary_id):
     # 删除明信片图片文件
     from services.postcard_service import delete_postcard_image
     postcard = Postcard.query.filter_by(diary_id=diary_id).first()
-    if postcard and postcard.image_url:
-        delete_postcard_image(postcard.image_url)
+    if postcard and (postcard.image_url or postcard.preview_url):
+        delete_postcard_image(postcard.image_url, postcard.preview_url)
 
     # 删除明信片记录
     if postcard:
@@ -496,6 +765,8 @@ def admin_delete_diary(diary_id):
     # 删除日记（级联删除分析）
     db.session.delete(diary)
     db.session.commit()
+    if adventure:
+        adventure_state.discard(adventure.id)
 
     return jsonify({'message': '日记已删除'})
 
@@ -511,7 +782,8 @@ def list_postcards():
     user_id = request.args.get('user_id', type=int)
     status = request.args.get('status', '')
 
-    query = Postcard.query
+    # 用户名随明信片一起JOIN查出，不再逐条查用户
+    query = db.session.query(Postcard, User.username).outerjoin(User, User.id == Postcard.user_id)
 
     if user_id:
         query = query.filter(Postcard.user_id == user_id)
@@ -519,23 +791,19 @@ def list_postcards():
     if status:
         query = query.filter(Postcard.status == status)
 
-    query = query.order_by(desc(Postcard.created_at))
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    rows, page_info = _paginate_list(
+        query, Postcard, page, per_page, filtered=bool(user_id or status),
+        key=lambda row: (row[0].created_at, row[0].id)
+    )
 
     postcards = []
-    for postcard in pagination.items:
+    for postcard, username in rows:
         postcard_dict = postcard.to_dict()
         # 添加用户信息
-        user = User.query.get(postcard.user_id)
-        postcard_dict['username'] = user.username if user else 'Unknown'
+        postcard_dict['username'] = username or 'Unknown'
         postcards.append(postcard_dict)
 
-    return jsonify({
-        'postcards': postcards,
-        'total': pagination.total,
-        'pages': pagination.pages,
-        'current_page': page
-    })
+    return jsonify({'postcards': postcards, **page_info})
 
 
 @bp.route('/postcards/<int:postcard_id>', methods=['DELETE'])
@@ -548,8 +816,8 @@ def delete_postcard(postcard_id):
 
     # 删除图片文件
     from services.postcard_service import delete_postcard_image
-    if postcard.image_url:
-        delete_postcard_image(postcard.image_url)
+    if postcard.image_url or postcard.preview_url:
+        delete_postcard_image(postcard.image_url, postcard.preview_url)
 
     # 删除记录
     db.session.delete(postcard)
@@ -563,11 +831,25 @@ def delete_postcard(postcard_id):
 @bp.route('/logs', methods=['GET'])
 @admin_required
 def list_access_logs():
-    """获取访问日志列表"""
+    """
+    获取访问日志列表
+
+    参数：
+    - source=archive&date=YYYY-MM-DD: 读取已归档的日志（超过保留期的日志不在数据库中）
+    """
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 50, type=int)
     path_filter = request.args.get('path', '')
 
+    if request.args.get('source') == 'archive':
+        from datetime import date
+        from services.log_archive import read_archive
+        try:
+            day = date.fromisoformat(request.args.get('date', ''))
+        except ValueError:
+            return jsonify({'error': '请提供归档日期 date=YYYY-MM-DD'}), 400
+        return jsonify(read_archive(day, page=page, per_page=min(per_page, 500), path_filter=path_filter))
+
     query = AccessLog.query
 
     if path_filter:
@@ -584,3 +866,19 @@ def list_access_logs():
         'pages': pagination.pages,
         'current_page': page
     })
+
+
+@bp.route('/logs/archive', methods=['GET'])
+@admin_required
+def list_log_archives():
+    """获取已归档的日期列表"""
+    from services.log_archive import list_archive_days, ACCESS_LOG_RETENTION_DAYS
+    return jsonify({'days': list_archive_days(), 'retention_days': ACCESS_LOG_RETENTION_DAYS})
+
+
+@bp.route('/logs/writer', methods=['GET'])
+@admin_required
+def get_log_writer_stats():
+    """获取访问日志写入器状态（当前进程的入队、写入、丢弃、采样计数）"""
+    from services.access_log import get_stats
+    return jsonify(get_stats())
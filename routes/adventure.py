@@ -7,10 +7,14 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
+import sys
 import json
 import random
 from extensions import db
 from models import AdventureSession, UserItem, EmotionDiary, GameState, EmotionAnalysis, Postcard
+from sqlalchemy import update
+from services.game_rewards import claim_diary_score, apply_rewards, grant_items
+from services import adventure_state
 
 adventure_bp = Blueprint('adventure', __name__)
 
@@ -53,8 +57,17 @@ def get_or_create_session(diary_id):
                 'message': '探险正在准备中，请稍候...'
             })
 
-        # 已经生成完成，直接返回
+        # 已经生成完成，直接返回（进行中的探险以状态存储里的答题进度为准）
         result = session.to_dict()
+        if session.status == 'in_progress' and adventure_state.enabled():
+            try:
+                state = adventure_state.get_state(session.id)
+            except adventure_state.AdventureStateUnavailable as e:
+                print(f"[探险] 状态存储不可用: {e}", file=sys.stderr)
+                state = None
+            if state:
+                result.update(challenges=state['challenges'], monsters=state['monsters'],
+                              current_challenge=state['current_challenge'])
         result['success'] = True
         result['is_new'] = False
         print(f"[探险] 返回已存在的会话 #{session.id}", file=sys.stderr)
@@ -75,14 +88,26 @@ def get_or_create_session(diary_id):
         # 判断正面/负面情绪
         is_positive = emotion_score >= 50
 
+        # 读完日记即归还连接，AI生成挑战期间不占用连接池
+        content, emotion_tags, trigger_event = diary.content, diary.emotion_tags or [], diary.trigger_event
+        db.session.close()
+
         # 尝试使用AI生成挑战
         monsters, challenges = generate_ai_challenges(
-            diary.content,
-            diary.emotion_tags or [],
+            content,
+            emotion_tags,
             emotion_score,
-            diary.trigger_event
+            trigger_event
         )
 
+        # AI生成期间可能已有并发请求建好会话，以已有的为准
+        session = AdventureSession.query.filter_by(diary_id=diary_id, user_id=user_id).first()
+        if session:
+            result = session.to_dict()
+            result['success'] = True
+            result['is_new'] = False
+            return jsonify(result)
+
         # 选择场景
         if is_positive:
             scene_name = random.choice(SCENE_NAMES_POSITIVE)
@@ -127,6 +152,13 @@ def start_adventure(adventure_id):
     session.started_at = datetime.utcnow()
     db.session.commit()
 
+    # 进行中的答题进度放进状态存储（失败时首次提交答案会再载入）
+    if adventure_state.enabled():
+        try:
+            adventure_state.load(session)
+        except adventure_state.AdventureStateUnavailable as e:
+            print(f"[探险] 状态存储不可用: {e}", file=sys.stderr)
+
     # 直接返回session数据
     result = session.to_dict()
     result['success'] = True
@@ -136,22 +168,54 @@ def start_adventure(adventure_id):
 @adventure_bp.route('/<int:adventure_id>/submit', methods=['POST'])
 @jwt_required()
 def submit_challenge(adventure_id):
-    """提交挑战答案"""
-    user_id = get_jwt_identity()
-    session = AdventureSession.query.filter_by(id=adventure_id, user_id=user_id).first()
-
-    if not session:
-        return jsonify({'error': '探险会话不存在'}), 404
+    """
+    提交挑战答案
 
-    if session.status != 'in_progress':
-        return jsonify({'error': '探险未开始或已完成'}), 400
+    启用了状态存储（services/adventure_state.py）时只在存储里原子地追加答案、推进进度，
+    不读写数据库；存储里没有该探险时先从数据库（最近的检查点）载入。
 
+    challenge_index 是客户端正在回答的题目序号，与服务端进度不一致时返回409（重复提交、多端同时作答），
+    不会把答案记到下一题上；不传时按服务端当前进度处理（兼容旧客户端）。
+    """
+    user_id = int(get_jwt_identity())
     data = request.get_json()
     # 兼容前端传递的两种参数名
     selected_answers = data.get('selected_ids', data.get('selected_answers', []))
+    challenge_index = data.get('challenge_index')
+    if challenge_index is not None:
+        try:
+            challenge_index = int(challenge_index)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'challenge_index 必须是整数'}), 400
+
+    session = None
+    state = None
+    try:
+        if adventure_state.enabled():
+            state = adventure_state.get_state(adventure_id)
+            if state is None:
+                session = AdventureSession.query.filter_by(id=adventure_id, user_id=user_id).first()
+                if session and session.status == 'in_progress':
+                    state = adventure_state.load(session)
+    except adventure_state.AdventureStateUnavailable as e:
+        print(f"[探险] 状态存储不可用: {e}", file=sys.stderr)
+        return jsonify({'error': '探险服务繁忙，请稍后重试'}), 503
+
+    if state is not None:
+        if state['user_id'] != user_id:
+            return jsonify({'error': '探险会话不存在'}), 404
+        challenges, monsters, current_idx = state['challenges'], state['monsters'], state['current_challenge']
+    else:
+        # 未启用状态存储，或探险不是进行中：直接读数据库
+        session = session or AdventureSession.query.filter_by(id=adventure_id, user_id=user_id).first()
+        if not session:
+            return jsonify({'error': '探险会话不存在'}), 404
+        if session.status != 'in_progress':
+            return jsonify({'error': '探险未开始或已完成'}), 400
+        challenges, monsters, current_idx = session.challenges or [], session.monsters or [], session.current_challenge
 
-    challenges = session.challenges or []
-    current_idx = session.current_challenge
+    if challenge_index is not None and challenge_index != current_idx:
+        return jsonify({'error': '该挑战已提交，请刷新探险', 'current_challenge': current_idx}), 409
 
     if current_idx >= len(challenges):
         return jsonify({'error': '没有更多挑战'}), 400
@@ -162,19 +226,6 @@ def submit_challenge(adventure_id):
     # 检查答案是否正确
     is_correct = set(selected_answers) == set(correct_ids)
 
-    # 更新挑战状态
-    challenges[current_idx]['completed'] = True
-    challenges[current_idx]['user_answers'] = selected_answers
-    challenges[current_idx]['is_correct'] = is_correct
-
-    # 更新怪物状态
-    monsters = session.monsters or []
-    if current_idx < len(monsters):
-        monsters[current_idx]['defeated'] = is_correct
-
-    session.challenges = challenges
-    session.monsters = monsters
-
     # 计算奖励
     reward = None
     if is_correct and current_idx < len(monsters):
@@ -186,13 +237,25 @@ def submit_challenge(adventure_id):
             if not reward:
                 reward = {'type': monster_cfg.get('reward', {}).get('type', 'stress_reduce'), 'value': 5}
 
-    # 移动到下一个挑战
-    session.current_challenge = current_idx + 1
+    # 记录答案并移动到下一个挑战
+    if state is not None:
+        try:
+            recorded = adventure_state.record_answer(adventure_id, current_idx, selected_answers, is_correct)
+        except adventure_state.AdventureStateUnavailable as e:
+            print(f"[探险] 状态存储不可用: {e}", file=sys.stderr)
+            return jsonify({'error': '探险服务繁忙，请稍后重试'}), 503
+        if not recorded:
+            return jsonify({'error': '该挑战已提交，请刷新探险'}), 409
+    else:
+        session.challenges, session.monsters = adventure_state.merge_answers(challenges, monsters, {
+            current_idx: {'user_answers': selected_answers, 'is_correct': is_correct}
+        })
+        session.current_challenge = current_idx + 1
+        db.session.commit()
 
     # 检查是否所有挑战完成
-    all_completed = session.current_challenge >= len(challenges)
-
-    db.session.commit()
+    next_challenge = current_idx + 1
+    all_completed = next_challenge >= len(challenges)
 
     # 计算本次挑战获得的金币
     coins_this_challenge = 15 if is_correct else 0
@@ -204,7 +267,7 @@ def submit_challenge(adventure_id):
         'reward': reward,
         'coins_earned': coins_this_challenge,
         'challenge_index': current_idx,
-        'next_challenge': session.current_challenge if not all_completed else None,
+        'next_challenge': next_challenge if not all_completed else None,
         'is_last': all_completed,
         'cbt_insight': challenge.get('explanation', '')
     })
@@ -213,16 +276,36 @@ def submit_challenge(adventure_id):
 @adventure_bp.route('/<int:adventure_id>/complete', methods=['POST'])
 @jwt_required()
 def complete_adventure(adventure_id):
-    """完成探险并结算奖励"""
-    user_id = get_jwt_identity()
-    session = AdventureSession.query.filter_by(id=adventure_id, user_id=user_id).first()
+    """
+    完成探险并结算奖励
+
+    先按会话状态比较并设置（pending/in_progress → completed/failed），抢到的请求才结算；
+    探险成功时在一个事务里按固定的几条语句完成结算（不随道具数量增加查询）：
+    1. 日记计分权比较并设置 + GameState 一条UPDATE原子结算（services/game_rewards.py）
+    2. 道具一条多行upsert（quantity + 1）
+    3. 明信片按 diary_id 唯一索引 upsert
+    提交之后才把明信片生成任务放进后台线程。
+    """
+    user_id = int(get_jwt_identity())
+    row = db.session.query(AdventureSession, EmotionDiary).outerjoin(
+        EmotionDiary, EmotionDiary.id == AdventureSession.diary_id
+    ).filter(AdventureSession.id == adventure_id, AdventureSession.user_id == user_id).first()
 
-    if not session:
+    if not row:
         return jsonify({'error': '探险会话不存在'}), 404
+    session, diary = row
 
     if session.status == 'completed':
         return jsonify({'error': '探险已完成'}), 400
 
+    # 状态存储里的答题进度随结算一起写进 adventure_sessions
+    if session.status == 'in_progress' and adventure_state.enabled():
+        try:
+            adventure_state.apply_to(session)
+        except adventure_state.AdventureStateUnavailable as e:
+            print(f"[探险] 状态存储不可用: {e}", file=sys.stderr)
+            return jsonify({'error': '探险服务繁忙，请稍后重试'}), 503
+
     # 计算总奖励
     monsters = session.monsters or []
     defeated_count = sum(1 for m in monsters if m.get('defeated'))
@@ -268,109 +351,83 @@ def complete_adventure(adventure_id):
                 elif effect_type == 'growth_boost':
                     stat_changes['growth'] += effect_value
 
-    # 获取日记
-    diary = EmotionDiary.query.get(session.diary_id)
-
-    # 更新GameState（只有成功才更新）
-    game_state = GameState.query.filter_by(user_id=user_id).first()
-    old_level = game_state.level if game_state else 1
-    new_level = old_level
-
-    if game_state and is_success:
-        game_state.coins += coins_earned
-        game_state.mental_health_score = max(0, min(100, game_state.mental_health_score + stat_changes['mental_health']))
-        game_state.stress_level = max(0, min(100, game_state.stress_level + stat_changes['stress']))
-        game_state.growth_potential = max(0, min(100, game_state.growth_potential + stat_changes['growth']))
-
-        # 只有日记未计分才增加日记计数（防止重复计分）
-        if diary and not diary.score_applied:
-            game_state.total_diaries += 1
-            diary.score_applied = True
-            diary.analysis_status = 'completed'
-
-            # 检查升级（每10篇日记升1级）
-            new_level = 1 + (game_state.total_diaries // 10)
-            if new_level > old_level:
-                game_state.level = new_level
-                coins_earned += 50  # 升级奖励
-                game_state.coins += 50
-
-        game_state.last_active = datetime.utcnow()
-
-    # 添加道具到用户背包（只有成功才添加）
-    if is_success:
-        for item in items_earned:
-            existing_item = UserItem.query.filter_by(
-                user_id=user_id,
-                item_name=item['name']
-            ).first()
-            if existing_item:
-                existing_item.quantity += 1
-            else:
-                new_item = UserItem(
-                    user_id=user_id,
-                    item_name=item['name'],
-                    item_name_zh=item['name_zh'],
-                    item_type='healing',
-                    effect_type=item['effect_type'],
-                    effect_value=item['effect_value']
-                )
-                db.session.add(new_item)
-
-    # 更新探险会话状态
-    if is_success:
-        session.status = 'completed'
-    else:
-        session.status = 'failed'  # 失败状态，可以重试
+    # 更新探险会话状态（成功/失败可以重试）：先按状态比较并设置抢结算权，
+    # 并发的重复完成只有一个能改到，其余直接返回，不会重复发奖励
+    new_status = 'completed' if is_success else 'failed'
+    sessions = AdventureSession.__table__
+    claimed = db.session.execute(
+        update(sessions)
+        .where(sessions.c.id == adventure_id, sessions.c.user_id == user_id,
+               sessions.c.status.in_(('pending', 'in_progress')))
+        .values(status=new_status)
+    ).rowcount
+    if claimed != 1:
+        db.session.rollback()
+        return jsonify({'error': '探险已完成'}), 400
 
+    session.status = new_status
     session.completed_at = datetime.utcnow()
-    session.coins_earned = coins_earned
     session.items_earned = items_earned
     session.stat_changes = stat_changes
 
-    # 只有探险成功才创建/更新明信片
-    postcard = None
-    postcard_id = None
-
     # 构建探险结果（用于明信片生成）
     adventure_result = {
         'defeated_count': defeated_count,
         'total_monsters': total_monsters
     }
 
+    level_up = False
+    new_level = None
+    postcard_id = None
+    postcard_created = False
+    diary_fields = _diary_postcard_fields(diary) if diary else None
+
     if is_success:
-        postcard = Postcard.query.filter_by(diary_id=session.diary_id, user_id=user_id).first()
-        if postcard:
-            postcard.stat_changes = stat_changes
-            postcard.coins_earned = coins_earned
-            print(f"[探险] 已更新明信片 #{postcard.id} 的探险收获")
-        elif diary:
-            # 明信片还不存在，创建一个pending状态的记录
-            print(f"[探险] 探险成功，创建pending明信片")
-            postcard = Postcard(
-                user_id=user_id,
-                diary_id=session.diary_id,
-                location_name=session.scene_name or '迷雾森林',
-                message='',  # 等待AI生成
-                status='pending',  # 等待AI生成内容和图片
-                emotion_tags=diary.emotion_tags or [],
-                emotion_intensity=diary.emotion_score.get('intensity', 5) if isinstance(diary.emotion_score, dict) else 5,
-                mental_health_score=game_state.mental_health_score if game_state else 50,
-                stat_changes=stat_changes,
-                coins_earned=coins_earned
-            )
-            db.session.add(postcard)
-            db.session.flush()  # 获取ID
-
-            # 触发后台生成明信片内容（传递探险结果）
-            trigger_postcard_generation(postcard.id, diary, session.scene_name, adventure_result)
-
-        postcard_id = postcard.id if postcard else None
+        connection = db.session.connection()
+
+        # 1. 结算GameState：日记未计分时才增加日记计数（防止重复计分），升级奖励50金币
+        diary_counted = bool(diary) and claim_diary_score(connection, diary.id)
+        state = apply_rewards(
+            connection, user_id, 'adventure', diary_id=session.diary_id, coins=coins_earned,
+            mental_health=stat_changes['mental_health'], stress=stat_changes['stress'],
+            growth=stat_changes['growth'], diaries=1 if diary_counted else 0
+        )
+        if state:
+            coins_earned = state['coins_earned']
+            level_up = state['level_up']
+            new_level = state['level'] if level_up else None
+
+        # 2. 道具放进背包
+        grant_items(connection, user_id, items_earned)
+
+        # 3. 创建/更新明信片（已存在时只更新探险收获）
+        if diary:
+            from services.postcard_service import upsert_postcard
+            postcard_id, postcard_created = upsert_postcard(connection, {
+                'user_id': user_id,
+                'diary_id': session.diary_id,
+                'location_name': session.scene_name or '迷雾森林',
+                'message': '',  # 等待AI生成
+                'status': 'pending',  # 等待AI生成内容和图片
+                'emotion_tags': diary_fields['emotion_tags'],
+                'emotion_intensity': diary_fields['intensity'],
+                'mental_health_score': state['mental_health_score'] if state else 50,
+                'stat_changes': stat_changes,
+                'coins_earned': coins_earned
+            }, on_existing={'stat_changes': stat_changes, 'coins_earned': coins_earned})
+            print(f"[探险] {'创建pending' if postcard_created else '已更新'}明信片 #{postcard_id} 的探险收获")
     else:
         print(f"[探险] 探险失败，不生成明信片，用户可重试")
 
+    session.coins_earned = coins_earned
     db.session.commit()
+    adventure_state.discard(adventure_id)
 
+    # 提交之后再触发后台生成明信片内容（传递探险结果）
+    if postcard_created:
+        trigger_postcard_generation(postcard_id, diary_fields, session.scene_name, adventure_result)
+
+    game_state = GameState.query.filter_by(user_id=user_id).first()
     return jsonify({
         'success': True,
         'is_victory': is_success,
@@ -381,8 +438,8 @@ def complete_adventure(adventure_id):
         'coins_earned': coins_earned,
         'items_earned': items_earned,
         'stat_changes': stat_changes,
-        'level_up': new_level > old_level,
-        'new_level': new_level if new_level > old_level else None,
+        'level_up': level_up,
+        'new_level': new_level,
         'game_state': game_state.to_dict() if game_state else None,
         'adventure': session.to_dict(),
         'postcard_id': postcard_id,
@@ -390,12 +447,22 @@ def complete_adventure(adventure_id):
     })
 
 
+def _diary_postcard_fields(diary) -> dict:
+    """明信片生成需要的日记字段（在请求内取出，后台线程不再访问ORM对象）"""
+    return {
+        'emotion_tags': diary.emotion_tags or [],
+        'intensity': diary.emotion_score.get('intensity', 5) if isinstance(diary.emotion_score, dict) else 5,
+        'content': diary.content,
+        'trigger_event': diary.trigger_event
+    }
+
+
 def trigger_postcard_generation(postcard_id, diary, scene_name, adventure_result=None):
     """触发后台生成明信片内容（异步）
 
     参数:
         postcard_id: 明信片ID
-        diary: 日记对象
+        diary: 日记字段（_diary_postcard_fields 的返回值）
         scene_name: 场景名称
         adventure_result: 探险结果 {'defeated_count': N, 'total_monsters': M}
     """
@@ -406,43 +473,67 @@ def trigger_postcard_generation(postcard_id, diary, scene_name, adventure_result
         from app import app
         with app.app_context():
             try:
-                from services.postcard_service import generate_postcard_data, generate_postcard_image
+                from services.postcard_service import (
+                    generate_postcard_data, generate_first_image, apply_first_image, schedule_image_followups
+                )
+                from services.fallback_library import attach_fallback_image
                 from models import Postcard, db
 
-                postcard = Postcard.query.get(postcard_id)
-                if not postcard:
+                # 读完输入即归还连接，调AI期间不占用连接池
+                row = db.session.query(Postcard.mental_health_score, Postcard.user_id, Postcard.diary_id) \
+                    .filter_by(id=postcard_id, status='pending').first()
+                db.session.close()
+                if not row:
                     return
 
                 print(f"[明信片生成] 开始为明信片 #{postcard_id} 生成内容", file=sys.stderr)
 
                 # 生成文本数据（传递探险结果）
                 postcard_data = generate_postcard_data(
-                    emotions=diary.emotion_tags or [],
-                    intensity=diary.emotion_score.get('intensity', 5) if isinstance(diary.emotion_score, dict) else 5,
-                    mental_health_score=postcard.mental_health_score or 50,
-                    diary_content=diary.content,
-                    trigger_event=diary.trigger_event,
+                    emotions=diary['emotion_tags'],
+                    intensity=diary['intensity'],
+                    mental_health_score=row.mental_health_score or 50,
+                    diary_content=diary['content'],
+                    trigger_event=diary['trigger_event'],
                     adventure_result=adventure_result
                 )
-
-                # 更新明信片内容
-                postcard.image_prompt = postcard_data['image_prompt']
-                postcard.location_name = postcard_data.get('location_name', scene_name) or scene_name
-                postcard.message = postcard_data['message']
+                image_prompt = postcard_data['image_prompt']
+
+                # 更新明信片内容（仍在等待生成时才写回）
+                updated = Postcard.query.filter_by(id=postcard_id, status='pending').update(
+                    {'image_prompt': image_prompt,
+                     'location_name': postcard_data.get('location_name', scene_name) or scene_name,
+                     'message': postcard_data['message']},
+                    synchronize_session=False
+                )
                 db.session.commit()
+                db.session.close()
+                if not updated:
+                    return
+
+                # 生成图片（先出预览图，2K图在后台补生成）
+                image_url, tier = generate_first_image(image_prompt)
 
-                # 生成图片
-                image_url = generate_postcard_image(postcard_data['image_prompt'])
+                postcard = Postcard.query.filter_by(id=postcard_id, status='pending').with_for_update().first()
+                if not postcard:
+                    db.session.rollback()
+                    return
                 if image_url:
-                    postcard.image_url = image_url
+                    apply_first_image(postcard, image_url, tier)
                     postcard.status = 'completed'
-                    postcard.generated_at = datetime.utcnow()
-                else:
+                elif not attach_fallback_image(postcard):
+                    # 生成失败或被限流时优先使用备用图库图片
                     postcard.status = 'completed'  # 即使图片失败，文字内容也算完成
 
                 db.session.commit()
+                db.session.close()
                 print(f"[明信片生成] 明信片 #{postcard_id} 生成完成", file=sys.stderr)
 
+                # 临时URL会过期，交给下载线程池转存到本地
+                if image_url:
+                    schedule_image_followups(postcard_id, image_url, tier, image_prompt,
+                                             row.user_id, row.diary_id)
+
             except Exception as e:
                 print(f"[明信片生成] 生成失败: {e}", file=sys.stderr)
                 import traceback
@@ -516,35 +607,34 @@ def skip_adventure(adventure_id):
     diary = EmotionDiary.query.get(session.diary_id)
     game_state = GameState.query.filter_by(user_id=user_id).first()
 
-    # 跳过探险也生成明信片（但没有探险奖励）
-    postcard = Postcard.query.filter_by(diary_id=session.diary_id, user_id=user_id).first()
+    # 跳过探险也生成明信片（但没有探险奖励）；按 diary_id 唯一索引插入，已有明信片时不改动
     postcard_id = None
-
-    if not postcard and diary:
-        print(f"[探险] 跳过探险，创建明信片")
-        postcard = Postcard(
-            user_id=user_id,
-            diary_id=session.diary_id,
-            location_name=session.scene_name or '迷雾森林',
-            message='',
-            status='pending',
-            emotion_tags=diary.emotion_tags or [],
-            emotion_intensity=diary.emotion_score.get('intensity', 5) if isinstance(diary.emotion_score, dict) else 5,
-            mental_health_score=game_state.mental_health_score if game_state else 50,
-            stat_changes={},  # 跳过无奖励
-            coins_earned=0
-        )
-        db.session.add(postcard)
-        db.session.flush()
-
-        # 触发后台生成明信片内容（无探险结果）
-        trigger_postcard_generation(postcard.id, diary, session.scene_name, adventure_result=None)
-        postcard_id = postcard.id
-    elif postcard:
-        postcard_id = postcard.id
-
+    postcard_created = False
+    if diary:
+        from services.postcard_service import upsert_postcard
+        postcard_id, postcard_created = upsert_postcard(db.session.connection(), {
+            'user_id': user_id,
+            'diary_id': session.diary_id,
+            'location_name': session.scene_name or '迷雾森林',
+            'message': '',
+            'status': 'pending',
+            'emotion_tags': diary.emotion_tags or [],
+            'emotion_intensity': diary.emotion_score.get('intensity', 5) if isinstance(diary.emotion_score, dict) else 5,
+            'mental_health_score': game_state.mental_health_score if game_state else 50,
+            'stat_changes': {},  # 跳过无奖励
+            'coins_earned': 0
+        })
+        diary_fields = _diary_postcard_fields(diary)
+    else:
+        postcard_id = db.session.query(Postcard.id).filter_by(diary_id=session.diary_id, user_id=user_id).scalar()
     db.session.commit()
 
+    if postcard_created:
+        print(f"[探险] 跳过探险，创建明信片 #{postcard_id}")
+        # 提交之后再触发后台生成明信片内容（无探险结果）
+        trigger_postcard_generation(postcard_id, diary_fields, session.scene_name, adventure_result=None)
+    adventure_state.discard(adventure_id)
+
     return jsonify({
         'success': True,
         'message': '已跳过探险',
@@ -10,6 +10,8 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import EmotionAnalysis, EmotionDiary, GameState, Postcard, db
+from services.pagination import keyset_page, InvalidCursorError
+from services.game_rewards import claim_diary_score, apply_rewards
 from datetime import datetime
 import json
 import os
@@ -171,6 +173,12 @@ def perform_unified_analysis(diary_id: int, user_id) -> dict:
         intensity = 5
         if isinstance(diary.emotion_score, dict):
             intensity = diary.emotion_score.get('intensity', 5)
+        content = diary.content
+        trigger_event = diary.trigger_event
+
+        # 读完输入先提交（新建的GameState随之落库），归还连接后再调AI；
+        # 结算时由 claim_diary_score 比较并抢计分权，AI期间的并发分析不会重复计分
+        db.session.commit()
 
         # 6. 调用ChatGLM
         analysis_result = None
@@ -182,9 +190,9 @@ def perform_unified_analysis(diary_id: int, user_id) -> dict:
                 client = ZhipuAI(api_key=zhipu_api_key)
                 prompt = get_unified_prompt(
                     emotions=emotions,
-                    trigger_event=diary.trigger_event or '',
+                    trigger_event=trigger_event or '',
                     intensity=intensity,
-                    content=diary.content,
+                    content=content,
                     current_scores=current_scores
                 )
 
@@ -236,31 +244,12 @@ def perform_unified_analysis(diary_id: int, user_id) -> dict:
         stress_change = score_changes.get('stress_level_change', 0)
         growth_change = score_changes.get('growth_potential_change', 0)
 
-        # 9. 应用分数变化
-        game_state.mental_health_score = clamp(game_state.mental_health_score + mental_change, 0, 100)
-        game_state.stress_level = clamp(game_state.stress_level + stress_change, 0, 100)
-        game_state.growth_potential = clamp(game_state.growth_potential + growth_change, 0, 100)
-
-        # 10. 计算奖励
+        # 9. 计算奖励
         rewards = analysis_result.get('rewards', {})
         base_coins = rewards.get('coins_earned', 20)
         coins_earned = max(10, min(100, base_coins))
-        game_state.coins += coins_earned
-
-        # 11. 更新日记数量和等级
-        game_state.total_diaries += 1
-        old_level = game_state.level
-        new_level = 1 + game_state.total_diaries // 10
-        level_up = new_level > old_level
-        if level_up:
-            game_state.level = new_level
-            game_state.coins += 50  # 升级奖励
-
-        # 12. 标记日记已计分和分析完成
-        diary.score_applied = True
-        diary.analysis_status = 'completed'
-
-        # 13. 保存分析记录
+
+        # 10. 保存分析记录
         existing_analysis = EmotionAnalysis.query.filter_by(diary_id=diary_id).first()
         if not existing_analysis:
             new_analysis = EmotionAnalysis(
@@ -271,10 +260,23 @@ def perform_unified_analysis(diary_id: int, user_id) -> dict:
             )
             db.session.add(new_analysis)
 
+        # 11. 提交前原子结算：先抢日记计分权（并发分析同一篇只有一个成功），
+        #     再用一条UPDATE累加分数、金币、日记数并判断升级
+        connection = db.session.connection()
+        if not claim_diary_score(connection, diary_id):
+            db.session.rollback()
+            print(f"[后台分析] 日记 #{diary_id} 已被其他请求计分，跳过", file=sys.stderr)
+            return {'already_analyzed': True}
+        state = apply_rewards(
+            connection, user_id, 'analysis', diary_id=diary_id, coins=coins_earned,
+            mental_health=mental_change, stress=stress_change, growth=growth_change, diaries=1
+        )
+        level_up = state['level_up']
+
         db.session.commit()
         print(f"[后台分析] 分析完成，日记ID: {diary_id}, 金币+{coins_earned}", file=sys.stderr)
 
-        # 14. 触发明信片生成
+        # 12. 触发明信片生成
         if create_postcard_async:
             try:
                 create_postcard_async(
@@ -282,9 +284,9 @@ def perform_unified_analysis(diary_id: int, user_id) -> dict:
                     diary_id=diary_id,
                     emotions=emotions,
                     intensity=intensity,
-                    mental_health_score=game_state.mental_health_score,
-                    diary_content=diary.content,
-                    trigger_event=diary.trigger_event
+                    mental_health_score=state['mental_health_score'],
+                    diary_content=content,
+                    trigger_event=trigger_event
                 )
                 print(f"[后台分析] 明信片生成已触发", file=sys.stderr)
             except Exception as e:
@@ -414,6 +416,12 @@ def unified_analyze_legacy(diary_id):
         intensity = 5
         if isinstance(diary.emotion_score, dict):
             intensity = diary.emotion_score.get('intensity', 5)
+        content = diary.content
+        trigger_event = diary.trigger_event
+
+        # 读完输入先提交（新建的GameState随之落库），归还连接后再调AI；
+        # 结算时由 claim_diary_score 比较并抢计分权，AI期间的并发分析不会重复计分
+        db.session.commit()
 
         # 6. 调用ChatGLM（统一Prompt）
         analysis_result = None
@@ -425,9 +433,9 @@ def unified_analyze_legacy(diary_id):
                 client = ZhipuAI(api_key=zhipu_api_key)
                 prompt = get_unified_prompt(
                     emotions=emotions,
-                    trigger_event=diary.trigger_event or '',
+                    trigger_event=trigger_event or '',
                     intensity=intensity,
-                    content=diary.content,
+                    content=content,
                     current_scores=current_scores
                 )
 
@@ -489,32 +497,10 @@ def unified_analyze_legacy(diary_id):
         rewards = analysis_result.get('rewards', {})
         coins_earned = clamp(rewards.get('coins_earned', 20), 10, 50)
 
-        # 10. 更新GameState（单一事务）
-        previous_scores = {
-            'mental_health_score': game_state.mental_health_score,
-            'stress_level': game_state.stress_level,
-            'growth_potential': game_state.growth_potential
-        }
+        # 10. 结算前的分数（用于响应）
+        previous_scores = current_scores.copy()
 
-        game_state.mental_health_score = clamp(game_state.mental_health_score + mental_change, 0, 100)
-        game_state.stress_level = clamp(game_state.stress_level + stress_change, 0, 100)
-        game_state.growth_potential = clamp(game_state.growth_potential + growth_change, 0, 100)
-        game_state.coins += coins_earned
-        game_state.total_diaries += 1
-        game_state.last_active = datetime.utcnow()
-
-        # 检查升级（每10篇日记升1级）
-        old_level = game_state.level
-        new_level = 1 + (game_state.total_diaries // 10)
-        level_up = new_level > old_level
-        if level_up:
-            game_state.level = new_level
-
-        # 11. 标记日记已分析
-        diary.score_applied = True
-        diary.analysis_status = 'completed'
-
-        # 12. 保存分析结果到EmotionAnalysis
+        # 11. 保存分析结果到EmotionAnalysis
         existing_analysis = EmotionAnalysis.query.filter_by(diary_id=diary_id).first()
         if existing_analysis:
             existing_analysis.analysis_payload = analysis_result
@@ -531,6 +517,18 @@ def unified_analyze_legacy(diary_id):
             )
             db.session.add(new_analysis)
 
+        # 12. 提交前原子结算（此端点升级不奖励金币）
+        connection = db.session.connection()
+        if not claim_diary_score(connection, diary_id):
+            db.session.rollback()
+            return jsonify({'success': True, 'already_analyzed': True, 'message': '该日记已分析过'}), 200
+        state = apply_rewards(
+            connection, user_id, 'legacy_analysis', diary_id=diary_id, coins=coins_earned,
+            mental_health=mental_change, stress=stress_change, growth=growth_change, diaries=1, level_bonus=0
+        )
+        level_up = state['level_up']
+        new_level = state['level']
+
         # 13. 提交事务
         db.session.commit()
 
@@ -545,9 +543,9 @@ def unified_analyze_legacy(diary_id):
                     diary_id=diary_id,
                     emotions=emotions,
                     intensity=intensity,
-                    mental_health_score=game_state.mental_health_score,
-                    diary_content=diary.content,
-                    trigger_event=diary.trigger_event
+                    mental_health_score=state['mental_health_score'],
+                    diary_content=content,
+                    trigger_event=trigger_event
                 )
                 print(f"[统一分析] 明信片生成已触发", file=sys.stderr)
             except Exception as e:
@@ -625,11 +623,19 @@ def get_analysis(diary_id):
 @bp.route('/history', methods=['GET'])
 @jwt_required()
 def get_analysis_history():
-    """获取用户的情绪分析历史"""
+    """
+    获取用户的情绪分析历史
+
+    Query参数:
+    - page/limit: 页码分页
+    - cursor: 游标分页（第一页传空字符串，之后传上一页返回的 next_cursor）
+    - with_total: 游标模式下是否返回总数（需要一次COUNT），默认false
+    """
     try:
         user_id = get_jwt_identity()
         page = request.args.get('page', 1, type=int)
         limit = request.args.get('limit', 20, type=int)
+        cursor = request.args.get('cursor')
 
         # 限制每页数量
         limit = min(limit, 100)
@@ -639,16 +645,36 @@ def get_analysis_history():
             EmotionDiary, EmotionAnalysis.diary_id == EmotionDiary.id
         ).filter(
             EmotionDiary.user_id == user_id
-        ).order_by(EmotionAnalysis.analyzed_at.desc())
+        )
 
-        # 分页
-        results = query.paginate(page=page, per_page=limit, error_out=False)
-
-        analysis_list = []
-        for analysis, diary in results.items:
+        def to_item(analysis, diary):
             analysis_data = analysis.to_dict()
             analysis_data['diary_content'] = diary.content[:100] + '...' if len(diary.content) > 100 else diary.content
-            analysis_list.append(analysis_data)
+            return analysis_data
+
+        if cursor is not None:
+            try:
+                result = keyset_page(
+                    query, EmotionAnalysis.analyzed_at, EmotionAnalysis.id, cursor, limit,
+                    key=lambda row: (row[0].analyzed_at, row[0].id)
+                )
+            except InvalidCursorError as e:
+                return jsonify({'error': str(e)}), 400
+            with_total = request.args.get('with_total', 'false').lower() == 'true'
+            return jsonify({
+                'analysis_history': [to_item(analysis, diary) for analysis, diary in result['items']],
+                'pagination': {
+                    'per_page': limit,
+                    'total': query.order_by(None).count() if with_total else None,
+                    'has_next': result['has_more'],
+                    'next_cursor': result['next_cursor']
+                }
+            }), 200
+
+        # 分页
+        results = query.order_by(EmotionAnalysis.analyzed_at.desc()).paginate(page=page, per_page=limit, error_out=False)
+
+        analysis_list = [to_item(analysis, diary) for analysis, diary in results.items]
 
         return jsonify({
             'analysis_history': analysis_list,
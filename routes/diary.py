@@ -2,7 +2,13 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import EmotionDiary, db, User, GameState, Postcard, AdventureSession
 from datetime import datetime, timedelta
+from sqlalchemy import update, or_
 from concurrent.futures import ThreadPoolExecutor
+from services.pagination import keyset_page, InvalidCursorError
+from services.diary_search import apply_search, make_snippet
+from services.emotion_tags import tag_filter
+from services.diary_stats import recent_diary_count, tag_histogram
+from services import adventure_state
 import sys
 
 bp = Blueprint('diary', __name__)
@@ -13,15 +19,40 @@ _executor = ThreadPoolExecutor(max_workers=2)
 @bp.route('/', methods=['GET'])
 @jwt_required()
 def get_diaries():
-    """获取用户的日记列表"""
+    """
+    获取用户的日记列表
+
+    Query参数:
+    - page/limit: 页码分页
+    - cursor: 游标分页（第一页传空字符串，之后传上一页返回的 next_cursor），
+      不做COUNT和OFFSET，翻到多深耗时都一样
+    """
     try:
         user_id = get_jwt_identity()
         page = request.args.get('page', 1, type=int)
         limit = request.args.get('limit', 10, type=int)
+        cursor = request.args.get('cursor')
 
         # 限制每页数量
         limit = min(limit, 50)
 
+        if cursor is not None:
+            result = keyset_page(
+                EmotionDiary.query.filter_by(user_id=user_id),
+                EmotionDiary.created_at, EmotionDiary.id, cursor, limit
+            )
+            # 总数读用户计数缓存
+            total = db.session.query(User.diary_count).filter(User.id == user_id).scalar() or 0
+            return jsonify({
+                'diaries': [diary.to_dict() for diary in result['items']],
+                'pagination': {
+                    'per_page': limit,
+                    'total': total,
+                    'has_next': result['has_more'],
+                    'next_cursor': result['next_cursor']
+                }
+            }), 200
+
         # 查询用户的日记
         query = EmotionDiary.query.filter_by(user_id=user_id).order_by(EmotionDiary.created_at.desc())
 
@@ -45,6 +76,8 @@ def get_diaries():
             }
         }), 200
 
+    except InvalidCursorError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to get diaries: {str(e)}'}), 500
 
@@ -271,10 +304,10 @@ def delete_diary(diary_id):
 
         # 1. 先删除关联的明信片图片文件
         postcard = Postcard.query.filter_by(diary_id=diary_id, user_id=user_id).first()
-        if postcard and postcard.image_url:
+        if postcard and (postcard.image_url or postcard.preview_url):
             try:
                 from services.postcard_service import delete_postcard_image
-                delete_postcard_image(postcard.image_url)
+                delete_postcard_image(postcard.image_url, postcard.preview_url)
                 print(f"[日记删除] 已删除明信片图片: {postcard.image_url}", file=sys.stderr)
             except Exception as img_err:
                 print(f"[日记删除] 删除明信片图片失败（不影响日记删除）: {img_err}", file=sys.stderr)
@@ -293,6 +326,8 @@ def delete_diary(diary_id):
         # 4. 删除日记（会级联删除EmotionAnalysis）
         db.session.delete(diary)
         db.session.commit()
+        if adventure:
+            adventure_state.discard(adventure.id)
 
         print(f"[日记删除] 日记 #{diary_id} 及关联数据删除成功", file=sys.stderr)
 
@@ -312,27 +347,12 @@ def get_diary_stats():
     try:
         user_id = get_jwt_identity()
 
-        # 计算统计信息
-        total_diaries = EmotionDiary.query.filter_by(user_id=user_id).count()
-
-        # 最近7天的日记数量
-        seven_days_ago = datetime.utcnow() - timedelta(days=7)
-        recent_diaries = EmotionDiary.query.filter(
-            EmotionDiary.user_id == user_id,
-            EmotionDiary.created_at >= seven_days_ago
-        ).count()
-
-        # 按情绪标签统计
-        all_diaries = EmotionDiary.query.filter_by(user_id=user_id).all()
-        emotion_stats = {}
-
-        for diary in all_diaries:
-            for tag in diary.emotion_tags:
-                if tag not in emotion_stats:
-                    emotion_stats[tag] = 0
-                emotion_stats[tag] += 1
-
+        # 总数读用户行上的计数，最近7天和标签分布读汇总表（services/diary_stats.py）
         user = db.session.get(User, user_id)
+        total_diaries = (user.diary_count or 0) if user else 0
+        recent_diaries = recent_diary_count(user_id, days=7)
+        emotion_stats = tag_histogram(user_id)
+
         weeks_since_signup = 1
         if user and user.created_at:
             days_since_signup = max(1, (datetime.utcnow() - user.created_at).days)
@@ -351,7 +371,14 @@ def get_diary_stats():
 @bp.route('/search', methods=['GET'])
 @jwt_required()
 def search_diaries():
-    """搜索日记"""
+    """
+    搜索日记
+
+    Query参数:
+    - keyword: 关键词（空格分隔多个，需同时命中），走全文索引并按相关度排序，结果带高亮摘要 snippet
+    - emotion_tag / date_from / date_to: 筛选条件
+    - page/limit: 分页，默认每页20条，最多50条
+    """
     try:
         user_id = get_jwt_identity()
 
@@ -360,18 +387,19 @@ def search_diaries():
         emotion_tag = request.args.get('emotion_tag', '').strip()
         date_from = request.args.get('date_from')
         date_to = request.args.get('date_to')
+        page = request.args.get('page', 1, type=int)
+        limit = min(request.args.get('limit', 20, type=int), 50)
 
         # 基础查询
         query = EmotionDiary.query.filter_by(user_id=user_id)
 
-        # 关键词搜索
+        # 关键词搜索（全文索引，按相关度排序）
         if keyword:
-            query = query.filter(EmotionDiary.content.contains(keyword))
+            query = apply_search(query, keyword, ranked=True)
 
-        # 情绪标签筛选（兼容MySQL和SQLite的JSON查询）
+        # 情绪标签筛选（走 diary_emotion_tags 索引）
         if emotion_tag:
-            # 使用LIKE模式匹配JSON数组中的标签
-            query = query.filter(EmotionDiary.emotion_tags.like(f'%"{emotion_tag}"%'))
+            query = query.filter(tag_filter(user_id, emotion_tag))
 
         # 日期范围筛选
         if date_from:
@@ -394,12 +422,27 @@ def search_diaries():
             except ValueError:
                 pass
 
-        # 执行查询
-        diaries = query.order_by(EmotionDiary.created_at.desc()).all()
+        # 执行查询（相关度相同时按时间倒序）
+        results = query.order_by(EmotionDiary.created_at.desc()).paginate(page=page, per_page=limit, error_out=False)
+
+        diaries = []
+        for diary in results.items:
+            diary_dict = diary.to_dict()
+            if keyword:
+                diary_dict['snippet'] = make_snippet(diary.content, keyword)
+            diaries.append(diary_dict)
 
         return jsonify({
-            'diaries': [diary.to_dict() for diary in diaries],
-            'total': len(diaries)
+            'diaries': diaries,
+            'total': results.total,
+            'pagination': {
+                'page': results.page,
+                'pages': results.pages,
+                'per_page': results.per_page,
+                'total': results.total,
+                'has_prev': results.has_prev,
+                'has_next': results.has_next
+            }
         }), 200
 
     except Exception as e:
@@ -542,6 +585,9 @@ def analyze_diary_stream(diary_id):
                 'intensity': request_data.get('intensity', diary.emotion_score.get('intensity') if diary.emotion_score else 5)
             }
 
+            # 读完输入就归还数据库连接，AI流式输出期间（可能几十秒）不占用连接池
+            db.session.close()
+
             # 流式调用AI分析
             full_analysis_data = None
             for event in analysis_service.analyze_cbt_content_stream(
@@ -578,9 +624,16 @@ def analyze_diary_stream(diary_id):
                 # 调用保存方法
                 analysis_service._save_analysis_result(diary_id, analysis_result)
 
-                # 更新日记状态
-                diary.analysis_status = 'completed'
+                # 重新取连接写回：比较并设置日记状态（已被其他请求完成时不重复改写）
+                diaries = EmotionDiary.__table__
+                db.session.execute(
+                    update(diaries)
+                    .where(diaries.c.id == diary_id, diaries.c.user_id == user_id,
+                           or_(diaries.c.analysis_status.is_(None), diaries.c.analysis_status != 'completed'))
+                    .values(analysis_status='completed')
+                )
                 db.session.commit()
+                db.session.close()
 
             # 发送完成事件
             yield f"data: {json.dumps({'type': 'done'})}\n\n"
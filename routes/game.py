@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import GameState, db
-from datetime import datetime
+from datetime import datetime, timedelta
 
 bp = Blueprint('game', __name__)
 
@@ -98,4 +98,57 @@ def get_game_progress():
             'progress': progress
         }), 200
     except Exception as e:
-        return jsonify({'error': f'Failed to get game progress: {str(e)}'}), 500
\ No newline at end of file
+        return jsonify({'error': f'Failed to get game progress: {str(e)}'}), 500
+
+def _parse_time(value: str):
+    """解析ISO时间（兼容末尾的Z），返回UTC naive datetime"""
+    return datetime.fromisoformat(value.strip().replace('Z', '+00:00')).replace(tzinfo=None)
+
+@bp.route('/history', methods=['GET'])
+@jwt_required()
+def get_game_history():
+    """
+    游戏状态变化历史（来自 game_ledger 流水，用于画属性/金币曲线）
+
+    Query参数:
+    - days: 最近多少天，默认30，最多365
+    - since / until: ISO时间，指定时优先于 days
+    - limit: 最多返回多少条变化，默认500
+    """
+    from services.game_ledger import history
+
+    try:
+        user_id = int(get_jwt_identity())
+        days = max(1, min(request.args.get('days', 30, type=int), 365))
+        limit = max(1, min(request.args.get('limit', 500, type=int), 1000))
+        since = request.args.get('since')
+        until = request.args.get('until')
+        try:
+            since = _parse_time(since) if since else datetime.utcnow() - timedelta(days=days)
+            until = _parse_time(until) if until else None
+        except ValueError:
+            return jsonify({'error': '时间格式错误，应为ISO格式'}), 400
+
+        return jsonify(dict(history(user_id, since, until, limit=limit), success=True)), 200
+    except Exception as e:
+        return jsonify({'error': f'Failed to get game history: {str(e)}'}), 500
+
+@bp.route('/state-at', methods=['GET'])
+@jwt_required()
+def get_game_state_at():
+    """某一时刻的游戏状态（快照 + 重放流水），Query参数 at 为ISO时间"""
+    from services.game_ledger import state_at
+
+    try:
+        user_id = int(get_jwt_identity())
+        at = request.args.get('at')
+        if not at:
+            return jsonify({'error': '缺少参数 at'}), 400
+        try:
+            at = _parse_time(at)
+        except ValueError:
+            return jsonify({'error': '时间格式错误，应为ISO格式'}), 400
+
+        return jsonify({'success': True, 'at': at.isoformat() + 'Z', 'game_state': state_at(user_id, at)}), 200
+    except Exception as e:
+        return jsonify({'error': f'Failed to get game state: {str(e)}'}), 500
@@ -11,7 +11,8 @@
 
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Postcard, EmotionDiary, db
+from models import Postcard, EmotionDiary, User, db
+from services.pagination import keyset_page, InvalidCursorError
 from datetime import datetime
 
 bp = Blueprint('postcard', __name__)
@@ -26,6 +27,7 @@ def get_postcards():
     Query参数:
     - limit: 返回数量，默认20，最大100
     - offset: 偏移量，默认0
+    - cursor: 游标分页（第一页传空字符串，之后传上一页返回的 next_cursor），传了就忽略offset
     - unread_only: 是否只返回未读，默认false
 
     返回:
@@ -47,15 +49,30 @@ def get_postcards():
         if unread_only:
             query = query.filter_by(is_read=False)
 
-        # 获取总数
-        total = query.count()
+        # 总数和未读数直接读用户行上的计数缓存
+        unread_count, postcard_count = db.session.query(
+            User.unread_postcards, User.postcard_count
+        ).filter(User.id == user_id).first() or (0, 0)
+        unread_count = unread_count or 0
+        total = unread_count if unread_only else (postcard_count or 0)
+
+        cursor = request.args.get('cursor')
+        if cursor is not None:
+            result = keyset_page(query, Postcard.created_at, Postcard.id, cursor, limit)
+            return jsonify({
+                'postcards': [p.to_dict() for p in result['items']],
+                'pagination': {
+                    'total': total,
+                    'limit': limit,
+                    'has_more': result['has_more'],
+                    'next_cursor': result['next_cursor']
+                },
+                'unread_count': unread_count
+            }), 200
 
         # 获取分页数据
         postcards = query.order_by(Postcard.created_at.desc()).offset(offset).limit(limit).all()
 
-        # 获取未读数量
-        unread_count = Postcard.query.filter_by(user_id=user_id, is_read=False).count()
-
         return jsonify({
             'postcards': [p.to_dict() for p in postcards],
             'pagination': {
@@ -67,6 +84,8 @@ def get_postcards():
             'unread_count': unread_count
         }), 200
 
+    except InvalidCursorError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'获取明信片列表失败: {str(e)}'}), 500
 
@@ -157,7 +176,8 @@ def get_unread_count():
     """
     try:
         user_id = get_jwt_identity()
-        unread_count = Postcard.query.filter_by(user_id=user_id, is_read=False).count()
+        # 主键查询读计数缓存（前端轮询，不再COUNT）
+        unread_count = db.session.query(User.unread_postcards).filter(User.id == user_id).scalar() or 0
 
         return jsonify({
             'unread_count': unread_count
@@ -239,32 +259,51 @@ def regenerate_image(postcard_id):
         if not postcard:
             return jsonify({'error': '明信片不存在'}), 404
 
-        # 只有text_only或failed状态的明信片可以重新生成
-        if postcard.status not in ['text_only', 'failed']:
+        # 只有text_only、failed状态或使用备用图库图片的明信片可以重新生成
+        if postcard.status not in ['text_only', 'failed'] and postcard.image_source != 'library':
             return jsonify({'error': '该明信片不需要重新生成'}), 400
 
         # 导入服务
-        from services.postcard_service import generate_postcard_image
-
-        # 更新状态
-        postcard.status = 'generating'
+        from services.postcard_service import generate_first_image, apply_first_image, schedule_image_followups
+        from services.fallback_library import attach_fallback_image
+
+        # 按原状态比较并改为生成中（并发的重复请求只有一个能抢到），提交后归还连接再调AI
+        previous_status, image_prompt = postcard.status, postcard.image_prompt
+        claimed = Postcard.query.filter_by(id=postcard_id, status=previous_status).update(
+            {'status': 'generating'}, synchronize_session=False
+        )
         db.session.commit()
+        db.session.close()
+        if not claimed:
+            return jsonify({'error': '明信片正在生成中，请稍后'}), 409
 
-        # 生成图片
-        image_url = generate_postcard_image(postcard.image_prompt)
+        # 生成图片（先返回预览图，2K图在后台补生成）
+        image_url, tier = generate_first_image(image_prompt)
+
+        postcard = Postcard.query.filter_by(id=postcard_id, status='generating').with_for_update().first()
+        if not postcard:
+            db.session.rollback()
+            return jsonify({'error': '明信片不存在'}), 404
 
         if image_url:
-            postcard.image_url = image_url
+            apply_first_image(postcard, image_url, tier)
             postcard.status = 'completed'
-            postcard.generated_at = datetime.utcnow()
-        else:
+        elif postcard.image_source == 'library':
+            # 已有图库图片，重新生成失败时保留原图
+            postcard.status = previous_status
+        elif not attach_fallback_image(postcard):
             postcard.status = 'failed'
 
         db.session.commit()
+        result = postcard.to_dict()
+
+        if image_url:
+            schedule_image_followups(postcard_id, image_url, tier, image_prompt,
+                                     postcard.user_id, postcard.diary_id)
 
         return jsonify({
             'success': bool(image_url),
-            'postcard': postcard.to_dict()
+            'postcard': result
         }), 200
 
     except Exception as e:
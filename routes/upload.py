@@ -1,17 +1,16 @@
 """
 图片上传路由
 """
-from flask import Blueprint, request, jsonify, url_for
+from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
-import os
 import uuid
 from datetime import datetime
+from services.storage import get_storage
 
 bp = Blueprint('upload', __name__)
 
-# 配置
-UPLOAD_FOLDER = 'static/uploads'
+# 配置（保存位置由 services/storage.py 的 uploads 区域决定）
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
 
@@ -68,16 +67,12 @@ def upload_image():
         unique_id = str(uuid.uuid4())[:8]
         new_filename = f"{timestamp}_{unique_id}.{file_ext}"
 
-        # 确保上传目录存在
-        upload_path = os.path.join(os.getcwd(), UPLOAD_FOLDER)
-        os.makedirs(upload_path, exist_ok=True)
-
         # 保存文件
-        file_path = os.path.join(upload_path, new_filename)
-        file.save(file_path)
+        storage = get_storage('uploads')
+        storage.save_fileobj(new_filename, file.stream, content_type=file.mimetype)
 
         # 生成URL
-        image_url = url_for('static', filename=f'uploads/{new_filename}', _external=False)
+        image_url = storage.url_for(new_filename)
 
         return jsonify({
             'message': '上传成功',
@@ -111,15 +106,9 @@ def delete_image():
         # 安全检查：确保文件名不包含路径遍历
         filename = secure_filename(filename)
 
-        # 构建完整路径
-        file_path = os.path.join(os.getcwd(), UPLOAD_FOLDER, filename)
-
-        # 检查文件是否存在
-        if not os.path.exists(file_path):
-            return jsonify({'error': '文件不存在'}), 404
-
         # 删除文件
-        os.remove(file_path)
+        if not get_storage('uploads').delete(filename):
+            return jsonify({'error': '文件不存在'}), 404
 
         return jsonify({'message': '删除成功'}), 200
 
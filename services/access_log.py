@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+访问日志缓冲写入
+
+原来每个请求在 before_request 里单独插入一行并提交事务，现在改为：
+1. 请求结束时只把日志记录放进内存队列（不访问数据库）
+2. 后台线程每 ACCESS_LOG_FLUSH_INTERVAL_MS 毫秒或攒够 ACCESS_LOG_BATCH_SIZE 条，用一条多行INSERT写入
+3. 支持按比例采样（错误响应始终保留）
+4. 队列满时直接丢弃并计数，绝不阻塞请求
+5. 进程退出时把队列中剩余的日志写完
+6. 访问量、5xx数和独立访客草图在采样、入队之前计数（内存），不受采样和丢弃影响：
+   写入线程每隔 ACCESS_LOG_FLUSH_INTERVAL_MS 把访问量累加进 stats_hourly / stats_daily，
+   并按间隔保存访客草图（services/visitor_sketch.py）；其余汇总列由定时线程维护（services/stats_rollup.py）
+"""
+
+import os
+import sys
+import time
+import queue
+import random
+import atexit
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 最长攒多久写一次（毫秒）
+ACCESS_LOG_FLUSH_INTERVAL_MS = int(os.environ.get('ACCESS_LOG_FLUSH_INTERVAL_MS', 1000))
+# 每批最多写多少条
+ACCESS_LOG_BATCH_SIZE = int(os.environ.get('ACCESS_LOG_BATCH_SIZE', 200))
+# 内存队列上限，超过后丢弃新日志
+ACCESS_LOG_QUEUE_SIZE = int(os.environ.get('ACCESS_LOG_QUEUE_SIZE', 10000))
+# 采样比例（0~1），状态码>=400的请求始终记录
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', 1.0))
+
+_queue = queue.Queue(maxsize=ACCESS_LOG_QUEUE_SIZE)
+_start_lock = threading.Lock()
+_flusher = None
+_flusher_pid = None
+
+# 按小时的流量计数 {小时起点: [访问量, 5xx数]}，写入线程定期累加进汇总表
+_traffic_lock = threading.Lock()
+_traffic = {}
+
+_stats_lock = threading.Lock()
+_stats = {
+    'enqueued': 0,
+    'written': 0,
+    'dropped': 0,       # 队列满被丢弃
+    'sampled_out': 0,   # 采样跳过
+    'failed': 0,        # 写入数据库失败
+    'flushes': 0,
+}
+
+
+def _incr(name: str, value: int = 1):
+    with _stats_lock:
+        _stats[name] += value
+
+
+def get_stats() -> dict:
+    """写入器计数（当前进程）"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['queue_size'] = _queue.qsize()
+    stats['sample_rate'] = ACCESS_LOG_SAMPLE_RATE
+    return stats
+
+
+def record(entry: dict):
+    """
+    记录一条访问日志（只入队，不访问数据库）
+
+    Args:
+        entry: AccessLog 的列值，如 {'ip_address': ..., 'path': ..., 'status_code': ...}
+    """
+    status_code = entry.get('status_code') or 0
+    _ensure_flusher()
+    _count_traffic(entry, status_code)
+
+    if status_code < 400 and ACCESS_LOG_SAMPLE_RATE < 1.0 and random.random() >= ACCESS_LOG_SAMPLE_RATE:
+        _incr('sampled_out')
+        return
+
+    try:
+        _queue.put_nowait(entry)
+        _incr('enqueued')
+    except queue.Full:
+        _incr('dropped')
+
+
+def _count_traffic(entry: dict, status_code: int):
+    """计入访问量和访客草图（只改内存）"""
+    created_at = entry.get('created_at')
+    if created_at is None:
+        return
+    hour = created_at.replace(minute=0, second=0, microsecond=0)
+    with _traffic_lock:
+        counts = _traffic.setdefault(hour, [0, 0])
+        counts[0] += 1
+        if status_code >= 500:
+            counts[1] += 1
+
+    try:
+        from services.visitor_sketch import observe
+        observe([entry])
+    except Exception as e:
+        print(f"[访问日志] 更新访客草图失败: {e}", file=sys.stderr)
+
+
+def _ensure_flusher():
+    """按进程启动后台写入线程（gunicorn fork 出的每个worker各自一个）"""
+    global _flusher, _flusher_pid
+    pid = os.getpid()
+    if _flusher is not None and _flusher_pid == pid and _flusher.is_alive():
+        return
+    with _start_lock:
+        if _flusher is not None and _flusher_pid == pid and _flusher.is_alive():
+            return
+        _flusher = threading.Thread(target=_flush_loop, name='access-log-flusher', daemon=True)
+        _flusher_pid = pid
+        _flusher.start()
+
+
+def _drain(max_items: int, timeout: float) -> list:
+    """从队列取一批日志：等到第一条后，在剩余时间内尽量凑满一批"""
+    batch = []
+    deadline = time.monotonic() + timeout
+    while len(batch) < max_items:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+def _flush_loop():
+    interval = ACCESS_LOG_FLUSH_INTERVAL_MS / 1000.0
+    last_counters = time.monotonic()
+    while True:
+        batch = _drain(ACCESS_LOG_BATCH_SIZE, interval)
+        if batch:
+            _write_batch(batch)
+        if time.monotonic() - last_counters >= interval:
+            last_counters = time.monotonic()
+            _flush_counters()
+
+
+def _write_batch(batch: list):
+    """用一条多行INSERT写入一批日志"""
+    from app import app
+    from sqlalchemy import insert
+    from extensions import db
+    from models import AccessLog
+
+    try:
+        with app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(insert(AccessLog).values(batch))
+        _incr('written', len(batch))
+        _incr('flushes')
+    except Exception as e:
+        _incr('failed', len(batch))
+        print(f"[访问日志] 批量写入失败（{len(batch)}条）: {e}", file=sys.stderr)
+
+
+def _write_traffic(counts: dict):
+    """把按小时的访问量累加进 stats_hourly / stats_daily（多个worker各自累加，互不覆盖）"""
+    from app import app
+    from extensions import db
+    from models import StatsHourly, StatsDaily
+    from services.db_utils import upsert_add
+
+    hourly_rows = []
+    daily = {}
+    for hour in sorted(counts):
+        visits, server_errors = counts[hour]
+        # updated_at 留空：这一小时还没有被定时汇总算过其他列
+        hourly_rows.append({'bucket_start': hour, 'visits': visits, 'server_errors': server_errors,
+                            'updated_at': None})
+        day = daily.setdefault(hour.date(), [0, 0])
+        day[0] += visits
+        day[1] += server_errors
+    daily_rows = [{'day': day, 'visits': visits, 'server_errors': server_errors, 'updated_at': None}
+                  for day, (visits, server_errors) in sorted(daily.items())]
+
+    with app.app_context():
+        with db.engine.begin() as connection:
+            dialect = connection.dialect.name
+            connection.execute(
+                upsert_add(StatsHourly.__table__, dialect, ['bucket_start'], ['visits', 'server_errors']), hourly_rows
+            )
+            connection.execute(
+                upsert_add(StatsDaily.__table__, dialect, ['day'], ['visits', 'server_errors']), daily_rows
+            )
+
+
+def _flush_counters():
+    """写入流量计数，并按间隔保存访客草图"""
+    with _traffic_lock:
+        counts = dict(_traffic)
+        _traffic.clear()
+
+    if counts:
+        try:
+            _write_traffic(counts)
+        except Exception as e:
+            # 放回内存，下次再写
+            with _traffic_lock:
+                for hour, (visits, server_errors) in counts.items():
+                    current = _traffic.setdefault(hour, [0, 0])
+                    current[0] += visits
+                    current[1] += server_errors
+            print(f"[访问日志] 写入流量计数失败: {e}", file=sys.stderr)
+
+    try:
+        from services.visitor_sketch import maybe_persist
+        maybe_persist()
+    except Exception as e:
+        print(f"[访问日志] 保存访客草图失败: {e}", file=sys.stderr)
+
+
+def flush():
+    """立即写入队列中的全部日志（进程退出时调用）"""
+    while True:
+        batch = _drain(ACCESS_LOG_BATCH_SIZE, 0.01)
+        if not batch:
+            break
+        _write_batch(batch)
+    _flush_counters()
+
+    try:
+        from services.visitor_sketch import persist
+        persist()
+    except Exception as e:
+        print(f"[访问日志] 保存访客草图失败: {e}", file=sys.stderr)
+
+
+atexit.register(flush)
@@ -84,14 +84,15 @@ def create_adventure_async(
                 from models import AdventureSession, db
                 from routes.adventure import generate_ai_challenges
 
-                # 重新获取会话
-                session = AdventureSession.query.get(session_id)
-                if not session:
+                # 读状态后即归还连接，AI生成期间不占用连接池
+                status = db.session.query(AdventureSession.status).filter_by(id=session_id).scalar()
+                db.session.close()
+                if status is None:
                     print(f"[探险预生成] 会话 #{session_id} 不存在", file=sys.stderr)
                     return
 
-                if session.status != 'generating':
-                    print(f"[探险预生成] 会话 #{session_id} 状态已变更: {session.status}", file=sys.stderr)
+                if status != 'generating':
+                    print(f"[探险预生成] 会话 #{session_id} 状态已变更: {status}", file=sys.stderr)
                     return
 
                 print(f"[探险预生成] 开始为会话 #{session_id} 生成AI题目", file=sys.stderr)
@@ -104,11 +105,18 @@ def create_adventure_async(
                     trigger_event
                 )
 
-                # 更新会话
+                # 重新取连接，仍在生成中才写回
+                session = AdventureSession.query.filter_by(id=session_id, status='generating') \
+                    .with_for_update().first()
+                if not session:
+                    db.session.rollback()
+                    print(f"[探险预生成] 会话 #{session_id} 已不在生成中，放弃本次结果", file=sys.stderr)
+                    return
                 session.monsters = monsters
                 session.challenges = challenges
                 session.status = 'pending'  # 标记为可用
                 db.session.commit()
+                db.session.close()
 
                 print(f"[探险预生成] 会话 #{session_id} 生成完成，{len(challenges)} 道题目", file=sys.stderr)
 
@@ -119,6 +127,7 @@ def create_adventure_async(
 
                 # 生成失败，删除占位会话，让用户可以重新触发
                 try:
+                    db.session.rollback()
                     session = AdventureSession.query.get(session_id)
                     if session and session.status == 'generating':
                         db.session.delete(session)
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+进行中探险的状态存储（写回式）
+
+一次探险是 start → submit × N → complete。原来每次 submit 都要重新读出 AdventureSession、
+改完整个 challenges / monsters JSON 再整列写回并提交。这里把进行中的探险放在状态存储里：
+
+1. start（或 submit 时发现存储里没有）从 adventure_sessions 载入题目、怪物和当前进度；
+   存储里已有状态时保留（HSETNX），并发的载入不会清掉别的请求刚记录的答案
+2. 每次答题只原子地追加一条答案并把进度 +1（客户端带上题目序号，进度不匹配时拒绝，重复提交不会跳题），
+   不访问数据库；答案单独保存，不改写整份题目
+3. complete 时把答案合并进 AdventureSession 随结算一起提交，然后删除存储中的状态
+4. 有新答案的探险每隔 ADVENTURE_CHECKPOINT_INTERVAL 秒由后台线程写回数据库一次（检查点，
+   只更新答过的 adventure_challenges / adventure_monsters 行；每个进程一个定时线程，
+   Redis 上抢占后同一间隔只有一个worker写回），
+   也可以执行 flask checkpoint-adventures；状态丢失（Redis重启、进程崩溃）时从最近的检查点恢复
+
+存储后端（ADVENTURE_STATE_STORE）：
+- auto（默认）：配置了 REDIS_URL 且可连接时用 Redis（services/cache.py 的客户端，多个worker共用），否则关闭
+- redis：同上
+- memory：进程内存，只适用于单进程部署（python app.py），gunicorn 多worker时各worker状态不一致
+- off：关闭，每次答题直接写数据库（原来的方式）
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ADVENTURE_STATE_STORE = os.environ.get('ADVENTURE_STATE_STORE', 'auto').lower()
+# 有新答案的探险多久写回一次数据库（秒）
+ADVENTURE_CHECKPOINT_INTERVAL = int(os.environ.get('ADVENTURE_CHECKPOINT_INTERVAL', 30))
+# 状态在存储中的保留时间（秒），放弃的探险到期自动清除
+ADVENTURE_STATE_TTL = int(os.environ.get('ADVENTURE_STATE_TTL', 2 * 86400))
+
+# 原子追加答案：进度等于 index 时写入答案、进度 +1、续期并标记为待写回；否则返回 -1
+_RECORD_ANSWER_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'current')
+if not current or tonumber(current) ~= tonumber(ARGV[1]) then
+    return -1
+end
+redis.call('HSET', KEYS[1], 'a:' .. ARGV[1], ARGV[2], 'current', tonumber(ARGV[1]) + 1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('SADD', KEYS[2], ARGV[4])
+return tonumber(ARGV[1]) + 1
+"""
+
+_lock = threading.Lock()
+_memory = {}        # adventure_id -> {'user_id', 'challenges', 'monsters', 'current', 'answers', 'expires_at'}
+_dirty = set()
+_record_script = None
+
+_start_lock = threading.Lock()
+_checkpointer = None
+_checkpointer_pid = None
+
+
+class AdventureStateUnavailable(Exception):
+    """状态存储（Redis）读写失败"""
+
+
+def _redis():
+    from services.cache import get_redis
+    if ADVENTURE_STATE_STORE in ('auto', 'redis'):
+        return get_redis()
+    return None
+
+
+def enabled() -> bool:
+    """是否启用状态存储（关闭时答题直接写数据库）；启用时确保本进程的检查点线程在运行"""
+    if ADVENTURE_STATE_STORE == 'memory' or _redis() is not None:
+        _ensure_checkpointer()
+        return True
+    return False
+
+
+def _key(adventure_id: int) -> str:
+    from services.cache import CACHE_KEY_PREFIX
+    return f"{CACHE_KEY_PREFIX}adventure:{adventure_id}"
+
+
+def _dirty_key() -> str:
+    from services.cache import CACHE_KEY_PREFIX
+    return f"{CACHE_KEY_PREFIX}adventure:dirty"
+
+
+def merge_answers(challenges: list, monsters: list, answers: dict):
+    """
+    把答案合并进题目和怪物（与原来 submit_challenge 对JSON的修改一致），返回新的列表
+
+    Args:
+        answers: {题目序号: {'user_answers', 'is_correct'}}
+    """
+    challenges = [dict(challenge) for challenge in challenges or []]
+    monsters = [dict(monster) for monster in monsters or []]
+    for index, answer in answers.items():
+        if index < len(challenges):
+            challenges[index]['completed'] = True
+            challenges[index]['user_answers'] = answer['user_answers']
+            challenges[index]['is_correct'] = answer['is_correct']
+        if index < len(monsters):
+            monsters[index]['defeated'] = answer['is_correct']
+    return challenges, monsters
+
+
+def load(session) -> dict:
+    """
+    把进行中的探险载入状态存储，返回存储中的状态
+
+    存储里已有该探险时保留原状态（逐字段 HSETNX），不会用数据库里较旧的检查点
+    覆盖并发请求刚记录的答案和进度
+
+    Args:
+        session: AdventureSession（存储里没有状态时以数据库中的进度为准，即最近的检查点）
+    """
+    state = {
+        'id': session.id,
+        'user_id': session.user_id,
+        'challenges': session.challenges or [],
+        'monsters': session.monsters or [],
+        'current_challenge': session.current_challenge or 0,
+    }
+    client = _redis()
+    if client is not None:
+        try:
+            key = _key(session.id)
+            pipe = client.pipeline()
+            pipe.hsetnx(key, 'user_id', state['user_id'])
+            pipe.hsetnx(key, 'challenges', json.dumps(state['challenges'], ensure_ascii=False))
+            pipe.hsetnx(key, 'monsters', json.dumps(state['monsters'], ensure_ascii=False))
+            pipe.hsetnx(key, 'current', state['current_challenge'])
+            pipe.expire(key, ADVENTURE_STATE_TTL)
+            pipe.execute()
+        except Exception as e:
+            raise AdventureStateUnavailable(str(e))
+    else:
+        with _lock:
+            entry = _memory.get(session.id)
+            if entry is None or entry['expires_at'] < time.time():
+                _memory[session.id] = {
+                    'user_id': state['user_id'],
+                    'challenges': state['challenges'],
+                    'monsters': state['monsters'],
+                    'current': state['current_challenge'],
+                    'answers': {},
+                    'expires_at': time.time() + ADVENTURE_STATE_TTL,
+                }
+            else:
+                entry['expires_at'] = time.time() + ADVENTURE_STATE_TTL
+
+    _ensure_checkpointer()
+    # 读回存储中的实际状态（可能是其他请求已经推进过的进度）
+    return get_state(session.id) or dict(state, answers={})
+
+
+def get_state(adventure_id: int):
+    """
+    读取状态（答案已合并进 challenges / monsters），不在存储中时返回 None
+
+    Returns:
+        dict: {'id', 'user_id', 'challenges', 'monsters', 'current_challenge', 'answers'}
+    """
+    client = _redis()
+    if client is not None:
+        try:
+            raw = client.hgetall(_key(adventure_id))
+        except Exception as e:
+            raise AdventureStateUnavailable(str(e))
+        if not raw or 'current' not in raw:
+            return None
+        user_id = int(raw['user_id'])
+        challenges = json.loads(raw['challenges'])
+        monsters = json.loads(raw['monsters'])
+        current = int(raw['current'])
+        answers = {int(name[2:]): json.loads(value) for name, value in raw.items() if name.startswith('a:')}
+    else:
+        with _lock:
+            entry = _memory.get(adventure_id)
+            if entry is None or entry['expires_at'] < time.time():
+                _memory.pop(adventure_id, None)
+                return None
+            user_id, challenges, monsters = entry['user_id'], entry['challenges'], entry['monsters']
+            current, answers = entry['current'], dict(entry['answers'])
+
+    challenges, monsters = merge_answers(challenges, monsters, answers)
+    return {
+        'id': adventure_id,
+        'user_id': user_id,
+        'challenges': challenges,
+        'monsters': monsters,
+        'current_challenge': current,
+        'answers': answers,
+    }
+
+
+def record_answer(adventure_id: int, index: int, user_answers: list, is_correct: bool) -> bool:
+    """
+    原子地记录第 index 题的答案并把进度推进到 index + 1
+
+    Returns:
+        bool: 进度仍是 index（本次写入成功）；状态不存在或已被其他请求推进时返回 False
+    """
+    global _record_script
+
+    answer = {'user_answers': user_answers, 'is_correct': is_correct}
+    client = _redis()
+    if client is not None:
+        try:
+            if _record_script is None:
+                _record_script = client.register_script(_RECORD_ANSWER_SCRIPT)
+            result = _record_script(
+                keys=[_key(adventure_id), _dirty_key()],
+                args=[index, json.dumps(answer, ensure_ascii=False), ADVENTURE_STATE_TTL, adventure_id],
+                client=client
+            )
+        except Exception as e:
+            raise AdventureStateUnavailable(str(e))
+        applied = int(result) >= 0
+    else:
+        with _lock:
+            entry = _memory.get(adventure_id)
+            applied = entry is not None and entry['current'] == index
+            if applied:
+                entry['answers'][index] = answer
+                entry['current'] = index + 1
+                entry['expires_at'] = time.time() + ADVENTURE_STATE_TTL
+                _dirty.add(adventure_id)
+
+    if applied:
+        _ensure_checkpointer()
+    return applied
+
+
+def apply_to(session) -> bool:
+    """
+    把存储中的进度写进 AdventureSession 对象（complete 结算前调用，随结算一起提交）
+
+    Returns:
+        bool: 存储中有该探险的状态
+    """
+    state = get_state(session.id)
+    if state is None:
+        return False
+    session.challenges = state['challenges']
+    session.monsters = state['monsters']
+    session.current_challenge = state['current_challenge']
+    return True
+
+
+def write_answers(connection, adventure_id: int, answers: dict):
+    """把答案写进对应序号的挑战行和怪物行（每张表一条批量UPDATE）"""
+    from sqlalchemy import update, bindparam
+    from models import AdventureChallenge, AdventureMonster
+
+    if not answers:
+        return
+    challenges = AdventureChallenge.__table__
+    monsters = AdventureMonster.__table__
+    rows = [
+        {'sid': adventure_id, 'pos': index, 'answers': answer['user_answers'], 'correct': answer['is_correct']}
+        for index, answer in answers.items()
+    ]
+    connection.execute(
+        update(challenges)
+        .where(challenges.c.session_id == bindparam('sid'), challenges.c.position == bindparam('pos'))
+        .values(completed=True, user_answers=bindparam('answers', type_=challenges.c.user_answers.type),
+                is_correct=bindparam('correct')),
+        rows
+    )
+    connection.execute(
+        update(monsters)
+        .where(monsters.c.session_id == bindparam('sid'), monsters.c.position == bindparam('pos'))
+        .values(defeated=bindparam('correct')),
+        rows
+    )
+
+
+def discard(adventure_id: int):
+    """删除状态（探险已结算、跳过或删除后调用）"""
+    client = _redis()
+    if client is not None:
+        try:
+            pipe = client.pipeline()
+            pipe.delete(_key(adventure_id))
+            pipe.srem(_dirty_key(), adventure_id)
+            pipe.execute()
+        except Exception as e:
+            print(f"[探险状态] 删除 #{adventure_id} 失败: {e}", file=sys.stderr)
+        return
+    with _lock:
+        _memory.pop(adventure_id, None)
+        _dirty.discard(adventure_id)
+
+
+# ==================== 检查点 ====================
+
+def _take_dirty() -> list:
+    """取出待写回的探险ID（取出后再有新答案会重新标记）"""
+    client = _redis()
+    if client is not None:
+        try:
+            pipe = client.pipeline()
+            pipe.smembers(_dirty_key())
+            pipe.delete(_dirty_key())
+            members, _ = pipe.execute()
+        except Exception as e:
+            raise AdventureStateUnavailable(str(e))
+        return [int(member) for member in members]
+    with _lock:
+        ids = list(_dirty)
+        _dirty.clear()
+        return ids
+
+
+def checkpoint() -> int:
+    """
+    把有新答案的探险写回 adventure_sessions（需要在应用上下文中调用）
+
+    只更新仍是 in_progress 的行：已结算的探险由 complete 写入最终结果，这里不会覆盖；
+    行已不是进行中（被删除、跳过）时顺带清除存储中的状态。
+
+    Returns:
+        int: 写回的探险数
+    """
+    from sqlalchemy import update
+    from extensions import db
+    from models import AdventureSession
+
+    sessions = AdventureSession.__table__
+    written = 0
+    for adventure_id in _take_dirty():
+        state = get_state(adventure_id)
+        if state is None:
+            continue
+        try:
+            result = db.session.execute(
+                update(sessions)
+                .where(sessions.c.id == adventure_id, sessions.c.status == 'in_progress')
+                .values(current_challenge=state['current_challenge'])
+            )
+            if result.rowcount:
+                write_answers(db.session.connection(), adventure_id, state['answers'])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[探险状态] 写回 #{adventure_id} 失败: {e}", file=sys.stderr)
+            _mark_dirty(adventure_id)
+            continue
+        if result.rowcount:
+            written += 1
+        else:
+            discard(adventure_id)
+    if written:
+        print(f"[探险状态] 检查点写回 {written} 个探险", file=sys.stderr)
+    return written
+
+
+def _mark_dirty(adventure_id: int):
+    client = _redis()
+    if client is not None:
+        try:
+            client.sadd(_dirty_key(), adventure_id)
+        except Exception:
+            pass
+        return
+    with _lock:
+        _dirty.add(adventure_id)
+
+
+def _claim_checkpoint() -> bool:
+    """抢占本次检查点（多个worker同一间隔只有一个在写回；内存存储只有本进程的线程）"""
+    client = _redis()
+    if client is None:
+        return True
+    try:
+        return bool(client.set(_dirty_key() + ':checkpointing', os.getpid(), nx=True,
+                               ex=max(1, ADVENTURE_CHECKPOINT_INTERVAL)))
+    except Exception:
+        return False
+
+
+def _checkpoint_loop():
+    from app import app
+    from extensions import db
+
+    while True:
+        time.sleep(ADVENTURE_CHECKPOINT_INTERVAL)
+        if not _claim_checkpoint():
+            continue
+        with app.app_context():
+            try:
+                checkpoint()
+            except Exception as e:
+                db.session.rollback()
+                print(f"[探险状态] 检查点失败: {e}", file=sys.stderr)
+            finally:
+                db.session.remove()
+
+
+def _ensure_checkpointer():
+    """按进程启动定时检查点线程（没有新答案时也按间隔运行，不依赖后续答题触发）"""
+    global _checkpointer, _checkpointer_pid
+    pid = os.getpid()
+    if _checkpointer is not None and _checkpointer_pid == pid and _checkpointer.is_alive():
+        return
+    with _start_lock:
+        if _checkpointer is not None and _checkpointer_pid == pid and _checkpointer.is_alive():
+            return
+        _checkpointer = threading.Thread(target=_checkpoint_loop, name='adventure-checkpoint', daemon=True)
+        _checkpointer_pid = pid
+        _checkpointer.start()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+快照缓存
+
+把开销较大的统计结果（如管理后台概览）存成带生成时间的快照：
+1. 配置了 REDIS_URL 且 redis 可连接时存在 Redis 里，所有 gunicorn worker 共用一份
+2. 否则存在进程内存中（每个worker各自一份）
+3. 快照超过 ttl 秒后仍先返回旧快照，同时在后台线程重新生成（同一时间只有一个worker在生成）
+4. 超过 max_age 秒或还没有快照时当场生成
+
+读取方拿到 (数据, 快照年龄秒数)，可以在响应里告诉前端数据是多久之前的。
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 留空则只用进程内存缓存
+REDIS_URL = os.environ.get('REDIS_URL', '')
+# Redis 键前缀（多个应用共用一个Redis时区分）
+CACHE_KEY_PREFIX = os.environ.get('CACHE_KEY_PREFIX', 'cbt:')
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+_redis_lock = threading.Lock()
+_redis_client = None
+_redis_checked = False
+
+_memory_lock = threading.Lock()
+_memory = {}            # name -> 快照
+_memory_refreshing = set()
+
+
+def get_redis():
+    """
+    共享的 Redis 客户端，未配置或连接失败时返回 None（只在第一次调用时检查）
+    """
+    global _redis_client, _redis_checked
+    if _redis_checked:
+        return _redis_client
+    with _redis_lock:
+        if _redis_checked:
+            return _redis_client
+        _redis_checked = True
+        if not REDIS_URL or redis is None:
+            return None
+        try:
+            client = redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=1, socket_connect_timeout=1)
+            client.ping()
+            _redis_client = client
+            print("[缓存] 使用Redis共享缓存", file=sys.stderr)
+        except Exception as e:
+            print(f"[缓存] Redis不可用，改用进程内缓存: {e}", file=sys.stderr)
+        return _redis_client
+
+
+def _key(name: str) -> str:
+    return f"{CACHE_KEY_PREFIX}snapshot:{name}"
+
+
+def _load(name: str):
+    client = get_redis()
+    if client is not None:
+        try:
+            raw = client.get(_key(name))
+            return json.loads(raw) if raw else None
+        except Exception as e:
+            print(f"[缓存] 读取快照 {name} 失败: {e}", file=sys.stderr)
+    with _memory_lock:
+        return _memory.get(name)
+
+
+def _save(name: str, snapshot: dict, keep_seconds: int):
+    client = get_redis()
+    if client is not None:
+        try:
+            client.set(_key(name), json.dumps(snapshot, ensure_ascii=False), ex=max(1, int(keep_seconds)))
+            return
+        except Exception as e:
+            print(f"[缓存] 写入快照 {name} 失败: {e}", file=sys.stderr)
+    with _memory_lock:
+        _memory[name] = snapshot
+
+
+def _claim_refresh(name: str, seconds: int) -> bool:
+    """抢占刷新权，避免多个worker/线程同时重新生成同一个快照"""
+    client = get_redis()
+    if client is not None:
+        try:
+            return bool(client.set(_key(name) + ':refreshing', os.getpid(), nx=True, ex=max(1, int(seconds))))
+        except Exception as e:
+            print(f"[缓存] 抢占刷新 {name} 失败: {e}", file=sys.stderr)
+    with _memory_lock:
+        if name in _memory_refreshing:
+            return False
+        _memory_refreshing.add(name)
+        return True
+
+
+def _release_refresh(name: str):
+    client = get_redis()
+    if client is not None:
+        try:
+            client.delete(_key(name) + ':refreshing')
+        except Exception:
+            pass
+    with _memory_lock:
+        _memory_refreshing.discard(name)
+
+
+def _build(name: str, builder, max_age: int) -> dict:
+    snapshot = {'generated_at': time.time(), 'data': builder()}
+    _save(name, snapshot, max_age)
+    return snapshot
+
+
+def _refresh_in_background(name: str, builder, max_age: int):
+    def run():
+        from app import app
+        try:
+            with app.app_context():
+                _build(name, builder, max_age)
+        except Exception as e:
+            print(f"[缓存] 后台刷新快照 {name} 失败: {e}", file=sys.stderr)
+        finally:
+            _release_refresh(name)
+
+    threading.Thread(target=run, name=f'snapshot-{name}', daemon=True).start()
+
+
+def get_snapshot(name: str, builder, ttl: int, max_age: int, force: bool = False):
+    """
+    读取快照，过期时刷新
+
+    Args:
+        name: 快照名
+        builder: 生成数据的函数（无参数，返回可JSON序列化的对象，在应用上下文中调用）
+        ttl: 超过该秒数后在后台刷新
+        max_age: 超过该秒数后不再返回旧快照，当场生成
+        force: 忽略缓存当场生成
+
+    Returns:
+        (data, age_seconds)
+    """
+    snapshot = None if force else _load(name)
+    age = time.time() - snapshot['generated_at'] if snapshot else None
+
+    if snapshot is None or age >= max_age:
+        snapshot = _build(name, builder, max_age)
+        return snapshot['data'], 0.0
+
+    if age >= ttl and _claim_refresh(name, max_age):
+        _refresh_in_background(name, builder, max_age)
+    return snapshot['data'], age
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+数据库连接池监控
+
+app.py 用 InstrumentedQueuePool 作为连接池类，记录本进程（每个gunicorn worker各自一份）：
+- 取连接的等待时间：连接全被占用时请求要排队，等待时间直接加在接口耗时上
+- 连接被占用的时长：超过 DB_POOL_LONG_HOLD_MS 的记为长占用（例如在调AI期间没有归还连接）
+- 取连接超时次数
+
+管理后台 GET /api/admin/stats/db-pool 查看，?reset=1 清零（便于对比改动前后）。
+"""
+
+import os
+import sys
+import time
+import threading
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+load_dotenv()
+
+# 取连接等待超过该毫秒数时打印日志
+DB_POOL_SLOW_WAIT_MS = int(os.environ.get('DB_POOL_SLOW_WAIT_MS', 100))
+# 连接占用超过该毫秒数记为长占用
+DB_POOL_LONG_HOLD_MS = int(os.environ.get('DB_POOL_LONG_HOLD_MS', 5000))
+
+_lock = threading.Lock()
+_metrics = {}
+
+
+def _empty_metrics() -> dict:
+    return {
+        'since': time.time(),
+        'checkouts': 0,
+        'waited': 0,            # 等待超过 DB_POOL_SLOW_WAIT_MS 的次数
+        'timeouts': 0,
+        'wait_ms_total': 0.0,
+        'wait_ms_max': 0.0,
+        'long_holds': 0,
+        'hold_ms_max': 0.0,
+    }
+
+
+_metrics.update(_empty_metrics())
+
+
+class InstrumentedQueuePool(QueuePool):
+    """记录取连接等待时间的 QueuePool（参数与 QueuePool 相同）"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with _lock:
+                _metrics['timeouts'] += 1
+            print(f"[连接池] 取连接超时（{self.status()}）", file=sys.stderr)
+            raise
+        finally:
+            wait_ms = (time.perf_counter() - started) * 1000
+            with _lock:
+                _metrics['checkouts'] += 1
+                _metrics['wait_ms_total'] += wait_ms
+                _metrics['wait_ms_max'] = max(_metrics['wait_ms_max'], wait_ms)
+                if wait_ms >= DB_POOL_SLOW_WAIT_MS:
+                    _metrics['waited'] += 1
+            if wait_ms >= DB_POOL_SLOW_WAIT_MS:
+                print(f"[连接池] 取连接等待 {wait_ms:.0f}ms（{self.status()}）", file=sys.stderr)
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info['checked_out_at'] = time.perf_counter()
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    started = connection_record.info.pop('checked_out_at', None)
+    if started is None:
+        return
+    hold_ms = (time.perf_counter() - started) * 1000
+    with _lock:
+        _metrics['hold_ms_max'] = max(_metrics['hold_ms_max'], hold_ms)
+        if hold_ms >= DB_POOL_LONG_HOLD_MS:
+            _metrics['long_holds'] += 1
+    if hold_ms >= DB_POOL_LONG_HOLD_MS:
+        print(f"[连接池] 连接被占用 {hold_ms / 1000:.1f}s", file=sys.stderr)
+
+
+def register_pool_events(engine):
+    """给引擎的连接池注册占用时长统计（重复调用不会重复注册）"""
+    for name, listener in (('checkout', _on_checkout), ('checkin', _on_checkin)):
+        if not event.contains(engine.pool, name, listener):
+            event.listen(engine.pool, name, listener)
+
+
+def pool_metrics(engine, reset: bool = False) -> dict:
+    """本进程的连接池统计"""
+    with _lock:
+        metrics = dict(_metrics)
+        if reset:
+            _metrics.update(_empty_metrics())
+
+    pool = engine.pool
+    checkouts = metrics['checkouts']
+    result = {
+        'pid': os.getpid(),
+        'seconds': round(time.time() - metrics['since'], 1),
+        'checkouts': checkouts,
+        'waited': metrics['waited'],
+        'timeouts': metrics['timeouts'],
+        'wait_ms_avg': round(metrics['wait_ms_total'] / checkouts, 2) if checkouts else 0,
+        'wait_ms_max': round(metrics['wait_ms_max'], 2),
+        'long_holds': metrics['long_holds'],
+        'hold_ms_max': round(metrics['hold_ms_max'], 2),
+        'slow_wait_ms': DB_POOL_SLOW_WAIT_MS,
+        'long_hold_ms': DB_POOL_LONG_HOLD_MS,
+    }
+    if isinstance(pool, QueuePool):
+        result.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    return result
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+跨数据库的写入辅助
+
+生产用 MySQL、开发用 SQLite，两者"唯一键冲突时跳过/累加"的语法不同，这里按方言生成语句。
+"""
+
+
+def insert_ignore(table, dialect: str):
+    """
+    唯一键冲突时跳过的 INSERT 语句
+
+    Args:
+        table: Table 对象（如 Model.__table__）
+        dialect: 数据库方言名（connection.dialect.name）
+
+    用法：connection.execute(insert_ignore(table, dialect), rows)
+    """
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing()
+
+    from sqlalchemy import insert
+    if dialect == 'mysql':
+        return insert(table).prefix_with('IGNORE')
+    if dialect == 'sqlite':
+        return insert(table).prefix_with('OR IGNORE')
+    return insert(table)
+
+
+def upsert_add(table, dialect: str, key_columns: list, delta_columns: list):
+    """
+    按主键累加计数的 INSERT：行不存在时插入，存在时 `列 = 列 + 新值`
+
+    Args:
+        table: Table 对象
+        dialect: 数据库方言名
+        key_columns: 主键/唯一键列名
+        delta_columns: 需要累加的列名
+
+    用法：connection.execute(upsert_add(table, dialect, ['user_id', 'day'], ['diary_count']), rows)
+    """
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table)
+        return statement.on_duplicate_key_update({
+            name: table.c[name] + statement.inserted[name] for name in delta_columns
+        })
+
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"upsert_add 不支持数据库 {dialect}")
+    statement = insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={name: table.c[name] + statement.excluded[name] for name in delta_columns}
+    )
+
+
+def upsert(table, dialect: str, key_columns: list, update_columns: list):
+    """
+    按主键覆盖写入的 INSERT：行不存在时插入，存在时 `列 = 新值`（只改 update_columns，其余列保持不变）
+
+    用法：connection.execute(upsert(table, dialect, ['day'], ['diaries', 'postcards']), rows)
+    """
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table)
+        return statement.on_duplicate_key_update({name: statement.inserted[name] for name in update_columns})
+
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"upsert 不支持数据库 {dialect}")
+    statement = insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={name: statement.excluded[name] for name in update_columns}
+    )
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+日记上传图片索引
+
+EmotionDiary.images 是 JSON 数组（图片URL），要知道某个上传文件被哪篇日记引用只能把日记全读出来。
+这里把其中 uploads 区域的图片同步到 diary_images: (diary_id, image_key, user_id)，索引 image_key，
+文件垃圾回收（services/storage_gc.py）每批文件只按key查这一批的引用。
+
+同步方式：日记插入、修改 images、删除时的 mapper 事件，与日记写入在同一事务内。
+已有日记用 flask backfill-diary-images 回填（迁移 4e6a2c8f1d37 也会回填一次）。
+"""
+
+import sys
+
+from sqlalchemy import event, select, delete, inspect as sa_inspect
+
+
+def upload_keys(images) -> list:
+    """images 中 uploads 区域图片的存储key（去重，保持顺序）"""
+    from services.storage import resolve_url
+
+    keys = []
+    for url in images or []:
+        if not isinstance(url, str):
+            continue
+        area, key = resolve_url(url)
+        if area == 'uploads' and key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def _replace_images(connection, diaries: list):
+    """
+    重写一批日记的上传图片关联
+
+    Args:
+        diaries: [(diary_id, user_id, images), ...]
+    """
+    from models import DiaryImage
+
+    links = DiaryImage.__table__
+    connection.execute(delete(links).where(links.c.diary_id.in_([item[0] for item in diaries])))
+    rows = [
+        {'diary_id': diary_id, 'image_key': key, 'user_id': user_id}
+        for diary_id, user_id, images in diaries
+        for key in upload_keys(images)
+    ]
+    if rows:
+        connection.execute(links.insert(), rows)
+
+
+# ==================== 同步事件 ====================
+
+def _diary_inserted(mapper, connection, target):
+    if target.images:
+        _replace_images(connection, [(target.id, target.user_id, target.images)])
+
+
+def _diary_updated(mapper, connection, target):
+    if sa_inspect(target).attrs.images.history.has_changes():
+        _replace_images(connection, [(target.id, target.user_id, target.images)])
+
+
+def _diary_deleting(mapper, connection, target):
+    # 在删除日记之前删除关联，避免外键约束报错
+    from models import DiaryImage
+
+    links = DiaryImage.__table__
+    connection.execute(delete(links).where(links.c.diary_id == target.id))
+
+
+def register_image_events():
+    """注册上传图片同步事件（重复调用不会重复注册）"""
+    from models import EmotionDiary
+
+    for name, listener in (
+        ('after_insert', _diary_inserted),
+        ('after_update', _diary_updated),
+        ('before_delete', _diary_deleting),
+    ):
+        if not event.contains(EmotionDiary, name, listener):
+            event.listen(EmotionDiary, name, listener)
+
+
+# ==================== 回填 ====================
+
+def backfill_diary_images(connection, batch_size: int = 500) -> int:
+    """
+    按 emotion_diaries 重建全部上传图片关联（可重复执行）
+
+    Returns:
+        int: 处理的日记数
+    """
+    from models import EmotionDiary
+
+    diaries = EmotionDiary.__table__
+    count = 0
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(diaries.c.id, diaries.c.user_id, diaries.c.images)
+            .where(diaries.c.id > last_id).order_by(diaries.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        _replace_images(connection, [tuple(row) for row in rows])
+        count += len(rows)
+        last_id = rows[-1][0]
+    print(f"[日记图片] 已回填 {count} 篇日记", file=sys.stderr)
+    return count
+
+
+# ==================== 查询 ====================
+
+def find_upload_owners(keys: list) -> dict:
+    """被日记引用的上传图片 {key: user_id}（需要在应用上下文中调用）"""
+    from extensions import db
+    from models import DiaryImage
+
+    if not keys:
+        return {}
+    return dict(db.session.query(DiaryImage.image_key, DiaryImage.user_id).filter(DiaryImage.image_key.in_(keys)))
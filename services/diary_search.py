@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+日记全文检索（支持中文）
+
+原来用 content LIKE '%关键词%' 扫全表，现在按数据库走全文索引：
+
+- MySQL（生产）：emotion_diaries.content 上的 FULLTEXT 索引，WITH PARSER ngram（默认2字切分），
+  由数据库自动维护。模型里声明了该索引，按模型建新库时建出，已有库由迁移 8d2b6f0c4e19 补建。
+- SQLite（开发）：FTS5 虚拟表 emotion_diaries_fts，rowid = 日记id。
+  中文没有空格分词，写入前自己切词：连续汉字切成相邻二字组（bigrams 列，保持顺序，
+  多字关键词用短语查询即相当于子串匹配）和单字（unigrams 列，用于单字关键词），
+  英文数字按单词小写。由本模块的 mapper 事件在日记增删改的同一事务内同步。
+- 其他数据库或 SQLite 没有编译 FTS5：退回 LIKE。
+
+多个关键词用空格分隔，需同时命中。结果按相关度排序（MySQL 匹配分、FTS5 bm25）。
+"""
+
+import re
+import sys
+import html
+
+from sqlalchemy import event, func, text, table, column, literal_column, inspect as sa_inspect
+
+FTS_TABLE = 'emotion_diaries_fts'
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_TOKEN_RE = re.compile(f'[{_CJK}]+|[0-9A-Za-z]+')
+_CJK_RE = re.compile(f'[{_CJK}]')
+
+# 每个进程只检查一次 SQLite 是否支持 FTS5
+_fts5_available = None
+
+
+def tokenize(content: str):
+    """
+    切词
+
+    Returns:
+        (bigrams, unigrams) 两个以空格分隔的字符串
+    """
+    bigrams = []
+    unigrams = []
+    for match in _TOKEN_RE.finditer(content or ''):
+        run = match.group()
+        if _CJK_RE.match(run):
+            unigrams.extend(run)
+            if len(run) == 1:
+                bigrams.append(run)
+            else:
+                bigrams.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            bigrams.append(run.lower())
+    return ' '.join(bigrams), ' '.join(unigrams)
+
+
+def split_keywords(keyword: str) -> list:
+    return [word for word in (keyword or '').split() if word]
+
+
+def _fts5_query(keywords: list) -> str:
+    """把关键词转成 FTS5 查询：每个关键词一个短语，全部 AND"""
+    clauses = []
+    for word in keywords:
+        for match in _TOKEN_RE.finditer(word):
+            run = match.group()
+            if _CJK_RE.match(run) and len(run) == 1:
+                clauses.append(f'unigrams:"{run}"')
+            else:
+                bigrams, _ = tokenize(run)
+                clauses.append(f'bigrams:"{bigrams}"')
+    return ' AND '.join(clauses)
+
+
+def _mysql_query(keywords: list) -> str:
+    """MySQL 布尔模式查询：每个关键词一个必须命中的短语"""
+    return ' '.join('+"{}"'.format(word.replace('"', ' ')) for word in keywords)
+
+
+def _sqlite_fts5_available(connection) -> bool:
+    global _fts5_available
+    if _fts5_available is None:
+        try:
+            _fts5_available = bool(connection.execute(
+                text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            ).scalar())
+        except Exception:
+            _fts5_available = False
+        if not _fts5_available:
+            print("[日记搜索] SQLite 不支持 FTS5，搜索退回 LIKE", file=sys.stderr)
+    return _fts5_available
+
+
+def ensure_sqlite_index(connection) -> bool:
+    """
+    确保 SQLite 的 FTS5 表存在，新建时从日记表回填
+
+    Returns:
+        bool: 是否可以使用全文索引
+    """
+    if connection.dialect.name != 'sqlite' or not _sqlite_fts5_available(connection):
+        return False
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}
+    ).scalar()
+    if not exists:
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(bigrams, unigrams, tokenize = 'unicode61')"
+        ))
+        rebuild_sqlite_index(connection)
+    return True
+
+
+def rebuild_sqlite_index(connection) -> int:
+    """清空并按日记表重建 FTS5 表，返回索引的日记数"""
+    connection.execute(text(f'DELETE FROM {FTS_TABLE}'))
+    count = 0
+    last_id = 0
+    while True:
+        rows = connection.execute(text(
+            'SELECT id, content FROM emotion_diaries WHERE id > :last_id ORDER BY id LIMIT 1000'
+        ), {'last_id': last_id}).fetchall()
+        if not rows:
+            break
+        connection.execute(
+            text(f'INSERT INTO {FTS_TABLE} (rowid, bigrams, unigrams) VALUES (:id, :bigrams, :unigrams)'),
+            [dict(zip(('bigrams', 'unigrams'), tokenize(content)), id=diary_id) for diary_id, content in rows]
+        )
+        count += len(rows)
+        last_id = rows[-1][0]
+    return count
+
+
+# ==================== 同步（仅 SQLite，MySQL 的 FULLTEXT 由数据库维护） ====================
+
+def _write_index(connection, diary_id: int, content: str):
+    bigrams, unigrams = tokenize(content)
+    connection.execute(text(f'DELETE FROM {FTS_TABLE} WHERE rowid = :id'), {'id': diary_id})
+    connection.execute(
+        text(f'INSERT INTO {FTS_TABLE} (rowid, bigrams, unigrams) VALUES (:id, :bigrams, :unigrams)'),
+        {'id': diary_id, 'bigrams': bigrams, 'unigrams': unigrams}
+    )
+
+
+def _diary_inserted(mapper, connection, target):
+    if ensure_sqlite_index(connection):
+        _write_index(connection, target.id, target.content)
+
+
+def _diary_updated(mapper, connection, target):
+    if sa_inspect(target).attrs.content.history.has_changes() and ensure_sqlite_index(connection):
+        _write_index(connection, target.id, target.content)
+
+
+def _diary_deleted(mapper, connection, target):
+    if ensure_sqlite_index(connection):
+        connection.execute(text(f'DELETE FROM {FTS_TABLE} WHERE rowid = :id'), {'id': target.id})
+
+
+def register_search_events():
+    """注册全文索引同步事件（重复调用不会重复注册）"""
+    from models import EmotionDiary
+
+    for name, listener in (
+        ('after_insert', _diary_inserted),
+        ('after_update', _diary_updated),
+        ('after_delete', _diary_deleted),
+    ):
+        if not event.contains(EmotionDiary, name, listener):
+            event.listen(EmotionDiary, name, listener)
+
+
+# ==================== 查询 ====================
+
+def apply_search(query, keyword: str, ranked: bool = False):
+    """
+    给 EmotionDiary 查询加上关键词条件
+
+    Args:
+        query: EmotionDiary 的查询（可以带其他过滤条件）
+        keyword: 搜索词，空格分隔多个关键词
+        ranked: 是否按相关度排序
+
+    Returns:
+        新的查询
+    """
+    from extensions import db
+    from models import EmotionDiary
+
+    keywords = split_keywords(keyword)
+    if not keywords:
+        return query
+
+    dialect = db.engine.dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import match
+
+        # ngram 默认按2字切分，单字关键词在索引里查不到，改用LIKE
+        long_words = [word for word in keywords if len(word) >= 2]
+        for word in keywords:
+            if len(word) < 2:
+                query = query.filter(EmotionDiary.content.contains(word))
+        if long_words:
+            score = match(EmotionDiary.content, against=_mysql_query(long_words)).in_boolean_mode()
+            query = query.filter(score)
+            if ranked:
+                query = query.order_by(score.desc())
+        return query
+
+    fts_query = _fts5_query(keywords) if dialect == 'sqlite' else ''
+    fts_ready = False
+    if fts_query:
+        # 单独的连接建表并提交，不受只读请求结束时回滚的影响
+        with db.engine.begin() as connection:
+            fts_ready = ensure_sqlite_index(connection)
+    if fts_ready:
+        fts = literal_column(FTS_TABLE)
+        fts_table = table(FTS_TABLE, column('rowid'))
+        query = query.join(fts_table, fts_table.c.rowid == EmotionDiary.id).filter(fts.op('MATCH')(fts_query))
+        if ranked:
+            query = query.order_by(func.bm25(fts))
+        return query
+
+    for word in keywords:
+        query = query.filter(EmotionDiary.content.contains(word))
+    return query
+
+
+def make_snippet(content: str, keyword: str, width: int = 40) -> str:
+    """
+    截取第一个命中关键词附近的文字，关键词用 <mark> 高亮（其余内容已做HTML转义）
+    """
+    content = content or ''
+    keywords = split_keywords(keyword)
+    lowered = content.lower()
+    positions = [lowered.find(word.lower()) for word in keywords]
+    positions = [position for position in positions if position >= 0]
+    start = max(min(positions) - width // 2, 0) if positions else 0
+    end = min(start + width * 2, len(content))
+    fragment = content[start:end]
+
+    escaped = html.escape(fragment)
+    if keywords:
+        pattern = re.compile('|'.join(re.escape(html.escape(word)) for word in keywords), re.IGNORECASE)
+        escaped = pattern.sub(lambda m: f'<mark>{m.group()}</mark>', escaped)
+    return ('…' if start > 0 else '') + escaped + ('…' if end < len(content) else '')
+
+
+# ==================== 基准测试 ====================
+
+_BENCHMARK_PHRASES = (
+    '今天工作压力很大', '和朋友一起吃了晚饭', '心情慢慢好起来了', '担心明天的考试', '下雨天有点低落',
+    '散步的时候看到晚霞', '和家人吵了一架', '完成了一个重要项目', '晚上失眠想了很多', '被同事夸奖很开心',
+    '觉得自己什么都做不好', '读完了一本喜欢的书', '周末去公园跑步', '对未来有些迷茫', '收到了老朋友的消息',
+    '练习了深呼吸放松', '写下三件感恩的小事', '地铁上人太多很烦躁', '做了一顿好吃的午饭', 'CBT练习记录自动思维',
+)
+
+
+def benchmark_search(rows: int = 1000000, keywords: list = None, repeat: int = 5) -> dict:
+    """
+    在临时 SQLite 库里生成 rows 篇合成日记，比较 LIKE 扫描与 FTS5 检索（取前20条）的耗时
+
+    不连接应用数据库；MySQL ngram 索引请在预发环境用真实数据对比 EXPLAIN 与耗时。
+
+    Returns:
+        dict: {'rows', 'build_seconds', 'queries': [{'keyword', 'matches', 'fts_matches', 'like_ms', 'fts_ms'}, ...]}
+    """
+    import os
+    import time
+    import random
+    import sqlite3
+    import tempfile
+
+    rng = random.Random(42)
+    # 常见短语（每个关键词命中约三成日记）之外，每篇再带一个低频地名（每个约命中 rows/5000 篇）
+    pool = '山水风云花草树林湖海星月光影春夏秋冬晨夕雾雪雷虹江河溪泉石竹松柏'
+    places = [''.join(rng.choice(pool) for _ in range(3)) for _ in range(5000)]
+    keywords = keywords or ['开心', '深呼吸放松', '压力 失眠', places[0], places[1] + ' 晚霞']
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        connection = sqlite3.connect(os.path.join(tmpdir, 'benchmark.db'))
+        connection.execute('CREATE TABLE emotion_diaries (id INTEGER PRIMARY KEY, content TEXT)')
+        connection.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(bigrams, unigrams, tokenize = 'unicode61')")
+
+        started = time.perf_counter()
+        batch = []
+        for diary_id in range(1, rows + 1):
+            content = '，'.join(rng.choice(_BENCHMARK_PHRASES) for _ in range(rng.randint(3, 12)))
+            content += f'。去了{rng.choice(places)}。'
+            batch.append((diary_id, content) + tokenize(content))
+            if len(batch) >= 10000 or diary_id == rows:
+                connection.executemany('INSERT INTO emotion_diaries (id, content) VALUES (?, ?)',
+                                       [item[:2] for item in batch])
+                connection.executemany(f'INSERT INTO {FTS_TABLE} (rowid, bigrams, unigrams) VALUES (?, ?, ?)',
+                                       [(item[0], item[2], item[3]) for item in batch])
+                batch = []
+        connection.commit()
+        build_seconds = time.perf_counter() - started
+
+        def timed(sql, params):
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                result = connection.execute(sql, params).fetchall()
+                elapsed = (time.perf_counter() - started) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            return result, round(best, 2)
+
+        # 与搜索接口一致：COUNT(*) 求总数 + 取第一页
+        queries = []
+        for keyword in keywords:
+            words = split_keywords(keyword)
+            like_where = ' AND '.join(['content LIKE ?'] * len(words))
+            like_params = [f'%{word}%' for word in words]
+            count_rows, like_count_ms = timed(f'SELECT count(*) FROM emotion_diaries WHERE {like_where}', like_params)
+            _, like_page_ms = timed(f'SELECT id FROM emotion_diaries WHERE {like_where} ORDER BY id DESC LIMIT 20',
+                                    like_params)
+
+            fts_params = [_fts5_query(words)]
+            fts_count_rows, fts_count_ms = timed(f'SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?',
+                                                 fts_params)
+            _, fts_page_ms = timed(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? '
+                                   f'ORDER BY bm25({FTS_TABLE}) LIMIT 20', fts_params)
+            queries.append({
+                'keyword': keyword,
+                'matches': count_rows[0][0],
+                'fts_matches': fts_count_rows[0][0],
+                'like_ms': round(like_count_ms + like_page_ms, 2),
+                'fts_ms': round(fts_count_ms + fts_page_ms, 2)
+            })
+        connection.close()
+
+    return {'rows': rows, 'build_seconds': round(build_seconds, 1), 'queries': queries}
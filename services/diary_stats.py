@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+用户日记统计汇总
+
+/api/diary/stats 原来每次都读出用户全部日记再统计，这里维护两张按用户汇总的表：
+- user_diary_daily: (user_id, day) -> 当天日记数，"最近7天"对7行求和
+- user_tag_counts:  (user_id, tag_id) -> 带该标签的日记数
+
+日记总数沿用 users.diary_count（services/user_counters.py）。
+维护方式：日记插入/删除（及创建时间变化）时的 mapper 事件累加每日计数；
+标签计数由 services/emotion_tags.py 在重写标签关联时把变化量交给 adjust_tag_counts()。
+都是 `列 = 列 + 变化量` 的 upsert，与日记写入在同一事务中提交或回滚。
+绕过ORM改动日记或回填标签后执行 flask rebuild-diary-stats 重算。
+"""
+
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, select, delete, insert, func, inspect as sa_inspect
+
+from services.db_utils import upsert_add
+
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _adjust_daily(connection, changes: dict):
+    """changes: {(user_id, day): 变化量}"""
+    from models import UserDiaryDaily
+
+    rows = [
+        {'user_id': user_id, 'day': day, 'diary_count': delta}
+        for (user_id, day), delta in changes.items() if user_id and day and delta
+    ]
+    if rows:
+        table = UserDiaryDaily.__table__
+        connection.execute(upsert_add(table, connection.dialect.name, ['user_id', 'day'], ['diary_count']), rows)
+
+
+def adjust_tag_counts(connection, changes: dict):
+    """changes: {(user_id, tag_id): 变化量}，在当前flush的连接上累加"""
+    from models import UserTagCount
+
+    rows = [
+        {'user_id': user_id, 'tag_id': tag_id, 'diary_count': delta}
+        for (user_id, tag_id), delta in changes.items() if user_id and delta
+    ]
+    if rows:
+        table = UserTagCount.__table__
+        connection.execute(upsert_add(table, connection.dialect.name, ['user_id', 'tag_id'], ['diary_count']), rows)
+
+
+# ==================== 同步事件 ====================
+
+def _diary_inserted(mapper, connection, target):
+    _adjust_daily(connection, {(target.user_id, _day(target.created_at)): 1})
+
+
+def _diary_deleted(mapper, connection, target):
+    _adjust_daily(connection, {(target.user_id, _day(target.created_at)): -1})
+
+
+def _diary_updated(mapper, connection, target):
+    history = sa_inspect(target).attrs.created_at.history
+    if not history.has_changes() or not history.deleted:
+        return
+    old_day, new_day = _day(history.deleted[0]), _day(target.created_at)
+    if old_day != new_day:
+        _adjust_daily(connection, {(target.user_id, old_day): -1, (target.user_id, new_day): 1})
+
+
+def register_stats_events():
+    """注册日记统计维护事件（重复调用不会重复注册）"""
+    from models import EmotionDiary
+
+    for name, listener in (
+        ('after_insert', _diary_inserted),
+        ('after_delete', _diary_deleted),
+        ('after_update', _diary_updated),
+    ):
+        if not event.contains(EmotionDiary, name, listener):
+            event.listen(EmotionDiary, name, listener)
+
+
+# ==================== 重算 ====================
+
+def rebuild_diary_stats(connection, user_ids: list = None) -> dict:
+    """
+    按 emotion_diaries / diary_emotion_tags 重算汇总表（可重复执行）
+
+    Args:
+        user_ids: 只重算这些用户，默认全部
+
+    Returns:
+        dict: 重算后两张表的行数
+    """
+    from models import EmotionDiary, DiaryEmotionTag, UserDiaryDaily, UserTagCount
+
+    diaries = EmotionDiary.__table__
+    links = DiaryEmotionTag.__table__
+    daily = UserDiaryDaily.__table__
+    tag_counts = UserTagCount.__table__
+
+    def scoped(statement, column):
+        return statement.where(column.in_(user_ids)) if user_ids else statement
+
+    connection.execute(scoped(delete(daily), daily.c.user_id))
+    connection.execute(scoped(delete(tag_counts), tag_counts.c.user_id))
+
+    day = func.date(diaries.c.created_at)
+    connection.execute(insert(daily).from_select(
+        ['user_id', 'day', 'diary_count'],
+        scoped(select(diaries.c.user_id, day, func.count()), diaries.c.user_id)
+        .where(diaries.c.created_at.isnot(None))
+        .group_by(diaries.c.user_id, day)
+    ))
+    connection.execute(insert(tag_counts).from_select(
+        ['user_id', 'tag_id', 'diary_count'],
+        scoped(select(links.c.user_id, links.c.tag_id, func.count()), links.c.user_id)
+        .group_by(links.c.user_id, links.c.tag_id)
+    ))
+
+    result = {
+        'daily_rows': connection.execute(scoped(select(func.count()).select_from(daily), daily.c.user_id)).scalar(),
+        'tag_rows': connection.execute(scoped(select(func.count()).select_from(tag_counts), tag_counts.c.user_id)).scalar(),
+    }
+    print(f"[日记统计] 已重算 {result}", file=sys.stderr)
+    return result
+
+
+# ==================== 查询 ====================
+
+def recent_diary_count(user_id: int, days: int = 7) -> int:
+    """最近 days 天（含今天，按UTC日期）的日记数"""
+    from extensions import db
+    from models import UserDiaryDaily
+
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    total = db.session.query(func.sum(UserDiaryDaily.diary_count)).filter(
+        UserDiaryDaily.user_id == user_id,
+        UserDiaryDaily.day >= since
+    ).scalar()
+    return max(0, int(total or 0))
+
+
+def tag_histogram(user_id: int) -> dict:
+    """用户各情绪标签出现的日记数"""
+    from extensions import db
+    from models import EmotionTag, UserTagCount
+
+    rows = db.session.query(EmotionTag.name, UserTagCount.diary_count).join(
+        UserTagCount, UserTagCount.tag_id == EmotionTag.id
+    ).filter(UserTagCount.user_id == user_id, UserTagCount.diary_count > 0).all()
+    return {name: count for name, count in rows}
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+情绪标签规范化
+
+EmotionDiary.emotion_tags 是 JSON 数组，按标签筛选只能 LIKE '%"标签"%'，统计要把日记全读出来。
+这里把标签同步到两张表：
+- emotion_tags: 标签字典 (id, name)
+- diary_emotion_tags: (diary_id, tag_id, user_id, created_at)，索引 (user_id, tag_id, created_at)
+
+按标签筛选变成索引查找，每个用户的标签分布由 services/diary_stats.py 随关联变化累加。
+同步方式：日记插入、修改 emotion_tags、删除时的 mapper 事件，与日记写入在同一事务内。
+已有日记用 flask backfill-emotion-tags 回填（迁移 9e4c7a1b5f28 也会回填一次）。
+"""
+
+import sys
+from collections import Counter
+
+from sqlalchemy import event, select, delete, inspect as sa_inspect
+
+from services.db_utils import insert_ignore
+from services.diary_stats import adjust_tag_counts
+
+# 标签名最长长度（与 EmotionTag.name 一致）
+TAG_NAME_MAX_LENGTH = 50
+
+
+def normalize_tags(tags) -> list:
+    """去空白、去重（保持顺序）、截断过长的标签"""
+    result = []
+    for tag in tags or []:
+        if not isinstance(tag, str):
+            continue
+        name = tag.strip()[:TAG_NAME_MAX_LENGTH]
+        if name and name not in result:
+            result.append(name)
+    return result
+
+
+def _tag_ids(connection, names: list) -> dict:
+    """标签名 -> id，字典里没有的先插入（并发插入同名标签时由唯一键去重）"""
+    from models import EmotionTag
+
+    tags = EmotionTag.__table__
+    if not names:
+        return {}
+    found = dict(connection.execute(select(tags.c.name, tags.c.id).where(tags.c.name.in_(names))).all())
+    missing = [name for name in names if name not in found]
+    if missing:
+        connection.execute(insert_ignore(tags, connection.dialect.name), [{'name': name} for name in missing])
+        found.update(connection.execute(select(tags.c.name, tags.c.id).where(tags.c.name.in_(missing))).all())
+    return found
+
+
+def _remove_links(connection, diary_ids: list) -> Counter:
+    """删除这些日记的标签关联，返回被删除的 {(user_id, tag_id): 条数}"""
+    from models import DiaryEmotionTag
+
+    links = DiaryEmotionTag.__table__
+    removed = Counter(tuple(row) for row in connection.execute(
+        select(links.c.user_id, links.c.tag_id).where(links.c.diary_id.in_(diary_ids))
+    ))
+    if removed:
+        connection.execute(delete(links).where(links.c.diary_id.in_(diary_ids)))
+    return removed
+
+
+def _replace_links(connection, diaries: list) -> Counter:
+    """
+    重写一批日记的标签关联
+
+    Args:
+        diaries: [(diary_id, user_id, created_at, emotion_tags), ...]
+
+    Returns:
+        Counter: 各 (user_id, tag_id) 的日记数变化，交给 services/diary_stats.py 累加
+    """
+    from models import DiaryEmotionTag
+
+    links = DiaryEmotionTag.__table__
+    normalized = [(diary_id, user_id, created_at, normalize_tags(tags)) for diary_id, user_id, created_at, tags in diaries]
+    ids = _tag_ids(connection, sorted({name for *_, names in normalized for name in names}))
+
+    changes = Counter()
+    changes.subtract(_remove_links(connection, [item[0] for item in normalized]))
+    rows = [
+        {'diary_id': diary_id, 'tag_id': ids[name], 'user_id': user_id, 'created_at': created_at}
+        for diary_id, user_id, created_at, names in normalized
+        for name in names
+    ]
+    if rows:
+        connection.execute(links.insert(), rows)
+        changes.update((row['user_id'], row['tag_id']) for row in rows)
+    return changes
+
+
+# ==================== 同步事件 ====================
+
+def _diary_inserted(mapper, connection, target):
+    if target.emotion_tags:
+        changes = _replace_links(connection, [(target.id, target.user_id, target.created_at, target.emotion_tags)])
+        adjust_tag_counts(connection, changes)
+
+
+def _diary_updated(mapper, connection, target):
+    if sa_inspect(target).attrs.emotion_tags.history.has_changes():
+        changes = _replace_links(connection, [(target.id, target.user_id, target.created_at, target.emotion_tags)])
+        adjust_tag_counts(connection, changes)
+
+
+def _diary_deleting(mapper, connection, target):
+    # 在删除日记之前删除关联，避免外键约束报错
+    removed = _remove_links(connection, [target.id])
+    adjust_tag_counts(connection, Counter({key: -count for key, count in removed.items()}))
+
+
+def register_tag_events():
+    """注册标签同步事件（重复调用不会重复注册）"""
+    from models import EmotionDiary
+
+    for name, listener in (
+        ('after_insert', _diary_inserted),
+        ('after_update', _diary_updated),
+        ('before_delete', _diary_deleting),
+    ):
+        if not event.contains(EmotionDiary, name, listener):
+            event.listen(EmotionDiary, name, listener)
+
+
+# ==================== 回填 ====================
+
+def backfill_emotion_tags(connection, batch_size: int = 500) -> int:
+    """
+    按 emotion_diaries 重建全部标签关联（可重复执行）
+
+    不更新 user_tag_counts，回填后需要 services/diary_stats.py 的 rebuild_diary_stats() 重算
+
+    Returns:
+        int: 处理的日记数
+    """
+    from models import EmotionDiary
+
+    diaries = EmotionDiary.__table__
+    count = 0
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(diaries.c.id, diaries.c.user_id, diaries.c.created_at, diaries.c.emotion_tags)
+            .where(diaries.c.id > last_id).order_by(diaries.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        _replace_links(connection, [tuple(row) for row in rows])
+        count += len(rows)
+        last_id = rows[-1][0]
+    print(f"[情绪标签] 已回填 {count} 篇日记", file=sys.stderr)
+    return count
+
+
+# ==================== 查询 ====================
+
+def tag_filter(user_id: int, tag_name: str):
+    """用户日记中带某个标签的条件，用于 EmotionDiary 查询：query.filter(tag_filter(...))"""
+    from models import EmotionDiary, EmotionTag, DiaryEmotionTag
+
+    return EmotionDiary.id.in_(
+        select(DiaryEmotionTag.diary_id)
+        .join(EmotionTag, EmotionTag.id == DiaryEmotionTag.tag_id)
+        .where(DiaryEmotionTag.user_id == user_id, EmotionTag.name == tag_name.strip())
+    )
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+备用明信片图片库
+
+功能：
+1. 离线批量生成图库：为 FALLBACK_SCENES 的每个场景、COMMON_LOCATIONS 的每个地点按心情预先生成图片
+2. 明信片图片生成失败或被限流时，按场景和心情挑一张图库图片立即挂上，不再出现空白明信片
+
+图库图片保存在明信片存储的 library/ 目录下，被多张明信片共用，删除明信片时不会删除图库文件。
+
+使用方式：flask build-fallback-library [--variants 2] [--tier full] [--force]
+"""
+
+import os
+import sys
+import time
+import random
+import threading
+import uuid
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 图库在明信片存储中的key前缀
+FALLBACK_LIBRARY_PREFIX = 'library/'
+# 图库索引在内存中的缓存时间（秒）
+FALLBACK_LIBRARY_CACHE_SECONDS = int(os.environ.get('FALLBACK_LIBRARY_CACHE_SECONDS', 300))
+
+_cache_lock = threading.Lock()
+_cache_loaded_at = 0
+_cache_index = {}  # mood -> [(scene_name, image_url), ...]
+
+
+def is_library_key(key: str) -> bool:
+    """存储key是否属于共用图库"""
+    return bool(key) and key.startswith(FALLBACK_LIBRARY_PREFIX)
+
+
+def _load_index(force: bool = False) -> dict:
+    """加载图库索引（图库很小，整表缓存在内存中）"""
+    global _cache_loaded_at, _cache_index
+
+    if not force and time.time() - _cache_loaded_at < FALLBACK_LIBRARY_CACHE_SECONDS:
+        return _cache_index
+
+    with _cache_lock:
+        if not force and time.time() - _cache_loaded_at < FALLBACK_LIBRARY_CACHE_SECONDS:
+            return _cache_index
+
+        from extensions import db
+        from models import FallbackImage
+
+        index = {}
+        try:
+            rows = db.session.query(FallbackImage.mood, FallbackImage.scene_name, FallbackImage.image_url).all()
+            for mood, scene_name, image_url in rows:
+                index.setdefault(mood, []).append((scene_name, image_url))
+        except Exception as e:
+            db.session.rollback()
+            print(f"[备用图库] 加载失败: {e}", file=sys.stderr)
+
+        _cache_index = index
+        _cache_loaded_at = time.time()
+        return index
+
+
+def pick_fallback_image(mood: str, location_name: str = None) -> str:
+    """
+    挑选一张图库图片
+
+    优先选场景名出现在地点名中的图片（如"夕阳下的小河边"匹配"河边"），
+    其次同心情的任意图片，最后任意图片。
+
+    Returns:
+        图片URL，图库为空返回None
+    """
+    index = _load_index()
+    candidates = index.get(mood) or []
+
+    if location_name and candidates:
+        matched = [url for scene_name, url in candidates if scene_name in location_name]
+        if matched:
+            return random.choice(matched)
+
+    if candidates:
+        return random.choice(candidates)[1]
+
+    everything = [url for items in index.values() for _, url in items]
+    return random.choice(everything) if everything else None
+
+
+def attach_fallback_image(postcard) -> bool:
+    """
+    给明信片挂上图库图片（调用方负责提交）
+
+    Returns:
+        是否挂上了图片
+    """
+    from prompts.postcard_prompts import get_scene_type
+
+    image_url = pick_fallback_image(get_scene_type(postcard.mental_health_score), postcard.location_name)
+    if not image_url:
+        return False
+
+    now = datetime.utcnow()
+    postcard.image_url = image_url
+    postcard.image_tier = 'full'
+    postcard.image_source = 'library'
+    postcard.status = 'completed'
+    postcard.generated_at = now
+    if postcard.time_to_first_image_ms is None and postcard.created_at:
+        postcard.time_to_first_image_ms = int((now - postcard.created_at).total_seconds() * 1000)
+    print(f"[备用图库] 明信片 #{postcard.id} 使用图库图片: {image_url}", file=sys.stderr)
+    return True
+
+
+def build_library(variants: int = 1, tier: str = 'full', force: bool = False, delay: float = 1.0) -> dict:
+    """
+    批量生成图库（需要在应用上下文中调用，逐张调用图片API，适合离线执行）
+
+    Args:
+        variants: 每个场景+心情生成几张
+        tier: 使用的尺寸档位
+        force: 重新生成已存在的图片
+        delay: 每次调用图片API后的间隔（秒），避免触发限流
+
+    Returns:
+        dict: 生成统计
+    """
+    from extensions import db
+    from models import FallbackImage
+    from prompts.postcard_prompts import get_library_image_specs
+    from services.image_downloader import download_to_file
+    from services.postcard_service import generate_postcard_image
+    from services.storage import get_storage
+
+    storage = get_storage('postcards')
+    stats = {'total': 0, 'generated': 0, 'skipped': 0, 'failed': 0}
+
+    for spec in get_library_image_specs():
+        for variant in range(variants):
+            stats['total'] += 1
+            existing = FallbackImage.query.filter_by(
+                scene_name=spec['scene_name'], mood=spec['mood'], variant=variant
+            ).first()
+            if existing and not force:
+                stats['skipped'] += 1
+                continue
+
+            label = f"{spec['mood']}/{spec['scene_name']}#{variant}"
+            temp_url = generate_postcard_image(spec['image_prompt'], tier=tier)
+            time.sleep(delay)
+            if not temp_url:
+                stats['failed'] += 1
+                print(f"[备用图库] {label} 生成失败", file=sys.stderr)
+                continue
+
+            key = f"{FALLBACK_LIBRARY_PREFIX}{spec['mood']}/{uuid.uuid4().hex}.jpg"
+            try:
+                staging_path = storage.staging_path(key)
+                download_to_file(temp_url, staging_path)
+                storage.save_file(key, staging_path, content_type='image/jpeg')
+            except Exception as e:
+                stats['failed'] += 1
+                print(f"[备用图库] {label} 保存失败: {e}", file=sys.stderr)
+                continue
+
+            old_url = None
+            if existing:
+                old_url = existing.image_url
+                existing.image_url = storage.url_for(key)
+                existing.image_prompt = spec['image_prompt']
+                existing.created_at = datetime.utcnow()
+            else:
+                db.session.add(FallbackImage(
+                    scene_name=spec['scene_name'],
+                    mood=spec['mood'],
+                    variant=variant,
+                    image_url=storage.url_for(key),
+                    image_prompt=spec['image_prompt']
+                ))
+            db.session.commit()
+            stats['generated'] += 1
+            print(f"[备用图库] {label} 已生成: {storage.url_for(key)}", file=sys.stderr)
+            if old_url:
+                # 被替换的旧图可能仍被明信片引用，交给 gc-files 对账清理
+                print(f"[备用图库] {label} 旧图片待回收: {old_url}", file=sys.stderr)
+
+    _load_index(force=True)
+    return stats
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+游戏状态流水与快照
+
+GameState 只保存当前值，"心理健康值这一个月怎么变化的"只能从明信片、探险记录里反推。
+现在每次奖励结算（services/game_rewards.py 的 apply_rewards）在同一事务里：
+1. GameState.ledger_seq + 1，并追加一条 game_ledger 流水（变化量、来源、日记ID）
+2. seq 是 GAME_SNAPSHOT_INTERVAL 的整数倍时保存一份 game_snapshots 快照
+
+任意时刻的状态 = 该时刻之前最近的快照 + 重放其后不超过 GAME_SNAPSHOT_INTERVAL 条流水，
+重放规则与 apply_rewards 的 SQL 相同（属性截断到0-100、按日记数升级）。
+历史曲线只需要按 (user_id, seq) 读一段连续流水。
+
+流水上线前已有的用户，迁移时以当时的状态保存 seq=0 的快照；没有快照的用户从初始值开始重放。
+"""
+
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import insert, func
+
+load_dotenv()
+
+# 每多少条流水保存一次快照（重放最多这么多条）
+GAME_SNAPSHOT_INTERVAL = int(os.environ.get('GAME_SNAPSHOT_INTERVAL', 20))
+
+# 新建 GameState 的初始值（与各路由创建 GameState 时一致）
+INITIAL_STATE = {
+    'mental_health_score': 50,
+    'stress_level': 50,
+    'growth_potential': 50,
+    'coins': 0,
+    'level': 1,
+    'total_diaries': 0,
+}
+STATE_FIELDS = tuple(INITIAL_STATE)
+DELTA_FIELDS = ('coins', 'mental_health', 'stress', 'growth', 'diaries')
+
+
+def record(connection, user_id: int, state: dict, source: str, diary_id: int = None, deltas: dict = None,
+           created_at: datetime = None):
+    """
+    追加一条流水（apply_rewards 在同一事务中调用）
+
+    Args:
+        state: apply_rewards 结算后的状态（含 ledger_seq、level_up、coins_earned）
+        deltas: 属性/日记数变化量 {'mental_health', 'stress', 'growth', 'diaries'}
+    """
+    from models import GameLedger, GameSnapshot
+
+    deltas = deltas or {}
+    created_at = created_at or datetime.utcnow()
+    seq = state['ledger_seq']
+    connection.execute(insert(GameLedger.__table__).values(
+        user_id=user_id,
+        seq=seq,
+        source=source,
+        diary_id=diary_id,
+        coins=state['coins_earned'],
+        mental_health=deltas.get('mental_health', 0),
+        stress=deltas.get('stress', 0),
+        growth=deltas.get('growth', 0),
+        diaries=deltas.get('diaries', 0),
+        level_up=state['level_up'],
+        created_at=created_at
+    ))
+    if seq % GAME_SNAPSHOT_INTERVAL == 0:
+        connection.execute(insert(GameSnapshot.__table__).values(
+            user_id=user_id, seq=seq, created_at=created_at,
+            **{name: state[name] for name in STATE_FIELDS}
+        ))
+
+
+def apply_entry(state: dict, entry) -> dict:
+    """按一条流水计算下一个状态（与 apply_rewards 的UPDATE规则一致）"""
+    from services.game_rewards import STAT_MIN, STAT_MAX, DIARIES_PER_LEVEL
+
+    def clamped(value, delta):
+        return max(STAT_MIN, min(STAT_MAX, value + (delta or 0)))
+
+    total = state['total_diaries'] + (entry.diaries or 0)
+    return {
+        'mental_health_score': clamped(state['mental_health_score'], entry.mental_health),
+        'stress_level': clamped(state['stress_level'], entry.stress),
+        'growth_potential': clamped(state['growth_potential'], entry.growth),
+        'coins': state['coins'] + (entry.coins or 0),
+        'level': 1 + total // DIARIES_PER_LEVEL if entry.level_up else state['level'],
+        'total_diaries': total,
+    }
+
+
+def _snapshot_at_or_before(user_id: int, seq: int):
+    """seq 之前（含）最近的快照，返回 (快照seq, 状态)"""
+    from models import GameSnapshot
+
+    snapshot = GameSnapshot.query.filter(
+        GameSnapshot.user_id == user_id, GameSnapshot.seq <= seq
+    ).order_by(GameSnapshot.seq.desc()).first()
+    if snapshot is None:
+        return 0, dict(INITIAL_STATE)
+    return snapshot.seq, {name: getattr(snapshot, name) for name in STATE_FIELDS}
+
+
+def _entries(user_id: int, after_seq: int, until_seq: int = None, until_time: datetime = None, limit: int = None):
+    """after_seq 之后的流水（按 seq 升序）"""
+    from models import GameLedger
+
+    query = GameLedger.query.filter(GameLedger.user_id == user_id, GameLedger.seq > after_seq)
+    if until_seq is not None:
+        query = query.filter(GameLedger.seq <= until_seq)
+    if until_time is not None:
+        query = query.filter(GameLedger.created_at <= until_time)
+    query = query.order_by(GameLedger.seq)
+    return query.limit(limit).all() if limit else query.all()
+
+
+def _seq_at(user_id: int, at: datetime) -> int:
+    """at 时刻（含）之前的最后一条流水序号"""
+    from extensions import db
+    from models import GameLedger
+
+    return db.session.query(func.max(GameLedger.seq)).filter(
+        GameLedger.user_id == user_id, GameLedger.created_at <= at
+    ).scalar() or 0
+
+
+def state_at_seq(user_id: int, seq: int) -> dict:
+    """第 seq 条流水之后的状态（快照 + 短重放）"""
+    base_seq, state = _snapshot_at_or_before(user_id, seq)
+    for entry in _entries(user_id, base_seq, until_seq=seq):
+        state = apply_entry(state, entry)
+    return dict(state, seq=seq)
+
+
+def state_at(user_id: int, at: datetime = None) -> dict:
+    """某一时刻的状态，at 为空时为当前状态"""
+    if at is None:
+        from extensions import db
+        from models import GameLedger
+        seq = db.session.query(func.max(GameLedger.seq)).filter(GameLedger.user_id == user_id).scalar() or 0
+    else:
+        seq = _seq_at(user_id, at)
+    return state_at_seq(user_id, seq)
+
+
+def history(user_id: int, since: datetime, until: datetime = None, limit: int = 500) -> dict:
+    """
+    一段时间内的状态变化
+
+    Returns:
+        dict: {'start': since 时刻的状态, 'points': [每条流水及其之后的状态], 'has_more': bool}
+    """
+    from models import format_datetime
+
+    start = state_at(user_id, since)
+    entries = _entries(user_id, start['seq'], until_time=until, limit=limit + 1)
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    state = {name: start[name] for name in STATE_FIELDS}
+    points = []
+    for entry in entries:
+        state = apply_entry(state, entry)
+        points.append({
+            'seq': entry.seq,
+            'created_at': format_datetime(entry.created_at),
+            'source': entry.source,
+            'diary_id': entry.diary_id,
+            'changes': {name: getattr(entry, name) or 0 for name in DELTA_FIELDS},
+            'level_up': bool(entry.level_up),
+            'state': dict(state)
+        })
+    return {'start': start, 'points': points, 'has_more': has_more}
+
+
+def verify_ledger(user_ids: list = None) -> dict:
+    """
+    用快照 + 重放计算每个用户的当前状态，与 GameState 行比对（需要在应用上下文中调用）
+
+    Returns:
+        dict: {'checked': 用户数, 'mismatched': [{'user_id', 'game_state', 'replayed'}, ...]}
+    """
+    from models import GameState
+
+    query = GameState.query
+    if user_ids:
+        query = query.filter(GameState.user_id.in_(user_ids))
+
+    checked = 0
+    mismatched = []
+    last_id = 0
+    while True:
+        # 按id分批读取，重放查询不与未读完的结果集共用连接
+        batch = query.filter(GameState.id > last_id).order_by(GameState.id).limit(200).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        for game_state in batch:
+            checked += 1
+            replayed = state_at_seq(game_state.user_id, game_state.ledger_seq or 0)
+            actual = {name: getattr(game_state, name) for name in STATE_FIELDS}
+            if any(actual[name] != replayed[name] for name in STATE_FIELDS):
+                mismatched.append({'user_id': game_state.user_id, 'game_state': actual, 'replayed': replayed})
+    return {'checked': checked, 'mismatched': mismatched}
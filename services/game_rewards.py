@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+游戏奖励结算
+
+原来分析和探险结算都是先读出 GameState，在 Python 里改金币、属性、等级，再随事务提交：
+两个请求同时结算时后提交的会覆盖先提交的（丢失更新），
+而且从读取到提交之间夹着其他ORM操作，game_states 行锁持有时间长。
+
+这里改为：
+1. claim_diary_score(): `UPDATE emotion_diaries SET score_applied = 1 WHERE id = ? AND score_applied = 0`，
+   影响行数为1的请求才给这篇日记计分，重复/并发的分析请求不会重复加日记数
+2. apply_rewards(): 一条 UPDATE 完成金币累加、属性截断到0-100、日记数累加、升级判断和升级奖励，
+   数据库支持 RETURNING（SQLite 3.35+、PostgreSQL、MariaDB）时直接返回新值，否则同一事务内再读一次；
+   同时 ledger_seq + 1 并追加一条 game_ledger 流水（services/game_ledger.py）
+
+两者都应在事务快结束、提交之前调用，行锁只持有到 commit；
+会话里已加载的 GameState 在 commit 后过期，下次访问时读到结算后的值。
+"""
+
+from datetime import datetime
+
+from sqlalchemy import update, select, case, or_, func, literal
+
+# 属性范围
+STAT_MIN = 0
+STAT_MAX = 100
+# 每多少篇日记升一级，升级奖励金币
+DIARIES_PER_LEVEL = 10
+LEVEL_UP_BONUS = 50
+
+# apply_rewards 的属性参数 -> GameState 列
+STAT_COLUMNS = {
+    'mental_health': 'mental_health_score',
+    'stress': 'stress_level',
+    'growth': 'growth_potential',
+}
+STATE_COLUMNS = ('mental_health_score', 'stress_level', 'growth_potential', 'coins', 'level', 'total_diaries', 'ledger_seq')
+
+
+def _clamped(column, delta: int):
+    """column + delta 截断到 [STAT_MIN, STAT_MAX]（用CASE，各数据库通用）"""
+    value = column + delta
+    return case(
+        (value > STAT_MAX, STAT_MAX),
+        (value < STAT_MIN, STAT_MIN),
+        else_=value
+    )
+
+
+def claim_diary_score(connection, diary_id: int) -> bool:
+    """
+    把日记标记为已计分（比较并设置）
+
+    Returns:
+        bool: 本次调用抢到了计分权（之前未计分）
+    """
+    from models import EmotionDiary
+
+    diaries = EmotionDiary.__table__
+    result = connection.execute(
+        update(diaries)
+        .where(diaries.c.id == diary_id, or_(diaries.c.score_applied.is_(None), diaries.c.score_applied == False))
+        .values(score_applied=True, analysis_status='completed')
+    )
+    return result.rowcount == 1
+
+
+def apply_rewards(connection, user_id: int, source: str, diary_id: int = None, coins: int = 0,
+                  mental_health: int = 0, stress: int = 0, growth: int = 0, diaries: int = 0,
+                  level_bonus: int = LEVEL_UP_BONUS) -> dict:
+    """
+    原子地给用户的 GameState 结算一次奖励
+
+    Args:
+        connection: 当前事务的连接（路由里用 db.session.connection()）
+        source / diary_id: 记入流水的来源（analysis / adventure / legacy_analysis）和日记
+        coins: 金币增量（不含升级奖励）
+        mental_health / stress / growth: 属性增量，结果截断到0-100
+        diaries: 日记数增量（0或1），跨过 DIARIES_PER_LEVEL 的整数倍时升级
+        level_bonus: 升级时额外奖励的金币
+
+    Returns:
+        dict: 结算后的各列值，外加 level_up、coins_earned（含升级奖励）；用户没有 GameState 时返回 None
+    """
+    from models import GameState
+
+    states = GameState.__table__
+    c = states.c
+
+    # MySQL 的单表 UPDATE 按书写顺序赋值、后面的表达式会读到前面已更新的值，
+    # 因此引用 level / total_diaries 旧值的列放在前面，最后才改这两列
+    new_total = c.total_diaries + diaries
+    assignments = [(c.coins, c.coins + coins)]
+    if diaries > 0:
+        target_level = literal(1) + new_total // DIARIES_PER_LEVEL
+        level_up = target_level > c.level
+        assignments = [
+            (c.coins, c.coins + coins + case((level_up, level_bonus), else_=0)),
+            (c.level, case((level_up, target_level), else_=c.level)),
+        ]
+    for name, delta in (('mental_health', mental_health), ('stress', stress), ('growth', growth)):
+        if delta:
+            column = c[STAT_COLUMNS[name]]
+            assignments.append((column, _clamped(column, delta)))
+    now = datetime.utcnow()
+    assignments += [
+        (c.total_diaries, new_total),
+        (c.ledger_seq, func.coalesce(c.ledger_seq, 0) + 1),
+        (c.last_active, now),
+    ]
+
+    statement = update(states).where(c.user_id == user_id).ordered_values(*assignments)
+    returned = [c[name] for name in STATE_COLUMNS]
+    if connection.dialect.update_returning:
+        row = connection.execute(statement.returning(*returned)).first()
+    elif connection.execute(statement).rowcount:
+        # 没有 RETURNING：同一事务内本行已被锁住，再读到的就是本次更新后的值
+        row = connection.execute(select(*returned).where(c.user_id == user_id)).first()
+    else:
+        row = None
+    if not row:
+        return None
+
+    state = dict(zip(STATE_COLUMNS, row))
+    total = state['total_diaries']
+    # 本次跨过了整数倍且等级与日记数一致，说明 CASE 里触发了升级
+    leveled = (diaries > 0 and total // DIARIES_PER_LEVEL > (total - diaries) // DIARIES_PER_LEVEL
+               and state['level'] == 1 + total // DIARIES_PER_LEVEL)
+    state['level_up'] = leveled
+    state['coins_earned'] = coins + (level_bonus if leveled else 0)
+
+    # 同一事务追加流水（services/game_ledger.py）
+    from services.game_ledger import record
+    record(connection, user_id, state, source, diary_id=diary_id, created_at=now, deltas={
+        'mental_health': mental_health, 'stress': stress, 'growth': growth, 'diaries': diaries
+    })
+    return state
+
+
+def grant_items(connection, user_id: int, items: list) -> int:
+    """
+    把道具放进用户背包：同名道具 quantity + 1，没有则插入（一条多行upsert，依赖 (user_id, item_name) 唯一索引）
+
+    Args:
+        items: [{'name', 'name_zh', 'effect_type', 'effect_value'}, ...]，同名道具可重复出现
+
+    Returns:
+        int: 发放的道具件数
+    """
+    from collections import Counter
+    from models import UserItem
+    from services.db_utils import upsert_add
+
+    counts = Counter(item['name'] for item in items)
+    rows = {}
+    for item in items:
+        rows.setdefault(item['name'], {
+            'user_id': user_id,
+            'item_name': item['name'],
+            'item_name_zh': item['name_zh'],
+            'item_type': 'healing',
+            'quantity': counts[item['name']],
+            'effect_type': item['effect_type'],
+            'effect_value': item['effect_value'],
+            'acquired_at': datetime.utcnow()
+        })
+    if rows:
+        table = UserItem.__table__
+        connection.execute(upsert_add(table, connection.dialect.name, ['user_id', 'item_name'], ['quantity']),
+                           list(rows.values()))
+    return sum(counts.values())
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+HyperLogLog 基数估计
+
+用固定 2^p 个寄存器（p=14 时 16384 字节）估计去重数量，标准误差约 1.04/sqrt(2^p) ≈ 0.8%。
+两个草图逐个寄存器取最大值即可合并，合并结果与把两批数据一起加入完全相同，
+因此按天保存的草图可以任意组合成 7/30/90 天的去重访客数。
+"""
+
+import math
+import zlib
+import hashlib
+
+HLL_PRECISION = 14
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """HyperLogLog 草图"""
+
+    __slots__ = ('p', 'm', 'registers')
+
+    def __init__(self, p: int = HLL_PRECISION, registers: bytes = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers else bytearray(self.m)
+        if len(self.registers) != self.m:
+            raise ValueError(f"寄存器数量不匹配: {len(self.registers)} != {self.m}")
+
+    def add(self, value: str):
+        x = _hash64(value)
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        # 剩余位中第一个1出现的位置（从1开始）
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        if other.p != self.p:
+            raise ValueError("精度不同的草图无法合并")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        total = 0.0
+        zeros = 0
+        for r in self.registers:
+            total += 2.0 ** -r
+            if r == 0:
+                zeros += 1
+        estimate = alpha * m * m / total
+        # 小基数时用线性计数修正
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def is_empty(self) -> bool:
+        return not any(self.registers)
+
+    def to_bytes(self) -> bytes:
+        """序列化：1字节精度 + zlib压缩的寄存器（访问量少的日子大部分寄存器为0，压缩后很小）"""
+        return bytes([self.p]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        return cls(p=data[0], registers=zlib.decompress(data[1:]))
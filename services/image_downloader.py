@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+图片下载服务
+
+功能：
+1. 复用 keep-alive 连接池下载豆包Seedream CDN上的图片（避免每次重新TLS握手）
+2. 使用独立线程池并发下载，慢速CDN不会占用AI文本生成的线程
+3. 校验 Content-Length / Content-Type 以及文件头，截断时自动重试
+4. 先写入 .part 临时文件再原子重命名，避免留下半截图片
+"""
+
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 并发下载数（同时也是连接池大小）
+IMAGE_DOWNLOAD_WORKERS = int(os.environ.get('IMAGE_DOWNLOAD_WORKERS', 4))
+# 单次请求超时（秒）：(连接超时, 读取超时)
+IMAGE_DOWNLOAD_CONNECT_TIMEOUT = int(os.environ.get('IMAGE_DOWNLOAD_CONNECT_TIMEOUT', 10))
+IMAGE_DOWNLOAD_READ_TIMEOUT = int(os.environ.get('IMAGE_DOWNLOAD_READ_TIMEOUT', 60))
+# 截断/网络错误时的最大尝试次数
+IMAGE_DOWNLOAD_RETRIES = int(os.environ.get('IMAGE_DOWNLOAD_RETRIES', 3))
+# 读写缓冲区大小（原来是8KB一块，现在默认256KB）
+IMAGE_DOWNLOAD_CHUNK_SIZE = int(os.environ.get('IMAGE_DOWNLOAD_CHUNK_SIZE', 256 * 1024))
+# 单张图片大小上限，防止异常响应写满磁盘
+IMAGE_DOWNLOAD_MAX_BYTES = int(os.environ.get('IMAGE_DOWNLOAD_MAX_BYTES', 30 * 1024 * 1024))
+
+# 临时文件后缀（下载中断时残留的文件由垃圾回收任务清理）
+PARTIAL_SUFFIX = '.part'
+
+# 文件头魔数 -> 图片类型
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+class ImageDownloadError(Exception):
+    """图片下载失败（重试后仍失败或内容校验不通过）"""
+
+
+class _TruncatedDownload(Exception):
+    """响应体被截断，可重试"""
+
+
+_session = None
+_session_lock = threading.Lock()
+
+# 下载专用线程池，与AI生成线程完全隔离
+_executor = ThreadPoolExecutor(max_workers=IMAGE_DOWNLOAD_WORKERS, thread_name_prefix='image-download')
+
+
+def get_session() -> requests.Session:
+    """获取带连接池的下载会话（单例，线程安全）"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=IMAGE_DOWNLOAD_WORKERS,
+                    pool_maxsize=IMAGE_DOWNLOAD_WORKERS,
+                    max_retries=0  # 重试由本模块统一处理（包括响应体截断）
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def sniff_image_type(head: bytes) -> str:
+    """根据文件头判断图片类型，无法识别返回None"""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if len(head) >= 12 and head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def _download_once(image_url: str, partial_path: str) -> int:
+    """执行一次下载，返回写入的字节数"""
+    timeout = (IMAGE_DOWNLOAD_CONNECT_TIMEOUT, IMAGE_DOWNLOAD_READ_TIMEOUT)
+
+    with get_session().get(image_url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type and not content_type.startswith('image/') and content_type != 'application/octet-stream':
+            raise ImageDownloadError(f"响应不是图片: Content-Type={content_type}")
+
+        # 只有未压缩传输时Content-Length才等于实际内容长度
+        expected_length = None
+        content_encoding = response.headers.get('Content-Encoding', 'identity').lower()
+        if content_encoding == 'identity' and response.headers.get('Content-Length', '').isdigit():
+            expected_length = int(response.headers['Content-Length'])
+            if expected_length > IMAGE_DOWNLOAD_MAX_BYTES:
+                raise ImageDownloadError(f"图片过大: {expected_length} bytes")
+
+        written = 0
+        sniffed = False
+        with open(partial_path, 'wb', buffering=IMAGE_DOWNLOAD_CHUNK_SIZE) as f:
+            for chunk in response.iter_content(chunk_size=IMAGE_DOWNLOAD_CHUNK_SIZE):
+                if not chunk:
+                    continue
+                if not sniffed:
+                    if not sniff_image_type(chunk[:16]):
+                        raise ImageDownloadError("文件头校验失败，不是有效的图片")
+                    sniffed = True
+                f.write(chunk)
+                written += len(chunk)
+                if written > IMAGE_DOWNLOAD_MAX_BYTES:
+                    raise ImageDownloadError(f"图片超过大小上限 {IMAGE_DOWNLOAD_MAX_BYTES} bytes")
+            f.flush()
+            os.fsync(f.fileno())
+
+    if written == 0:
+        raise _TruncatedDownload("响应体为空")
+    if expected_length is not None and written != expected_length:
+        raise _TruncatedDownload(f"响应体被截断: {written}/{expected_length} bytes")
+
+    return written
+
+
+def download_to_file(image_url: str, filepath: str) -> int:
+    """
+    同步下载图片到指定路径（在调用线程中执行）
+
+    Args:
+        image_url: 远程图片URL
+        filepath: 目标文件路径（目录会自动创建）
+
+    Returns:
+        写入的字节数
+
+    Raises:
+        ImageDownloadError: 重试后仍失败或内容校验不通过
+    """
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    partial_path = filepath + PARTIAL_SUFFIX
+    last_error = None
+
+    for attempt in range(IMAGE_DOWNLOAD_RETRIES):
+        try:
+            written = _download_once(image_url, partial_path)
+            os.replace(partial_path, filepath)
+            return written
+        except (_TruncatedDownload, requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            last_error = e
+            print(f"[图片下载] 第{attempt + 1}次下载失败: {e}", file=sys.stderr)
+        except requests.HTTPError as e:
+            last_error = e
+            status = e.response.status_code if e.response is not None else None
+            print(f"[图片下载] HTTP错误: {status}", file=sys.stderr)
+            # 4xx（如临时URL已过期）重试无意义
+            if status is not None and 400 <= status < 500 and status != 429:
+                break
+        except ImageDownloadError:
+            _remove_quietly(partial_path)
+            raise
+        finally:
+            if os.path.exists(partial_path):
+                _remove_quietly(partial_path)
+
+        # 指数退避：0.5s, 1s, 2s...（最后一次失败后不再等待，直接返回失败）
+        if attempt < IMAGE_DOWNLOAD_RETRIES - 1:
+            time.sleep(0.5 * (2 ** attempt))
+
+    raise ImageDownloadError(f"图片下载失败: {last_error}")
+
+
+def submit_download(image_url: str, filepath: str, callback=None):
+    """
+    提交后台下载任务（在下载线程池中执行）
+
+    Args:
+        image_url: 远程图片URL
+        filepath: 目标文件路径
+        callback: 下载结束后的回调 callback(filepath or None, error or None)，在下载线程中调用
+
+    Returns:
+        concurrent.futures.Future，结果为写入的字节数
+    """
+    def task():
+        try:
+            written = download_to_file(image_url, filepath)
+        except Exception as e:
+            print(f"[图片下载] 下载失败: {image_url[:80]}... {e}", file=sys.stderr)
+            if callback:
+                callback(None, e)
+            raise
+        if callback:
+            callback(filepath, None)
+        return written
+
+    return _executor.submit(task)
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+延迟直方图
+
+按对数分桶记录请求耗时（微秒），相邻桶的边界相差 LATENCY_BUCKET_BASE 倍，
+分位数的相对误差不超过约 (base - 1) / 2。
+
+直方图只是 {桶号: 次数}，不同时间段、不同接口、不同进程的直方图直接相加即可合并，
+因此数据库里每条访问日志只需要存一个桶号，统计时 GROUP BY 桶号计数，不需要对原始耗时排序。
+"""
+
+import math
+
+# 桶边界倍数：1.1 表示每个桶比前一个宽10%，分位数误差约5%
+LATENCY_BUCKET_BASE = 1.1
+_LOG_BASE = math.log(LATENCY_BUCKET_BASE)
+
+
+def bucket_for(duration_us: int) -> int:
+    """耗时（微秒）所属的桶号"""
+    if duration_us is None or duration_us <= 1:
+        return 0
+    return int(math.log(duration_us) / _LOG_BASE)
+
+
+def bucket_value(bucket: int) -> float:
+    """桶的代表值（上下边界的几何中点，微秒）"""
+    if bucket <= 0:
+        return 1.0
+    return LATENCY_BUCKET_BASE ** (bucket + 0.5)
+
+
+class LatencyHistogram:
+    """可合并的对数分桶直方图"""
+
+    __slots__ = ('counts', 'total')
+
+    def __init__(self, counts: dict = None):
+        self.counts = {}
+        self.total = 0
+        if counts:
+            for bucket, count in counts.items():
+                self.add_bucket(int(bucket), int(count))
+
+    def add(self, duration_us: int, count: int = 1):
+        self.add_bucket(bucket_for(duration_us), count)
+
+    def add_bucket(self, bucket: int, count: int = 1):
+        if count <= 0:
+            return
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += count
+
+    def merge(self, other: 'LatencyHistogram') -> 'LatencyHistogram':
+        for bucket, count in other.counts.items():
+            self.add_bucket(bucket, count)
+        return self
+
+    def percentile(self, q: float) -> float:
+        """
+        分位数（微秒）
+
+        Args:
+            q: 0~100，如 50、95、99
+        """
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(self.total * q / 100.0))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return bucket_value(bucket)
+        return bucket_value(max(self.counts))
+
+    def summary(self) -> dict:
+        """常用分位数（毫秒）"""
+        result = {'count': self.total}
+        for q in (50, 95, 99):
+            value = self.percentile(q)
+            result[f'p{q}_ms'] = round(value / 1000.0, 2) if value is not None else None
+        return result
+
+    def to_dict(self) -> dict:
+        """序列化为JSON友好的 {"桶号": 次数}"""
+        return {str(bucket): count for bucket, count in self.counts.items()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'LatencyHistogram':
+        return cls(data or {})
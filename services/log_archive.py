@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+访问日志归档
+
+超过保留天数的访问日志从 access_logs 表移到按天的归档文件，热表只保留最近的数据：
+
+    <ACCESS_LOG_ARCHIVE_DIR>/2026-01-01.seg   数据段：若干个 zlib 压缩的 JSON Lines 数据块，只追加
+    <ACCESS_LOG_ARCHIVE_DIR>/2026-01-01.idx   索引：每个数据块一条定长记录 (偏移, 压缩长度, 行数, 块内最大id)
+
+写入顺序：先追加数据块并fsync，再追加索引并fsync，最后才删除数据库中的行。
+中途崩溃时，没有索引的数据块会被忽略；重新归档时跳过索引里已记录的id，不会重复。
+
+读取时用 mmap 映射索引和数据段，只解压需要的数据块，可以直接翻页和按路径过滤。
+
+使用方式：flask archive-logs [--retention-days 30]（建议每天定时执行）
+"""
+
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+from datetime import datetime, date, timedelta
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 文件锁（Windows本地开发没有fcntl，只在单进程下运行归档）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 访问日志在数据库中保留的天数
+ACCESS_LOG_RETENTION_DAYS = int(os.environ.get('ACCESS_LOG_RETENTION_DAYS', 30))
+# 归档目录（Zeabur上放在持久化的 /image 下）
+ACCESS_LOG_ARCHIVE_DIR = os.environ.get('ACCESS_LOG_ARCHIVE_DIR', '/image/access_logs')
+# 每个数据块的行数
+ARCHIVE_BLOCK_ROWS = int(os.environ.get('ARCHIVE_BLOCK_ROWS', 500))
+
+# 索引记录：偏移(uint64) 压缩长度(uint32) 行数(uint32) 块内最大id(int64)
+_INDEX_ENTRY = struct.Struct('<QIIq')
+
+_ARCHIVE_COLUMNS = (
+    'id', 'ip_address', 'user_agent', 'path', 'method', 'user_id',
+    'status_code', 'endpoint', 'duration_us', 'response_bytes', 'created_at'
+)
+
+
+class ArchiveBusyError(Exception):
+    """另一个进程正在归档"""
+
+
+def _paths(day: date):
+    base = os.path.join(ACCESS_LOG_ARCHIVE_DIR, day.isoformat())
+    return base + '.seg', base + '.idx'
+
+
+def _read_index(index_path: str) -> list:
+    """读取索引（mmap映射，返回 [(offset, length, rows, last_id), ...]）"""
+    if not os.path.exists(index_path):
+        return []
+    size = os.path.getsize(index_path)
+    usable = size - size % _INDEX_ENTRY.size  # 忽略写了一半的记录
+    if usable <= 0:
+        return []
+    with open(index_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return list(_INDEX_ENTRY.iter_unpack(mm[:usable]))
+
+
+def _append_block(segment_path: str, index_path: str, rows: list):
+    """追加一个数据块并写索引"""
+    payload = '\n'.join(json.dumps(row, ensure_ascii=False, default=str) for row in rows).encode('utf-8')
+    block = zlib.compress(payload, 6)
+
+    with open(segment_path, 'ab') as seg:
+        offset = seg.tell()
+        seg.write(block)
+        seg.flush()
+        os.fsync(seg.fileno())
+
+    entry = _INDEX_ENTRY.pack(offset, len(block), len(rows), max(row['id'] for row in rows))
+    with open(index_path, 'ab') as idx:
+        # 上次崩溃留下的半条索引记录需要先截掉
+        remainder = idx.tell() % _INDEX_ENTRY.size
+        if remainder:
+            idx.truncate(idx.tell() - remainder)
+            idx.seek(0, os.SEEK_END)
+        idx.write(entry)
+        idx.flush()
+        os.fsync(idx.fileno())
+
+
+def _row_to_dict(log) -> dict:
+    row = {column: getattr(log, column) for column in _ARCHIVE_COLUMNS}
+    row['created_at'] = log.created_at.isoformat() if log.created_at else None
+    return row
+
+
+def archive_old_logs(retention_days: int = None) -> dict:
+    """
+    把超过保留期的访问日志归档并从数据库删除（需要在应用上下文中调用）
+
+    Returns:
+        dict: 每天归档的行数
+    """
+    from sqlalchemy import func
+    from extensions import db
+    from models import AccessLog
+
+    retention_days = ACCESS_LOG_RETENTION_DAYS if retention_days is None else retention_days
+    cutoff = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=retention_days)
+    os.makedirs(ACCESS_LOG_ARCHIVE_DIR, exist_ok=True)
+
+    lock_file = open(os.path.join(ACCESS_LOG_ARCHIVE_DIR, '.lock'), 'w')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise ArchiveBusyError("另一个进程正在归档访问日志")
+
+    archived = {}
+    try:
+        oldest = db.session.query(func.min(AccessLog.created_at)).filter(AccessLog.created_at < cutoff).scalar()
+        day = oldest.date() if oldest else None
+
+        while day is not None and day < cutoff.date():
+            day_start = datetime.combine(day, datetime.min.time())
+            day_end = day_start + timedelta(days=1)
+            segment_path, index_path = _paths(day)
+            index = _read_index(index_path)
+            last_id = max((entry[3] for entry in index), default=0)
+
+            # 崩溃恢复：索引里已经有的行只需要从数据库删除
+            if last_id:
+                AccessLog.query.filter(
+                    AccessLog.created_at >= day_start, AccessLog.created_at < day_end, AccessLog.id <= last_id
+                ).delete(synchronize_session=False)
+                db.session.commit()
+
+            count = 0
+            while True:
+                logs = AccessLog.query.filter(
+                    AccessLog.created_at >= day_start,
+                    AccessLog.created_at < day_end,
+                    AccessLog.id > last_id
+                ).order_by(AccessLog.id).limit(ARCHIVE_BLOCK_ROWS).all()
+                if not logs:
+                    break
+
+                rows = [_row_to_dict(log) for log in logs]
+                _append_block(segment_path, index_path, rows)
+                ids = [row['id'] for row in rows]
+                AccessLog.query.filter(AccessLog.id.in_(ids)).delete(synchronize_session=False)
+                db.session.commit()
+                db.session.expunge_all()
+
+                last_id = ids[-1]
+                count += len(ids)
+
+            if count:
+                archived[day.isoformat()] = count
+                print(f"[日志归档] {day} 归档 {count} 条", file=sys.stderr)
+            day += timedelta(days=1)
+    finally:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    return archived
+
+
+def list_archive_days() -> list:
+    """已归档的日期及行数（只读索引）"""
+    if not os.path.isdir(ACCESS_LOG_ARCHIVE_DIR):
+        return []
+    days = []
+    for name in sorted(os.listdir(ACCESS_LOG_ARCHIVE_DIR), reverse=True):
+        if not name.endswith('.idx'):
+            continue
+        index = _read_index(os.path.join(ACCESS_LOG_ARCHIVE_DIR, name))
+        days.append({
+            'date': name[:-4],
+            'rows': sum(entry[2] for entry in index),
+            'blocks': len(index)
+        })
+    return days
+
+
+def _to_api_dict(row: dict) -> dict:
+    """与 AccessLog.to_dict() 相同的字段"""
+    duration_us = row.get('duration_us')
+    return {
+        'id': row.get('id'),
+        'ip_address': row.get('ip_address'),
+        'user_agent': row.get('user_agent'),
+        'path': row.get('path'),
+        'method': row.get('method'),
+        'user_id': row.get('user_id'),
+        'status_code': row.get('status_code'),
+        'endpoint': row.get('endpoint'),
+        'duration_ms': round(duration_us / 1000.0, 2) if duration_us is not None else None,
+        'response_bytes': row.get('response_bytes'),
+        'created_at': row['created_at'] + 'Z' if row.get('created_at') else None
+    }
+
+
+def read_archive(day: date, page: int = 1, per_page: int = 50, path_filter: str = None) -> dict:
+    """
+    分页读取某天的归档日志（最新的在前）
+
+    不过滤时根据索引里的行数直接定位需要的数据块，只解压这几个块；
+    按路径过滤时逐块（从新到旧）解压扫描。
+    """
+    segment_path, index_path = _paths(day)
+    index = _read_index(index_path)
+    page = max(page, 1)
+    per_page = max(per_page, 1)
+    empty = {'logs': [], 'total': 0, 'pages': 0, 'current_page': page}
+    if not index or not os.path.exists(segment_path) or os.path.getsize(segment_path) == 0:
+        return empty
+
+    with open(segment_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        def load_block(entry):
+            offset, length, _, _ = entry
+            lines = zlib.decompress(mm[offset:offset + length]).decode('utf-8').split('\n')
+            # 块内按id升序保存，翻转为最新在前
+            return [json.loads(line) for line in reversed(lines) if line]
+
+        skip = (page - 1) * per_page
+        logs = []
+
+        if not path_filter:
+            total = sum(entry[2] for entry in index)
+            for entry in reversed(index):
+                rows = entry[2]
+                if skip >= rows:
+                    skip -= rows
+                    continue
+                block = load_block(entry)
+                logs.extend(block[skip:skip + per_page - len(logs)])
+                skip = 0
+                if len(logs) >= per_page:
+                    break
+        else:
+            total = 0
+            for entry in reversed(index):
+                for row in load_block(entry):
+                    if path_filter not in (row.get('path') or ''):
+                        continue
+                    if skip <= total < skip + per_page:
+                        logs.append(row)
+                    total += 1
+
+    return {
+        'logs': [_to_api_dict(row) for row in logs],
+        'total': total,
+        'pages': (total + per_page - 1) // per_page,
+        'current_page': page
+    }
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+游标分页（keyset pagination）
+
+按 (时间, id) 倒序翻页：下一页的条件是 `时间 < 上一页最后一条的时间
+OR (时间 = 它 AND id < 它的id)`，数据库沿索引直接定位，不需要 OFFSET 跳过前面的行，
+也不需要每页 COUNT(*)，翻到多深耗时都一样。
+
+游标是上一页最后一条的 (时间, id) 经 base64url 编码后的字符串，对前端不透明，
+接口带上 cursor 参数（第一页传空字符串）即进入游标模式，原来的 page/offset 参数保持不变。
+"""
+
+import json
+import base64
+from datetime import datetime
+
+
+class InvalidCursorError(ValueError):
+    """游标无法解析"""
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str):
+    """
+    解析游标
+
+    Returns:
+        (created_at, id)，空字符串返回 None（第一页）
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError("无效的分页游标") from e
+
+
+def keyset_page(query, time_column, id_column, cursor: str, limit: int, key=None) -> dict:
+    """
+    取一页数据（按 time_column、id_column 倒序）
+
+    Args:
+        query: 已加好过滤条件、未排序的查询
+        time_column / id_column: 排序列，如 EmotionDiary.created_at, EmotionDiary.id
+        cursor: 上一页返回的 next_cursor，第一页传空字符串
+        limit: 每页数量
+        key: 从结果行取 (时间, id) 的函数，多实体查询时需要，默认取行对象的同名属性
+
+    Returns:
+        dict: {'items': [...], 'next_cursor': str或None, 'has_more': bool}
+    """
+    from sqlalchemy import or_, and_
+
+    position = decode_cursor(cursor)
+    if position:
+        last_time, last_id = position
+        query = query.filter(or_(
+            time_column < last_time,
+            and_(time_column == last_time, id_column < last_id)
+        ))
+
+    rows = query.order_by(time_column.desc(), id_column.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more and rows:
+        if key is None:
+            last = rows[-1]
+            next_cursor = encode_cursor(getattr(last, time_column.key), getattr(last, id_column.key))
+        else:
+            next_cursor = encode_cursor(*key(rows[-1]))
+
+    return {'items': rows, 'next_cursor': next_cursor, 'has_more': has_more}
+
+
+def approximate_count(model) -> int:
+    """
+    整张表的大致行数（管理后台不带筛选条件时使用）
+
+    MySQL 读 information_schema 中 InnoDB 维护的估计值，不扫描表；其他数据库直接 COUNT。
+    """
+    from sqlalchemy import func, text
+    from extensions import db
+
+    if db.engine.dialect.name == 'mysql':
+        estimate = db.session.execute(text(
+            'SELECT TABLE_ROWS FROM information_schema.TABLES '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table'
+        ), {'table': model.__tablename__}).scalar()
+        if estimate is not None:
+            return int(estimate)
+    return db.session.query(func.count(model.id)).scalar()
@@ -7,28 +7,59 @@
 2. 调用豆包AI生成明信片消息和图片prompt
 3. 调用豆包Seedream生成明信片图片
 4. 保存明信片到数据库
+5. 临时图片URL转存到明信片存储；进程重启丢失的转存任务由定时扫描（sweep_pending_images）重新提交
 """
 
 import os
 import sys
 import json
 import re
+import time
 import uuid
-import requests
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# 明信片图片保存目录 (Zeabur部署使用/image/持久化存储)
-# 优先使用环境变量配置的路径，否则使用默认的/image/postcards
-POSTCARD_UPLOAD_FOLDER = os.environ.get('POSTCARD_UPLOAD_FOLDER', '/image/postcards')
+# 明信片图片保存位置由 services/storage.py 统一管理
+# （本地默认 /image/postcards，可切换为S3兼容对象存储）
 
 # 豆包API配置
 DOUBAO_API_KEY = os.environ.get('DOUBAO_API_KEY', 'a7ce8af1-5b59-467b-984e-4d0934976e80')
 DOUBAO_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
 DOUBAO_POSTCARD_MODEL = os.environ.get('DOUBAO_POSTCARD_MODEL', 'doubao-seed-1-6-flash-250828')  # 用flash模型，速度更快
 
+# 明信片图片尺寸档位
+# Seedream 4.5 最小只支持 2560x1440，预览档默认使用支持小尺寸的 Seedream 4.0
+POSTCARD_IMAGE_TIERS = {
+    'preview': {
+        'model': os.environ.get('POSTCARD_PREVIEW_IMAGE_MODEL', 'doubao-seedream-4-0-250828'),
+        'size': os.environ.get('POSTCARD_PREVIEW_IMAGE_SIZE', '1280x720'),
+    },
+    'full': {
+        'model': os.environ.get('DOUBAO_IMAGE_MODEL', 'doubao-seedream-4-5-251128'),
+        'size': os.environ.get('POSTCARD_FULL_IMAGE_SIZE', '2560x1440'),
+    },
+}
+# 是否先生成预览图（关闭后直接生成完整2K图，与原来行为一致）
+POSTCARD_PREVIEW_ENABLED = os.environ.get('POSTCARD_PREVIEW_ENABLED', 'true').lower() == 'true'
+# 预览图生成后是否在后台补生成完整2K图
+POSTCARD_FULL_IMAGE_ENABLED = os.environ.get('POSTCARD_FULL_IMAGE_ENABLED', 'true').lower() == 'true'
+# 后台2K图并发数
+POSTCARD_FULL_IMAGE_WORKERS = int(os.environ.get('POSTCARD_FULL_IMAGE_WORKERS', 2))
+# 延迟预算（秒）：预计排队+生成时间超过该值时跳过2K图，只保留预览图
+POSTCARD_FULL_IMAGE_LATENCY_BUDGET = float(os.environ.get('POSTCARD_FULL_IMAGE_LATENCY_BUDGET', 180))
+# 2K图生成耗时的初始估计（秒），之后按实际耗时滑动平均
+POSTCARD_FULL_IMAGE_EXPECTED_SECONDS = float(os.environ.get('POSTCARD_FULL_IMAGE_EXPECTED_SECONDS', 40))
+# 同时进行的首图生成请求上限，超出时直接使用备用图库（高峰期限流，减轻图片服务压力）
+POSTCARD_IMAGE_MAX_CONCURRENCY = int(os.environ.get('POSTCARD_IMAGE_MAX_CONCURRENCY', 8))
+# 临时图片URL提交转存后多久还没完成就重新提交（秒），也是定时扫描的间隔
+POSTCARD_IMAGE_RETRY_AFTER = int(os.environ.get('POSTCARD_IMAGE_RETRY_AFTER', 600))
+# 临时图片URL的有效期（小时），超过后不再尝试转存
+POSTCARD_IMAGE_TEMP_URL_TTL_HOURS = int(os.environ.get('POSTCARD_IMAGE_TEMP_URL_TTL_HOURS', 24))
+
 # 导入OpenAI SDK（用于豆包API）
 try:
     from openai import OpenAI
@@ -36,6 +67,8 @@ except ImportError:
     OpenAI = None
     print("警告: 未安装 openai 包，豆包功能将不可用", file=sys.stderr)
 
+from services.fallback_library import attach_fallback_image
+
 # 导入Prompt模板
 try:
     sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
@@ -220,19 +253,21 @@ def generate_local_message(emotions: list, mental_health_score: int, scene_name:
     return random.choice(messages)
 
 
-def generate_postcard_image(image_prompt: str) -> str:
+def generate_postcard_image(image_prompt: str, tier: str = 'full') -> str:
     """
-    调用豆包Seedream 4.5图片生成API创建明信片图片
+    调用豆包Seedream图片生成API创建明信片图片
 
     Args:
         image_prompt: 图片生成提示词
+        tier: 尺寸档位，'preview'（快速低分辨率）或 'full'（2K）
 
     Returns:
         生成的图片URL，失败返回None
     """
     # 获取豆包API配置（优先使用ARK_API_KEY，否则使用DOUBAO_API_KEY）
     ark_api_key = os.getenv('ARK_API_KEY') or DOUBAO_API_KEY
-    image_model = os.getenv('DOUBAO_IMAGE_MODEL', 'doubao-seedream-4-5-251128')
+    tier_config = POSTCARD_IMAGE_TIERS.get(tier) or POSTCARD_IMAGE_TIERS['full']
+    image_model = tier_config['model']
 
     if not ark_api_key:
         print("[明信片图片] 未配置豆包API Key", file=sys.stderr)
@@ -245,14 +280,14 @@ def generate_postcard_image(image_prompt: str) -> str:
             api_key=ark_api_key
         )
 
-        print(f"[明信片图片] 调用豆包Seedream生成图片，模型: {image_model}", file=sys.stderr)
+        print(f"[明信片图片] 调用豆包Seedream生成{tier}图片，模型: {image_model}，尺寸: {tier_config['size']}", file=sys.stderr)
         print(f"[明信片图片] Prompt: {image_prompt[:100]}...", file=sys.stderr)
 
-        # 生成2K 16:9的图片 (2560x1440)
+        # 16:9 图片，预览档 1280x720，完整档 2560x1440
         response = client.images.generate(
             model=image_model,
             prompt=image_prompt,
-            size="2560x1440",  # 2K 16:9 比例
+            size=tier_config['size'],
             response_format="url",
             extra_body={
                 "watermark": False,  # 不添加水印
@@ -278,9 +313,20 @@ def generate_postcard_image(image_prompt: str) -> str:
         return None
 
 
+def build_postcard_image_key(user_id: int, diary_id: int = None) -> str:
+    """生成明信片图片在存储中的key（如 9/diary_123_abc.jpg）"""
+    # 生成唯一文件名（包含diary_id便于追踪）
+    unique_id = uuid.uuid4().hex[:8]
+    if diary_id:
+        filename = f"diary_{diary_id}_{unique_id}.jpg"
+    else:
+        filename = f"{uuid.uuid4().hex}.jpg"
+    return f"{user_id}/{filename}"
+
+
 def download_and_save_image(image_url: str, user_id: int, diary_id: int = None) -> str:
     """
-    下载远程图片并保存到本地服务器
+    下载远程图片并保存到明信片存储（同步，在调用线程中执行）
 
     Args:
         image_url: 远程图片URL
@@ -288,77 +334,370 @@ def download_and_save_image(image_url: str, user_id: int, diary_id: int = None)
         diary_id: 日记ID（用于文件命名，便于关联删除）
 
     Returns:
-        本地图片的相对路径（如 /image/postcards/9/diary_123_abc.jpg），失败返回None
+        图片的相对路径（如 /image/postcards/9/diary_123_abc.jpg），失败返回None
     """
     if not image_url:
         return None
 
-    try:
-        # 确保目录存在
-        user_folder = os.path.join(POSTCARD_UPLOAD_FOLDER, str(user_id))
-        os.makedirs(user_folder, exist_ok=True)
-
-        # 生成唯一文件名（包含diary_id便于追踪）
-        unique_id = uuid.uuid4().hex[:8]
-        if diary_id:
-            filename = f"diary_{diary_id}_{unique_id}.jpg"
-        else:
-            filename = f"{uuid.uuid4().hex}.jpg"
-        filepath = os.path.join(user_folder, filename)
-
-        print(f"[明信片图片] 正在下载图片到: {filepath}", file=sys.stderr)
-
-        # 下载图片
-        response = requests.get(image_url, timeout=60, stream=True)
-        response.raise_for_status()
+    from services.image_downloader import download_to_file
+    from services.storage import get_storage
 
-        # 保存到本地
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+    staging_path = None
+    try:
+        storage = get_storage('postcards')
+        key = build_postcard_image_key(user_id, diary_id)
+        staging_path = storage.staging_path(key)
+        print(f"[明信片图片] 正在下载图片: {key}", file=sys.stderr)
 
-        # 返回相对路径（用于Web访问，通过Flask路由服务）
-        relative_path = f"/image/postcards/{user_id}/{filename}"
-        print(f"[明信片图片] 下载成功: {relative_path}", file=sys.stderr)
+        size = download_to_file(image_url, staging_path)
+        storage.save_file(key, staging_path, content_type='image/jpeg')
 
+        # 返回相对路径（用于Web访问，通过 /image/ 路由服务）
+        relative_path = storage.url_for(key)
+        print(f"[明信片图片] 下载成功: {relative_path} ({size} bytes)", file=sys.stderr)
         return relative_path
 
     except Exception as e:
         print(f"[明信片图片] 下载保存失败: {str(e)}", file=sys.stderr)
-        import traceback
-        traceback.print_exc()
+        if staging_path:
+            storage.discard_staging(staging_path)
+        return None
+
+
+def save_postcard_image_async(postcard_id: int, image_url: str, user_id: int, diary_id: int = None):
+    """
+    在下载线程池中把临时图片URL转存到明信片存储，完成后替换明信片的image_url
+
+    调用方先把豆包返回的临时URL写入明信片（用户可以立即看到图片），
+    生成线程随即释放；下载完成后再把image_url换成存储路径。
+    只有image_url（或preview_url）仍是这个临时URL时才替换，避免覆盖期间重新生成的图片。
+    """
+    if not image_url:
+        return None
+
+    from app import app
+    from services.image_downloader import submit_download
+    from services.storage import get_storage
+
+    storage = get_storage('postcards')
+    key = build_postcard_image_key(user_id, diary_id)
+    relative_path = storage.url_for(key)
+    staging = storage.staging_path(key)
+
+    def on_done(staging_path, error):
+        if error:
+            # 下载失败时保留临时URL（与原来的降级行为一致），image_pending_at 不清空，定时扫描会重新提交；
+            # S3后端清理 staging_path 建的临时文件
+            storage.discard_staging(staging)
+            return
+        with app.app_context():
+            from models import Postcard, db
+            try:
+                storage.save_file(key, staging_path, content_type='image/jpeg')
+                updated = Postcard.query.filter_by(id=postcard_id, image_url=image_url).update(
+                    {'image_url': relative_path}, synchronize_session=False
+                )
+                # 下载期间2K图已生成，这张预览图已移到preview_url
+                updated += Postcard.query.filter_by(id=postcard_id, preview_url=image_url).update(
+                    {'preview_url': relative_path}, synchronize_session=False
+                )
+                _clear_image_pending(postcard_id)
+                db.session.commit()
+                if updated:
+                    print(f"[明信片图片] #{postcard_id} 已转存: {relative_path}", file=sys.stderr)
+                else:
+                    # 明信片已被删除或图片已更换，转存的文件变成孤儿
+                    storage.delete(key)
+            except Exception as e:
+                db.session.rollback()
+                print(f"[明信片图片] #{postcard_id} 转存失败: {e}", file=sys.stderr)
+
+    print(f"[明信片图片] #{postcard_id} 提交后台下载: {key}", file=sys.stderr)
+    return submit_download(image_url, staging, callback=on_done)
+
+
+def _is_temp_url(url: str) -> bool:
+    """豆包返回的临时图片URL（存储中的图片是 /image/... 相对路径）"""
+    return bool(url) and url.startswith(('http://', 'https://'))
+
+
+def _clear_image_pending(postcard_id: int):
+    """image_url 和 preview_url 都已不是临时URL时清空 image_pending_at（调用方负责提交）"""
+    from sqlalchemy import or_
+    from models import Postcard
+
+    Postcard.query.filter(
+        Postcard.id == postcard_id,
+        or_(Postcard.image_url.is_(None), ~Postcard.image_url.like('http%')),
+        or_(Postcard.preview_url.is_(None), ~Postcard.preview_url.like('http%'))
+    ).update({'image_pending_at': None}, synchronize_session=False)
+
+
+def sweep_pending_images(limit: int = 100) -> int:
+    """
+    重新提交还没转存完的临时图片（需要在应用上下文中调用）
+
+    image_pending_at 早于 POSTCARD_IMAGE_RETRY_AFTER 秒前的明信片（进程重启丢了下载任务、或上次下载失败）
+    先比较并设置 image_pending_at 抢占（多个worker只有一个重新提交），再按原来的方式转存；
+    生成超过临时URL有效期的不再尝试，清空标记。
+
+    Returns:
+        int: 重新提交的明信片数
+    """
+    from models import Postcard, db
+
+    now = datetime.utcnow()
+    expired_before = now - timedelta(hours=POSTCARD_IMAGE_TEMP_URL_TTL_HOURS)
+    rows = db.session.query(
+        Postcard.id, Postcard.user_id, Postcard.diary_id, Postcard.image_url, Postcard.preview_url,
+        Postcard.generated_at, Postcard.created_at, Postcard.image_pending_at
+    ).filter(
+        Postcard.image_pending_at < now - timedelta(seconds=POSTCARD_IMAGE_RETRY_AFTER)
+    ).order_by(Postcard.image_pending_at).limit(limit).all()
+
+    resubmitted = 0
+    for row in rows:
+        temp_urls = [url for url in (row.image_url, row.preview_url) if _is_temp_url(url)]
+        expired = (row.generated_at or row.created_at or now) < expired_before
+        claimed = Postcard.query.filter_by(id=row.id, image_pending_at=row.image_pending_at).update(
+            {'image_pending_at': None if expired or not temp_urls else now}, synchronize_session=False
+        )
+        db.session.commit()
+        if not claimed:
+            continue
+        if expired and temp_urls:
+            print(f"[明信片图片] #{row.id} 临时URL已过期，放弃转存", file=sys.stderr)
+        if expired or not temp_urls:
+            continue
+        for url in temp_urls:
+            save_postcard_image_async(row.id, url, row.user_id, row.diary_id)
+        resubmitted += 1
+
+    if resubmitted:
+        print(f"[明信片图片] 重新提交 {resubmitted} 张明信片的转存", file=sys.stderr)
+    return resubmitted
+
+
+_sweeper = None
+_sweeper_pid = None
+_sweeper_lock = threading.Lock()
+
+
+def _sweep_loop():
+    from app import app
+    from models import db
+
+    while True:
+        time.sleep(POSTCARD_IMAGE_RETRY_AFTER)
+        with app.app_context():
+            try:
+                sweep_pending_images()
+            except Exception as e:
+                db.session.rollback()
+                print(f"[明信片图片] 扫描待转存图片失败: {e}", file=sys.stderr)
+            finally:
+                db.session.remove()
+
+
+def ensure_image_sweeper():
+    """按进程启动待转存图片的定时扫描线程"""
+    global _sweeper, _sweeper_pid
+    pid = os.getpid()
+    if _sweeper is not None and _sweeper_pid == pid and _sweeper.is_alive():
+        return
+    with _sweeper_lock:
+        if _sweeper is not None and _sweeper_pid == pid and _sweeper.is_alive():
+            return
+        _sweeper = threading.Thread(target=_sweep_loop, name='postcard-image-sweep', daemon=True)
+        _sweeper_pid = pid
+        _sweeper.start()
+
+
+# 后台2K图生成线程池（与文本生成、图片下载线程分开）
+_full_image_executor = ThreadPoolExecutor(
+    max_workers=POSTCARD_FULL_IMAGE_WORKERS, thread_name_prefix='postcard-full-image'
+)
+_full_image_lock = threading.Lock()
+_full_image_pending = 0
+_full_image_avg_seconds = POSTCARD_FULL_IMAGE_EXPECTED_SECONDS
+_first_image_slots = threading.BoundedSemaphore(POSTCARD_IMAGE_MAX_CONCURRENCY)
+
+
+def generate_first_image(image_prompt: str):
+    """
+    生成明信片的第一张图片：优先快速预览档，失败时退回完整档
+
+    同时生成的请求超过 POSTCARD_IMAGE_MAX_CONCURRENCY 时不调用图片API（被限流），
+    调用方应改用备用图库（attach_fallback_image）
+
+    Returns:
+        (临时图片URL, 档位)，失败或被限流返回 (None, None)
+    """
+    if not _first_image_slots.acquire(blocking=False):
+        print("[明信片图片] 图片生成并发已满，本次使用备用图库", file=sys.stderr)
+        return None, None
+
+    try:
+        tiers = ('preview', 'full') if POSTCARD_PREVIEW_ENABLED else ('full',)
+        for tier in tiers:
+            image_url = generate_postcard_image(image_prompt, tier=tier)
+            if image_url:
+                return image_url, tier
+        return None, None
+    finally:
+        _first_image_slots.release()
+
+
+def apply_first_image(postcard, image_url: str, tier: str):
+    """把第一张图片写入明信片，并记录首图耗时（调用方负责提交）"""
+    now = datetime.utcnow()
+    postcard.image_url = image_url
+    postcard.image_pending_at = now
+    postcard.image_tier = tier
+    postcard.image_source = 'generated'
+    postcard.generated_at = now
+    if postcard.time_to_first_image_ms is None and postcard.created_at:
+        postcard.time_to_first_image_ms = int((now - postcard.created_at).total_seconds() * 1000)
+        print(f"[明信片图片] #{postcard.id} 首图耗时 {postcard.time_to_first_image_ms}ms（{tier}）", file=sys.stderr)
+
+
+def schedule_image_followups(postcard_id: int, image_url: str, tier: str, image_prompt: str,
+                             user_id: int, diary_id: int = None):
+    """首图提交数据库后调用：后台转存首图，预览档再按延迟预算补生成2K图"""
+    save_postcard_image_async(postcard_id, image_url, user_id, diary_id)
+    if tier == 'preview':
+        schedule_full_image(postcard_id, image_prompt, user_id, diary_id)
+
+
+def schedule_full_image(postcard_id: int, image_prompt: str, user_id: int, diary_id: int = None):
+    """
+    提交后台2K图生成任务
+
+    延迟预算规则：预计完成时间 =（排队任务数 / 并发数 + 1）× 平均生成耗时，
+    超过 POSTCARD_FULL_IMAGE_LATENCY_BUDGET 时跳过，明信片保留预览图。
+
+    Returns:
+        Future，被跳过时返回None
+    """
+    global _full_image_pending
+
+    if not POSTCARD_FULL_IMAGE_ENABLED or not image_prompt:
         return None
 
+    with _full_image_lock:
+        estimated = (_full_image_pending // POSTCARD_FULL_IMAGE_WORKERS + 1) * _full_image_avg_seconds
+        if estimated > POSTCARD_FULL_IMAGE_LATENCY_BUDGET:
+            print(f"[明信片图片] #{postcard_id} 2K图队列积压（{_full_image_pending}个，预计{estimated:.0f}s），跳过", file=sys.stderr)
+            return None
+        _full_image_pending += 1
+
+    return _full_image_executor.submit(_render_full_image, postcard_id, image_prompt, user_id, diary_id)
+
+
+def _render_full_image(postcard_id: int, image_prompt: str, user_id: int, diary_id: int = None):
+    """生成2K图并替换预览图（预览图保留在preview_url）"""
+    global _full_image_pending, _full_image_avg_seconds
 
-def delete_postcard_image(image_url: str) -> bool:
+    from app import app
+
+    started = time.time()
+    try:
+        image_url = generate_postcard_image(image_prompt, tier='full')
+    finally:
+        elapsed = time.time() - started
+        with _full_image_lock:
+            _full_image_pending -= 1
+            _full_image_avg_seconds = 0.8 * _full_image_avg_seconds + 0.2 * elapsed
+
+    if not image_url:
+        return
+
+    with app.app_context():
+        from models import Postcard, db
+
+        try:
+            # 预览图转存可能同时在修改image_url，用比较后更新并重试
+            for _ in range(3):
+                row = db.session.query(Postcard.image_url, Postcard.image_tier).filter_by(id=postcard_id).first()
+                if not row or row.image_tier != 'preview':
+                    return
+                updated = Postcard.query.filter_by(id=postcard_id, image_url=row.image_url).update(
+                    {'preview_url': row.image_url, 'image_url': image_url, 'image_tier': 'full',
+                     'image_pending_at': datetime.utcnow()},
+                    synchronize_session=False
+                )
+                db.session.commit()
+                if updated:
+                    print(f"[明信片图片] #{postcard_id} 2K图生成完成（{elapsed:.1f}s）", file=sys.stderr)
+                    save_postcard_image_async(postcard_id, image_url, user_id, diary_id)
+                    return
+        except Exception as e:
+            db.session.rollback()
+            print(f"[明信片图片] #{postcard_id} 2K图更新失败: {e}", file=sys.stderr)
+
+
+def delete_postcard_image(image_url: str, preview_url: str = None) -> bool:
     """
-    删除明信片图片文件
+    删除明信片图片文件（2K图生成后保留的预览图一并删除）
 
     Args:
         image_url: 图片的相对路径（如 /image/postcards/9/diary_123_abc.jpg）
+        preview_url: 预览图的相对路径（Postcard.preview_url）
 
     Returns:
-        是否删除成功
+        是否删除了文件
     """
-    if not image_url or not image_url.startswith('/image/postcards/'):
-        return False
+    from services.storage import get_storage, resolve_url
+    from services.fallback_library import is_library_key
 
-    try:
-        # 从URL路径构建实际文件路径
-        # /image/postcards/9/filename.jpg -> /image/postcards/9/filename.jpg
-        filepath = image_url  # Zeabur上直接使用/image/作为根目录
+    deleted = False
+    for url in (image_url, preview_url):
+        area, key = resolve_url(url)
+        if area != 'postcards' or is_library_key(key):
+            # 临时URL、备用图库图片（被多张明信片共用）不随明信片删除
+            continue
 
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            print(f"[明信片图片] 删除成功: {filepath}", file=sys.stderr)
-            return True
-        else:
-            print(f"[明信片图片] 文件不存在: {filepath}", file=sys.stderr)
-            return False
+        try:
+            if get_storage(area).delete(key):
+                print(f"[明信片图片] 删除成功: {url}", file=sys.stderr)
+                deleted = True
+            else:
+                print(f"[明信片图片] 文件不存在: {url}", file=sys.stderr)
+        except Exception as e:
+            print(f"[明信片图片] 删除失败: {str(e)}", file=sys.stderr)
+    return deleted
 
-    except Exception as e:
-        print(f"[明信片图片] 删除失败: {str(e)}", file=sys.stderr)
-        return False
+
+def upsert_postcard(connection, values: dict, on_existing: dict = None):
+    """
+    按 diary_id 唯一索引插入明信片（并发时只有一个请求插入成功），已存在时只更新 on_existing 里的列
+
+    Args:
+        connection: 当前事务的连接（db.session.connection()）
+        values: 新建时的各列值，必须包含 user_id、diary_id
+        on_existing: 已存在时要更新的列，None 表示不改已有记录
+
+    Returns:
+        (postcard_id, 是否新建)
+    """
+    from sqlalchemy import select, update
+    from models import Postcard
+    from services.db_utils import insert_ignore
+    from services.user_counters import adjust_counters
+
+    postcards = Postcard.__table__
+    result = connection.execute(insert_ignore(postcards, connection.dialect.name).values(**values))
+    if result.rowcount == 1:
+        # Core插入不触发mapper事件，自己维护用户的明信片计数
+        adjust_counters(connection, values['user_id'], postcard_count=1, unread_postcards=1)
+        return result.inserted_primary_key[0], True
+
+    if on_existing:
+        connection.execute(update(postcards).where(postcards.c.diary_id == values['diary_id']).values(**on_existing))
+    postcard_id = connection.execute(
+        select(postcards.c.id).where(postcards.c.diary_id == values['diary_id'])
+    ).scalar()
+    return postcard_id, False
 
 
 def create_postcard(
@@ -387,6 +726,7 @@ def create_postcard(
     Returns:
         创建的明信片数据字典
     """
+    from sqlalchemy.exc import IntegrityError
     from models import Postcard, db
 
     try:
@@ -405,8 +745,8 @@ def create_postcard(
         image_url = None
         local_image_path = None
         if generate_image:
-            # 先从豆包API获取临时URL
-            temp_image_url = generate_postcard_image(postcard_data['image_prompt'])
+            # 先从豆包API获取临时URL（同步接口直接生成完整图）
+            temp_image_url = generate_postcard_image(postcard_data['image_prompt'], tier='full')
             if temp_image_url:
                 # 下载并保存到本地（传入diary_id便于关联删除）
                 local_image_path = download_and_save_image(temp_image_url, user_id, diary_id)
@@ -422,13 +762,29 @@ def create_postcard(
             location_name=postcard_data['location_name'],
             message=postcard_data['message'],
             status='completed' if image_url else 'text_only',
+            image_tier='full' if image_url else None,
+            image_source='generated' if image_url else None,
+            # 同步转存失败、保留了临时URL时由定时扫描补转存
+            image_pending_at=datetime.utcnow() if image_url and not local_image_path else None,
             emotion_tags=emotions,
             emotion_intensity=intensity,
             mental_health_score=mental_health_score,
             generated_at=datetime.utcnow() if image_url else None
         )
-
         db.session.add(postcard)
+        try:
+            # flush 之后才有 id 和 created_at（首图耗时、日志都依赖它们）
+            db.session.flush()
+        except IntegrityError:
+            # 并发请求已为这篇日记创建了明信片（diary_id 唯一），返回已有的那张
+            db.session.rollback()
+            if local_image_path:
+                delete_postcard_image(local_image_path)
+            existing = Postcard.query.filter_by(diary_id=diary_id).first()
+            print(f"[明信片] 日记 {diary_id} 已有明信片 #{existing.id if existing else None}，跳过创建", file=sys.stderr)
+            return existing.to_dict() if existing else None
+        if generate_image and not image_url:
+            attach_fallback_image(postcard)
         db.session.commit()
 
         print(f"[明信片] 创建成功，ID: {postcard.id}", file=sys.stderr)
@@ -468,44 +824,45 @@ def create_postcard_async(
 
     # 先在主线程创建占位记录（避免重复创建）
     with app.app_context():
-        from models import Postcard, db
-
-        # 检查是否已存在
-        existing = Postcard.query.filter_by(diary_id=diary_id, user_id=user_id).first()
-        if existing:
-            print(f"[明信片] 已存在记录 #{existing.id}，跳过创建", file=sys.stderr)
-            postcard_id = existing.id
-        else:
-            # 创建占位记录
-            postcard = Postcard(
-                user_id=user_id,
-                diary_id=diary_id,
-                image_prompt='',  # 占位
-                location_name='生成中...',
-                message='小橘正在写信给你...',  # 占位消息
-                status='generating',  # 标记为生成中
-                emotion_tags=emotions,
-                emotion_intensity=intensity,
-                mental_health_score=mental_health_score
-            )
-            db.session.add(postcard)
-            db.session.commit()
-            postcard_id = postcard.id
+        from models import db
+
+        # 按 diary_id 唯一索引插入，并发重复请求只有一个创建成功
+        postcard_id, created = upsert_postcard(db.session.connection(), {
+            'user_id': user_id,
+            'diary_id': diary_id,
+            'image_prompt': '',  # 占位
+            'location_name': '生成中...',
+            'message': '小橘正在写信给你...',  # 占位消息
+            'status': 'generating',  # 标记为生成中
+            'emotion_tags': emotions,
+            'emotion_intensity': intensity,
+            'mental_health_score': mental_health_score
+        })
+        db.session.commit()
+        if created:
             print(f"[明信片] 创建占位记录 #{postcard_id}，开始后台生成", file=sys.stderr)
+        else:
+            print(f"[明信片] 已存在记录 #{postcard_id}，跳过创建", file=sys.stderr)
 
     def generate_task():
-        """后台生成任务：文本 + 图片"""
+        """
+        后台生成任务：文本 + 图片
+
+        按阶段使用数据库连接：读状态后即归还连接，调AI期间不占连接；
+        写回时按 status='generating' 比较后更新，记录已被其他请求完成/删除时放弃本次结果。
+        """
         with app.app_context():
             from models import Postcard, db
 
             try:
-                postcard = Postcard.query.get(postcard_id)
-                if not postcard:
+                status = db.session.query(Postcard.status).filter_by(id=postcard_id).scalar()
+                db.session.close()
+                if status is None:
                     print(f"[明信片] 记录 #{postcard_id} 不存在", file=sys.stderr)
                     return
 
                 # 如果已经完成，跳过
-                if postcard.status == 'completed':
+                if status == 'completed':
                     print(f"[明信片] 记录 #{postcard_id} 已完成，跳过", file=sys.stderr)
                     return
 
@@ -519,33 +876,51 @@ def create_postcard_async(
                     diary_content=diary_content,
                     trigger_event=trigger_event
                 )
+                image_prompt = postcard_data.get('image_prompt', '')
+                location_name = postcard_data.get('location_name', '温暖森林')
 
                 # 更新文本内容
-                postcard.image_prompt = postcard_data.get('image_prompt', '')
-                postcard.location_name = postcard_data.get('location_name', '温暖森林')
-                postcard.message = postcard_data.get('message', '')
+                updated = Postcard.query.filter_by(id=postcard_id, status='generating').update(
+                    {'image_prompt': image_prompt, 'location_name': location_name,
+                     'message': postcard_data.get('message', '')},
+                    synchronize_session=False
+                )
                 db.session.commit()
+                db.session.close()
+                if not updated:
+                    print(f"[明信片] #{postcard_id} 已不在生成中，放弃本次结果", file=sys.stderr)
+                    return
 
-                print(f"[明信片] #{postcard_id} 文本生成完成，场景: {postcard.location_name}", file=sys.stderr)
-
-                # 2. 生成图片
-                if postcard.image_prompt:
-                    temp_image_url = generate_postcard_image(postcard.image_prompt)
-                    if temp_image_url:
-                        # 下载并保存到本地持久化存储
-                        local_image_path = download_and_save_image(temp_image_url, user_id, diary_id)
-                        # 优先使用本地路径，失败则使用临时URL
-                        postcard.image_url = local_image_path if local_image_path else temp_image_url
-                        postcard.status = 'completed'
-                        postcard.generated_at = datetime.utcnow()
-                        print(f"[明信片] #{postcard_id} 图片生成完成，路径: {postcard.image_url}", file=sys.stderr)
-                    else:
-                        postcard.status = 'text_only'
-                        print(f"[明信片] #{postcard_id} 图片生成失败，仅保留文本", file=sys.stderr)
+                print(f"[明信片] #{postcard_id} 文本生成完成，场景: {location_name}", file=sys.stderr)
+
+                # 2. 生成图片（先出预览图，2K图在后台补生成）
+                temp_image_url, tier = generate_first_image(image_prompt) if image_prompt else (None, None)
+
+                postcard = Postcard.query.filter_by(id=postcard_id, status='generating').with_for_update().first()
+                if not postcard:
+                    db.session.rollback()
+                    print(f"[明信片] #{postcard_id} 已不在生成中，放弃图片结果", file=sys.stderr)
+                    return
+
+                if temp_image_url:
+                    # 先使用临时URL，下载线程转存到本地后再替换
+                    apply_first_image(postcard, temp_image_url, tier)
+                    postcard.status = 'completed'
+                    print(f"[明信片] #{postcard_id} 图片生成完成", file=sys.stderr)
+                elif not image_prompt:
+                    postcard.status = 'text_only'
+                elif attach_fallback_image(postcard):
+                    print(f"[明信片] #{postcard_id} 图片生成失败，使用备用图库", file=sys.stderr)
                 else:
                     postcard.status = 'text_only'
+                    print(f"[明信片] #{postcard_id} 图片生成失败，仅保留文本", file=sys.stderr)
 
                 db.session.commit()
+                db.session.close()
+
+                # 下载持久化存储交给下载线程池，不占用生成线程
+                if temp_image_url:
+                    schedule_image_followups(postcard_id, temp_image_url, tier, image_prompt, user_id, diary_id)
 
             except Exception as e:
                 print(f"[明信片] #{postcard_id} 生成失败: {e}", file=sys.stderr)
@@ -554,11 +929,12 @@ def create_postcard_async(
 
                 # 即使失败，也更新状态
                 try:
-                    postcard = Postcard.query.get(postcard_id)
-                    if postcard and postcard.status == 'generating':
-                        postcard.status = 'failed'
-                        postcard.message = '生成失败，请稍后重试'
-                        db.session.commit()
+                    db.session.rollback()
+                    Postcard.query.filter_by(id=postcard_id, status='generating').update(
+                        {'status': 'failed', 'message': '生成失败，请稍后重试'},
+                        synchronize_session=False
+                    )
+                    db.session.commit()
                 except:
                     pass
 
@@ -622,6 +998,6 @@ def mark_postcard_read(postcard_id: int, user_id: int) -> bool:
 
 
 def get_unread_count(user_id: int) -> int:
-    """获取用户未读明信片数量"""
-    from models import Postcard
-    return Postcard.query.filter_by(user_id=user_id, is_read=False).count()
+    """获取用户未读明信片数量（读用户行上的计数缓存）"""
+    from models import User, db
+    return db.session.query(User.unread_postcards).filter(User.id == user_id).scalar() or 0
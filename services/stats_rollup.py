@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+统计汇总表维护
+
+把新用户、日记、明信片按小时和按天汇总到 stats_hourly / stats_daily，
+管理后台的趋势接口只读汇总表，查询成本与原始表大小无关。
+
+访问量（visits / server_errors）由访问日志写入器在采样之前计数、直接累加进汇总表（services/access_log.py），
+独立访客取自访客草图（services/visitor_sketch.py），这里不再从采样过的 access_logs 统计流量，也不会覆盖这两列。
+
+增量方式：从汇总表已有的最新时间点往前回看 STATS_ROLLUP_LOOKBACK_HOURS 小时开始重算
+（覆盖还没结束的小时、刚生成完成的明信片状态），更早的时段不再重复计算。
+重算结果按时间桶 upsert（区间内每个小时/每天都写一行），可以重复执行，并发执行也不会主键冲突。
+
+触发方式：
+1. 定时线程（ensure_scheduler，每个进程一个）每隔 STATS_ROLLUP_INTERVAL 秒运行一次：
+   先抢任务锁（MySQL GET_LOCK），其他worker刚刷新过就跳过，不占用访问日志写入线程
+2. 命令行：flask rollup-stats [--rebuild]（同样先抢锁）
+
+--rebuild 从最早的数据开始重算业务列，不删除任何汇总行：已归档（不在 access_logs 里）的日子保留原有的访问量和独立访客；
+还没有计数过访问量的时间桶（访问量计数上线之前的历史）用仍在 access_logs 里的明细补上。
+"""
+
+import os
+import sys
+import time
+import threading
+from datetime import datetime, date, timedelta
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 定时线程刷新汇总的间隔（秒）
+STATS_ROLLUP_INTERVAL = int(os.environ.get('STATS_ROLLUP_INTERVAL', 300))
+# 每次刷新回看多少小时重新计算
+STATS_ROLLUP_LOOKBACK_HOURS = int(os.environ.get('STATS_ROLLUP_LOOKBACK_HOURS', 2))
+
+# 单次汇总查询覆盖的最长时间，避免全量重建时一次扫描过多数据
+_HOURLY_CHUNK = timedelta(days=1)
+_DAILY_CHUNK = timedelta(days=31)
+
+# MySQL 命名锁
+_LOCK_NAME = 'stats_rollup'
+
+_refresh_lock = threading.Lock()
+_start_lock = threading.Lock()
+_scheduler = None
+_scheduler_pid = None
+
+
+def _hour_expr(column, dialect: str):
+    """把时间列截断到小时（返回字符串或datetime，由 _to_datetime 统一转换）"""
+    from sqlalchemy import func
+    if dialect == 'sqlite':
+        return func.strftime('%Y-%m-%d %H:00:00', column)
+    if dialect == 'mysql':
+        return func.date_format(column, '%Y-%m-%d %H:00:00')
+    return func.date_trunc('hour', column)
+
+
+def _day_expr(column, dialect: str):
+    from sqlalchemy import func
+    return func.date(column)
+
+
+def _to_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S')
+
+
+def _to_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _collect(bucket_expr, start: datetime, end: datetime) -> dict:
+    """按时间桶汇总 [start, end) 区间内的业务指标"""
+    from sqlalchemy import func
+    from extensions import db
+    from models import User, EmotionDiary, Postcard
+
+    metrics = {}
+
+    def bucket(key):
+        return metrics.setdefault(key, _empty_metrics())
+
+    for model, field in ((User, 'new_users'), (EmotionDiary, 'diaries')):
+        model_bucket = bucket_expr(model.created_at)
+        for key, count in db.session.query(model_bucket, func.count(model.id)).filter(
+            model.created_at >= start, model.created_at < end
+        ).group_by(model_bucket):
+            bucket(key)[field] = count
+
+    postcard_bucket = bucket_expr(Postcard.created_at)
+    for key, status, count in db.session.query(postcard_bucket, Postcard.status, func.count(Postcard.id)).filter(
+        Postcard.created_at >= start, Postcard.created_at < end
+    ).group_by(postcard_bucket, Postcard.status):
+        item = bucket(key)
+        item['postcards'] += count
+        item['postcards_by_status'][status or 'unknown'] = count
+
+    return metrics
+
+
+METRIC_COLUMNS = ('unique_visitors', 'new_users', 'diaries', 'postcards', 'postcards_by_status')
+
+
+def _empty_metrics() -> dict:
+    return {'unique_visitors': 0, 'new_users': 0, 'diaries': 0, 'postcards': 0, 'postcards_by_status': {}}
+
+
+def _existing_unique_visitors(model, key_column: str, start, end) -> dict:
+    """汇总表里已有的独立访客数（没有草图的时间桶沿用原值，如草图上线前的日子）"""
+    from extensions import db
+
+    key = getattr(model, key_column)
+    return dict(db.session.query(key, model.unique_visitors).filter(key >= start, key < end))
+
+
+def _upsert(model, key_column: str, rows: list):
+    """按时间桶覆盖写入汇总行（没有数据的时间桶也写一行0，覆盖之前的结果；访问量列保持不变）"""
+    from extensions import db
+    from services.db_utils import upsert
+
+    if not rows:
+        return
+    with db.engine.begin() as connection:
+        connection.execute(
+            upsert(model.__table__, connection.dialect.name, [key_column], list(METRIC_COLUMNS) + ['updated_at']),
+            rows
+        )
+
+
+def _backfill_traffic(model, key_column: str, bucket_expr, to_key, start, end):
+    """
+    用 access_logs 明细补上还没有访问量的时间桶（只在 --rebuild 时执行）
+
+    已经有访问量（写入器计数过，或者明细已归档前算过）的时间桶保持不变
+    """
+    from sqlalchemy import func, case
+    from extensions import db
+    from models import AccessLog
+    from services.db_utils import upsert
+
+    log_bucket = bucket_expr(AccessLog.created_at)
+    counts = {to_key(key): (visits, int(server_errors or 0)) for key, visits, server_errors in db.session.query(
+        log_bucket,
+        func.count(AccessLog.id),
+        func.sum(case((AccessLog.status_code >= 500, 1), else_=0))
+    ).filter(AccessLog.created_at >= start, AccessLog.created_at < end).group_by(log_bucket)}
+    if not counts:
+        return
+
+    key = getattr(model, key_column)
+    counted = {bucket for bucket, visits in db.session.query(key, model.visits).filter(
+        key.in_(list(counts))
+    ) if visits}
+    rows = [{key_column: bucket, 'visits': visits, 'server_errors': server_errors}
+            for bucket, (visits, server_errors) in counts.items() if bucket not in counted]
+    if not rows:
+        return
+    with db.engine.begin() as connection:
+        connection.execute(upsert(model.__table__, connection.dialect.name, [key_column], ['visits', 'server_errors']),
+                           rows)
+
+
+def _rollup_hours(start: datetime, end: datetime, dialect: str, backfill: bool = False):
+    from models import StatsHourly
+    from services.visitor_sketch import hourly_unique_visitors
+
+    metrics = {_to_datetime(key): values
+               for key, values in _collect(lambda column: _hour_expr(column, dialect), start, end).items()}
+    sketch_counts = hourly_unique_visitors(start.date(), (end - timedelta(seconds=1)).date())
+    existing = _existing_unique_visitors(StatsHourly, 'bucket_start', start, end)
+    now = datetime.utcnow()
+    rows = []
+    hour = start
+    while hour < end:
+        row = dict(metrics.get(hour) or _empty_metrics(), bucket_start=hour, updated_at=now)
+        row['unique_visitors'] = sketch_counts.get(hour, existing.get(hour) or 0)
+        rows.append(row)
+        hour += timedelta(hours=1)
+    _upsert(StatsHourly, 'bucket_start', rows)
+    if backfill:
+        _backfill_traffic(StatsHourly, 'bucket_start', lambda column: _hour_expr(column, dialect), _to_datetime,
+                          start, end)
+
+
+def _rollup_days(start: date, end: date, dialect: str, backfill: bool = False):
+    """汇总 [start, end] 的每一天"""
+    from models import StatsDaily
+    from services.visitor_sketch import daily_unique_visitors
+
+    start_at = datetime.combine(start, datetime.min.time())
+    end_at = datetime.combine(end + timedelta(days=1), datetime.min.time())
+    metrics = {_to_date(key): values
+               for key, values in _collect(lambda column: _day_expr(column, dialect), start_at, end_at).items()}
+    sketch_counts = daily_unique_visitors(start, end)
+    existing = _existing_unique_visitors(StatsDaily, 'day', start, end + timedelta(days=1))
+    now = datetime.utcnow()
+    rows = []
+    day = start
+    while day <= end:
+        row = dict(metrics.get(day) or _empty_metrics(), day=day, updated_at=now)
+        row['unique_visitors'] = sketch_counts.get(day, existing.get(day) or 0)
+        rows.append(row)
+        day += timedelta(days=1)
+    _upsert(StatsDaily, 'day', rows)
+    if backfill:
+        _backfill_traffic(StatsDaily, 'day', lambda column: _day_expr(column, dialect), _to_date, start_at, end_at)
+
+
+def _earliest_record() -> datetime:
+    from sqlalchemy import func
+    from extensions import db
+    from models import AccessLog, User, EmotionDiary, Postcard
+
+    candidates = [
+        db.session.query(func.min(model.created_at)).scalar()
+        for model in (AccessLog, User, EmotionDiary, Postcard)
+    ]
+    candidates = [_to_datetime(value) for value in candidates if value is not None]
+    return min(candidates) if candidates else None
+
+
+def refresh_rollups(rebuild: bool = False) -> dict:
+    """
+    刷新汇总表（需要在应用上下文中调用）
+
+    Args:
+        rebuild: 从最早的数据开始重算业务列，并补上没有访问量的时间桶
+
+    Returns:
+        dict: 本次重算的时间范围
+    """
+    from sqlalchemy import func
+    from extensions import db
+    from models import StatsHourly
+
+    dialect = db.engine.dialect.name
+    now = datetime.utcnow()
+    current_hour = now.replace(minute=0, second=0, microsecond=0)
+
+    # 只有访问量计数、还没被汇总过的行 updated_at 为空
+    latest = None if rebuild else db.session.query(func.max(StatsHourly.bucket_start)).filter(
+        StatsHourly.updated_at.isnot(None)
+    ).scalar()
+    if latest is not None:
+        start = _to_datetime(latest) - timedelta(hours=STATS_ROLLUP_LOOKBACK_HOURS)
+    else:
+        start = _earliest_record()
+        if start is None:
+            return {'start': None, 'end': None}
+    start = start.replace(minute=0, second=0, microsecond=0)
+    end = current_hour + timedelta(hours=1)
+
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + _HOURLY_CHUNK, end)
+        _rollup_hours(chunk_start, chunk_end, dialect, backfill=rebuild)
+        chunk_start = chunk_end
+
+    day = start.date()
+    while day <= now.date():
+        last_day = min(day + _DAILY_CHUNK - timedelta(days=1), now.date())
+        _rollup_days(day, last_day, dialect, backfill=rebuild)
+        day = last_day + timedelta(days=1)
+
+    # 结束只读事务，归还连接
+    db.session.commit()
+    return {'start': start.isoformat(), 'end': end.isoformat()}
+
+
+def _claim(connection) -> bool:
+    """
+    抢汇总任务锁（与 connection 绑定，连接关闭或 RELEASE_LOCK 时释放）
+
+    MySQL 用命名锁 GET_LOCK，多个worker同一时间只有一个在算；
+    其他数据库（SQLite开发环境是单进程）只用进程内的锁
+    """
+    from sqlalchemy import text
+    if connection.dialect.name != 'mysql':
+        return True
+    return connection.execute(text('SELECT GET_LOCK(:name, 0)'), {'name': _LOCK_NAME}).scalar() == 1
+
+
+def _release(connection):
+    from sqlalchemy import text
+    if connection.dialect.name == 'mysql':
+        connection.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': _LOCK_NAME})
+
+
+def _refreshed_recently() -> bool:
+    """其他worker刚刷新过（汇总行的 updated_at 在半个间隔之内）"""
+    from sqlalchemy import func
+    from extensions import db
+    from models import StatsHourly
+
+    latest = db.session.query(func.max(StatsHourly.updated_at)).scalar()
+    db.session.commit()
+    return latest is not None and datetime.utcnow() - _to_datetime(latest) < timedelta(seconds=STATS_ROLLUP_INTERVAL / 2)
+
+
+def run_locked(rebuild: bool = False, force: bool = False) -> dict:
+    """
+    抢到汇总任务锁后刷新汇总表（需要在应用上下文中调用）
+
+    Args:
+        rebuild: 从最早的数据开始全部重算
+        force: 不检查其他worker是否刚刷新过
+
+    Returns:
+        dict: refresh_rollups 的结果，没抢到锁或不需要刷新时返回 None
+    """
+    from extensions import db
+
+    if not _refresh_lock.acquire(blocking=False):
+        return None
+    try:
+        with db.engine.connect() as connection:
+            if not _claim(connection):
+                return None
+            try:
+                if not force and _refreshed_recently():
+                    return None
+                return refresh_rollups(rebuild=rebuild)
+            finally:
+                _release(connection)
+    finally:
+        _refresh_lock.release()
+
+
+def _scheduler_loop():
+    from app import app
+    from extensions import db
+
+    while True:
+        time.sleep(STATS_ROLLUP_INTERVAL)
+        with app.app_context():
+            try:
+                run_locked()
+            except Exception as e:
+                db.session.rollback()
+                print(f"[统计汇总] 刷新失败: {e}", file=sys.stderr)
+            finally:
+                db.session.remove()
+
+
+def ensure_scheduler():
+    """按进程启动定时汇总线程（gunicorn 每个worker各一个，运行前抢锁，同一时间只有一个worker在算）"""
+    global _scheduler, _scheduler_pid
+    pid = os.getpid()
+    if _scheduler is not None and _scheduler_pid == pid and _scheduler.is_alive():
+        return
+    with _start_lock:
+        if _scheduler is not None and _scheduler_pid == pid and _scheduler.is_alive():
+            return
+        _scheduler = threading.Thread(target=_scheduler_loop, name='stats-rollup', daemon=True)
+        _scheduler_pid = pid
+        _scheduler.start()
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+文件存储服务
+
+把明信片图片、用户上传图片的读写统一到一个存储接口，支持两种后端：
+1. local: 本地磁盘（默认，兼容原来的 /image/postcards 和 static/uploads 目录）
+2. s3: S3兼容对象存储（AWS S3 / MinIO / 火山TOS等），图片通过预签名URL重定向，由对象存储直接返回字节
+
+数据库里保存的图片URL与后端无关（明信片 /image/postcards/...，上传图片 /static/uploads/...），
+切换后端不需要修改历史数据，多台Web节点也不再依赖共享磁盘。
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 存储后端：local / s3
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local').lower()
+
+# 本地存储目录
+POSTCARD_UPLOAD_FOLDER = os.environ.get('POSTCARD_UPLOAD_FOLDER', '/image/postcards')
+UPLOAD_IMAGE_FOLDER = os.environ.get('UPLOAD_IMAGE_FOLDER', os.path.join(os.getcwd(), 'static', 'uploads'))
+
+# S3兼容存储配置
+S3_BUCKET = os.environ.get('S3_BUCKET')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # MinIO等自建服务填写，如 http://minio:9000
+S3_REGION = os.environ.get('S3_REGION', 'us-east-1')
+S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID')
+S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY')
+S3_PRESIGN_EXPIRES = int(os.environ.get('S3_PRESIGN_EXPIRES', 3600))
+S3_PUBLIC_BASE_URL = os.environ.get('S3_PUBLIC_BASE_URL')  # 公开读的桶/CDN域名，配置后直接重定向不签名
+
+# 存储区域 -> 写进数据库的URL前缀（两种后端相同；对象key前缀即区域名）
+STORAGE_AREAS = {
+    'postcards': '/image/postcards',
+    'uploads': '/static/uploads',
+}
+# 只用于解析旧数据：S3后端曾经把上传图片写成 /image/uploads/...
+_LEGACY_URL_PREFIXES = {
+    '/image/uploads': 'uploads',
+}
+
+# 导入boto3（仅S3后端需要）
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+    ClientError = Exception
+
+
+class StorageObject:
+    """存储中的一个对象（用于遍历）"""
+
+    __slots__ = ('key', 'size', 'modified_at')
+
+    def __init__(self, key: str, size: int, modified_at: datetime):
+        self.key = key
+        self.size = size
+        self.modified_at = modified_at
+
+
+class LocalStorage:
+    """本地磁盘存储"""
+
+    backend = 'local'
+
+    def __init__(self, root: str, url_prefix: str):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"非法的存储key: {key}")
+        return path
+
+    def url_for(self, key: str) -> str:
+        return f"{self.url_prefix}/{key}"
+
+    def staging_path(self, key: str) -> str:
+        """返回写入该对象时使用的本地路径（本地存储直接写到最终位置）"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def discard_staging(self, path: str):
+        """写入失败时清理 staging_path（本地存储就是最终位置，下载器失败时不会留下文件）"""
+
+    def save_file(self, key: str, local_path: str, content_type: str = None):
+        target = self._path(key)
+        if os.path.abspath(local_path) != os.path.abspath(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(local_path, target)
+
+    def save_fileobj(self, key: str, fileobj, content_type: str = None):
+        target = self.staging_path(key)
+        with open(target, 'wb') as f:
+            shutil.copyfileobj(fileobj, f, length=256 * 1024)
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def delete(self, key: str) -> bool:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        return True
+
+    def iter_objects(self, prefix: str = ''):
+        """按目录流式遍历对象（不会一次性列出全部文件）"""
+        start = os.path.join(self.root, prefix) if prefix else self.root
+        if not os.path.isdir(start):
+            return
+        stack = [start]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat()
+                            key = os.path.relpath(entry.path, self.root).replace(os.sep, '/')
+                            yield StorageObject(key, stat.st_size, datetime.utcfromtimestamp(stat.st_mtime))
+            except FileNotFoundError:
+                continue
+
+    def serve(self, key: str):
+        from flask import send_from_directory
+        return send_from_directory(self.root, key)
+
+
+class S3Storage:
+    """S3兼容对象存储（MinIO等）"""
+
+    backend = 's3'
+
+    def __init__(self, bucket: str, key_prefix: str, url_prefix: str):
+        if boto3 is None:
+            raise RuntimeError("S3存储需要安装 boto3: pip install boto3")
+        if not bucket:
+            raise RuntimeError("S3存储未配置 S3_BUCKET")
+        self.bucket = bucket
+        self.key_prefix = key_prefix.strip('/')
+        self.url_prefix = url_prefix.rstrip('/')
+        self.client = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL,
+            region_name=S3_REGION,
+            aws_access_key_id=S3_ACCESS_KEY_ID,
+            aws_secret_access_key=S3_SECRET_ACCESS_KEY
+        )
+
+    def _object_key(self, key: str) -> str:
+        if '..' in key.split('/'):
+            raise ValueError(f"非法的存储key: {key}")
+        return f"{self.key_prefix}/{key}"
+
+    def url_for(self, key: str) -> str:
+        return f"{self.url_prefix}/{key}"
+
+    def staging_path(self, key: str) -> str:
+        """对象存储需要先写到本地临时文件，再由save_file上传"""
+        fd, path = tempfile.mkstemp(prefix='storage_', suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        return path
+
+    def discard_staging(self, path: str):
+        """下载或上传失败时删除 staging_path 建的临时文件（成功时由 save_file 删除）"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def save_file(self, key: str, local_path: str, content_type: str = None):
+        extra_args = {'ContentType': content_type} if content_type else None
+        try:
+            self.client.upload_file(local_path, self.bucket, self._object_key(key), ExtraArgs=extra_args)
+        finally:
+            try:
+                os.remove(local_path)
+            except OSError:
+                pass
+
+    def save_fileobj(self, key: str, fileobj, content_type: str = None):
+        extra_args = {'ContentType': content_type} if content_type else None
+        self.client.upload_fileobj(fileobj, self.bucket, self._object_key(key), ExtraArgs=extra_args)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except ClientError:
+            return False
+
+    def delete(self, key: str) -> bool:
+        if not self.exists(key):
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        return True
+
+    def iter_objects(self, prefix: str = ''):
+        """分页遍历对象（每页最多1000个）"""
+        paginator = self.client.get_paginator('list_objects_v2')
+        full_prefix = f"{self.key_prefix}/{prefix}" if prefix else f"{self.key_prefix}/"
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=full_prefix):
+            for item in page.get('Contents', []):
+                key = item['Key'][len(self.key_prefix) + 1:]
+                modified_at = item['LastModified'].replace(tzinfo=None)
+                yield StorageObject(key, item['Size'], modified_at)
+
+    def presigned_url(self, key: str, expires: int = None) -> str:
+        if S3_PUBLIC_BASE_URL:
+            return f"{S3_PUBLIC_BASE_URL.rstrip('/')}/{self._object_key(key)}"
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self._object_key(key)},
+            ExpiresIn=expires or S3_PRESIGN_EXPIRES
+        )
+
+    def serve(self, key: str):
+        from flask import redirect
+        response = redirect(self.presigned_url(key), code=302)
+        # 允许浏览器在签名有效期内缓存重定向
+        response.headers['Cache-Control'] = f"private, max-age={max(0, S3_PRESIGN_EXPIRES - 60)}"
+        return response
+
+
+_storages = {}
+
+
+def get_storage(area: str):
+    """
+    获取指定区域的存储实例（单例）
+
+    Args:
+        area: 'postcards'（明信片图片）或 'uploads'（用户上传图片）
+    """
+    if area not in STORAGE_AREAS:
+        raise ValueError(f"未知的存储区域: {area}")
+
+    storage = _storages.get(area)
+    if storage is None:
+        if STORAGE_BACKEND == 's3':
+            storage = S3Storage(S3_BUCKET, key_prefix=area, url_prefix=STORAGE_AREAS[area])
+        elif area == 'postcards':
+            storage = LocalStorage(POSTCARD_UPLOAD_FOLDER, STORAGE_AREAS[area])
+        else:
+            # 本地上传图片仍由Flask静态目录提供
+            storage = LocalStorage(UPLOAD_IMAGE_FOLDER, STORAGE_AREAS[area])
+        _storages[area] = storage
+        print(f"[存储] {area} 使用 {storage.backend} 后端", file=sys.stderr)
+    return storage
+
+
+def resolve_url(url: str):
+    """
+    把数据库中保存的图片URL解析为 (区域, key)
+
+    支持 /image/postcards/..., /static/uploads/...，以及旧的 /image/uploads/...
+    无法识别（如豆包临时URL）返回 (None, None)
+    """
+    if not url:
+        return None, None
+    path = url.split('?', 1)[0]
+    prefixes = [(prefix, area) for area, prefix in STORAGE_AREAS.items()] + list(_LEGACY_URL_PREFIXES.items())
+    for prefix, area in prefixes:
+        if path.startswith(prefix + '/'):
+            return area, path[len(prefix) + 1:]
+    return None, None
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+存储文件垃圾回收
+
+把存储中的图片与数据库引用做对账：
+1. 明信片图片：与 Postcard.image_url / preview_url 及备用图库对账（重新生成后被替换的旧图会成为孤儿文件）
+2. 上传图片：与 EmotionDiary.images 对账（上传后没有保存到日记的图片），按 diary_images 关联表查引用
+3. 下载中断残留的 .part 临时文件
+
+超过保留期且未被引用的文件会被删除；仍被引用的文件按用户累计占用，写入 user_storage_usage 表供管理后台展示。
+
+整个过程按批处理：存储端流式遍历对象，每批只按这一批文件的URL/key查询对应的数据库记录（都走索引）。
+内存占用与存储中的文件总数、日记数无关（与批大小和用户数成正比）。
+
+使用方式：flask gc-files [--dry-run] [--grace-hours 24] [--batch-size 500]
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 未被引用的文件保留多久才删除（小时），给"已上传未保存日记"、"后台下载中"留出时间
+STORAGE_GC_GRACE_HOURS = int(os.environ.get('STORAGE_GC_GRACE_HOURS', 24))
+# 每批对账的文件数
+STORAGE_GC_BATCH_SIZE = int(os.environ.get('STORAGE_GC_BATCH_SIZE', 500))
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _find_postcard_owners(storage, batch):
+    """
+    返回这一批明信片图片中被引用的 {key: user_id}（包括2K图和保留的预览图）
+
+    备用图库的图片由多张明信片共用，不计入用户占用，user_id 为 None
+    """
+    from sqlalchemy import or_
+    from extensions import db
+    from models import Postcard, FallbackImage
+    from services.fallback_library import is_library_key
+
+    url_to_key = {storage.url_for(obj.key): obj.key for obj in batch}
+    urls = list(url_to_key.keys())
+    rows = db.session.query(Postcard.image_url, Postcard.preview_url, Postcard.user_id).filter(
+        or_(Postcard.image_url.in_(urls), Postcard.preview_url.in_(urls))
+    ).all()
+
+    owners = {}
+    for image_url, preview_url, user_id in rows:
+        for url in (image_url, preview_url):
+            if url in url_to_key:
+                key = url_to_key[url]
+                owners[key] = None if is_library_key(key) else user_id
+
+    library_urls = [url for url, key in url_to_key.items() if is_library_key(key)]
+    if library_urls:
+        for (image_url,) in db.session.query(FallbackImage.image_url).filter(
+            FallbackImage.image_url.in_(library_urls)
+        ):
+            owners[url_to_key[image_url]] = None
+    return owners
+
+
+def _save_usage(usage: dict):
+    """用本次对账结果整体替换用户存储占用统计"""
+    from extensions import db
+    from models import UserStorageUsage
+
+    now = datetime.utcnow()
+    UserStorageUsage.query.delete()
+    db.session.bulk_insert_mappings(UserStorageUsage, [
+        {
+            'user_id': user_id,
+            'postcard_files': counts['postcards'][0],
+            'postcard_bytes': counts['postcards'][1],
+            'upload_files': counts['uploads'][0],
+            'upload_bytes': counts['uploads'][1],
+            'updated_at': now
+        }
+        for user_id, counts in usage.items()
+    ])
+    db.session.commit()
+
+
+def collect_garbage(grace_hours: int = None, batch_size: int = None, dry_run: bool = False) -> dict:
+    """
+    执行一次存储对账（需要在应用上下文中调用）
+
+    Args:
+        grace_hours: 未引用文件的保留时间，默认 STORAGE_GC_GRACE_HOURS
+        batch_size: 每批对账的文件数，默认 STORAGE_GC_BATCH_SIZE
+        dry_run: 只统计不删除，也不写入占用统计
+
+    Returns:
+        dict: 各区域的扫描/删除统计
+    """
+    from extensions import db
+    from services.storage import get_storage
+    from services.image_downloader import PARTIAL_SUFFIX
+    from services.diary_images import find_upload_owners
+
+    grace_hours = STORAGE_GC_GRACE_HOURS if grace_hours is None else grace_hours
+    batch_size = batch_size or STORAGE_GC_BATCH_SIZE
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+    started = time.time()
+
+    usage = {}
+    summary = {}
+
+    for area in ('postcards', 'uploads'):
+        storage = get_storage(area)
+        stats = {
+            'scanned': 0, 'referenced': 0, 'referenced_bytes': 0,
+            'orphaned': 0, 'deleted': 0, 'deleted_bytes': 0, 'kept_recent': 0
+        }
+
+        for batch in _batched(storage.iter_objects(), batch_size):
+            stats['scanned'] += len(batch)
+            candidates = [obj for obj in batch if not obj.key.endswith(PARTIAL_SUFFIX)]
+
+            if candidates:
+                if area == 'postcards':
+                    owners = _find_postcard_owners(storage, candidates)
+                else:
+                    owners = find_upload_owners([obj.key for obj in candidates])
+            else:
+                owners = {}
+            # 每批查询完释放会话中的对象
+            db.session.expunge_all()
+
+            for obj in batch:
+                if obj.key in owners:
+                    user_id = owners[obj.key]
+                    if user_id is not None:
+                        counts = usage.setdefault(user_id, {'postcards': [0, 0], 'uploads': [0, 0]})
+                        counts[area][0] += 1
+                        counts[area][1] += obj.size
+                    stats['referenced'] += 1
+                    stats['referenced_bytes'] += obj.size
+                    continue
+
+                stats['orphaned'] += 1
+                if obj.modified_at > cutoff:
+                    stats['kept_recent'] += 1
+                    continue
+
+                if dry_run:
+                    print(f"[存储回收] (dry-run) 将删除 {area}/{obj.key}", file=sys.stderr)
+                    continue
+                try:
+                    if storage.delete(obj.key):
+                        stats['deleted'] += 1
+                        stats['deleted_bytes'] += obj.size
+                except Exception as e:
+                    print(f"[存储回收] 删除失败 {area}/{obj.key}: {e}", file=sys.stderr)
+
+        summary[area] = stats
+        print(f"[存储回收] {area}: {stats}", file=sys.stderr)
+
+    if not dry_run:
+        _save_usage(usage)
+
+    summary['users'] = len(usage)
+    summary['dry_run'] = dry_run
+    summary['elapsed_seconds'] = round(time.time() - started, 2)
+    return summary
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+用户计数缓存
+
+users 表上冗余保存三个计数，热点读取（未读数轮询、明信片列表、管理后台用户列表）
+直接读用户行，不再对 postcards / emotion_diaries 做 COUNT：
+
+- unread_postcards: 未读明信片数
+- postcard_count:   明信片总数
+- diary_count:      日记总数
+
+维护方式：ORM flush 时的 mapper 事件里对 users 行执行 `col = col ± 1`，
+与插入/删除/标记已读在同一个事务里提交或回滚，并发写入也不会丢失计数。
+绕过ORM的单条插入在同一事务里调用 adjust_counters()；
+绕过ORM的批量 UPDATE/DELETE 不会触发事件，这类改动之后执行 flask recount-user-counters 修复。
+"""
+
+import sys
+
+from sqlalchemy import event, update, func, inspect as sa_inspect
+
+
+def adjust_counters(connection, user_id: int, **deltas):
+    """
+    对一个用户的计数做增量更新（在当前flush/事务的连接上执行）
+
+    用 Core 语句直接插入明信片、日记（不触发mapper事件）时由调用方自己调用
+    """
+    from models import User
+
+    if not user_id:
+        return
+    users = User.__table__
+    values = {name: users.c[name] + delta for name, delta in deltas.items() if delta}
+    if values:
+        connection.execute(update(users).where(users.c.id == user_id).values(**values))
+
+
+def _postcard_inserted(mapper, connection, target):
+    adjust_counters(connection, target.user_id, postcard_count=1, unread_postcards=0 if target.is_read else 1)
+
+
+def _postcard_deleted(mapper, connection, target):
+    adjust_counters(connection, target.user_id, postcard_count=-1, unread_postcards=0 if target.is_read else -1)
+
+
+def _postcard_updated(mapper, connection, target):
+    history = sa_inspect(target).attrs.is_read.history
+    if not history.has_changes():
+        return
+    was_read = bool(history.deleted[0]) if history.deleted else False
+    if was_read != bool(target.is_read):
+        adjust_counters(connection, target.user_id, unread_postcards=1 if was_read else -1)
+
+
+def _diary_inserted(mapper, connection, target):
+    adjust_counters(connection, target.user_id, diary_count=1)
+
+
+def _diary_deleted(mapper, connection, target):
+    adjust_counters(connection, target.user_id, diary_count=-1)
+
+
+_LISTENERS = (
+    ('Postcard', 'after_insert', _postcard_inserted),
+    ('Postcard', 'after_delete', _postcard_deleted),
+    ('Postcard', 'after_update', _postcard_updated),
+    ('EmotionDiary', 'after_insert', _diary_inserted),
+    ('EmotionDiary', 'after_delete', _diary_deleted),
+)
+
+
+def register_counter_events():
+    """注册计数维护事件（重复调用不会重复注册）"""
+    import models
+
+    for model_name, name, listener in _LISTENERS:
+        model = getattr(models, model_name)
+        if not event.contains(model, name, listener):
+            event.listen(model, name, listener)
+
+
+def recount_user_counters(user_ids: list = None) -> int:
+    """
+    按实际数据重新计算用户计数（需要在应用上下文中调用）
+
+    Args:
+        user_ids: 只修复这些用户，默认全部
+
+    Returns:
+        int: 更新的用户数
+    """
+    from extensions import db
+    from models import User, Postcard, EmotionDiary
+
+    users = User.__table__
+
+    def counted(model, *conditions):
+        return db.session.query(func.count(model.id)).filter(
+            model.user_id == users.c.id, *conditions
+        ).scalar_subquery()
+
+    statement = update(users).values(
+        diary_count=counted(EmotionDiary),
+        postcard_count=counted(Postcard),
+        unread_postcards=counted(Postcard, Postcard.is_read.is_(False))
+    )
+    if user_ids:
+        statement = statement.where(users.c.id.in_(user_ids))
+
+    result = db.session.execute(statement)
+    db.session.commit()
+    print(f"[用户计数] 已重新计算 {result.rowcount} 个用户", file=sys.stderr)
+    return result.rowcount
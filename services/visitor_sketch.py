@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+独立访客草图
+
+每个请求在采样、入队之前（services/access_log.py record）就把IP加入当天的 HyperLogLog 草图
+（全站、路径前缀、所在小时），访问日志采样或队列满丢弃都不影响独立访客数；
+访问日志写入线程每隔 VISITOR_SKETCH_PERSIST_INTERVAL 秒把内存中的草图合并进 visitor_sketches 表。
+草图合并是幂等的（寄存器取最大值），当天的草图保留在内存里反复合并也不会重复计数。
+
+查询任意天数的独立访客只需要读取并合并对应天数的草图，不再扫描访问日志做 COUNT(DISTINCT)。
+"""
+
+import os
+import sys
+import time
+import threading
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+from services.hll import HyperLogLog
+
+load_dotenv()
+
+# 内存草图合并进数据库的间隔（秒）
+VISITOR_SKETCH_PERSIST_INTERVAL = int(os.environ.get('VISITOR_SKETCH_PERSIST_INTERVAL', 60))
+
+ALL_SCOPE = '*'
+# 按小时的全站草图 hour:00 ~ hour:23（统计汇总表每小时的独立访客），不计入路径前缀排行
+HOUR_SCOPE_PREFIX = 'hour:'
+
+_lock = threading.Lock()
+_sketches = {}   # (day, scope) -> HyperLogLog
+_dirty = set()
+_last_persist = time.time()
+
+
+def scope_for_path(path: str) -> str:
+    """路径前缀：/api/diary/12 -> /api/diary，/postcard/3 -> /postcard，/ -> /"""
+    parts = [part for part in (path or '').split('/') if part]
+    if not parts:
+        return '/'
+    if parts[0] == 'api' and len(parts) > 1:
+        return f"/api/{parts[1]}"[:50]
+    return f"/{parts[0]}"[:50]
+
+
+def hour_scope(hour: int) -> str:
+    return f"{HOUR_SCOPE_PREFIX}{hour:02d}"
+
+
+def observe(entries: list):
+    """把访问记录的IP加入当天草图（只改内存，不访问数据库）"""
+    with _lock:
+        for entry in entries:
+            ip = entry.get('ip_address')
+            created_at = entry.get('created_at')
+            if not ip or created_at is None:
+                continue
+            day = created_at.date()
+            scopes = [ALL_SCOPE, hour_scope(created_at.hour)]
+            # 只为匹配到路由的请求记录路径前缀，避免扫描器的随机路径产生大量草图
+            if entry.get('endpoint'):
+                scopes.append(scope_for_path(entry.get('path')))
+            for scope in scopes:
+                key = (day, scope)
+                sketch = _sketches.get(key)
+                if sketch is None:
+                    sketch = _sketches[key] = HyperLogLog()
+                sketch.add(ip)
+                _dirty.add(key)
+
+
+def maybe_persist():
+    """距上次保存超过 VISITOR_SKETCH_PERSIST_INTERVAL 秒时保存（访问日志写入线程调用）"""
+    if time.time() - _last_persist >= VISITOR_SKETCH_PERSIST_INTERVAL:
+        persist()
+
+
+def persist():
+    """把有变化的内存草图合并进数据库（需要能导入app）"""
+    global _last_persist
+
+    with _lock:
+        _last_persist = time.time()
+        dirty = {key: HyperLogLog(registers=_sketches[key].registers) for key in _dirty}
+        _dirty.clear()
+        # 只保留今天的草图，更早的日子合并后就不会再有新数据
+        today = datetime.utcnow().date()
+        for key in [key for key in _sketches if key[0] < today and key not in dirty]:
+            del _sketches[key]
+
+    if not dirty:
+        return
+
+    from app import app
+    from sqlalchemy.exc import IntegrityError
+    from extensions import db
+    from models import VisitorSketch
+
+    with app.app_context():
+        for (day, scope), sketch in dirty.items():
+            for _ in range(2):
+                try:
+                    row = VisitorSketch.query.filter_by(day=day, scope=scope).with_for_update().first()
+                    if row:
+                        row.sketch = HyperLogLog.from_bytes(row.sketch).merge(sketch).to_bytes()
+                        row.updated_at = datetime.utcnow()
+                    else:
+                        db.session.add(VisitorSketch(day=day, scope=scope, sketch=sketch.to_bytes()))
+                    db.session.commit()
+                    break
+                except IntegrityError:
+                    # 其他worker刚插入了同一行，重试时走合并分支
+                    db.session.rollback()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[访客草图] 保存失败 {day} {scope}: {e}", file=sys.stderr)
+                    with _lock:
+                        _dirty.add((day, scope))
+                    break
+
+
+def backfill(days: int) -> int:
+    """用最近days天的原始访问日志重建草图（上线前已有的日志，需要在应用上下文中调用）"""
+    from extensions import db
+    from models import AccessLog
+
+    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    query = db.session.query(
+        AccessLog.ip_address, AccessLog.created_at, AccessLog.endpoint, AccessLog.path
+    ).filter(AccessLog.created_at >= start).execution_options(yield_per=5000)
+
+    total = 0
+    batch = []
+    for ip_address, created_at, endpoint, path in query:
+        batch.append({'ip_address': ip_address, 'created_at': created_at, 'endpoint': endpoint, 'path': path})
+        if len(batch) >= 5000:
+            observe(batch)
+            maybe_persist()
+            total += len(batch)
+            batch = []
+    if batch:
+        observe(batch)
+        total += len(batch)
+    persist()
+    return total
+
+
+def _load(start_day, end_day, scope: str = None):
+    from models import VisitorSketch
+
+    query = VisitorSketch.query.filter(VisitorSketch.day >= start_day, VisitorSketch.day <= end_day)
+    if scope is not None:
+        query = query.filter(VisitorSketch.scope == scope)
+    return query.all()
+
+
+def unique_visitors(start_day, end_day, scope: str = ALL_SCOPE) -> int:
+    """[start_day, end_day] 内的独立访客估计值（合并每日草图）"""
+    merged = HyperLogLog()
+    for row in _load(start_day, end_day, scope):
+        merged.merge(HyperLogLog.from_bytes(row.sketch))
+    return merged.count()
+
+
+def daily_unique_visitors(start_day, end_day, scope: str = ALL_SCOPE) -> dict:
+    """每天的独立访客估计值 {date: count}"""
+    return {row.day: HyperLogLog.from_bytes(row.sketch).count() for row in _load(start_day, end_day, scope)}
+
+
+def hourly_unique_visitors(start_day, end_day) -> dict:
+    """每小时的独立访客估计值 {小时起点datetime: count}"""
+    result = {}
+    for row in _load(start_day, end_day):
+        if row.scope.startswith(HOUR_SCOPE_PREFIX):
+            hour = int(row.scope[len(HOUR_SCOPE_PREFIX):])
+            result[datetime.combine(row.day, datetime.min.time()).replace(hour=hour)] = \
+                HyperLogLog.from_bytes(row.sketch).count()
+    return result
+
+
+def unique_visitors_by_scope(start_day, end_day) -> dict:
+    """各路径前缀在区间内的独立访客估计值 {scope: count}（不含按小时的草图）"""
+    merged = {}
+    for row in _load(start_day, end_day):
+        if row.scope.startswith(HOUR_SCOPE_PREFIX):
+            continue
+        sketch = HyperLogLog.from_bytes(row.sketch)
+        if row.scope in merged:
+            merged[row.scope].merge(sketch)
+        else:
+            merged[row.scope] = sketch
+    return {scope: sketch.count() for scope, sketch in merged.items()}
+
+
+def range_for_days(days: int):
+    """最近days天（含今天）的起止日期"""
+    end_day = datetime.utcnow().date()
+    return end_day - timedelta(days=days - 1), end_day
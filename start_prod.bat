@@ -26,6 +26,15 @@ if not exist .env (
 set PORT=5000
 for /f "tokens=2 delims==" %%a in ('findstr "^PORT=" .env') do set PORT=%%a
 
+echo [迁移] 正在执行数据库迁移...
+flask --app app db upgrade
+if errorlevel 1 (
+    echo [错误] 数据库迁移失败
+    pause
+    exit /b 1
+)
+flask --app app create-default-admin
+
 echo [启动] 正在使用Gunicorn启动应用...
 echo [信息] 访问地址: http://localhost:%PORT%
 echo [信息] 工作进程: 4
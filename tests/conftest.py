@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共配置
+
+导入 app 之前把数据库指到临时目录里的 SQLite 文件、图片存储指到临时目录，测试只在这个临时库上建表、写数据、清表，
+不会连到 .env / 环境变量里配置的开发或生产数据库。
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+_tmp_dir = tempfile.mkdtemp(prefix='diary-tests-')
+TEST_DATABASE_URL = f"sqlite:///{os.path.join(_tmp_dir, 'test.db')}"
+
+os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+os.environ['STORAGE_BACKEND'] = 'local'
+os.environ['POSTCARD_UPLOAD_FOLDER'] = os.path.join(_tmp_dir, 'postcards')
+os.environ['UPLOAD_IMAGE_FOLDER'] = os.path.join(_tmp_dir, 'uploads')
+os.environ['ADVENTURE_STATE_STORE'] = 'off'
+os.environ.setdefault('JWT_SECRET_KEY', 'test-jwt-secret-key-0123456789abcdef')
+os.environ.pop('REDIS_URL', None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app  # noqa: E402
+from extensions import db  # noqa: E402
+
+if flask_app.config['SQLALCHEMY_DATABASE_URI'] != TEST_DATABASE_URL:
+    # .env 里的 DATABASE_URL 会覆盖上面的设置（load_dotenv(override=True)），这时拒绝运行
+    pytest.exit(f"测试必须使用临时数据库，当前为 {flask_app.config['SQLALCHEMY_DATABASE_URI']}", returncode=2)
+
+from services import storage as _storage  # noqa: E402
+
+if _storage.STORAGE_BACKEND != 'local' or not _storage.POSTCARD_UPLOAD_FOLDER.startswith(_tmp_dir):
+    pytest.exit(f"测试必须使用临时图片目录，当前为 {_storage.STORAGE_BACKEND} {_storage.POSTCARD_UPLOAD_FOLDER}", returncode=2)
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.create_all()
+    return flask_app
+
+
+@pytest.fixture(autouse=True)
+def clean_tables(app):
+    """每个测试前清空所有表（包括不在模型里的 SQLite 全文索引表）"""
+    from sqlalchemy import text
+    from services.diary_search import FTS_TABLE
+
+    with app.app_context():
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        if db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': FTS_TABLE}).scalar():
+            db.session.execute(text(f'DELETE FROM {FTS_TABLE}'))
+        db.session.commit()
+        db.session.remove()
+    yield
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    """创建用户，返回 (user_id, 请求头)"""
+    from flask_jwt_extended import create_access_token
+    from models import User
+
+    counter = {'n': 0}
+
+    def _make_user(is_admin=False, **fields):
+        counter['n'] += 1
+        with app.app_context():
+            user = User(username=f"user{counter['n']}", email=f"user{counter['n']}@example.com",
+                        password_hash='x', is_admin=is_admin, **fields)
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            token = create_access_token(identity=str(user_id))
+            db.session.remove()
+        return user_id, {'Authorization': f'Bearer {token}'}
+
+    return _make_user
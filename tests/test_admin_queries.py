@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""管理后台列表接口：每页条数不影响SQL语句数（没有逐行查询）"""
+
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from extensions import db
+from models import EmotionDiary, Postcard, User
+
+ROWS = 60
+
+
+@pytest.fixture
+def seeded(app, make_user):
+    _, headers = make_user(is_admin=True)
+    with app.app_context():
+        for i in range(ROWS):
+            user = User(username=f'member{i}', email=f'member{i}@example.com', password_hash='x')
+            db.session.add(user)
+            db.session.flush()
+            diary = EmotionDiary(user_id=user.id, content=f'第{i}篇日记' * 30)
+            db.session.add(diary)
+            db.session.flush()
+            db.session.add(Postcard(user_id=user.id, diary_id=diary.id, status='completed'))
+        db.session.commit()
+        db.session.remove()
+    return headers
+
+
+def _count_statements(app, client, url, headers):
+    """只统计发请求的这个线程执行的语句（后台写日志线程不算）"""
+    statements = []
+    thread_id = threading.get_ident()
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread_id:
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert response.status_code == 200
+    return response.get_json(), statements
+
+
+@pytest.mark.parametrize('path, items', [
+    ('/api/admin/users', 'users'),
+    ('/api/admin/diaries', 'diaries'),
+    ('/api/admin/postcards', 'postcards'),
+])
+@pytest.mark.parametrize('mode', ['page=1', 'cursor='])
+def test_list_statement_count_independent_of_page_size(app, client, seeded, path, items, mode):
+    small, small_statements = _count_statements(app, client, f'{path}?{mode}&per_page=1', seeded)
+    large, large_statements = _count_statements(app, client, f'{path}?{mode}&per_page=50', seeded)
+
+    assert len(small[items]) == 1
+    assert len(large[items]) == 50
+    assert len(large_statements) == len(small_statements), large_statements
+    # 鉴权 + 列表 + 计数/关联查询，固定几条
+    assert len(large_statements) <= 5, large_statements
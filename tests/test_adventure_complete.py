@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""探险完成结算：并发重复完成只结算一次"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+from sqlalchemy import event
+
+from extensions import db
+from models import AdventureSession, EmotionDiary, GameLedger, GameState, UserItem
+from prompts.adventure_prompts import MONSTER_CONFIG
+
+# 并发完成压测规模和 p95 耗时上限（毫秒）；要复现更大规模时设置这些环境变量
+BENCHMARK_USERS = int(os.environ.get('ADVENTURE_BENCHMARK_USERS', 4))
+BENCHMARK_ROUNDS = int(os.environ.get('ADVENTURE_BENCHMARK_ROUNDS', 5))
+BENCHMARK_P95_MS = float(os.environ.get('ADVENTURE_BENCHMARK_P95_MS', 2000))
+
+
+@pytest.fixture(autouse=True)
+def no_postcard_generation(monkeypatch):
+    """结算后不启动明信片后台生成（不调用AI）"""
+    import routes.adventure as adventure_routes
+    monkeypatch.setattr(adventure_routes, 'trigger_postcard_generation', lambda *args, **kwargs: None)
+
+
+def _create_adventure(app, user_id, status='in_progress'):
+    monster_type = next(iter(MONSTER_CONFIG))
+    with app.app_context():
+        db.session.add(GameState(user_id=user_id))
+        diary = EmotionDiary(user_id=user_id, content='今天很焦虑', emotion_tags=['焦虑'],
+                             emotion_score={'intensity': 5})
+        db.session.add(diary)
+        db.session.flush()
+        adventure = AdventureSession(user_id=user_id, diary_id=diary.id, status=status, scene_name='迷雾森林',
+                                     monsters=[{'type': monster_type, 'defeated': True}])
+        db.session.add(adventure)
+        db.session.commit()
+        adventure_id = adventure.id
+        db.session.remove()
+    return adventure_id, monster_type
+
+
+def test_concurrent_complete_pays_out_once(app, make_user):
+    user_id, headers = make_user()
+    adventure_id, monster_type = _create_adventure(app, user_id)
+
+    requests = 4
+    barrier = threading.Barrier(requests)
+    status_codes = []
+    lock = threading.Lock()
+
+    def complete():
+        client = app.test_client()
+        barrier.wait()
+        response = client.post(f'/api/adventure/{adventure_id}/complete', headers=headers)
+        with lock:
+            status_codes.append(response.status_code)
+
+    workers = [threading.Thread(target=complete) for _ in range(requests)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    assert sorted(status_codes) == [200] + [400] * (requests - 1)
+    with app.app_context():
+        state = GameState.query.filter_by(user_id=user_id).first()
+        item = UserItem.query.filter_by(user_id=user_id, item_name=f'{monster_type}_reward').first()
+        assert state.coins == 35
+        assert state.total_diaries == 1
+        assert item.quantity == 1
+        assert GameLedger.query.filter_by(user_id=user_id).count() == 1
+        assert db.session.get(AdventureSession, adventure_id).status == 'completed'
+
+
+def test_complete_twice_returns_400(app, client, make_user):
+    user_id, headers = make_user()
+    adventure_id, _ = _create_adventure(app, user_id, status='pending')
+
+    assert client.post(f'/api/adventure/{adventure_id}/complete', headers=headers).status_code == 200
+    response = client.post(f'/api/adventure/{adventure_id}/complete', headers=headers)
+    assert response.status_code == 400
+    with app.app_context():
+        assert GameState.query.filter_by(user_id=user_id).first().coins == 35
+
+
+def test_concurrent_users_complete_with_constant_statements(app, make_user):
+    """多个用户并发完成多次探险：全部成功、结算结果正确，每次完成执行的SQL条数相同，统计每次完成的耗时"""
+    users, rounds = BENCHMARK_USERS, BENCHMARK_ROUNDS
+    monster_types = list(MONSTER_CONFIG)[:2]
+    sessions = {}
+    for _ in range(users):
+        user_id, headers = make_user()
+        with app.app_context():
+            db.session.add(GameState(user_id=user_id))
+            adventure_ids = []
+            for _ in range(rounds):
+                diary = EmotionDiary(user_id=user_id, content='今天很焦虑', emotion_tags=['焦虑'],
+                                     emotion_score={'intensity': 5})
+                db.session.add(diary)
+                db.session.flush()
+                adventure = AdventureSession(user_id=user_id, diary_id=diary.id, status='in_progress',
+                                             scene_name='迷雾森林',
+                                             monsters=[{'type': name, 'defeated': True} for name in monster_types])
+                db.session.add(adventure)
+                db.session.flush()
+                adventure_ids.append(adventure.id)
+            db.session.commit()
+            db.session.remove()
+        sessions[user_id] = (headers, adventure_ids)
+
+    counter = threading.local()
+    statements, status_codes, latencies = [], [], []
+    lock = threading.Lock()
+    barrier = threading.Barrier(users)
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        # 每 GAME_SNAPSHOT_INTERVAL 条流水额外写一次快照，不计入
+        if not statement.startswith('INSERT INTO game_snapshots'):
+            counter.value = getattr(counter, 'value', 0) + 1
+
+    def worker(headers, adventure_ids):
+        client = app.test_client()
+        barrier.wait()
+        for adventure_id in adventure_ids:
+            counter.value = 0
+            start = time.perf_counter()
+            response = client.post(f'/api/adventure/{adventure_id}/complete', headers=headers)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                status_codes.append(response.status_code)
+                statements.append(counter.value)
+                latencies.append(elapsed)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        workers = [threading.Thread(target=worker, args=args) for args in sessions.values()]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+
+    latencies.sort()
+    p50, p95 = (latencies[min(len(latencies) - 1, int(len(latencies) * p))] for p in (0.5, 0.95))
+    print(f"[探险] {users}个用户并发完成{users * rounds}次: p50 {p50:.1f}ms p95 {p95:.1f}ms "
+          f"max {latencies[-1]:.1f}ms，每次 {statements[0]} 条SQL", file=sys.stderr)
+
+    assert status_codes == [200] * (users * rounds)
+    assert len(set(statements)) == 1, statements
+    assert p95 < BENCHMARK_P95_MS, latencies
+    with app.app_context():
+        for user_id in sessions:
+            assert GameState.query.filter_by(user_id=user_id).first().total_diaries == rounds
+            quantities = {item.item_name: item.quantity for item in UserItem.query.filter_by(user_id=user_id)}
+            assert all(quantities.get(f'{name}_reward') == rounds for name in monster_types)
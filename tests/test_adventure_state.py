@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""进行中探险的状态存储（内存后端）：按题目序号提交、载入不覆盖已有答案、定时检查点"""
+
+import time
+
+import pytest
+
+from extensions import db
+from models import AdventureChallenge, AdventureSession, EmotionDiary
+from services import adventure_state
+
+
+@pytest.fixture(scope='module', autouse=True)
+def memory_store():
+    """整个模块使用内存存储，检查点间隔缩短（定时线程启动后一直按这个间隔运行）"""
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(adventure_state, 'ADVENTURE_STATE_STORE', 'memory')
+        patch.setattr(adventure_state, 'ADVENTURE_CHECKPOINT_INTERVAL', 0.05)
+        yield
+
+
+@pytest.fixture(autouse=True)
+def clear_memory():
+    """SQLite 清表后会复用探险ID，每个测试前清空内存状态"""
+    with adventure_state._lock:
+        adventure_state._memory.clear()
+        adventure_state._dirty.clear()
+    yield
+
+
+def _create_adventure(app, user_id):
+    challenges = [
+        {'question': f'第{i + 1}题', 'options': [{'id': 'a'}, {'id': 'b'}], 'correct_ids': ['a']}
+        for i in range(2)
+    ]
+    with app.app_context():
+        diary = EmotionDiary(user_id=user_id, content='今天有点累', emotion_tags=['疲惫'])
+        db.session.add(diary)
+        db.session.flush()
+        adventure = AdventureSession(user_id=user_id, diary_id=diary.id, status='in_progress', scene_name='迷雾森林',
+                                     challenges=challenges, monsters=[{'type': 'x'}, {'type': 'y'}])
+        db.session.add(adventure)
+        db.session.commit()
+        adventure_id = adventure.id
+        db.session.remove()
+    return adventure_id
+
+
+def test_submit_checks_challenge_index(app, client, make_user):
+    user_id, headers = make_user()
+    adventure_id = _create_adventure(app, user_id)
+    url = f'/api/adventure/{adventure_id}/submit'
+
+    assert client.post(url, json={'challenge_index': 0, 'selected_ids': ['a']}, headers=headers).status_code == 200
+    # 重复提交第0题：不会被记到第1题上
+    response = client.post(url, json={'challenge_index': 0, 'selected_ids': ['b']}, headers=headers)
+    assert response.status_code == 409
+    assert response.get_json()['current_challenge'] == 1
+
+    response = client.post(url, json={'challenge_index': 1, 'selected_ids': ['b']}, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['correct'] is False
+    state = adventure_state.get_state(adventure_id)
+    assert state['answers'][0]['user_answers'] == ['a']
+    assert state['answers'][1]['user_answers'] == ['b']
+
+
+def test_load_keeps_recorded_answers(app, make_user):
+    user_id, _ = make_user()
+    adventure_id = _create_adventure(app, user_id)
+
+    with app.app_context():
+        session = db.session.get(AdventureSession, adventure_id)
+        adventure_state.load(session)
+        assert adventure_state.record_answer(adventure_id, 0, ['a'], True)
+        # 并发请求用数据库里较旧的进度再次载入，不清掉已记录的答案
+        state = adventure_state.load(session)
+        db.session.remove()
+    assert state['current_challenge'] == 1
+    assert state['answers'] == {0: {'user_answers': ['a'], 'is_correct': True}}
+
+
+def test_checkpoint_runs_without_more_submits(app, make_user):
+    user_id, _ = make_user()
+    adventure_id = _create_adventure(app, user_id)
+
+    with app.app_context():
+        adventure_state.load(db.session.get(AdventureSession, adventure_id))
+        db.session.remove()
+    assert adventure_state.record_answer(adventure_id, 0, ['a'], True)
+
+    # 之后不再答题，定时线程也会把答案写回数据库
+    deadline = time.time() + 5
+    current = None
+    while time.time() < deadline:
+        with app.app_context():
+            current = db.session.get(AdventureSession, adventure_id).current_challenge
+            completed = AdventureChallenge.query.filter_by(session_id=adventure_id, position=0).one().completed
+            db.session.remove()
+        if current == 1 and completed:
+            break
+        time.sleep(0.05)
+    assert current == 1 and completed
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""日记全文检索"""
+
+import os
+
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import CreateIndex
+
+from extensions import db
+from models import EmotionDiary
+from services.diary_search import benchmark_search
+
+# 合成日记数量；要复现 100 万篇的对比时设置 DIARY_SEARCH_BENCHMARK_ROWS=1000000
+BENCHMARK_ROWS = int(os.environ.get('DIARY_SEARCH_BENCHMARK_ROWS', 20000))
+
+
+def test_fulltext_index_declared_for_mysql():
+    """新库走 db.create_all() 时也要建出 MySQL ngram 全文索引，否则 MATCH 查询报 1191"""
+    index = next(index for index in EmotionDiary.__table__.indexes if index.name == 'ft_emotion_diaries_content')
+    ddl = str(CreateIndex(index).compile(dialect=mysql.dialect()))
+    assert ddl.startswith('CREATE FULLTEXT INDEX ft_emotion_diaries_content')
+    assert ddl.endswith('WITH PARSER ngram')
+
+
+def test_fulltext_index_not_created_on_sqlite(app):
+    with app.app_context():
+        names = {index['name'] for index in db.inspect(db.engine).get_indexes('emotion_diaries')}
+    assert 'ft_emotion_diaries_content' not in names
+
+
+def test_search_endpoint_matches_substrings(app, client, make_user):
+    user_id, headers = make_user()
+    with app.app_context():
+        for content in ('今天去湖边散步，心情很好', '工作压力大，晚上失眠', '压力来自考试，但散步后好多了'):
+            db.session.add(EmotionDiary(user_id=user_id, content=content, emotion_tags=[]))
+        db.session.commit()
+
+    def search(keyword):
+        response = client.get('/api/diary/search', query_string={'keyword': keyword}, headers=headers)
+        assert response.status_code == 200
+        return sorted(diary['content'] for diary in response.json['diaries'])
+
+    assert search('散步') == ['今天去湖边散步，心情很好', '压力来自考试，但散步后好多了']
+    assert search('压力 散步') == ['压力来自考试，但散步后好多了']
+    assert search('眠') == ['工作压力大，晚上失眠']
+    assert search('登山') == []
+
+
+def test_benchmark_fts_matches_like():
+    """合成日记上 FTS5 与 LIKE 命中数一致，低频关键词 FTS5 更快"""
+    result = benchmark_search(rows=BENCHMARK_ROWS, repeat=3)
+
+    for query in result['queries']:
+        assert query['fts_matches'] == query['matches'], query
+    rare = [query for query in result['queries'] if query['matches'] < BENCHMARK_ROWS // 100]
+    assert rare
+    for query in rare:
+        assert query['fts_ms'] < query['like_ms'], query
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""游戏奖励结算：多个连接并发结算同一用户不丢失更新"""
+
+import threading
+
+from extensions import db
+from models import EmotionDiary, GameLedger, GameState
+from services.game_rewards import DIARIES_PER_LEVEL, LEVEL_UP_BONUS, apply_rewards, claim_diary_score
+
+
+def test_concurrent_apply_rewards_loses_no_updates(app, make_user):
+    user_id, _ = make_user()
+    with app.app_context():
+        db.session.add(GameState(user_id=user_id, mental_health_score=50, stress_level=50, growth_potential=50,
+                                 coins=0, level=1, total_diaries=0))
+        db.session.commit()
+        db.session.remove()
+
+    threads, rounds = 8, 25
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def worker():
+        with app.app_context():
+            barrier.wait()
+            for _ in range(rounds):
+                try:
+                    with db.engine.begin() as connection:
+                        apply_rewards(connection, user_id, 'test', coins=1, mental_health=1, diaries=1)
+                except Exception as e:
+                    errors.append(str(e))
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    total = threads * rounds
+    level = 1 + total // DIARIES_PER_LEVEL
+    assert errors == []
+    with app.app_context():
+        state = GameState.query.filter_by(user_id=user_id).first()
+        assert state.total_diaries == total
+        assert state.coins == total + (level - 1) * LEVEL_UP_BONUS
+        assert state.level == level
+        # 属性截断到100
+        assert state.mental_health_score == 100
+        assert state.ledger_seq == total
+        assert GameLedger.query.filter_by(user_id=user_id).count() == total
+
+
+def test_claim_diary_score_only_once(app, make_user):
+    user_id, _ = make_user()
+    with app.app_context():
+        diary = EmotionDiary(user_id=user_id, content='今天很平静', emotion_tags=[])
+        db.session.add(diary)
+        db.session.commit()
+        diary_id = diary.id
+        db.session.remove()
+
+        with db.engine.begin() as connection:
+            assert claim_diary_score(connection, diary_id) is True
+            assert claim_diary_score(connection, diary_id) is False
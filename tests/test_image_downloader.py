@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""图片下载重试：失败之间指数退避，最后一次失败、4xx 后不再等待"""
+
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from services import image_downloader
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """只替换下载模块里的 time（其他线程的 time.sleep 不受影响）"""
+    calls = []
+    monkeypatch.setattr(image_downloader, 'time', SimpleNamespace(sleep=calls.append))
+    return calls
+
+
+def test_no_backoff_after_last_attempt(tmp_path, monkeypatch, sleeps):
+    attempts = []
+
+    def fail(image_url, partial_path):
+        attempts.append(image_url)
+        raise requests.ConnectionError('reset')
+
+    monkeypatch.setattr(image_downloader, '_download_once', fail)
+    with pytest.raises(image_downloader.ImageDownloadError):
+        image_downloader.download_to_file('https://example.com/a.png', str(tmp_path / 'a.png'))
+
+    assert len(attempts) == image_downloader.IMAGE_DOWNLOAD_RETRIES
+    assert sleeps == [0.5 * (2 ** attempt) for attempt in range(image_downloader.IMAGE_DOWNLOAD_RETRIES - 1)]
+
+
+def test_no_retry_or_backoff_on_client_error(tmp_path, monkeypatch, sleeps):
+    attempts = []
+
+    def expired(image_url, partial_path):
+        attempts.append(image_url)
+        response = requests.Response()
+        response.status_code = 403
+        raise requests.HTTPError('forbidden', response=response)
+
+    monkeypatch.setattr(image_downloader, '_download_once', expired)
+    with pytest.raises(image_downloader.ImageDownloadError):
+        image_downloader.download_to_file('https://example.com/a.png', str(tmp_path / 'a.png'))
+
+    assert len(attempts) == 1
+    assert sleeps == []
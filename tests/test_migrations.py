@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""数据库迁移"""
+
+import os
+
+from alembic.config import Config as AlembicConfig
+from alembic.script import ScriptDirectory
+from flask_migrate import stamp, upgrade
+
+from extensions import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+RUNTIME_TABLES = ('user_storage_usage', 'fallback_images', 'stats_hourly', 'stats_daily', 'visitor_sketches')
+
+
+def _script():
+    config = AlembicConfig()
+    config.set_main_option('script_location', MIGRATIONS_DIR)
+    return ScriptDirectory.from_config(config)
+
+
+def test_single_linear_history():
+    script = _script()
+    assert len(script.get_heads()) == 1
+    # 3f2a9c1d7b45 发布时就是第一个版本，之后的迁移只能叠在上面
+    assert script.get_bases() == ['3f2a9c1d7b45']
+
+
+def test_upgrade_creates_tables_previously_created_at_runtime(app):
+    with app.app_context():
+        for name in RUNTIME_TABLES:
+            db.metadata.tables[name].drop(db.engine)
+        try:
+            stamp(directory=MIGRATIONS_DIR, revision='e5b1d7f3a926')
+            upgrade(directory=MIGRATIONS_DIR)
+            tables = set(db.inspect(db.engine).get_table_names())
+            assert set(RUNTIME_TABLES) <= tables
+        finally:
+            db.create_all()
+
+
+def test_duplicate_postcards_backed_up_and_restored(app, make_user):
+    from sqlalchemy import text
+    from flask_migrate import downgrade
+    from models import EmotionDiary, Postcard
+
+    user_id, _ = make_user()
+    with app.app_context():
+        diary = EmotionDiary(user_id=user_id, content='同一篇日记')
+        db.session.add(diary)
+        db.session.flush()
+        db.session.execute(text('DROP INDEX uq_postcards_diary'))
+        db.session.execute(text('CREATE INDEX ix_postcards_diary ON postcards (diary_id)'))
+        kept = Postcard(user_id=user_id, diary_id=diary.id, status='completed')
+        duplicate = Postcard(user_id=user_id, diary_id=diary.id, status='failed',
+                             image_url='/static/postcards/a.png', preview_url='/static/postcards/a_preview.png')
+        db.session.add_all([kept, duplicate])
+        db.session.commit()
+        kept_id, duplicate_id = kept.id, duplicate.id
+        try:
+            stamp(directory=MIGRATIONS_DIR, revision='c7e2a5d9f314')
+            upgrade(directory=MIGRATIONS_DIR, revision='d4a8c6e1b572')
+            rows = db.session.execute(text('SELECT id, kept_id FROM postcards_duplicate_backup')).fetchall()
+            assert [tuple(row) for row in rows] == [(duplicate_id, kept_id)]
+            db.session.expire_all()
+            assert [postcard.id for postcard in Postcard.query.all()] == [kept_id]
+            assert db.session.get(Postcard, kept_id).image_url == '/static/postcards/a.png'
+            db.session.commit()
+
+            downgrade(directory=MIGRATIONS_DIR, revision='c7e2a5d9f314')
+            db.session.expire_all()
+            assert sorted(postcard.id for postcard in Postcard.query.all()) == [kept_id, duplicate_id]
+            assert 'postcards_duplicate_backup' not in db.inspect(db.engine).get_table_names()
+        finally:
+            db.session.rollback()
+            db.session.execute(Postcard.__table__.delete())
+            db.session.execute(text('DROP INDEX IF EXISTS ix_postcards_diary'))
+            db.session.execute(text('DROP TABLE IF EXISTS postcards_duplicate_backup'))
+            db.session.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS uq_postcards_diary ON postcards (diary_id)'))
+            db.session.commit()
+            db.session.remove()
+
+
+def test_upgrade_builds_empty_database(app):
+    """部署只执行 flask db upgrade：空库由迁移按模型建出全部表，并记录为最新版本"""
+    from sqlalchemy import text
+
+    with app.app_context():
+        db.drop_all()
+        db.session.execute(text('DROP TABLE IF EXISTS alembic_version'))
+        db.session.commit()
+        try:
+            upgrade(directory=MIGRATIONS_DIR)
+            tables = set(db.inspect(db.engine).get_table_names())
+            assert set(db.metadata.tables) <= tables
+            version = db.session.execute(text('SELECT version_num FROM alembic_version')).scalar()
+            assert version == _script().get_current_head()
+        finally:
+            db.session.remove()
+            db.create_all()
+
+
+def test_revision_dates_follow_history():
+    script = _script()
+    for revision in script.walk_revisions():
+        if revision.down_revision:
+            parent = script.get_revision(revision.down_revision)
+            assert _create_date(revision) > _create_date(parent), revision.revision
+
+
+def _create_date(revision):
+    import re
+    return re.search(r'Create Date: (\S+ \S+)', revision.module.__doc__).group(1)
+
+
+def test_per_request_column_revisions_patch_old_tables(app):
+    """1a7d5e3c2b90 只补原始版本的列，后续需求的列由各自的迁移补上"""
+    from sqlalchemy import text
+
+    with app.app_context():
+        for table, column in (('postcards', 'preview_url'), ('postcards', 'image_source'),
+                              ('access_logs', 'response_bytes')):
+            db.session.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+        db.session.commit()
+        try:
+            stamp(directory=MIGRATIONS_DIR, revision='1a7d5e3c2b90')
+            upgrade(directory=MIGRATIONS_DIR)
+            inspector = db.inspect(db.engine)
+            assert {'preview_url', 'image_source'} <= {c['name'] for c in inspector.get_columns('postcards')}
+            assert 'response_bytes' in {c['name'] for c in inspector.get_columns('access_logs')}
+        finally:
+            db.session.remove()
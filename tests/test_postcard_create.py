@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""同步创建明信片的备用图库降级、同一日记重复创建、删除明信片时清理图片文件"""
+
+from extensions import db
+from models import AdventureSession, EmotionDiary, Postcard
+from services import fallback_library, postcard_service
+from services.storage import get_storage
+
+
+def _create_diary(app, user_id):
+    with app.app_context():
+        diary = EmotionDiary(user_id=user_id, content='今天下雨了')
+        db.session.add(diary)
+        db.session.commit()
+        diary_id = diary.id
+        db.session.remove()
+    return diary_id
+
+
+def test_sync_create_uses_fallback_after_flush(app, make_user, monkeypatch):
+    monkeypatch.setattr(postcard_service, 'generate_postcard_data', lambda **kwargs: {
+        'image_prompt': 'rainy forest', 'location_name': '心灵森林', 'message': '别担心'
+    })
+    monkeypatch.setattr(postcard_service, 'generate_postcard_image', lambda prompt, tier='full': None)
+    library_url = f'/image/postcards/{fallback_library.FALLBACK_LIBRARY_PREFIX}forest_calm_1.jpg'
+    monkeypatch.setattr(fallback_library, 'pick_fallback_image', lambda scene, location: library_url)
+    user_id, _ = make_user()
+    diary_id = _create_diary(app, user_id)
+
+    with app.app_context():
+        result = postcard_service.create_postcard(user_id, diary_id, ['平静'], 3, 60, '今天下雨了')
+        db.session.remove()
+
+    assert result['image_url'] == library_url
+    assert result['image_source'] == 'library'
+    assert result['status'] == 'completed'
+    # 挂图时明信片已经有 created_at，首图耗时才能算出来
+    assert result['time_to_first_image_ms'] is not None
+
+
+def test_delete_postcard_removes_preview_file(app, client, make_user):
+    storage = get_storage('postcards')
+    keys = []
+    for name in ('full.jpg', 'preview.jpg'):
+        key = f'delete-test/{name}'
+        with open(storage.staging_path(key), 'wb') as f:
+            f.write(b'\xff\xd8\xff')
+        keys.append(key)
+
+    user_id, _ = make_user()
+    _, admin_headers = make_user(is_admin=True)
+    diary_id = _create_diary(app, user_id)
+    with app.app_context():
+        postcard = Postcard(user_id=user_id, diary_id=diary_id, status='completed', image_tier='full',
+                            image_url=storage.url_for(keys[0]), preview_url=storage.url_for(keys[1]))
+        db.session.add(postcard)
+        db.session.commit()
+        postcard_id = postcard.id
+        db.session.remove()
+
+    assert client.delete(f'/api/admin/postcards/{postcard_id}', headers=admin_headers).status_code == 200
+    assert not storage.exists(keys[0])
+    assert not storage.exists(keys[1])
+
+
+def _create_postcard(app, user_id, diary_id, status='completed'):
+    with app.app_context():
+        postcard = Postcard(user_id=user_id, diary_id=diary_id, status=status)
+        db.session.add(postcard)
+        db.session.commit()
+        postcard_id = postcard.id
+        db.session.remove()
+    return postcard_id
+
+
+def test_sync_create_returns_existing_postcard(app, make_user, monkeypatch):
+    monkeypatch.setattr(postcard_service, 'generate_postcard_data', lambda **kwargs: {
+        'image_prompt': 'rainy forest', 'location_name': '心灵森林', 'message': '别担心'
+    })
+    user_id, _ = make_user()
+    diary_id = _create_diary(app, user_id)
+    postcard_id = _create_postcard(app, user_id, diary_id)
+
+    with app.app_context():
+        result = postcard_service.create_postcard(user_id, diary_id, ['平静'], 3, 60, '今天下雨了',
+                                                  generate_image=False)
+        assert result['id'] == postcard_id
+        assert Postcard.query.filter_by(diary_id=diary_id).count() == 1
+        db.session.remove()
+
+
+def test_async_create_skips_existing_postcard(app, make_user):
+    user_id, _ = make_user()
+    diary_id = _create_diary(app, user_id)
+    postcard_id = _create_postcard(app, user_id, diary_id)
+
+    postcard_service.create_postcard_async(user_id, diary_id, ['平静'], 3, 60, '今天下雨了')
+    with app.app_context():
+        assert [postcard.id for postcard in Postcard.query.filter_by(diary_id=diary_id)] == [postcard_id]
+
+
+def test_skip_keeps_existing_postcard(app, client, make_user, monkeypatch):
+    """跳过探险不再先查后插：日记已有明信片（并发请求先插入）时走唯一索引冲突分支，返回已有的那张"""
+    import routes.adventure as adventure_routes
+    triggered = []
+    monkeypatch.setattr(adventure_routes, 'trigger_postcard_generation', lambda *args, **kwargs: triggered.append(args))
+    user_id, headers = make_user()
+    diary_id = _create_diary(app, user_id)
+    postcard_id = _create_postcard(app, user_id, diary_id, status='pending')
+    with app.app_context():
+        adventure = AdventureSession(user_id=user_id, diary_id=diary_id, status='in_progress', scene_name='迷雾森林')
+        db.session.add(adventure)
+        db.session.commit()
+        adventure_id = adventure.id
+        db.session.remove()
+
+    response = client.post(f'/api/adventure/{adventure_id}/skip', headers=headers)
+    assert response.status_code == 200
+    assert response.json['postcard_id'] == postcard_id
+    assert triggered == []
+    with app.app_context():
+        assert Postcard.query.filter_by(diary_id=diary_id).count() == 1
+
+
+def test_skip_creates_postcard(app, client, make_user, monkeypatch):
+    import routes.adventure as adventure_routes
+    triggered = []
+    monkeypatch.setattr(adventure_routes, 'trigger_postcard_generation', lambda *args, **kwargs: triggered.append(args))
+    user_id, headers = make_user()
+    diary_id = _create_diary(app, user_id)
+    with app.app_context():
+        adventure = AdventureSession(user_id=user_id, diary_id=diary_id, status='in_progress', scene_name='迷雾森林')
+        db.session.add(adventure)
+        db.session.commit()
+        adventure_id = adventure.id
+        db.session.remove()
+
+    response = client.post(f'/api/adventure/{adventure_id}/skip', headers=headers)
+    assert response.status_code == 200
+    assert [args[0] for args in triggered] == [response.json['postcard_id']]
+    with app.app_context():
+        from models import User
+        assert db.session.get(User, user_id).postcard_count == 1
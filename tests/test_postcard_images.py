@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""明信片临时图片转存：进程重启后由定时扫描重新提交"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions import db
+from models import EmotionDiary, Postcard
+from services import image_downloader, postcard_service
+from services.storage import get_storage
+
+TEMP_URL = 'https://cdn.example.com/seedream/tmp.jpg'
+JPEG_BYTES = b'\xff\xd8\xff\xe0' + b'0' * 64
+
+
+@pytest.fixture
+def fake_download(monkeypatch):
+    """不访问网络：把JPEG字节写到目标路径"""
+    calls = []
+
+    def download_to_file(image_url, filepath):
+        calls.append(image_url)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'wb') as f:
+            f.write(JPEG_BYTES)
+        return len(JPEG_BYTES)
+
+    monkeypatch.setattr(image_downloader, 'download_to_file', download_to_file)
+    return calls
+
+
+def _create_postcard(app, user_id, generated_at, pending_at):
+    with app.app_context():
+        diary = EmotionDiary(user_id=user_id, content='今天去了海边')
+        db.session.add(diary)
+        db.session.flush()
+        postcard = Postcard(user_id=user_id, diary_id=diary.id, image_url=TEMP_URL, status='completed',
+                            image_tier='full', image_source='generated', generated_at=generated_at,
+                            image_pending_at=pending_at)
+        db.session.add(postcard)
+        db.session.commit()
+        postcard_id = postcard.id
+        db.session.remove()
+    return postcard_id
+
+
+def _wait_for(app, postcard_id, predicate, timeout=5):
+    deadline = time.time() + timeout
+    while True:
+        with app.app_context():
+            postcard = db.session.get(Postcard, postcard_id)
+            result = (postcard.image_url, postcard.image_pending_at)
+            db.session.remove()
+        if predicate(*result) or time.time() > deadline:
+            return result
+        time.sleep(0.05)
+
+
+def test_sweep_resubmits_lost_download(app, make_user, fake_download):
+    user_id, _ = make_user()
+    # 上次提交转存后进程重启：image_pending_at 停在一小时前
+    hour_ago = datetime.utcnow() - timedelta(hours=1)
+    postcard_id = _create_postcard(app, user_id, hour_ago, hour_ago)
+
+    with app.app_context():
+        assert postcard_service.sweep_pending_images() == 1
+        # 刚重新提交过，再次扫描不会重复提交
+        assert postcard_service.sweep_pending_images() == 0
+
+    image_url, pending_at = _wait_for(app, postcard_id, lambda url, pending: pending is None)
+    assert fake_download == [TEMP_URL]
+    assert image_url.startswith('/image/postcards/')
+    assert pending_at is None
+    key = image_url[len('/image/postcards/'):]
+    assert get_storage('postcards').exists(key)
+
+
+def test_sweep_gives_up_on_expired_temp_url(app, make_user, fake_download):
+    user_id, _ = make_user()
+    long_ago = datetime.utcnow() - timedelta(hours=postcard_service.POSTCARD_IMAGE_TEMP_URL_TTL_HOURS + 1)
+    postcard_id = _create_postcard(app, user_id, long_ago, long_ago)
+
+    with app.app_context():
+        assert postcard_service.sweep_pending_images() == 0
+        postcard = db.session.get(Postcard, postcard_id)
+        assert postcard.image_url == TEMP_URL
+        assert postcard.image_pending_at is None
+        db.session.remove()
+    assert fake_download == []
+
+
+def test_failed_download_stays_pending(app, make_user, monkeypatch):
+    def fail(image_url, filepath):
+        raise image_downloader.ImageDownloadError('boom')
+
+    monkeypatch.setattr(image_downloader, 'download_to_file', fail)
+    user_id, _ = make_user()
+    hour_ago = datetime.utcnow() - timedelta(hours=1)
+    postcard_id = _create_postcard(app, user_id, hour_ago, hour_ago)
+
+    with app.app_context():
+        assert postcard_service.sweep_pending_images() == 1
+    time.sleep(0.2)
+    image_url, pending_at = _wait_for(app, postcard_id, lambda url, pending: True)
+    # 仍是临时URL且保留待转存标记，下个扫描周期再试
+    assert image_url == TEMP_URL
+    assert pending_at is not None
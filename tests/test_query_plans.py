@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+高频查询执行计划：确认每个查询按索引查找，而不是全表扫描或全索引扫描
+
+- SQLite（临时测试库）：EXPLAIN QUERY PLAN 的每一步都必须是 "SEARCH <表> USING [COVERING] INDEX"；
+  "SCAN <表>" 是全表扫描，"SCAN <表> USING COVERING INDEX" 是全索引扫描，都不通过
+- MySQL：设置 TEST_MYSQL_URL（库名须含 test，测试会在里面建表、删表）时运行，
+  EXPLAIN 结果中 type = ALL 或 key 为空即不通过
+
+索引定义见 models.py 各模型的 __table_args__。
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+from extensions import db
+from models import AccessLog, AdventureSession, EmotionDiary, GameState, Postcard, UserItem
+
+TEST_MYSQL_URL = os.environ.get('TEST_MYSQL_URL')
+
+# (名称, 生成查询的函数)，参数值只用于生成执行计划
+HOT_QUERIES = [
+    ('日记列表', lambda: EmotionDiary.query.filter_by(user_id=1).order_by(EmotionDiary.created_at.desc())),
+    ('明信片未读数', lambda: Postcard.query.filter_by(user_id=1, is_read=False)),
+    ('按日记查明信片', lambda: Postcard.query.filter_by(diary_id=1)),
+    ('按日记查探险', lambda: AdventureSession.query.filter_by(diary_id=1, user_id=1)),
+    ('背包道具', lambda: UserItem.query.filter_by(user_id=1, item_name='sunshine_dew')),
+    ('游戏状态', lambda: GameState.query.filter_by(user_id=1)),
+    ('访问日志时间范围', lambda: AccessLog.query.filter(AccessLog.created_at >= datetime.utcnow() - timedelta(days=1))),
+]
+QUERY_IDS = [name for name, _ in HOT_QUERIES]
+
+
+def _compile(query, dialect) -> str:
+    return str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+
+@pytest.mark.parametrize('name, build_query', HOT_QUERIES, ids=QUERY_IDS)
+def test_hot_query_uses_index_sqlite(app, name, build_query):
+    with app.app_context():
+        sql = _compile(build_query(), db.engine.dialect)
+        plan = [row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+
+    lookups = [detail for detail in plan if detail.startswith(('SEARCH ', 'SCAN '))]
+    assert lookups, f"{name}: {'; '.join(plan)}"
+    for detail in lookups:
+        assert detail.startswith('SEARCH ') and ' USING ' in detail and 'INDEX' in detail, \
+            f"{name}: {'; '.join(plan)}"
+
+
+@pytest.fixture(scope='module')
+def mysql_engine(app):
+    if not TEST_MYSQL_URL:
+        pytest.skip('未设置 TEST_MYSQL_URL')
+    if 'test' not in (make_url(TEST_MYSQL_URL).database or ''):
+        pytest.fail(f'TEST_MYSQL_URL 的库名须含 test（测试会建表、删表）: {TEST_MYSQL_URL}')
+
+    engine = create_engine(TEST_MYSQL_URL)
+    db.metadata.create_all(engine)
+    try:
+        yield engine
+    finally:
+        db.metadata.drop_all(engine)
+        engine.dispose()
+
+
+@pytest.mark.parametrize('name, build_query', HOT_QUERIES, ids=QUERY_IDS)
+def test_hot_query_uses_index_mysql(app, mysql_engine, name, build_query):
+    with app.app_context():
+        sql = _compile(build_query(), mysql_engine.dialect)
+    with mysql_engine.connect() as connection:
+        rows = connection.execute(text('EXPLAIN ' + sql)).mappings().all()
+
+    plan = '; '.join(f"{row['table']}: type={row['type']} key={row['key']} {row['Extra'] or ''}" for row in rows)
+    assert rows, name
+    for row in rows:
+        if 'no matching row in const table' in (row['Extra'] or ''):
+            # 唯一索引等值查找在优化阶段已执行（空表时 key 显示为空）
+            continue
+        assert row['type'] != 'ALL' and row['key'] is not None, f'{name}: {plan}'
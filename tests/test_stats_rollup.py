@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""统计汇总：按时间桶 upsert，可重复执行，同一时间只有一个刷新任务"""
+
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import AccessLog, StatsDaily, StatsHourly, User
+from services import access_log, stats_rollup
+
+
+def _add_logs(app, created_at, count, ip_prefix='10.0.0.'):
+    with app.app_context():
+        for i in range(count):
+            db.session.add(AccessLog(ip_address=f'{ip_prefix}{i % 3}', path='/', method='GET',
+                                     status_code=500 if i == 0 else 200, created_at=created_at))
+        db.session.commit()
+        db.session.remove()
+
+
+def _hour_row(app, bucket_start):
+    with app.app_context():
+        row = db.session.get(StatsHourly, bucket_start)
+        result = None if row is None else (row.visits, row.unique_visitors, row.server_errors)
+        db.session.remove()
+    return result
+
+
+def _record(created_at, count, ip_prefix):
+    for i in range(count):
+        access_log.record({'ip_address': f'{ip_prefix}{i % 4}', 'path': '/api/diary/list', 'method': 'GET',
+                           'endpoint': 'diary.list', 'status_code': 500 if i == 0 else 200,
+                           'created_at': created_at})
+    access_log.flush()
+
+
+def test_traffic_counted_before_sampling(app, monkeypatch):
+    """采样只影响 access_logs 明细，访问量和独立访客按全部请求统计"""
+    monkeypatch.setattr(access_log, 'ACCESS_LOG_SAMPLE_RATE', 0.0)
+    hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+
+    _record(hour + timedelta(minutes=5), 10, '10.0.0.')
+    with app.app_context():
+        # 只有500的那条进了明细（按时间过滤：前面测试的请求日志可能由后台线程晚一点写入）
+        assert AccessLog.query.filter_by(created_at=hour + timedelta(minutes=5)).count() == 1
+        assert stats_rollup.run_locked(force=True) is not None
+    assert _hour_row(app, hour) == (10, 4, 1)
+
+    # 再跑一次汇总：已有的时间桶被覆盖更新，不会主键冲突，访问量也不会被改写
+    _record(hour + timedelta(minutes=10), 2, '10.0.1.')
+    with app.app_context():
+        assert stats_rollup.run_locked(force=True) is not None
+        day = db.session.get(StatsDaily, hour.date())
+        assert day.visits >= 12
+        db.session.remove()
+    assert _hour_row(app, hour) == (12, 6, 2)
+
+
+def test_overview_visits_from_rollup(app, client, make_user, monkeypatch):
+    monkeypatch.setattr(access_log, 'ACCESS_LOG_SAMPLE_RATE', 0.0)
+    _, headers = make_user(is_admin=True)
+    _record(datetime.utcnow(), 8, '10.0.2.')
+
+    data = client.get('/api/admin/stats/overview?refresh=1', headers=headers).get_json()
+    assert data['visits']['today'] >= 8
+
+
+def test_rollup_skips_when_already_running(app):
+    with app.app_context():
+        assert stats_rollup._refresh_lock.acquire(blocking=False)
+        try:
+            assert stats_rollup.run_locked(force=True) is None
+        finally:
+            stats_rollup._refresh_lock.release()
+
+
+def test_rollup_skips_when_refreshed_recently(app):
+    _add_logs(app, datetime.utcnow(), 1)
+    with app.app_context():
+        assert stats_rollup.run_locked() is not None
+        # 刚刷新过，定时任务（不带 force）跳过
+        assert stats_rollup.run_locked() is None
+
+
+def test_rebuild_keeps_archived_traffic(app, make_user):
+    """--rebuild 不清空已归档日子的访问量和独立访客，只补上没有计数过的时间桶"""
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    archived_hour = now - timedelta(days=40)
+    counted_hour = now - timedelta(hours=5)
+    history_hour = now - timedelta(hours=3)
+
+    user_id, _ = make_user()
+    with app.app_context():
+        db.session.get(User, user_id).created_at = archived_hour - timedelta(days=5)
+        # 明细已归档的日子：汇总表里有数，access_logs 里没有
+        db.session.add(StatsHourly(bucket_start=archived_hour, visits=100, unique_visitors=50, server_errors=2,
+                                   updated_at=archived_hour))
+        db.session.add(StatsDaily(day=archived_hour.date(), visits=300, unique_visitors=120, server_errors=3,
+                                  updated_at=archived_hour))
+        # 写入器计数过的小时：明细是采样后的，不能用来覆盖
+        db.session.add(StatsHourly(bucket_start=counted_hour, visits=7, server_errors=0, updated_at=None))
+        db.session.commit()
+        db.session.remove()
+    # 计数上线之前的历史：只有明细
+    _add_logs(app, history_hour + timedelta(minutes=1), 4)
+    _add_logs(app, counted_hour + timedelta(minutes=1), 3)
+
+    with app.app_context():
+        assert stats_rollup.run_locked(rebuild=True, force=True) is not None
+        archived_day = db.session.get(StatsDaily, archived_hour.date())
+        assert (archived_day.visits, archived_day.unique_visitors, archived_day.server_errors) == (300, 120, 3)
+        db.session.remove()
+    assert _hour_row(app, archived_hour) == (100, 50, 2)
+    assert _hour_row(app, counted_hour)[0] == 7
+    assert _hour_row(app, history_hour)[0] == 4
+    assert _hour_row(app, history_hour)[2] == 1
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""存储垃圾回收：上传图片与日记引用对账"""
+
+import os
+import time
+
+from sqlalchemy import event
+
+from extensions import db
+from models import EmotionDiary, UserStorageUsage
+from services.storage import get_storage
+from services import storage_gc
+
+
+def _write_uploads(count, age_hours=48):
+    storage = get_storage('uploads')
+    past = time.time() - age_hours * 3600
+    keys = []
+    for i in range(count):
+        key = f'gc_{i:04d}.jpg'
+        path = storage.staging_path(key)
+        with open(path, 'wb') as f:
+            f.write(b'x' * 10)
+        os.utime(path, (past, past))
+        keys.append(key)
+    return keys
+
+
+def test_upload_gc_looks_up_each_batch_by_key(app, make_user):
+    user_id, _ = make_user()
+    keys = _write_uploads(30)
+    with app.app_context():
+        # 新旧两种URL都算引用；改掉的图片、删除的日记里的图片不再算引用
+        db.session.add(EmotionDiary(user_id=user_id, content='a', images=[f'/static/uploads/{keys[0]}']))
+        db.session.add(EmotionDiary(user_id=user_id, content='b', images=[f'/image/uploads/{keys[1]}', None]))
+        edited = EmotionDiary(user_id=user_id, content='c', images=[f'/static/uploads/{keys[2]}'])
+        deleted = EmotionDiary(user_id=user_id, content='d', images=[f'/static/uploads/{keys[3]}'])
+        db.session.add_all([edited, deleted])
+        db.session.commit()
+        edited.images = [f'/static/uploads/{keys[4]}']
+        db.session.delete(deleted)
+        db.session.commit()
+
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if 'FROM emotion_diaries' in statement or 'FROM diary_images' in statement:
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            result = storage_gc.collect_garbage(grace_hours=1, batch_size=10)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+        # 30个文件分3批，每批按key查一次 diary_images，不扫描日记表
+        assert len(statements) == 3
+        assert all('FROM diary_images' in statement and 'emotion_diaries' not in statement for statement in statements)
+        assert result['uploads']['referenced'] == 3
+        assert result['uploads']['deleted'] == 27
+        usage = db.session.get(UserStorageUsage, user_id)
+        assert (usage.upload_files, usage.upload_bytes) == (3, 30)
+        db.session.remove()
+
+    storage = get_storage('uploads')
+    assert all(storage.exists(keys[i]) for i in (0, 1, 4))
+    assert not storage.exists(keys[2]) and not storage.exists(keys[3])
+
+
+def test_backfill_diary_images(app, make_user):
+    from models import DiaryImage
+    from services.diary_images import backfill_diary_images
+
+    user_id, _ = make_user()
+    with app.app_context():
+        db.session.add(EmotionDiary(user_id=user_id, content='a',
+                                    images=['/static/uploads/x.jpg', '/static/uploads/x.jpg', 'https://cdn/tmp.jpg']))
+        db.session.commit()
+        db.session.execute(DiaryImage.__table__.delete())
+        db.session.commit()
+
+        with db.engine.begin() as connection:
+            assert backfill_diary_images(connection, batch_size=1) == 1
+        assert [(row.image_key, row.user_id) for row in DiaryImage.query] == [('x.jpg', user_id)]
+        db.session.remove()
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""本地存储：/static/uploads/ 从上传目录返回文件，Flask 自带的 /static/ 不受影响"""
+
+from services.storage import get_storage
+
+
+def test_static_uploads_served_from_upload_folder(app, client):
+    storage = get_storage('uploads')
+    key = 'route-test.jpg'
+    with open(storage.staging_path(key), 'wb') as f:
+        f.write(b'\xff\xd8\xffupload')
+
+    response = client.get(f'/static/uploads/{key}')
+    assert response.status_code == 200
+    assert response.data == b'\xff\xd8\xffupload'
+    response.close()
+    assert client.get('/static/uploads/missing.jpg').status_code == 404
+
+
+def test_builtin_static_endpoint_untouched(app, client):
+    adapter = app.url_map.bind('localhost')
+    assert adapter.match('/static/uploads/a.jpg')[0] == 'serve_upload'
+    assert adapter.match('/static/favicon.svg')[0] == 'static'
+
+    response = client.get('/static/favicon.svg')
+    assert response.status_code == 200
+    response.close()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""S3兼容存储（moto 模拟的 S3，代替 MinIO）：转存、失败清理临时文件、上传图片URL"""
+
+import io
+import os
+import time
+import tempfile
+
+import pytest
+
+moto = pytest.importorskip('moto')
+
+from extensions import db  # noqa: E402
+from models import EmotionDiary, Postcard  # noqa: E402
+from services import image_downloader, postcard_service, storage  # noqa: E402
+
+BUCKET = 'diary-test'
+JPEG_BYTES = b'\xff\xd8\xff\xe0' + b'0' * 64
+TEMP_URL = 'https://cdn.example.com/seedream/tmp.jpg'
+
+
+@pytest.fixture
+def s3(monkeypatch, tmp_path):
+    """postcards / uploads 两个区域换成 S3 后端，staging 临时文件放在 tmp_path"""
+    for name, value in (('AWS_ACCESS_KEY_ID', 'test'), ('AWS_SECRET_ACCESS_KEY', 'test'),
+                        ('AWS_DEFAULT_REGION', 'us-east-1')):
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+
+    with moto.mock_aws():
+        areas = {area: storage.S3Storage(BUCKET, key_prefix=area, url_prefix=prefix)
+                 for area, prefix in storage.STORAGE_AREAS.items()}
+        areas['postcards'].client.create_bucket(Bucket=BUCKET)
+        for area, backend in areas.items():
+            monkeypatch.setitem(storage._storages, area, backend)
+        yield areas
+
+
+def _staging_files(tmp_path):
+    return [name for name in os.listdir(tmp_path) if name.startswith('storage_')]
+
+
+def _create_postcard(app, user_id):
+    with app.app_context():
+        diary = EmotionDiary(user_id=user_id, content='今天去了海边')
+        db.session.add(diary)
+        db.session.flush()
+        postcard = Postcard(user_id=user_id, diary_id=diary.id, image_url=TEMP_URL, status='completed')
+        db.session.add(postcard)
+        db.session.commit()
+        postcard_id = postcard.id
+        db.session.remove()
+    return postcard_id
+
+
+def test_transfer_uploads_object(app, make_user, s3, monkeypatch, tmp_path):
+    def download_to_file(image_url, filepath):
+        with open(filepath, 'wb') as f:
+            f.write(JPEG_BYTES)
+        return len(JPEG_BYTES)
+
+    monkeypatch.setattr(image_downloader, 'download_to_file', download_to_file)
+    user_id, _ = make_user()
+    postcard_id = _create_postcard(app, user_id)
+
+    postcard_service.save_postcard_image_async(postcard_id, TEMP_URL, user_id).result(timeout=5)
+
+    with app.app_context():
+        image_url = db.session.get(Postcard, postcard_id).image_url
+        db.session.remove()
+    area, key = storage.resolve_url(image_url)
+    assert image_url.startswith('/image/postcards/') and area == 'postcards'
+    body = s3['postcards'].client.get_object(Bucket=BUCKET, Key=f'postcards/{key}')['Body'].read()
+    assert body == JPEG_BYTES
+    assert _staging_files(tmp_path) == []
+
+
+def test_failed_download_removes_staging_file(app, make_user, s3, monkeypatch, tmp_path):
+    def fail(image_url, filepath):
+        raise image_downloader.ImageDownloadError('expired')
+
+    monkeypatch.setattr(image_downloader, 'download_to_file', fail)
+    user_id, _ = make_user()
+    postcard_id = _create_postcard(app, user_id)
+
+    future = postcard_service.save_postcard_image_async(postcard_id, TEMP_URL, user_id)
+    with pytest.raises(image_downloader.ImageDownloadError):
+        future.result(timeout=5)
+    assert postcard_service.download_and_save_image(TEMP_URL, user_id) is None
+
+    deadline = time.time() + 2
+    while _staging_files(tmp_path) and time.time() < deadline:
+        time.sleep(0.05)
+    assert _staging_files(tmp_path) == []
+
+
+def test_upload_url_same_as_local_backend(client, make_user, s3):
+    _, headers = make_user()
+    response = client.post('/api/upload/image', headers=headers, content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(JPEG_BYTES), 'photo.jpg')})
+    assert response.status_code == 200
+    image_url = response.get_json()['image_url']
+    # 与本地存储、历史数据相同的URL形式
+    assert image_url.startswith('/static/uploads/')
+    assert storage.resolve_url(image_url) == ('uploads', response.get_json()['filename'])
+
+    redirect = client.get(image_url)
+    assert redirect.status_code == 302
+    assert BUCKET in redirect.headers['Location']
+    # S3后端早先写入的 /image/uploads/ URL 仍然可以访问
+    legacy = client.get(image_url.replace('/static/uploads/', '/image/uploads/'))
+    assert legacy.status_code == 302